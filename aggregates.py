@@ -0,0 +1,247 @@
+# aggregates.py — компактные агрегаты тренировки для графиков по истории без сырых точек
+#
+# При разборе считаем и храним рядом с тренировкой (workouts.aggregates, base64 ~0.5–2 КБ):
+#   • гистограммы с фиксированными бинами — секунды по темпу и каденсу (пульс уже есть в hr_hist
+#     с шагом 1 уд/мин, см. recompute.py — его не дублируем);
+#   • поминутные средние: пульс, скорость, каденс, высота, мощность.
+# Секунды в зонах пишутся в workouts.zone_s (тот же вектор держит в актуальном виде recompute.py).
+# Бины одинаковы у всех тренировок одной версии, поэтому история — матрица (n × бины),
+# а недельные распределения и «время выше порога» — суммы строк/столбцов без чтения записей.
+
+from __future__ import annotations
+import base64
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from gps import varint_encode, varint_decode
+from recompute import hr_histogram, decode_hist, zone_matrix
+
+AGG_VERSION = 1
+MAX_DT_S = 30          # точка длиннее — пауза, в гистограммы и минуты не идёт
+
+# (нижняя граница, шаг, число бинов); значения за краями — в крайние бины
+HIST_BINS = {
+    "pace": (150, 10, 48),      # с/км: 2:30 … 10:30+, только на ходу (скорость > MOVING_SPEED)
+    "cadence": (0, 5, 48),      # шаг/мин (об/мин): 0 … 240+
+}
+MOVING_SPEED = 0.5     # м/с
+N_HIST = sum(n for _, _, n in HIST_BINS.values())
+
+# поминутные каналы: колонка df_rec → множитель квантования (целые в хранилище)
+MINUTE_CHANNELS = {"hr": 1, "speed": 100, "cadence": 1, "elev": 10, "power": 1}
+
+
+def _col(df: pd.DataFrame, name: str) -> np.ndarray:
+    if name not in df:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[name], errors="coerce").to_numpy(float)
+
+
+def _weights(df_rec: pd.DataFrame) -> np.ndarray:
+    dt_s = np.nan_to_num(_col(df_rec, "dt_s"), nan=0.0)
+    return np.where((dt_s > 0) & (dt_s <= MAX_DT_S), dt_s, 0.0)
+
+
+def _binned(values: np.ndarray, w: np.ndarray, lo: float, step: float, n: int) -> np.ndarray:
+    ok = np.isfinite(values) & (w > 0)
+    b = np.clip(((values[ok] - lo) // step).astype(np.int64), 0, n - 1)
+    return np.rint(np.bincount(b, weights=w[ok], minlength=n)).astype(np.int64)
+
+
+def histograms(df_rec: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Секунды по бинам HIST_BINS (int64)."""
+    w = _weights(df_rec)
+    spd = _col(df_rec, "speed")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pace = np.where(spd > MOVING_SPEED, 1000.0 / spd, np.nan)
+    cad = _col(df_rec, "cadence")
+    return {"pace": _binned(pace, w, *HIST_BINS["pace"]),
+            "cadence": _binned(np.where(cad > 0, cad, np.nan), w, *HIST_BINS["cadence"])}
+
+
+def minute_rollup(df_rec: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Средние по минутам от старта (взвешены по dt_s); NaN — в минуте нет данных канала."""
+    t = _col(df_rec, "t_rel_s")
+    ok_t = np.isfinite(t)
+    if not ok_t.any():
+        return {}
+    m = np.where(ok_t, t // 60, -1).astype(np.int64)
+    n = int(m.max()) + 1
+    w = _weights(df_rec)
+    out: Dict[str, np.ndarray] = {"sec": np.bincount(m[ok_t], weights=w[ok_t], minlength=n)}
+    for ch in MINUTE_CHANNELS:
+        x = _col(df_rec, ch)
+        ok = ok_t & np.isfinite(x) & (w > 0)
+        s = np.bincount(m[ok], weights=x[ok] * w[ok], minlength=n)
+        c = np.bincount(m[ok], weights=w[ok], minlength=n)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[ch] = np.where(c > 0, s / c, np.nan)
+    return out
+
+
+def zone_seconds(df_rec: pd.DataFrame, bounds: Sequence[int]) -> Optional[List[int]]:
+    """Секунды в зонах пульса — та же формула, что у recompute.py (гистограмма × индикатор зон)."""
+    if df_rec is None or df_rec.empty or not bounds or "hr" not in df_rec or "dt_s" not in df_rec:
+        return None
+    c = hr_histogram(df_rec["hr"], df_rec["dt_s"])
+    if c is None:
+        return None
+    return [int(round(x)) for x in c.astype(np.float64) @ zone_matrix(bounds)]
+
+
+# ---------- хранение ----------
+
+def _code(x: np.ndarray, scale: float) -> np.ndarray:
+    """Квантование + zigzag; 0 — пропуск, значения сдвинуты на 1."""
+    q = np.rint(np.nan_to_num(x, nan=0.0) * scale).astype(np.int64)
+    return np.where(np.isfinite(x), ((q << 1) ^ (q >> 63)) + 1, 0).astype(np.uint64)
+
+
+def _uncode(u: np.ndarray, scale: float) -> np.ndarray:
+    u = u.astype(np.int64)
+    z = u - 1
+    q = (z >> 1) ^ -(z & 1)
+    return np.where(u > 0, q / scale, np.nan)
+
+
+def encode_aggregates(hists: Dict[str, np.ndarray], minutes: Dict[str, np.ndarray]) -> str:
+    """[версия] + varint: число минут, секунды и каналы по минутам, затем гистограммы → base64."""
+    n = len(minutes.get("sec", ()))
+    parts = [np.asarray([n], np.uint64), np.rint(minutes["sec"]).astype(np.uint64) if n else np.empty(0, np.uint64)]
+    for ch, scale in MINUTE_CHANNELS.items():
+        parts.append(_code(minutes[ch], scale) if n else np.empty(0, np.uint64))
+    for name in HIST_BINS:
+        parts.append(np.asarray(hists[name], np.uint64))
+    return base64.b64encode(bytes([AGG_VERSION]) + varint_encode(np.concatenate(parts))).decode("ascii")
+
+
+def _values(s: str) -> np.ndarray:
+    raw = base64.b64decode(s)
+    if not raw or raw[0] != AGG_VERSION:
+        raise ValueError("unknown aggregates format")
+    v = varint_decode(raw[1:])
+    if not len(v) or len(v) != 1 + int(v[0]) * (1 + len(MINUTE_CHANNELS)) + N_HIST:
+        raise ValueError("truncated aggregates")
+    return v
+
+
+def decode_hists(s: str) -> Dict[str, np.ndarray]:
+    """Только гистограммы: они в конце записи, поминутные ряды не разбираем."""
+    v = _values(s)[-N_HIST:].astype(np.int64)
+    out, pos = {}, 0
+    for name, (_, _, nb) in HIST_BINS.items():
+        out[name] = v[pos:pos + nb]
+        pos += nb
+    return out
+
+
+def decode_aggregates(s: str) -> Dict[str, Any]:
+    """{"minutes": DataFrame (minute, sec, hr, speed, …), "hists": {name: int64[bins]}}."""
+    v = _values(s)
+    n = int(v[0])
+    pos = 1
+    minutes = {"minute": np.arange(n), "sec": v[pos:pos + n].astype(np.int64)}
+    pos += n
+    for ch, scale in MINUTE_CHANNELS.items():
+        minutes[ch] = _uncode(v[pos:pos + n], scale)
+        pos += n
+    return {"minutes": pd.DataFrame(minutes), "hists": decode_hists(s)}
+
+
+def build_aggregates(df_rec: Optional[pd.DataFrame]) -> Optional[str]:
+    """Для сохранения вместе с тренировкой (views / import_worker)."""
+    if df_rec is None or df_rec.empty:
+        return None
+    minutes = minute_rollup(df_rec)
+    if not minutes:
+        return None
+    return encode_aggregates(histograms(df_rec), minutes)
+
+
+# ---------- история: суммы векторов ----------
+
+def bin_edges(name: str) -> np.ndarray:
+    lo, step, n = HIST_BINS[name]
+    return lo + step * np.arange(n)
+
+
+def _week(rows: Sequence[Dict[str, Any]]) -> pd.Series:
+    """Понедельник недели по местной дате тренировки (local_date); без неё — по дате start_time в UTC."""
+    local = pd.to_datetime(pd.Series([r.get("local_date") for r in rows], dtype=object), errors="coerce")
+    utc = pd.to_datetime(pd.Series([r.get("start_time") for r in rows], dtype=object), errors="coerce", utc=True)
+    t = local.fillna(utc.dt.tz_localize(None).dt.normalize())
+    return t.dt.to_period("W-SUN").dt.start_time
+
+
+def hist_matrix(rows: Sequence[Dict[str, Any]], name: str) -> np.ndarray:
+    """(n × бины) секунд по гистограмме name; строки без агрегатов — нули."""
+    nb = HIST_BINS[name][2]
+    M = np.zeros((len(rows), nb), np.int64)
+    for i, r in enumerate(rows):
+        if r.get("aggregates"):
+            try:
+                M[i] = decode_hists(r["aggregates"])[name]
+            except ValueError:
+                pass
+    return M
+
+
+def hr_matrix(rows: Sequence[Dict[str, Any]]) -> np.ndarray:
+    """(n × 256) секунд на удар пульса из hr_hist."""
+    C = np.zeros((len(rows), 256), np.float64)
+    for i, r in enumerate(rows):
+        if r.get("hr_hist"):
+            try:
+                C[i] = decode_hist(r["hr_hist"])
+            except ValueError:
+                pass
+    return C
+
+
+def weekly_zones(rows: Sequence[Dict[str, Any]], bounds: Sequence[int]) -> pd.DataFrame:
+    """Минуты в зонах по неделям: zone_s, а где его нет — из hr_hist по текущим границам."""
+    k = len(bounds) + 1
+    Z = np.asarray(hr_matrix(rows) @ zone_matrix(bounds)) if bounds else np.zeros((len(rows), k))
+    for i, r in enumerate(rows):
+        zs = r.get("zone_s")
+        if isinstance(zs, list) and len(zs) == k and not Z[i].any():
+            Z[i] = zs
+    df = pd.DataFrame(Z / 60.0, columns=[f"Z{i}" for i in range(1, k + 1)])
+    df["week"] = _week(rows)
+    return df.dropna(subset=["week"]).groupby("week").sum().round(1)
+
+
+def weekly_hist(rows: Sequence[Dict[str, Any]], name: str) -> pd.DataFrame:
+    """Минуты по бинам гистограммы name по неделям (week × нижняя граница бина)."""
+    df = pd.DataFrame(hist_matrix(rows, name) / 60.0, columns=bin_edges(name))
+    df["week"] = _week(rows)
+    return df.dropna(subset=["week"]).groupby("week").sum()
+
+
+def time_above_hr(rows: Sequence[Dict[str, Any]], threshold: int) -> pd.Series:
+    """Минуты с пульсом ≥ threshold по каждой тренировке (id → минуты)."""
+    C = hr_matrix(rows)
+    return pd.Series(C[:, int(threshold):].sum(axis=1) / 60.0, index=[r.get("id") for r in rows]).round(1)
+
+
+def weekly_above_hr(rows: Sequence[Dict[str, Any]], threshold: int) -> pd.DataFrame:
+    """Минуты с пульсом ≥ threshold по неделям: week, minutes."""
+    df = pd.DataFrame({"week": _week(rows).to_numpy(), "minutes": time_above_hr(rows, threshold).to_numpy()})
+    return df.dropna(subset=["week"]).groupby("week", as_index=False).sum()
+
+
+def mean_from_hist(M: np.ndarray, name: str) -> np.ndarray:
+    """Среднее по гистограммам (середины бинов); NaN — пустая строка."""
+    lo, step, n = HIST_BINS[name]
+    mid = lo + step * (np.arange(n) + 0.5)
+    tot = M.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(tot > 0, (M @ mid) / tot, np.nan)
+
+
+def cadence_trend(rows: Sequence[Dict[str, Any]]) -> pd.DataFrame:
+    """Средний каденс на ходу по тренировкам: start_time, cadence."""
+    return pd.DataFrame({"start_time": pd.to_datetime([r.get("start_time") for r in rows], errors="coerce", utc=True),
+                         "cadence": mean_from_hist(hist_matrix(rows, "cadence"), "cadence").round(1)}).dropna()
@@ -11,6 +11,9 @@ from profile import load_or_init_profile, profile_sidebar
 from landing import render_landing
 from views_single import render_single_workout
 from views_multi import render_multi_workouts
+from dashboard import render_dashboard
+from db import fetch_coach_snapshot
+from instrument import debug_panel_enabled, render_debug_panel
 
 st.set_page_config(
     page_title="CapyRun — FIT Analyzer",
@@ -73,6 +76,9 @@ def user_display(user) -> str:
 def _user_id(u: Any):
     return u.get("id") if isinstance(u, dict) else getattr(u, "id", None)
 
+def _user_email(u: Any):
+    return u.get("email") if isinstance(u, dict) else getattr(u, "email", None)
+
 def _fmt_hhmmss(sec):
     try:
         sec = int(sec or 0)
@@ -100,6 +106,26 @@ def _fmt_pace_min_per_km(m_per_s):
     except Exception:
         return "—"
 
+def render_coach_context(supabase, uid):
+    """Что видит тренер: документ coach_training_context (coach_snapshot.py), одна строка."""
+    st.header("💬 Общение с тренером")
+    snap = fetch_coach_snapshot(supabase, uid)
+    doc = (snap or {}).get("doc")
+    if not doc:
+        st.info("Контекст для тренера появится после сохранения первой тренировки.")
+        return
+    load, trends = doc.get("load", {}), doc.get("trends", {})
+    c1, c2, c3 = st.columns(3)
+    c1.metric("ATL", load.get("atl"))
+    c2.metric("CTL", load.get("ctl"), load.get("ctl_delta_28d"))
+    c3.metric("TSB", load.get("tsb"))
+    if trends.get("flags"):
+        st.caption("Сигналы: " + ", ".join(trends["flags"]))
+    if doc.get("recent"):
+        st.dataframe(pd.DataFrame(doc["recent"]))
+    st.caption(f"Версия контекста {snap.get('version')}, обновлён {doc.get('updated_at', '—')[:16]}, "
+               f"тренировок: {doc.get('n_workouts', 0)}.")
+
 # ===== Subnav helper =====
 def render_subnav(page: str, items: list[tuple[str, str]], current_sub: str | None):
     st.markdown(
@@ -225,4 +251,17 @@ with st.sidebar:
         st.markdown(
             f'<div class="gpt-profile-bottom"><div class="gpt-ava-sm">{initials}</div><div>{uname}</div></div>',
             unsafe_allow_html=True,
-        )
\ No newline at end of file
+        )
+
+# ===== Debug: метрики горячих путей (только при CAPYRUN_DEBUG_PANEL, см. instrument.debug_panel_enabled) =====
+if debug_panel_enabled(_user_email(user)):
+    with st.sidebar:
+        render_debug_panel()
+
+# ===== Главная: сводки из RPC dash_fast_* (dashboard.py); тренер — контекст из coach_snapshot.py =====
+if user and _user_id(user):
+    page, _ = get_route()
+    if page == "home":
+        render_dashboard(supabase, _user_id(user))
+    elif page == "coach":
+        render_coach_context(supabase, _user_id(user))
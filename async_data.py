@@ -0,0 +1,150 @@
+# async_data.py — параллельная загрузка данных страницы: профиль, история, сводки дашборда
+#
+# Streamlit-скрипт раньше ходил в БД по очереди (профиль → история → сводки), и задержка страницы
+# была суммой round trips. Здесь независимые запросы стартуют одновременно на asyncio: каждый
+# блокирующий вызов supabase-py уходит в свой поток, у каждого — свой таймаут.
+# Итог ≈ самый медленный запрос, а не сумма. Запрос, упавший или не уложившийся в таймаут,
+# не ломает страницу: вместо результата — значение по умолчанию, причина — в errors.
+#
+# Пачке — свой пул на число запросов: очередь в общем пуле (другие сессии) съедала бы таймауты,
+# а так отсчёт идёт с реального старта запроса. Поток, не уложившийся в таймаут, не прерывается
+# (supabase-py так не умеет) — дорабатывает в фоне, результат выбрасывается.
+#
+# Вызывающим асинхронность не видна: run_queries()/load_page_data() — синхронные фасады. Сейчас через
+# них грузится главная (dashboard.load_dashboard: сводки по дням/неделям и последние тренировки).
+
+from __future__ import annotations
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from instrument import record
+from db import fetch_workouts, fetch_dash_days, fetch_dash_weeks
+from profile import load_or_init_profile, DEFAULTS as PROFILE_DEFAULTS
+
+# --- Streamlit script context (optional): st.* из рабочего потока без него не видны ---
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx  # type: ignore
+except Exception:
+    add_script_run_ctx = get_script_run_ctx = None
+
+DEFAULT_TIMEOUT_S = 8.0
+
+
+@dataclass
+class Query:
+    """Один независимый запрос: имя в результате, блокирующая функция, таймаут и значение на случай ошибки."""
+    name: str
+    fn: Callable[..., Any]
+    args: Tuple[Any, ...] = ()
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    timeout_s: float = DEFAULT_TIMEOUT_S
+    default: Any = None
+
+
+@dataclass
+class PageData:
+    values: Dict[str, Any]
+    errors: Dict[str, str]            # имя → "timeout" / текст исключения
+    ms: Dict[str, float]              # имя → время запроса
+    wall_ms: float                    # вся пачка
+
+    def __getitem__(self, name: str) -> Any:
+        return self.values.get(name)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+async def _run(q: Query, ctx: Any, pool: ThreadPoolExecutor) -> Tuple[str, Any, Optional[str], float]:
+    loop = asyncio.get_running_loop()
+
+    def call():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return q.fn(*q.args, **q.kwargs)
+
+    t0 = time.perf_counter()
+    try:
+        value = await asyncio.wait_for(loop.run_in_executor(pool, call), q.timeout_s)
+        err = None
+    except asyncio.TimeoutError:
+        value, err = q.default, "timeout"
+    except Exception as e:
+        value, err = q.default, f"{type(e).__name__}: {e}"
+    dur = time.perf_counter() - t0
+    record(f"data.{q.name}", dur)
+    return q.name, value, err, dur * 1000.0
+
+
+async def gather_queries(queries: Iterable[Query]) -> PageData:
+    """Все запросы одновременно; результат — когда закончится (или истечёт) последний."""
+    queries = list(queries)
+    ctx = get_script_run_ctx() if get_script_run_ctx is not None else None
+    t0 = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=max(len(queries), 1), thread_name_prefix="capyrun-data")
+    try:
+        done = await asyncio.gather(*(_run(q, ctx, pool) for q in queries))
+    finally:
+        pool.shutdown(wait=False)    # зависшие после таймаута потоки дорабатывают сами
+    values = {name: v for name, v, _, _ in done}
+    errors = {name: e for name, _, e, _ in done if e}
+    ms = {name: round(m, 1) for name, _, _, m in done}
+    return PageData(values, errors, ms, round((time.perf_counter() - t0) * 1000.0, 1))
+
+
+def run_queries(queries: Iterable[Query]) -> PageData:
+    """Синхронный фасад для скрипта Streamlit (в нём нет цикла событий — asyncio.run)."""
+    queries = list(queries)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(gather_queries(queries))
+    # цикл уже крутится в этом потоке (Jupyter, тесты) — отдельный поток со своим циклом
+    box: Dict[str, Any] = {}
+    th = threading.Thread(target=lambda: box.update(res=asyncio.run(gather_queries(queries))))
+    th.start()
+    th.join()
+    return box["res"]
+
+
+def page_queries(
+    supabase,
+    user_id: str,
+    parts: Iterable[str] = ("profile", "history", "dash_days", "dash_weeks"),
+    history_limit: int = 200,
+    days: int = 30,
+    weeks: int = 12,
+    timeouts: Optional[Dict[str, float]] = None,
+    history_newest: bool = False,
+) -> List[Query]:
+    """Стандартные запросы страницы; parts — какие из них нужны."""
+    timeouts = timeouts or {}
+    known = {
+        "profile": Query("profile", load_or_init_profile, (supabase, user_id),
+                         default={"user_id": user_id, **PROFILE_DEFAULTS}),
+        "history": Query("history", fetch_workouts, (supabase, user_id),
+                         {"limit": history_limit, "newest": history_newest},
+                         default=pd.DataFrame()),
+        "dash_days": Query("dash_days", fetch_dash_days, (supabase, days), default=[]),
+        "dash_weeks": Query("dash_weeks", fetch_dash_weeks, (supabase, weeks), default=[]),
+    }
+    out = []
+    for p in parts:
+        q = known[p]
+        if p in timeouts:
+            q.timeout_s = float(timeouts[p])
+        out.append(q)
+    return out
+
+
+def load_page_data(supabase, user_id: str, parts: Iterable[str] = ("profile", "history", "dash_days", "dash_weeks"),
+                   **kwargs) -> PageData:
+    """Профиль, история и сводки одной пачкой: data["profile"], data["history"], data["dash_weeks"], …"""
+    return run_queries(page_queries(supabase, user_id, parts, **kwargs))
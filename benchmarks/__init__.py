@@ -0,0 +1 @@
+# benchmarks — воспроизводимые замеры парсинга и метрик (python -m benchmarks.run)
@@ -0,0 +1,398 @@
+# benchmarks/fake_supabase.py — in-process заглушка клиента supabase-py для db.py / db_workouts.py / profile.py
+#
+# Повторяет ровно ту поверхность, которой пользуется приложение:
+#   table().select().eq().order().limit().single().execute(), insert / upsert / update / delete,
+#   rpc(name, params).execute(), auth.get_session() / auth.get_user(), postgrest.auth(token).
+# Есть общее хранилище строк, настраиваемая задержка и учёт каждого обращения (round trips, байты).
+
+from __future__ import annotations
+import json
+import time
+import uuid
+import random
+import threading
+import datetime as dt
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+
+def _size(obj: Any) -> int:
+    return len(json.dumps(obj, default=str, ensure_ascii=False).encode("utf-8")) if obj is not None else 0
+
+
+class Latency:
+    """Задержка одного запроса: base_ms + per_row_ms·rows + нормальный шум jitter_ms."""
+
+    def __init__(self, base_ms: float = 25.0, per_row_ms: float = 0.02, jitter_ms: float = 5.0, seed: int = 0):
+        self.base_ms = base_ms
+        self.per_row_ms = per_row_ms
+        self.jitter_ms = jitter_ms
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sleep(self, rows: int) -> None:
+        with self._lock:
+            noise = self._rng.gauss(0, self.jitter_ms) if self.jitter_ms else 0.0
+        ms = max(0.0, self.base_ms + self.per_row_ms * rows + noise)
+        if ms:
+            time.sleep(ms / 1000.0)
+
+
+class FakeBackend:
+    """Общий «сервер»: таблицы, RPC-функции и журнал вызовов (потокобезопасно)."""
+
+    def __init__(self, latency: Optional[Latency] = None):
+        self.latency = latency or Latency()
+        self.tables: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        # индекс по user_id: все запросы приложения фильтруют по нему, а полный скан
+        # под GIL на 100 потоках искажает задержки сильнее, чем сама «сеть»
+        self.by_user: Dict[str, Dict[str, List[Dict[str, Any]]]] = defaultdict(lambda: defaultdict(list))
+        self.rpcs: Dict[str, Callable[["FakeBackend", Optional[str], Dict[str, Any]], Any]] = {}
+        self.calls: List[Dict[str, Any]] = []
+        self.lock = threading.RLock()
+        self.register_rpc("insert_workouts", _rpc_insert_workouts)
+        self.register_rpc("update_workout_metrics", _rpc_update_workout_metrics)
+        self.register_rpc("update_workout_local_dates", _rpc_update_workout_local_dates)
+        self.register_rpc("dash_fast_days", _rpc_dash_fast_days)
+        self.register_rpc("dash_fast_weeks", _rpc_dash_fast_weeks)
+
+    def register_rpc(self, name: str, fn: Callable[["FakeBackend", Optional[str], Dict[str, Any]], Any]) -> None:
+        self.rpcs[name] = fn
+
+    def seed(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        with self.lock:
+            for r in rows:
+                self.add_row(table, dict(r))
+
+    def add_row(self, table: str, row: Dict[str, Any]) -> None:
+        self.tables[table].append(row)
+        self.by_user[table][str(row.get("user_id"))].append(row)
+
+    def reindex(self, table: str) -> None:
+        idx = self.by_user[table] = defaultdict(list)
+        for r in self.tables[table]:
+            idx[str(r.get("user_id"))].append(r)
+
+    def client(self, user_id: Optional[str] = None, email: Optional[str] = None, session: str = "") -> "FakeSupabase":
+        return FakeSupabase(self, user_id, email, session)
+
+    def log(self, client: "FakeSupabase", kind: str, target: str, req: Any, resp: Any, rows: int, started: float) -> None:
+        with self.lock:
+            self.calls.append({
+                "session": client.session, "tag": client.tag, "kind": kind, "target": target, "rows": rows,
+                "req_bytes": _size(req), "resp_bytes": _size(resp),
+                "ms": (time.perf_counter() - started) * 1000.0,
+            })
+
+    def reset_calls(self) -> None:
+        with self.lock:
+            self.calls.clear()
+
+
+def _rpc_update_workout_metrics(backend: FakeBackend, uid: Optional[str], params: Dict[str, Any]) -> Any:
+    by_id = {str(r.get("id")): r for r in backend.by_user["workouts"].get(str(uid), [])}
+    n = 0
+    for r in params.get("_rows") or []:
+        row = by_id.get(str(r.get("id")))
+        if row is not None:
+            row.update({k: v for k, v in r.items() if k != "id" and (k != "hr_hist" or v is not None)})
+            n += 1
+    return n
+
+
+def _rpc_update_workout_local_dates(backend: FakeBackend, uid: Optional[str], params: Dict[str, Any]) -> Any:
+    by_id = {str(r.get("id")): r for r in backend.by_user["workouts"].get(str(uid), [])}
+    n = 0
+    for r in params.get("_rows") or []:
+        row = by_id.get(str(r.get("id")))
+        if row is not None:
+            row["local_date"] = r.get("local_date")
+            if r.get("utc_offset_s") is not None:
+                row["utc_offset_s"] = r["utc_offset_s"]
+            n += 1
+    return n
+
+
+def _local_date(r: Dict[str, Any]) -> Optional[dt.date]:
+    for k in ("local_date", "start_time", "created_at"):
+        v = r.get(k)
+        if v:
+            return dt.date.fromisoformat(str(v)[:10])
+    return None
+
+
+def _rpc_dash_fast_days(backend: FakeBackend, uid: Optional[str], params: Dict[str, Any]) -> Any:
+    """Как SQL-функция dash_fast_days: группировка по локальной дате, удалённые не считаем."""
+    since = dt.date.today() - dt.timedelta(days=max(int(params.get("days", 30)) - 1, 0))
+    out: Dict[dt.date, Dict[str, Any]] = {}
+    for r in backend.by_user["workouts"].get(str(uid), []):
+        d = _local_date(r)
+        if r.get("deleted_at") or d is None or d < since:
+            continue
+        o = out.setdefault(d, {"d": d.isoformat(), "workouts": 0, "time_sec": 0, "distance_m": 0.0, "kcal": 0.0})
+        o["workouts"] += 1
+        o["time_sec"] += int(r.get("duration_sec") or r.get("time_s") or 0)
+        o["distance_m"] += float(r.get("distance_m") or (r.get("distance_km") or 0) * 1000)
+        o["kcal"] += float(r.get("calories_kcal") or 0)
+    return [out[d] for d in sorted(out)]
+
+
+def _rpc_dash_fast_weeks(backend: FakeBackend, uid: Optional[str], params: Dict[str, Any]) -> Any:
+    since = dt.date.today() - dt.timedelta(days=max(int(params.get("weeks", 12)), 1) * 7)
+    out: Dict[dt.date, Dict[str, Any]] = {}
+    for r in backend.by_user["workouts"].get(str(uid), []):
+        d = _local_date(r)
+        if r.get("deleted_at") or d is None or d < since:
+            continue
+        w = d - dt.timedelta(days=d.weekday())
+        o = out.setdefault(w, {"week_start": w.isoformat(), "workouts": 0, "time_sec": 0, "distance_m": 0.0})
+        o["workouts"] += 1
+        o["time_sec"] += int(r.get("duration_sec") or r.get("time_s") or 0)
+        o["distance_m"] += float(r.get("distance_m") or (r.get("distance_km") or 0) * 1000)
+    return [out[w] for w in sorted(out)]
+
+
+def _rpc_insert_workouts(backend: FakeBackend, uid: Optional[str], params: Dict[str, Any]) -> Any:
+    rows = []
+    for r in params.get("_rows") or []:
+        row = {"id": str(uuid.uuid4()), **r, "user_id": uid, "created_at": dt.datetime.utcnow().isoformat()}
+        backend.add_row("workouts", row)
+        rows.append(row)
+    return rows
+
+
+class _Result(SimpleNamespace):
+    pass
+
+
+class _Query:
+    def __init__(self, client: "FakeSupabase", table: str):
+        self.c = client
+        self.table = table
+        self.op = "select"
+        self.columns = "*"
+        self.payload: Any = None
+        self.on_conflict: Optional[str] = None
+        self.filters: List[tuple] = []
+        self.orders: List[tuple] = []
+        self.limit_n: Optional[int] = None
+        self.single_row = False
+        self.returning = False
+        self.count_mode: Optional[str] = None
+
+    # --- builder ---
+    def select(self, columns: str = "*", count: Optional[str] = None, **_kw):
+        self.count_mode = count
+        if self.op == "select":
+            self.columns = columns
+        else:
+            self.returning, self.columns = True, columns
+        return self
+
+    def insert(self, payload, **_kw):
+        self.op, self.payload = "insert", payload
+        return self
+
+    def upsert(self, payload, on_conflict: Optional[str] = None, **_kw):
+        self.op, self.payload, self.on_conflict = "upsert", payload, on_conflict
+        return self
+
+    def update(self, payload, **_kw):
+        self.op, self.payload = "update", payload
+        return self
+
+    def delete(self, **_kw):
+        self.op = "delete"
+        return self
+
+    def eq(self, col, val):
+        self.filters.append(("eq", col, val))
+        return self
+
+    def in_(self, col, vals):
+        self.filters.append(("in", col, list(vals)))
+        return self
+
+    def gt(self, col, val):
+        self.filters.append(("gt", col, val))
+        return self
+
+    def gte(self, col, val):
+        self.filters.append(("gte", col, val))
+        return self
+
+    def lte(self, col, val):
+        self.filters.append(("lte", col, val))
+        return self
+
+    def is_(self, col, val):
+        self.filters.append(("is", col, val))
+        return self
+
+    def order(self, col, desc: bool = False, **_kw):
+        self.orders.append((col, desc))
+        return self
+
+    def limit(self, n):
+        self.limit_n = int(n)
+        return self
+
+    def single(self):
+        self.single_row = True
+        return self
+
+    maybe_single = single
+
+    # --- execution ---
+    def _candidates(self, b: FakeBackend) -> List[Dict[str, Any]]:
+        uid = next((v for kind, col, v in self.filters if kind == "eq" and col == "user_id"), None)
+        if uid is not None:
+            return b.by_user[self.table].get(str(uid), [])
+        return b.tables[self.table]
+
+    def _match(self, row: Dict[str, Any]) -> bool:
+        for kind, col, val in self.filters:
+            v = row.get(col)
+            if kind == "eq" and str(v) != str(val):
+                return False
+            if kind == "in" and str(v) not in {str(x) for x in val}:
+                return False
+            if kind == "gt" and (v is None or str(v) <= str(val)):
+                return False
+            if kind == "gte" and (v is None or str(v) < str(val)):
+                return False
+            if kind == "lte" and (v is None or str(v) > str(val)):
+                return False
+            if kind == "is" and not (v is None if val in (None, "null") else v == val):
+                return False
+        return True
+
+    def _project(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        cols = [c.strip() for c in (self.columns or "*").split(",")]
+        if "*" in cols:
+            return [dict(r) for r in rows]
+        return [{c: r.get(c) for c in cols} for r in rows]
+
+    def execute(self):
+        b = self.c.backend
+        t0 = time.perf_counter()
+        with b.lock:
+            store = b.tables[self.table]
+            if self.op == "select":
+                rows = [r for r in self._candidates(b) if self._match(r)]
+                matched = len(rows)
+                for col, desc in reversed(self.orders):
+                    rows.sort(key=lambda r: (r.get(col) is None, str(r.get(col) or "")), reverse=desc)
+                if self.limit_n is not None:
+                    rows = rows[: self.limit_n]
+                data: Any = self._project(rows)
+            elif self.op in ("insert", "upsert"):
+                items = self.payload if isinstance(self.payload, list) else [self.payload]
+                keys = [k.strip() for k in (self.on_conflict or "id").split(",")]
+                out = []
+                for item in items:
+                    item = dict(item)
+                    existing = None
+                    if self.op == "upsert":
+                        pool = b.by_user[self.table].get(str(item.get("user_id")), []) if "user_id" in item else store
+                        existing = next((r for r in pool if all(str(r.get(k)) == str(item.get(k)) for k in keys)), None)
+                    if existing is not None:
+                        existing.update(item)
+                        out.append(existing)
+                    else:
+                        item.setdefault("id", str(uuid.uuid4()))
+                        b.add_row(self.table, item)
+                        out.append(item)
+                data = self._project(out)
+            elif self.op == "update":
+                out = [r for r in self._candidates(b) if self._match(r)]
+                for r in out:
+                    r.update(self.payload)
+                if "user_id" in (self.payload or {}):
+                    b.reindex(self.table)
+                data = self._project(out)
+            else:  # delete
+                keep = [r for r in store if not self._match(r)]
+                data = self._project([r for r in store if self._match(r)])
+                store[:] = keep
+                b.reindex(self.table)
+        if self.single_row:
+            data = data[0] if data else None
+        nrows = len(data) if isinstance(data, list) else int(data is not None)
+        b.latency.sleep(nrows)
+        b.log(self.c, self.op, self.table, self.payload, data, nrows, t0)
+        count = matched if (self.op == "select" and self.count_mode) else nrows
+        return _Result(data=data, error=None, count=count)
+
+
+class _Rpc:
+    def __init__(self, client: "FakeSupabase", name: str, params: Dict[str, Any]):
+        self.c, self.name, self.params = client, name, params or {}
+
+    def execute(self):
+        b = self.c.backend
+        t0 = time.perf_counter()
+        fn = b.rpcs.get(self.name)
+        if fn is None:
+            raise RuntimeError({"code": "PGRST202", "message": f"function {self.name} not found"})
+        with b.lock:
+            data = fn(b, self.c.uid, self.params)
+        nrows = len(data) if isinstance(data, list) else 1
+        b.latency.sleep(nrows)
+        b.log(self.c, "rpc", self.name, self.params, data, nrows, t0)
+        return _Result(data=data, error=None)
+
+
+class _Auth:
+    def __init__(self, client: "FakeSupabase"):
+        self.c = client
+
+    def _user(self):
+        return SimpleNamespace(id=self.c.uid, email=self.c.email) if self.c.uid else None
+
+    def get_session(self):
+        if not self.c.uid:
+            return None
+        return SimpleNamespace(access_token=f"fake-{self.c.uid}", refresh_token="fake-refresh", user=self._user())
+
+    def get_user(self):
+        return SimpleNamespace(user=self._user()) if self.c.uid else None
+
+    def sign_in_with_password(self, creds: Dict[str, str]):
+        email = creds.get("email")
+        self.c.uid = self.c.uid or f"user-{uuid.uuid5(uuid.NAMESPACE_DNS, email or 'anon').hex[:8]}"
+        self.c.email = email
+        return SimpleNamespace(session=self.get_session(), user=self._user())
+
+    def sign_out(self):
+        self.c.uid = None
+
+
+class _Postgrest:
+    def __init__(self):
+        self.token: Optional[str] = None
+
+    def auth(self, token: str) -> None:
+        self.token = token
+
+
+class FakeSupabase:
+    """Клиент одной сессии поверх общего FakeBackend (uid = auth.uid() для RPC)."""
+
+    def __init__(self, backend: FakeBackend, uid: Optional[str], email: Optional[str], session: str = ""):
+        self.backend = backend
+        self.uid = uid
+        self.email = email
+        self.session = session or (uid or "anon")
+        self.tag = ""  # метка текущей «страницы» для учёта вызовов по сценариям
+        self.auth = _Auth(self)
+        self.postgrest = _Postgrest()
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    from_ = table
+
+    def rpc(self, name: str, params: Optional[Dict[str, Any]] = None) -> _Rpc:
+        return _Rpc(self, name, params or {})
@@ -0,0 +1,212 @@
+# benchmarks/load_db.py — нагрузочный прогон слоя БД (db.py / db_workouts.py / profile.py) на FakeSupabase
+#
+#   python -m benchmarks.load_db --sessions 100 --pages 20 --latency-ms 25
+#
+# Каждая сессия — поток со своим клиентом; сессии проигрывают реалистичные сценарии страниц
+# и мы считаем round trips, байты и задержку страницы (p50/p95/p99).
+# Всё крутится в одном процессе, как и Streamlit-сервер: CPU клиентского кода (DataFrame, _jsonable)
+# делит один GIL, поэтому при 100 сессиях p95 страницы растёт быстрее, чем «сетевая» задержка вызова
+# (её видно отдельно в таблице по kind/target).
+
+from __future__ import annotations
+import sys
+import time
+import random
+import argparse
+import threading
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.fake_supabase import FakeBackend, Latency
+from db import fetch_workouts, save_workouts
+from db_workouts import list_workouts, get_workout_by_id
+from profile import load_or_init_profile, save_profile
+from async_data import load_page_data
+
+
+def seed_backend(backend: FakeBackend, users: int, workouts_per_user: int, seed: int = 0) -> List[str]:
+    """Пользователи с профилями и историей тренировок похожего на прод размера."""
+    rng = np.random.default_rng(seed)
+    uids = [f"user-{i:04d}" for i in range(users)]
+    start = dt.datetime(2024, 1, 1, 7, 0)
+    rows, profiles = [], []
+    for uid in uids:
+        profiles.append({"user_id": uid, "hr_rest": 50, "hr_max": 185, "zone_bounds_text": "120,140,155,170"})
+        for k in range(workouts_per_user):
+            t = start + dt.timedelta(days=int(k * 1.7), hours=int(rng.integers(0, 12)))
+            dist = float(rng.gamma(4.0, 2.5))
+            time_s = int(dist * float(rng.normal(330, 30)))
+            rows.append({
+                "id": f"{uid}-w{k}", "user_id": uid, "start_time": t.isoformat(), "date": t.date().isoformat(),
+                "uploaded_at": t.isoformat(), "sport": "running", "distance_km": round(dist, 2),
+                "distance_m": round(dist * 1000), "time_s": time_s, "time_min": round(time_s / 60, 1),
+                "avg_hr": int(rng.normal(145, 8)), "trimp": int(rng.gamma(3.0, 25.0)),
+                "ef": round(float(rng.normal(0.021, 0.002)), 4), "pa_hr_pct": round(float(rng.normal(3, 2)), 1),
+                "fit_summary": {"records": time_s, "laps": max(1, int(dist))},
+            })
+    backend.seed("profiles", profiles)
+    backend.seed("workouts", rows)
+    return uids
+
+
+def _summary(rng: random.Random) -> Dict[str, Any]:
+    t = dt.datetime(2025, 1, 1, 7, 0) + dt.timedelta(minutes=rng.randint(0, 500_000))
+    dist = round(rng.uniform(3, 21), 2)
+    return {"start_time": t, "date": t.date(), "sport": "running", "distance_km": dist,
+            "time_s": int(dist * 330), "time_min": round(dist * 5.5, 1), "avg_hr": 148,
+            "TRIMP": 90, "EF": 0.021, "Pa:Hr_%": 2.5}
+
+
+# сценарии страниц: каждый — последовательность вызовов, как их делает Streamlit-скрипт
+def page_home(sb, uid: str, rng: random.Random) -> None:
+    load_or_init_profile(sb, uid)
+    fetch_workouts(sb, uid, limit=200)
+
+
+def page_home_async(sb, uid: str, rng: random.Random) -> None:
+    # те же данные плюс сводки дашборда, но запросы идут одновременно (async_data.py)
+    load_page_data(sb, uid)
+
+
+def page_workouts(sb, uid: str, rng: random.Random) -> None:
+    load_or_init_profile(sb, uid)
+    rows = list_workouts(sb, user_id=uid, limit=20)
+    if rows:
+        get_workout_by_id(sb, workout_id=rows[rng.randrange(len(rows))]["id"], user_id=uid)
+
+
+def page_upload(sb, uid: str, rng: random.Random) -> None:
+    load_or_init_profile(sb, uid)
+    save_workouts(sb, uid, [_summary(rng)])
+    fetch_workouts(sb, uid, limit=100)
+
+
+def page_profile(sb, uid: str, rng: random.Random) -> None:
+    load_or_init_profile(sb, uid)
+    save_profile(sb, {"id": uid}, 50 + rng.randint(-3, 3), 185, "120,140,155,170")
+
+
+FLOWS: Dict[str, Callable[[Any, str, random.Random], None]] = {
+    "home": page_home,
+    "home_async": page_home_async,
+    "workouts": page_workouts,
+    "upload": page_upload,
+    "profile": page_profile,
+}
+DEFAULT_MIX = {"home": 0.5, "workouts": 0.3, "upload": 0.1, "profile": 0.1}
+
+
+def run_load(
+    sessions: int = 100,
+    pages_per_session: int = 20,
+    users: int = 200,
+    workouts_per_user: int = 150,
+    latency: Optional[Latency] = None,
+    mix: Optional[Dict[str, float]] = None,
+    seed: int = 0,
+) -> Dict[str, pd.DataFrame]:
+    backend = FakeBackend(latency or Latency())
+    uids = seed_backend(backend, users, workouts_per_user, seed)
+    mix = mix or DEFAULT_MIX
+    names, weights = list(mix), list(mix.values())
+    pages: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+
+    def session(i: int) -> None:
+        rng = random.Random(seed * 1000 + i)
+        uid = uids[i % len(uids)]
+        sb = backend.client(uid, f"{uid}@example.com", session=f"s{i}")
+        for p in range(pages_per_session):
+            flow = rng.choices(names, weights)[0]
+            sb.tag = flow
+            t0 = time.perf_counter()
+            err = None
+            try:
+                FLOWS[flow](sb, uid, rng)
+            except Exception as e:
+                err = str(e)
+            with lock:
+                pages.append({"session": f"s{i}", "page": p, "flow": flow,
+                              "ms": (time.perf_counter() - t0) * 1000.0, "error": err})
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        list(pool.map(session, range(sessions)))
+    wall = time.perf_counter() - t0
+
+    df_pages = pd.DataFrame(pages)
+    df_calls = pd.DataFrame(backend.calls)
+    return {"pages": df_pages, "calls": df_calls, "report": report(df_pages, df_calls, wall)}
+
+
+def _pct(s: pd.Series) -> pd.Series:
+    return pd.Series({"p50_ms": s.quantile(0.50), "p95_ms": s.quantile(0.95), "p99_ms": s.quantile(0.99)}).round(1)
+
+
+def report(df_pages: pd.DataFrame, df_calls: pd.DataFrame, wall_s: float) -> pd.DataFrame:
+    """Сводка по сценариям: перцентили задержки страницы, round trips и килобайты на страницу."""
+    pages = df_pages.groupby("flow").agg(pages=("ms", "size"), errors=("error", lambda s: int(s.notna().sum())))
+    lat = df_pages.groupby("flow")["ms"].apply(_pct).unstack()
+    calls = df_calls.assign(kb=(df_calls["req_bytes"] + df_calls["resp_bytes"]) / 1024) \
+        .groupby("tag").agg(rt=("kind", "size"), kb=("kb", "sum"))
+    out = pages.join(lat).join(calls)
+    out.loc["ALL"] = [len(df_pages), int(df_pages["error"].notna().sum()), *_pct(df_pages["ms"]).values,
+                      len(df_calls), calls["kb"].sum()]
+    out[["pages", "errors"]] = out[["pages", "errors"]].astype(int)
+    out["rt_per_page"] = (out.pop("rt") / out["pages"]).round(2)
+    out["kb_per_page"] = (out.pop("kb") / out["pages"]).round(1)
+    out.attrs["wall_s"] = wall_s
+    out.attrs["pages_per_s"] = len(df_pages) / wall_s if wall_s else None
+    out.attrs["calls_by_target"] = df_calls.groupby(["kind", "target"]).agg(
+        calls=("ms", "size"), rows=("rows", "sum"), resp_kb=("resp_bytes", lambda s: round(s.sum() / 1024, 1)),
+        p95_ms=("ms", lambda s: round(s.quantile(0.95), 1)))
+    return out
+
+
+def measure_flows(latency: Optional[Latency] = None, users: int = 5, workouts_per_user: int = 150) -> pd.DataFrame:
+    """Точный профиль одной страницы каждого сценария: round trips и байты (без конкуренции)."""
+    backend = FakeBackend(latency or Latency(0, 0, 0))
+    uids = seed_backend(backend, users, workouts_per_user)
+    rows = []
+    for name, flow in FLOWS.items():
+        sb = backend.client(uids[0], session=name)
+        backend.reset_calls()
+        t0 = time.perf_counter()
+        flow(sb, uids[0], random.Random(0))
+        ms = (time.perf_counter() - t0) * 1000.0
+        calls = pd.DataFrame(backend.calls)
+        rows.append({"flow": name, "round_trips": len(calls), "req_kb": round(calls["req_bytes"].sum() / 1024, 1),
+                     "resp_kb": round(calls["resp_bytes"].sum() / 1024, 1), "ms": round(ms, 1),
+                     "targets": ", ".join(f"{k}:{t}" for k, t in zip(calls["kind"], calls["target"]))})
+    return pd.DataFrame(rows)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="CapyRun DB-layer load test on a fake Supabase")
+    ap.add_argument("--sessions", type=int, default=100)
+    ap.add_argument("--pages", type=int, default=20, help="страниц на сессию")
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--workouts", type=int, default=150, help="тренировок на пользователя")
+    ap.add_argument("--latency-ms", type=float, default=25.0)
+    ap.add_argument("--per-row-ms", type=float, default=0.02)
+    ap.add_argument("--jitter-ms", type=float, default=5.0)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    lat = Latency(args.latency_ms, args.per_row_ms, args.jitter_ms, args.seed)
+    print(measure_flows(Latency(args.latency_ms, args.per_row_ms, 0.0), workouts_per_user=args.workouts).to_string(index=False))
+    res = run_load(args.sessions, args.pages, args.users, args.workouts, lat, seed=args.seed)
+    rep = res["report"]
+    print()
+    print(rep.to_string())
+    print(f"\nwall {rep.attrs['wall_s']:.1f} s, {rep.attrs['pages_per_s']:.1f} pages/s")
+    print(rep.attrs["calls_by_target"].to_string())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+# benchmarks/run.py — замеры горячих функций на синтетических FIT-файлах от 10 минут до 24 часов
+#
+#   python -m benchmarks.run                          # все размеры, печать таблицы
+#   python -m benchmarks.run --sizes 10,60 --save main # сохранить baseline в benchmarks/baselines/main.json
+#   python -m benchmarks.run --compare main            # сравнить с baseline (регрессии помечаются)
+
+from __future__ import annotations
+import io
+import os
+import gc
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import datetime as dt
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.fit_synth import synth_activity, make_pauses, ALL_CHANNELS
+from parsing import parse_fit_file
+from utils import zones_time, decoupling, ewma_daily, to_excel, build_ics, parse_bounds
+
+SIZES_MIN = (10, 60, 240, 1440)
+OPS = ("parse_fit_file", "zones_time", "decoupling", "ewma_daily", "to_excel", "build_ics")
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+HR_REST, HR_MAX = 50, 185
+BOUNDS = parse_bounds("120,140,155,170")
+
+
+def _timeit(fn: Callable[[], Any], repeat: int) -> Tuple[float, float]:
+    """(лучшее, медиана) время в секундах; GC выключен на время замера."""
+    times = []
+    gc_was = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+    finally:
+        if gc_was:
+            gc.enable()
+    return min(times), float(np.median(times))
+
+
+def _peak_mb(fn: Callable[[], Any]) -> float:
+    """Пик выделенной Python-памяти за вызов (tracemalloc; отдельный прогон, чтобы не искажать время)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1e6
+
+
+def _plan_df(weeks: int) -> pd.DataFrame:
+    days = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"] * weeks
+    types = ["Easy Z1–Z2", "Tempo Z3 (20–30 мин)", "Easy Z1–Z2", "Intervals Z4 (6×3’/2’)",
+             "Recovery 30–40’ Z1", "Long Z2", "Easy + strides"] * weeks
+    km = np.round(np.tile([4.8, 6.4, 4.0, 7.2, 3.2, 10.4, 4.0], weeks), 1)
+    return pd.DataFrame({"День": days, "Тип": types, "Пробежка (км)": km})
+
+
+def _cases(raw: bytes, minutes: int) -> Dict[str, Tuple[Callable[[], Any], int, int]]:
+    """op -> (вызов, число обработанных элементов, байт на входе)."""
+    df_rec, df_laps, df_ses, summary = parse_fit_file(io.BytesIO(raw), HR_REST, HR_MAX)
+    n = len(df_rec)
+    load = np.random.default_rng(1).gamma(2.0, 40.0, n)
+    weeks = max(1, minutes // 60)
+    plan = _plan_df(weeks)
+    return {
+        "parse_fit_file": (lambda: parse_fit_file(io.BytesIO(raw), HR_REST, HR_MAX), n, len(raw)),
+        "zones_time": (lambda: zones_time(df_rec["hr"], BOUNDS), n, 0),
+        "decoupling": (lambda: decoupling(df_rec["speed"], df_rec["hr"]), n, 0),
+        "ewma_daily": (lambda: ewma_daily(load, tau_days=42), n, 0),
+        "to_excel": (lambda: to_excel({"Summary": pd.DataFrame([summary]), "Laps": df_laps, "Records": df_rec}), n, 0),
+        "build_ics": (lambda: build_ics(plan, dt.date(2024, 5, 6), dt.time(7, 0), plan["День"].unique().tolist(),
+                                        60, "Park", 15), len(plan), 0),
+    }
+
+
+def run(
+    sizes=SIZES_MIN,
+    repeat: int = 3,
+    only: Optional[List[str]] = None,
+    hz: float = 1.0,
+    channels=ALL_CHANNELS,
+    pause_every_min: float = 20.0,
+    seed: int = 0,
+) -> pd.DataFrame:
+    rows: List[Dict[str, Any]] = []
+    for minutes in sizes:
+        raw = synth_activity(minutes, hz=hz, channels=channels,
+                             pauses=make_pauses(minutes, pause_every_min), seed=seed)
+        for op, (fn, items, nbytes) in _cases(raw, minutes).items():
+            if only and op not in only:
+                continue
+            best, med = _timeit(fn, repeat)
+            rows.append({
+                "op": op,
+                "minutes": minutes,
+                "items": items,
+                "best_ms": round(best * 1000, 3),
+                "median_ms": round(med * 1000, 3),
+                "items_per_s": round(items / best) if best > 0 else None,
+                "mb_per_s": round(nbytes / best / 1e6, 2) if (nbytes and best > 0) else None,
+                "peak_mb": round(_peak_mb(fn), 2),
+            })
+            print(f"  {op:<15} {minutes:>5} мин  {rows[-1]['median_ms']:>10.2f} мс", file=sys.stderr)
+    return pd.DataFrame(rows)
+
+
+def _env() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "ts": dt.datetime.utcnow().isoformat(),
+    }
+
+
+def save_baseline(df: pd.DataFrame, name: str, params: Dict[str, Any]) -> str:
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"env": _env(), "params": params, "results": df.to_dict(orient="records")},
+                  f, ensure_ascii=False, indent=2)
+    return path
+
+
+def compare(df: pd.DataFrame, name: str, tolerance: float = 0.10) -> pd.DataFrame:
+    """Медиана против baseline: ratio > 1 + tolerance — регрессия."""
+    with open(os.path.join(BASELINE_DIR, f"{name}.json"), encoding="utf-8") as f:
+        base = pd.DataFrame(json.load(f)["results"])
+    m = df.merge(base[["op", "minutes", "median_ms", "peak_mb"]], on=["op", "minutes"], suffixes=("", "_base"))
+    m["ratio"] = (m["median_ms"] / m["median_ms_base"]).round(3)
+    m["mem_ratio"] = (m["peak_mb"] / m["peak_mb_base"].replace(0, np.nan)).round(3)
+    m["status"] = np.where(m["ratio"] > 1 + tolerance, "SLOWER",
+                           np.where(m["ratio"] < 1 - tolerance, "faster", "≈"))
+    return m[["op", "minutes", "median_ms_base", "median_ms", "ratio", "peak_mb_base", "peak_mb", "mem_ratio", "status"]]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="CapyRun benchmarks")
+    ap.add_argument("--sizes", default=",".join(map(str, SIZES_MIN)), help="длительности в минутах через запятую")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--only", default="", help=f"подмножество операций: {','.join(OPS)}")
+    ap.add_argument("--hz", type=float, default=1.0)
+    ap.add_argument("--channels", default=",".join(ALL_CHANNELS))
+    ap.add_argument("--pause-every", type=float, default=20.0, help="пауза каждые N минут (0 — без пауз)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--save", help="сохранить результаты как baseline с этим именем")
+    ap.add_argument("--compare", help="сравнить с baseline с этим именем")
+    ap.add_argument("--tolerance", type=float, default=0.10)
+    args = ap.parse_args(argv)
+
+    params = {
+        "sizes": [int(s) for s in args.sizes.split(",") if s.strip()],
+        "repeat": args.repeat, "hz": args.hz, "seed": args.seed,
+        "channels": [c for c in args.channels.split(",") if c], "pause_every_min": args.pause_every,
+    }
+    only = [o for o in args.only.split(",") if o] or None
+    df = run(params["sizes"], args.repeat, only, args.hz, params["channels"], args.pause_every, args.seed)
+    print(df.to_string(index=False))
+
+    if args.save:
+        print(f"baseline: {save_baseline(df, args.save, params)}")
+    if args.compare:
+        cmp = compare(df, args.compare, args.tolerance)
+        print(cmp.to_string(index=False))
+        return 1 if (cmp["status"] == "SLOWER").any() else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
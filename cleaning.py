@@ -0,0 +1,163 @@
+# cleaning.py — очистка каналов df_rec: физиологические границы, фильтр Хампеля, ступеньки высоты, сглаживание
+#
+# Всё векторно: окна — np.lib.stride_tricks.sliding_window_view (n × w, без копии), медиана окна —
+# сортировка по строкам + выбор среднего элемента среди валидных. Окна «видят» только свой отрезок
+# записи: паузы длиннее gap_s режут ряд на сегменты, между ними в ряд вставляются NaN,
+# так что значение до паузы не тянет значение после неё. Сутки записи (86 400 точек, 4 канала) — десятки миллисекунд.
+
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+@dataclass(frozen=True)
+class ChannelConfig:
+    lo: float                      # физиологические/физические границы; вне — выброс
+    hi: float
+    window: int = 7                # окно Хампеля (нечётное, точек)
+    n_sigma: float = 3.0           # порог: |x − median| > n_sigma · 1.4826 · MAD
+    min_dev: float = 0.0           # и не меньше этого (MAD≈0 на ровных участках)
+    max_rate: Optional[float] = None   # ступенька: |Δx|/dt выше — сдвиг уровня, вычитаем
+    smooth: int = 0                # окно скользящего среднего после фильтра (0 — без сглаживания)
+
+
+DEFAULT_CONFIG: Dict[str, ChannelConfig] = {
+    "hr": ChannelConfig(lo=30, hi=230, window=9, n_sigma=3.0, min_dev=8.0),
+    "speed": ChannelConfig(lo=0.0, hi=30.0, window=7, n_sigma=3.0, min_dev=0.8, smooth=3),
+    "cadence": ChannelConfig(lo=0, hi=250, window=7, n_sigma=4.0, min_dev=10.0),
+    "elev": ChannelConfig(lo=-500, hi=9000, window=15, n_sigma=4.0, min_dev=5.0, max_rate=5.0, smooth=5),
+}
+GAP_S = 10.0
+
+
+def _segments(dt_s: Optional[np.ndarray], n: int, gap_s: float) -> np.ndarray:
+    """Номер непрерывного отрезка записи для каждой точки."""
+    if dt_s is None:
+        return np.zeros(n, np.int64)
+    return np.cumsum(np.nan_to_num(dt_s, nan=0.0) > gap_s)
+
+
+def _windows(x: np.ndarray, seg: np.ndarray, w: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Центрированные окна без копии: между сегментами вставляем w//2 NaN, так что окно не заходит
+    в соседний отрезок. Возвращает (окна, pos): окно точки x[i] — строка pos[i].
+    """
+    h = w // 2
+    cuts = np.flatnonzero(np.diff(seg)) + 1
+    xp = np.insert(x, np.repeat(cuts, h), np.nan) if len(cuts) else x
+    pos = np.arange(len(x)) + h * np.searchsorted(cuts, np.arange(len(x)), side="right")
+    return sliding_window_view(np.pad(xp, h, constant_values=np.nan), w), pos
+
+
+def _nanmedian_rows(win: np.ndarray) -> np.ndarray:
+    """
+    Медиана по строкам с пропусками: NaN уходят в конец при сортировке, берём середину валидных.
+    На коротких строках (окна 5–15) сортировка быстрее np.partition и np.nanmedian.
+    """
+    s = np.sort(win, axis=1)
+    n, w = s.shape
+    med = (s[:, (w - 1) // 2] + s[:, w // 2]) / 2.0
+    part = np.flatnonzero(np.isnan(s[:, -1]))       # неполные окна: края, паузы, дыры
+    if len(part):
+        sp = s[part]
+        k = w - np.isnan(sp).sum(axis=1)
+        rows = np.arange(len(part))
+        m = (sp[rows, np.maximum((k - 1) // 2, 0)] + sp[rows, np.maximum(k // 2, 0) - (k == 0)]) / 2.0
+        m[k == 0] = np.nan
+        med[part] = m
+    return med
+
+
+def hampel(x: np.ndarray, seg: np.ndarray, cfg: ChannelConfig) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Выбросы → медиана окна. Возвращает (очищенный ряд, маска заменённых).
+    Порог не ниже min_dev, поэтому MAD считаем только для точек, отошедших от медианы дальше min_dev.
+    """
+    win, pos = _windows(x, seg, cfg.window)
+    med = _nanmedian_rows(win)[pos]
+    dev = np.abs(x - med)
+    cand = np.flatnonzero(~np.isfinite(x) | (dev > cfg.min_dev))
+    bad = np.zeros(len(x), bool)
+    if len(cand):
+        mad = _nanmedian_rows(np.abs(win[pos[cand]] - med[cand, None]))
+        thr = np.maximum(cfg.n_sigma * 1.4826 * mad, cfg.min_dev)
+        bad[cand] = np.isfinite(med[cand]) & (~np.isfinite(x[cand]) | (dev[cand] > thr))
+    return np.where(bad, med, x), bad
+
+
+def remove_steps(x: np.ndarray, dt_s: Optional[np.ndarray], seg: np.ndarray, max_rate: float) -> Tuple[np.ndarray, int]:
+    """Ступеньки уровня (перекалибровка барометра): скачок быстрее max_rate·dt вычитается из хвоста сегмента."""
+    d = np.diff(x, prepend=np.nan)
+    dt = np.ones(len(x)) if dt_s is None else np.maximum(np.nan_to_num(dt_s, nan=1.0), 1.0)
+    jump = np.isfinite(d) & (np.abs(d) > max_rate * dt) & (np.diff(seg, prepend=seg[:1]) == 0)
+    if not jump.any():
+        return x, 0
+    return x - np.cumsum(np.where(jump, d, 0.0)), int(jump.sum())
+
+
+def smooth(x: np.ndarray, seg: np.ndarray, w: int) -> np.ndarray:
+    """
+    Центрированное скользящее среднее в пределах сегмента; NaN не размазываются.
+    Суммы окон — разности кумулятивных сумм с концами, обрезанными по границам сегмента.
+    """
+    n, h = len(x), w // 2
+    idx = np.arange(n)
+    first = np.flatnonzero(np.diff(seg, prepend=seg[0] - 1))          # начала сегментов
+    last = np.append(first[1:] - 1, n - 1)
+    k = np.searchsorted(first, idx, side="right") - 1
+    lo = np.maximum(idx - h, first[k])
+    hi = np.minimum(idx + h, last[k]) + 1
+    ok = np.isfinite(x)
+    cs = np.concatenate(([0.0], np.cumsum(np.where(ok, x, 0.0))))
+    cn = np.concatenate(([0], np.cumsum(ok)))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = (cs[hi] - cs[lo]) / (cn[hi] - cn[lo])
+    return np.where(ok, out, np.nan)
+
+
+def clean_channel(x: np.ndarray, dt_s: Optional[np.ndarray], cfg: ChannelConfig,
+                  gap_s: float = GAP_S) -> Tuple[np.ndarray, Dict[str, int]]:
+    """Один канал: границы → ступеньки → Хампель → сглаживание. Возвращает (ряд, счётчики)."""
+    x = np.asarray(x, float)
+    seg = _segments(dt_s, len(x), gap_s)
+    was = np.isfinite(x)
+    out_of_range = was & ((x < cfg.lo) | (x > cfg.hi))
+    y = np.where(out_of_range, np.nan, x)
+    steps = 0
+    if cfg.max_rate:
+        y, steps = remove_steps(y, dt_s, seg, cfg.max_rate)
+    y, bad = hampel(y, seg, cfg)
+    y = np.where(was, y, np.nan)              # пропуски исходника не выдумываем
+    outliers = bad & was & ~out_of_range
+    if cfg.smooth > 1:
+        y = smooth(y, seg, cfg.smooth)
+    # changed — заменённые точки; сдвиг хвоста после ступеньки и сглаживание в счётчик не входят
+    return y, {"clipped": int(out_of_range.sum()), "outliers": int(outliers.sum()),
+               "steps": steps, "changed": int((out_of_range | outliers).sum())}
+
+
+def clean_records(df_rec: pd.DataFrame, config: Optional[Dict[str, ChannelConfig]] = None,
+                  gap_s: float = GAP_S) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Чистит каналы df_rec по config (по умолчанию DEFAULT_CONFIG; None в значении — канал не трогаем).
+    Возвращает (df_rec, отчёт: строка на канал — clipped/outliers/steps/changed).
+    """
+    config = DEFAULT_CONFIG if config is None else config
+    rows = []
+    if df_rec.empty:
+        return df_rec, pd.DataFrame(rows)
+    dt_s = pd.to_numeric(df_rec["dt_s"], errors="coerce").to_numpy(float) if "dt_s" in df_rec else None
+    for ch, cfg in config.items():
+        if cfg is None or ch not in df_rec:
+            continue
+        x = pd.to_numeric(df_rec[ch], errors="coerce").to_numpy(float)
+        if not np.isfinite(x).any():
+            continue
+        y, rep = clean_channel(x, dt_s, cfg, gap_s)
+        df_rec[ch] = y
+        rows.append({"channel": ch, **rep})
+    return df_rec, pd.DataFrame(rows)
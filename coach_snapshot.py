@@ -0,0 +1,295 @@
+# coach_snapshot.py — контекст для тренера: компактный документ о тренировках пользователя, обновляемый при сохранении
+#
+# Страница «Общение с тренером» (supabase/functions/coach-orchestrator) читает одну строку
+# coach_training_context вместо сборки контекста из сырых тренировок на каждое сообщение. В документе:
+#   • recent — последние RECENT_N тренировок (ключевые метрики);
+#   • load — ATL/CTL/TSB по TRIMP на дату as_of (читающий может досчитать затухание до сегодня: exp(−дни/τ));
+#   • zones — минуты и доли в зонах пульса за 4 недели; weeks — недельные суммы за WEEKS недель;
+#   • prs — рекорды (самая длинная, самый быстрый средний темп на дистанции ≥ 5/10/21.1/42.2 км, лучший EF);
+#   • trends — изменение объёма, наклон EF, динамика CTL и флаги для подсказок тренера.
+# Обновление инкрементальное: новая тренировка добавляется к дневным нагрузкам окна WINDOW_DAYS и к недельным
+# корзинам; дни старше окна свёрнуты в начальное состояние EWMA (atl0/ctl0), поэтому документ не растёт
+# и совпадает с полной пересборкой. Тренировка старше окна, удаление дублей или пересчёт TRIMP — полная пересборка.
+# Строка версионирована: version растёт на каждой записи и служит оптимистической блокировкой;
+# doc["schema"] — версия формата (при смене формата документ пересобирается).
+
+from __future__ import annotations
+import math
+import datetime as dt
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+SCHEMA = 1
+RECENT_N = 10
+WINDOW_DAYS = 120
+WEEKS = 12
+TAU_ATL, TAU_CTL = 7, 42            # как utils.ewma_daily в views_multi
+PR_DISTANCES_KM = (5.0, 10.0, 21.1, 42.2)
+
+
+def _num(row: Dict[str, Any], *keys: str) -> Optional[float]:
+    for k in keys:
+        v = row.get(k)
+        if v is None:
+            continue
+        try:
+            x = float(v)
+        except (TypeError, ValueError):
+            continue
+        if math.isfinite(x):
+            return x
+    return None
+
+
+def _date(v: Any) -> Optional[dt.date]:
+    if v is None:
+        return None
+    if isinstance(v, dt.datetime):
+        return v.date()
+    if isinstance(v, dt.date):
+        return v
+    try:
+        return dt.date.fromisoformat(str(v)[:10])
+    except ValueError:
+        return None
+
+
+def workout_entry(row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Строка workouts / summary из парсера → компактная запись; None — без даты."""
+    day = _date(row.get("local_date") or row.get("date")) or _date(row.get("start_time"))
+    if day is None:
+        return None
+    dist = _num(row, "distance_km")
+    if dist is None:
+        dm = _num(row, "distance_m")
+        dist = dm / 1000.0 if dm is not None else None
+    start = row.get("start_time")
+    zs = row.get("zone_s")
+    return {
+        "id": str(row["id"]) if row.get("id") is not None else None,
+        "date": day.isoformat(),
+        "start_time": start.isoformat() if hasattr(start, "isoformat") else (str(start) if start else day.isoformat()),
+        "distance_km": round(dist, 2) if dist is not None else None,
+        "time_s": int(_num(row, "time_s", "duration_sec") or 0) or None,
+        "avg_hr": _num(row, "avg_hr"),
+        "trimp": _num(row, "trimp", "TRIMP"),
+        "tss": _num(row, "tss", "TSS"),
+        "ef": _num(row, "ef", "EF"),
+        "pa_hr_pct": _num(row, "pa_hr_pct", "Pa:Hr_%"),
+        "zone_s": [int(x) for x in zs] if isinstance(zs, list) else None,
+    }
+
+
+def empty_snapshot() -> Dict[str, Any]:
+    return {"schema": SCHEMA, "n_workouts": 0, "last_workout_at": None, "recent": [],
+            "load": {"measure": "TRIMP", "base_date": None, "atl0": 0.0, "ctl0": 0.0, "daily": {}},
+            "window_ids": {}, "weeks": {}, "prs": {}}
+
+
+# ---------- инкрементальное обновление ----------
+
+def _monday(d: dt.date) -> dt.date:
+    return d - dt.timedelta(days=d.weekday())
+
+
+def _ewma(atl: float, ctl: float, loads: Iterable[float]) -> tuple:
+    a, c = 1 - math.exp(-1.0 / TAU_ATL), 1 - math.exp(-1.0 / TAU_CTL)
+    for v in loads:
+        atl += a * (v - atl)
+        ctl += c * (v - ctl)
+    return atl, ctl
+
+
+def _days(d0: dt.date, d1: dt.date) -> List[dt.date]:
+    return [d0 + dt.timedelta(days=i) for i in range((d1 - d0).days + 1)]
+
+
+def _roll(doc: Dict[str, Any]) -> None:
+    """Дни старше окна WINDOW_DAYS (от последнего дня с нагрузкой) сворачиваем в atl0/ctl0."""
+    load = doc["load"]
+    daily = load["daily"]
+    if not daily:
+        return
+    new_base = max(_date(d) for d in daily) - dt.timedelta(days=WINDOW_DAYS)
+    first = _date(load["base_date"]) + dt.timedelta(days=1) if load["base_date"] else min(_date(d) for d in daily)
+    if first > new_base:
+        return
+    load["atl0"], load["ctl0"] = _ewma(load["atl0"], load["ctl0"],
+                                       (daily.get(d.isoformat(), 0.0) for d in _days(first, new_base)))
+    load["base_date"] = new_base.isoformat()
+    for d in [d for d in daily if _date(d) <= new_base]:
+        del daily[d]
+    ids = doc["window_ids"]
+    for k in [k for k, d in ids.items() if _date(d) <= new_base]:
+        del ids[k]
+
+
+def _pr(prs: Dict[str, Any], key: str, value: Optional[float], w: Dict[str, Any], lower_is_better: bool = False) -> None:
+    if value is None or value <= 0:
+        return
+    cur = prs.get(key)
+    better = cur is None or (value < cur["value"] if lower_is_better else value > cur["value"])
+    if better:
+        prs[key] = {"value": round(value, 3), "workout_id": w["id"], "date": w["date"]}
+
+
+def apply_workout(doc: Dict[str, Any], row: Dict[str, Any]) -> bool:
+    """Добавляет тренировку в документ. False — она старше окна, нужна полная пересборка."""
+    w = workout_entry(row)
+    if w is None:
+        return True
+    if w["id"] and w["id"] in doc["window_ids"]:
+        return True                      # повторное сохранение той же тренировки
+    day = _date(w["date"])
+    load = doc["load"]
+    if load["base_date"] and day <= _date(load["base_date"]):
+        return False
+
+    load["daily"][w["date"]] = round(load["daily"].get(w["date"], 0.0) + (w["trimp"] or 0.0), 1)
+    if w["id"]:
+        doc["window_ids"][w["id"]] = w["date"]
+
+    wk = _monday(day).isoformat()
+    b = doc["weeks"].setdefault(wk, {"n": 0, "km": 0.0, "time_s": 0, "trimp": 0.0, "zone_s": [],
+                                     "ef_sum": 0.0, "ef_n": 0, "pahr_sum": 0.0, "pahr_n": 0})
+    b["n"] += 1
+    b["km"] = round(b["km"] + (w["distance_km"] or 0.0), 2)
+    b["time_s"] += w["time_s"] or 0
+    b["trimp"] = round(b["trimp"] + (w["trimp"] or 0.0), 1)
+    if w["zone_s"]:
+        a, c = b["zone_s"], w["zone_s"]
+        b["zone_s"] = [(a[i] if i < len(a) else 0) + (c[i] if i < len(c) else 0) for i in range(max(len(a), len(c)))]
+    if w["ef"]:
+        b["ef_sum"], b["ef_n"] = b["ef_sum"] + w["ef"], b["ef_n"] + 1
+    if w["pa_hr_pct"] is not None:
+        b["pahr_sum"], b["pahr_n"] = b["pahr_sum"] + w["pa_hr_pct"], b["pahr_n"] + 1
+    for k in sorted(doc["weeks"])[:-WEEKS]:
+        del doc["weeks"][k]
+
+    prs = doc["prs"]
+    _pr(prs, "longest_km", w["distance_km"], w)
+    _pr(prs, "longest_time_s", w["time_s"], w)
+    _pr(prs, "best_ef", w["ef"], w)
+    if w["distance_km"] and w["time_s"]:
+        pace = w["time_s"] / w["distance_km"]
+        for km in PR_DISTANCES_KM:
+            if w["distance_km"] >= km:
+                _pr(prs, f"best_pace_s_per_km_{km:g}k", pace, w, lower_is_better=True)
+
+    recent = doc["recent"] + [{k: v for k, v in w.items() if k != "zone_s"}]
+    recent.sort(key=lambda r: r["start_time"], reverse=True)
+    doc["recent"] = recent[:RECENT_N]
+    doc["n_workouts"] += 1
+    if not doc["last_workout_at"] or w["start_time"] > doc["last_workout_at"]:
+        doc["last_workout_at"] = w["start_time"]
+    _roll(doc)
+    return True
+
+
+# ---------- производные поля ----------
+
+def finalize(doc: Dict[str, Any], today: Optional[dt.date] = None) -> Dict[str, Any]:
+    """Пересчитывает load/zones/trends на дату today (по умолчанию — сегодня)."""
+    today = today or dt.date.today()
+    load = doc["load"]
+    daily = load["daily"]
+    first = (_date(load["base_date"]) + dt.timedelta(days=1)) if load["base_date"] else \
+        (min(_date(d) for d in daily) if daily else today)
+    days = _days(first, max(today, first))
+    loads = [daily.get(d.isoformat(), 0.0) for d in days]
+    atl, ctl = _ewma(load["atl0"], load["ctl0"], loads)
+    ctl_28 = _ewma(load["atl0"], load["ctl0"], loads[:-28])[1] if len(loads) > 28 else None
+    load.update(atl=round(atl, 1), ctl=round(ctl, 1), tsb=round(ctl - atl, 1), as_of=today.isoformat(),
+                load_7d=round(sum(loads[-7:]), 1), ctl_delta_28d=round(ctl - ctl_28, 1) if ctl_28 is not None else None)
+
+    weeks = [doc["weeks"].get(_monday(today - dt.timedelta(weeks=i)).isoformat()) or {} for i in range(8)]
+    last4, prev4 = weeks[:4], weeks[4:]
+    zs = [w.get("zone_s") or [] for w in last4]
+    k = max((len(z) for z in zs), default=0)
+    zone = np.sum([z + [0] * (k - len(z)) for z in zs], axis=0) if k else np.zeros(0)
+    tot = float(zone.sum()) if k else 0.0
+    doc["zones"] = {"weeks": 4, "minutes": [int(round(float(x) / 60.0)) for x in zone],
+                    "share": [round(float(x) / tot, 3) for x in zone] if tot else []}
+
+    km4, kmp = sum(w.get("km", 0.0) for w in last4), sum(w.get("km", 0.0) for w in prev4)
+    ef_w = [(i, w["ef_sum"] / w["ef_n"]) for i, w in enumerate(reversed(weeks)) if w.get("ef_n")]
+    ef_slope = None
+    if len(ef_w) >= 3:
+        x, y = np.array(ef_w).T
+        ef_slope = float(np.polyfit(x, y, 1)[0] / y.mean() * 100.0)
+    pahr = [w["pahr_sum"] / w["pahr_n"] for w in last4 if w.get("pahr_n")]
+    trends = {
+        "km_4w": round(km4, 1),
+        "km_prev_4w": round(kmp, 1),
+        "volume_change_pct": round((km4 / kmp - 1.0) * 100.0, 1) if kmp > 0 else None,
+        "ef_slope_pct_per_week": round(ef_slope, 2) if ef_slope is not None else None,
+        "pa_hr_mean_4w": round(float(np.mean(pahr)), 1) if pahr else None,
+        "high_intensity_share": round(float(zone[-2:].sum()) / tot, 3) if tot and k >= 2 else None,
+    }
+    flags = []
+    if trends["volume_change_pct"] is not None and trends["volume_change_pct"] > 30:
+        flags.append("volume_spike")
+    elif trends["volume_change_pct"] is not None and trends["volume_change_pct"] < -30:
+        flags.append("volume_drop")
+    if ef_slope is not None:
+        flags.append("ef_improving" if ef_slope > 0.5 else "ef_declining" if ef_slope < -0.5 else "ef_stable")
+    if load["tsb"] < -20:
+        flags.append("fatigue_high")
+    elif load["tsb"] > 15:
+        flags.append("fresh")
+    if trends["pa_hr_mean_4w"] is not None and trends["pa_hr_mean_4w"] > 5:
+        flags.append("aerobic_decoupling")
+    if trends["high_intensity_share"] is not None and trends["high_intensity_share"] > 0.25:
+        flags.append("intensity_high")
+    trends["flags"] = flags
+    doc["trends"] = trends
+    doc["updated_at"] = dt.datetime.now(dt.timezone.utc).isoformat()
+    return doc
+
+
+def build_snapshot(rows: Iterable[Dict[str, Any]], today: Optional[dt.date] = None) -> Dict[str, Any]:
+    """Полная сборка из истории (строки workouts в любом порядке)."""
+    doc = empty_snapshot()
+    entries = [r for r in rows if workout_entry(r) is not None]
+    entries.sort(key=lambda r: workout_entry(r)["start_time"])
+    for r in entries:
+        apply_workout(doc, r)
+    return finalize(doc, today)
+
+
+def update_snapshot(doc: Optional[Dict[str, Any]], new_rows: Iterable[Dict[str, Any]],
+                    load_all: Callable[[], Iterable[Dict[str, Any]]], today: Optional[dt.date] = None) -> Dict[str, Any]:
+    """Инкрементально, если возможно; иначе (нет документа, другая схема, старая тренировка) — из load_all()."""
+    if doc and doc.get("schema") == SCHEMA:
+        new_rows = list(new_rows)
+        new_rows.sort(key=lambda r: (workout_entry(r) or {}).get("start_time") or "")
+        if all(apply_workout(doc, r) for r in new_rows):
+            return finalize(doc, today)
+    return build_snapshot(load_all(), today)
+
+
+def snapshot_row(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Колонки coach_training_context кроме user_id/version."""
+    return {"schema_version": SCHEMA, "doc": doc, "n_workouts": int(doc["n_workouts"]),
+            "last_workout_at": doc["last_workout_at"], "updated_at": doc["updated_at"]}
+
+
+# ---------- Supabase ----------
+
+def refresh_coach_snapshot(supabase, user_id: str, saved_rows: Iterable[Dict[str, Any]] = (),
+                           rebuild: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Обновить документ после сохранения тренировок (saved_rows — строки с id) или пересобрать (rebuild=True:
+    удаление дублей, пересчёт TRIMP). Конфликт версий (параллельная запись) — одна повторная попытка.
+    """
+    from db import fetch_coach_snapshot, save_coach_snapshot, fetch_coach_rows
+
+    saved_rows = list(saved_rows)
+    for _ in range(2):
+        cur = fetch_coach_snapshot(supabase, user_id)
+        doc = None if rebuild or not cur else cur.get("doc")
+        doc = update_snapshot(doc, saved_rows, lambda: fetch_coach_rows(supabase, user_id))
+        if save_coach_snapshot(supabase, user_id, snapshot_row(doc), cur.get("version") if cur else None):
+            return doc
+    return None
@@ -0,0 +1,172 @@
+# dashboard.py — главная страница: сводки по дням и неделям из серверных RPC dash_fast_days / dash_fast_weeks
+#
+# Агрегация — в Postgres (удалённые тренировки не считаются): 12 недель — одна строка на неделю,
+# ответ в сотни байт вместо всей истории и groupby в pandas на каждый рендер. Готовые таблицы
+# держим в локальном материализованном кэше процесса (ключ — пользователь, вид сводки, окно) с коротким TTL;
+# сохранение или удаление тренировок сбрасывает кэш пользователя (invalidate), так что после загрузки
+# файла главная сразу свежая. Промахи (дни, недели, последние тренировки) запрашиваются одной
+# параллельной пачкой через async_data.load_page_data.
+
+from __future__ import annotations
+import time
+import threading
+import datetime as dt
+from typing import Any, Dict, Optional, Tuple
+
+import pandas as pd
+import altair as alt
+import streamlit as st
+
+from async_data import load_page_data
+
+TTL_S = 120.0
+DAYS = 30
+WEEKS = 12
+RECENT = 10
+TIMEOUT_S = 5.0
+RECENT_COLUMNS = ("date", "start_time", "sport", "distance_km", "time_hms", "avg_hr", "TRIMP")
+
+
+class _Materialized:
+    """(user_id, вид, окно) → (момент устаревания, DataFrame); общий для сессий процесса."""
+
+    def __init__(self):
+        self._data: Dict[Tuple[str, str, int], Tuple[float, pd.DataFrame]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str, int]) -> Optional[pd.DataFrame]:
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None:
+                return None
+            if hit[0] < time.monotonic():
+                del self._data[key]
+                return None
+            return hit[1]
+
+    def put(self, key: Tuple[str, str, int], df: pd.DataFrame, ttl_s: float) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl_s, df)
+
+    def invalidate(self, user_id: Optional[str] = None) -> int:
+        with self._lock:
+            keys = [k for k in self._data if user_id is None or k[0] == str(user_id)]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+
+
+@st.cache_resource(show_spinner=False)
+def _store() -> _Materialized:
+    return _Materialized()
+
+
+def invalidate(user_id: Optional[str] = None) -> None:
+    """Сбросить сводки пользователя (все — если user_id не задан). Звать после сохранения/удаления тренировок."""
+    _store().invalidate(user_id)
+
+
+def _monday(d: dt.date) -> dt.date:
+    return d - dt.timedelta(days=d.weekday())
+
+
+def days_frame(rows, days: int, today: Optional[dt.date] = None) -> pd.DataFrame:
+    """Ответ dash_fast_days → все дни окна (пустые — нули): d, workouts, time_sec, distance_km, kcal."""
+    today = today or dt.date.today()
+    idx = pd.date_range(today - dt.timedelta(days=max(days - 1, 0)), today, freq="D")
+    df = pd.DataFrame(rows or [], columns=["d", "workouts", "time_sec", "distance_m", "kcal"])
+    df["d"] = pd.to_datetime(df["d"], errors="coerce")
+    df = df.dropna(subset=["d"]).set_index("d").apply(pd.to_numeric, errors="coerce")
+    df = df.reindex(idx, fill_value=0).fillna(0).rename_axis("d").reset_index()
+    df["distance_km"] = (df.pop("distance_m") / 1000.0).round(2)
+    return df
+
+
+def weeks_frame(rows, weeks: int, today: Optional[dt.date] = None) -> pd.DataFrame:
+    """Ответ dash_fast_weeks → последние weeks недель с понедельника: week_start, workouts, hours, distance_km."""
+    last = _monday(today or dt.date.today())
+    idx = pd.date_range(last - dt.timedelta(weeks=max(weeks, 1) - 1), last, freq="W-MON")
+    df = pd.DataFrame(rows or [], columns=["week_start", "workouts", "time_sec", "distance_m"])
+    df["week_start"] = pd.to_datetime(df["week_start"], errors="coerce")
+    df = df.dropna(subset=["week_start"]).set_index("week_start").apply(pd.to_numeric, errors="coerce")
+    df = df.reindex(idx, fill_value=0).fillna(0).rename_axis("week_start").reset_index()
+    df["hours"] = (df.pop("time_sec") / 3600.0).round(2)
+    df["distance_km"] = (df.pop("distance_m") / 1000.0).round(2)
+    return df
+
+
+def recent_frame(df: Optional[pd.DataFrame], n: int) -> pd.DataFrame:
+    """Последние n тренировок (fetch_workouts(newest=True)) → компактная таблица для главной."""
+    if df is None or df.empty:
+        return pd.DataFrame(columns=list(RECENT_COLUMNS))
+    return df[[c for c in RECENT_COLUMNS if c in df.columns]].head(n).reset_index(drop=True)
+
+
+def load_dashboard(supabase, user_id: str, days: int = DAYS, weeks: int = WEEKS, recent: int = RECENT,
+                   ttl_s: float = TTL_S) -> Dict[str, Any]:
+    """{"days", "weeks", "recent": DataFrame, "errors": {...}}; сеть — только для устаревших частей, одной пачкой."""
+    store = _store()
+    # вид → (часть async_data.page_queries, окно, построитель таблицы)
+    spec = {"days": ("dash_days", days, days_frame), "weeks": ("dash_weeks", weeks, weeks_frame),
+            "recent": ("history", recent, recent_frame)}
+    out: Dict[str, Any] = {"errors": {}}
+    missing = []
+    for kind, (_, n, _) in spec.items():
+        df = store.get((str(user_id), kind, n))
+        if df is None:
+            missing.append(kind)
+        else:
+            out[kind] = df
+    if missing:
+        parts = [spec[k][0] for k in missing]
+        res = load_page_data(supabase, user_id, parts, history_limit=recent, history_newest=True,
+                             days=days, weeks=weeks, timeouts={p: TIMEOUT_S for p in parts})
+        for kind in missing:
+            part, n, build = spec[kind]
+            out[kind] = build(res[part], n)
+            if part in res.errors:
+                out["errors"][kind] = res.errors[part]
+            else:
+                # ошибку не кэшируем: следующий рендер попробует снова
+                store.put((str(user_id), kind, n), out[kind], ttl_s)
+    return out
+
+
+def render_dashboard(supabase, user_id: str, days: int = DAYS, weeks: int = WEEKS) -> None:
+    st.header("🏠 Главная")
+    data = load_dashboard(supabase, user_id, days, weeks)
+    if data["errors"]:
+        st.warning("Часть сводок не загрузилась (временная проблема соединения).")
+    dw, dd = data["weeks"], data["days"]
+
+    cur, prev = dw.iloc[-1], dw.iloc[-2] if len(dw) > 1 else None
+    c1, c2, c3, c4 = st.columns(4)
+    with c1:
+        st.metric("Км за неделю", f"{cur['distance_km']:.1f}",
+                  None if prev is None else f"{cur['distance_km'] - prev['distance_km']:+.1f}")
+    with c2:
+        st.metric("Часы за неделю", f"{cur['hours']:.1f}",
+                  None if prev is None else f"{cur['hours'] - prev['hours']:+.1f}")
+    with c3:
+        st.metric("Тренировок за неделю", int(cur["workouts"]),
+                  None if prev is None else int(cur["workouts"] - prev["workouts"]))
+    with c4:
+        st.metric(f"Км за {days} дн.", f"{dd['distance_km'].sum():.1f}")
+
+    if not dw["workouts"].any():
+        st.info(f"За последние {weeks} недель тренировок нет — загрузите FIT-файлы.")
+        return
+
+    st.subheader(f"Объём по неделям ({weeks} нед.)")
+    st.altair_chart(alt.Chart(dw).mark_bar().encode(
+        x=alt.X("week_start:T", title="неделя"), y=alt.Y("distance_km:Q", title="км"),
+        tooltip=["week_start:T", "distance_km:Q", "hours:Q", "workouts:Q"]), use_container_width=True)
+
+    st.subheader(f"По дням ({days} дн.)")
+    st.altair_chart(alt.Chart(dd).mark_bar().encode(
+        x=alt.X("d:T", title="день"), y=alt.Y("distance_km:Q", title="км"),
+        tooltip=["d:T", "distance_km:Q", "workouts:Q", "kcal:Q"]), use_container_width=True)
+
+    if not data["recent"].empty:
+        st.subheader("Последние тренировки")
+        st.dataframe(data["recent"], hide_index=True)
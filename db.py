@@ -8,11 +8,17 @@ from typing import List, Dict, Any, Tuple, Optional
 import numpy as np
 import pandas as pd
 
+from instrument import traced
+
 # ---- Маппинг "ключ из summary" -> "колонка в БД" ----
 KEY_MAP_SAVE = {
     "Pa:Hr_%": "pa_hr_pct",
     "TRIMP": "trimp",
     "EF": "ef",
+    "IF": "intensity_factor",
+    "TSS": "tss",
+    "GAP_EF": "gap_ef",
+    "GAP_Pa:Hr_%": "gap_pa_hr_pct",
 }
 KEY_MAP_LOAD = {v: k for k, v in KEY_MAP_SAVE.items()}
 
@@ -94,13 +100,16 @@ def _normalize_row_for_save(user_id: str, row: Dict[str, Any]) -> Dict[str, Any]
     return out
 
 
-def save_workouts(supabase, user_id: str, summaries: List[Dict[str, Any]]) -> None:
+@traced("db.save_workouts", lambda res, sb, uid, summaries, *a, **k: {"rows_out": len(summaries or [])})
+def save_workouts(supabase, user_id: str, summaries: List[Dict[str, Any]]) -> List[Optional[str]]:
     """
     Пишем через RPC-функцию insert_workouts: она сама ставит user_id = auth.uid().
     Если пользователь не аутентифицирован — не делаем ничего.
+    Возвращает id вставленных строк в порядке summaries (None — не нашли); [] — ничего не сохранено.
+    Если RPC вернул не строки (void/счётчик — зависит от версии функции на сервере), id ищем по start_time.
     """
     if not summaries:
-        return
+        return []
 
     # Нормализуем и маппим ключи (как раньше), но БЕЗ user_id — его проставит функция
     rows = []
@@ -117,13 +126,90 @@ def save_workouts(supabase, user_id: str, summaries: List[Dict[str, Any]]) -> No
 
     if not uid or not token:
         # Не аутентифицирован — не сохраняем, но не бросаем исключение
-        return
+        return []
 
     # Вызов RPC
-    supabase.rpc("insert_workouts", {"_rows": rows}).execute()
+    res = supabase.rpc("insert_workouts", {"_rows": rows}).execute()
+    data = getattr(res, "data", None)
+    if isinstance(data, list) and len(data) == len(rows):
+        ids = [(d or {}).get("id") if isinstance(d, dict) else d for d in data]
+        if all(ids):
+            return ids
+    return _lookup_inserted_ids(supabase, uid, rows)
+
+
+def _lookup_inserted_ids(supabase, uid: str, rows: List[Dict[str, Any]]) -> List[Optional[str]]:
+    """id только что вставленных строк: одна выборка по окну start_time, совпадение — по моменту в UTC (новейшая)."""
+    starts = pd.to_datetime(pd.Series([r.get("start_time") for r in rows], dtype=object),
+                            errors="coerce", utc=True, format="mixed")
+    if starts.isna().all():
+        return [None] * len(rows)
+    lo, hi = starts.min() - pd.Timedelta(seconds=1), starts.max() + pd.Timedelta(seconds=1)
+    res = supabase.table("workouts").select("id, start_time, created_at").eq("user_id", uid) \
+        .gte("start_time", lo.isoformat()).lte("start_time", hi.isoformat()) \
+        .is_("deleted_at", "null").order("created_at", desc=True).execute()
+    found: Dict[pd.Timestamp, str] = {}
+    for d in getattr(res, "data", None) or []:
+        t = pd.to_datetime(d.get("start_time"), errors="coerce", utc=True)
+        if pd.notna(t):
+            found.setdefault(t, d.get("id"))      # по created_at desc: первая — самая свежая
+    return [found.get(t) if pd.notna(t) else None for t in starts]
+
+
+def save_tracks(supabase, user_id: str, workout_ids: List[Optional[str]], tracks: List[Optional[Dict[str, Any]]]) -> int:
+    """
+    GPS-треки (gps.build_track) в workout_tracks одним upsert'ом; пары (id, трек) без id или без GPS пропускаем.
+    Возвращает число сохранённых треков.
+    """
+    rows = [{"workout_id": wid, "user_id": user_id, **tr}
+            for wid, tr in zip(workout_ids or [], tracks or []) if wid and tr]
+    if not rows:
+        return 0
+    _attach_auth_token(supabase)
+    supabase.table("workout_tracks").upsert(_jsonable(rows), on_conflict="workout_id").execute()
+    return len(rows)
 
 
-def fetch_workouts(supabase, user_id: str, limit: int = 200) -> pd.DataFrame:
+def fetch_track(supabase, workout_id: str, zoom: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Трек тренировки для карты. С zoom тянем только bbox и уровни (без полного polyline).
+    """
+    _attach_auth_token(supabase)
+    cols = "workout_id, n_points, min_lat, min_lon, max_lat, max_lon, levels"
+    if zoom is None:
+        cols += ", polyline, times"
+    res = supabase.table("workout_tracks").select(cols).eq("workout_id", workout_id).limit(1).execute()
+    data = getattr(res, "data", None) or []
+    return data[0] if data else None
+
+
+def fetch_tracks(supabase, user_id: str, workout_ids: Optional[List[str]] = None, full: bool = False,
+                 live_only: bool = False) -> List[Dict[str, Any]]:
+    """
+    Треки пользователя одним запросом. full=False — только bbox и уровни (для индексов),
+    full=True — ещё полный polyline и times (для точной проверки кандидатов).
+    live_only=True — без треков скрытых тренировок (deleted_at, дубли): для полной сборки индексов и карты.
+    """
+    uid, _ = _attach_auth_token(supabase)
+    cols = "workout_id, n_points, min_lat, min_lon, max_lat, max_lon, levels"
+    if full:
+        cols += ", polyline, times"
+    q = supabase.table("workout_tracks").select(cols).eq("user_id", uid or user_id)
+    if workout_ids is not None:
+        if not workout_ids:
+            return []
+        q = q.in_("workout_id", list(workout_ids))
+    rows = getattr(q.execute(), "data", None) or []
+    if live_only and rows:
+        res = supabase.table("workouts").select("id").eq("user_id", uid or user_id).is_("deleted_at", "null").execute()
+        live = {str(r["id"]) for r in getattr(res, "data", None) or []}
+        rows = [r for r in rows if str(r["workout_id"]) in live]
+    return rows
+
+
+@traced("db.fetch_workouts", lambda df, *a, **k: {"rows_out": len(df)})
+def fetch_workouts(supabase, user_id: str, limit: int = 200, newest: bool = False) -> pd.DataFrame:
+    """Тренировки пользователя по start_time; newest=True — последние limit (в порядке убывания)."""
     uid, token = _attach_auth_token(supabase)
     # фильтруем по uid (если было получено), иначе по переданному user_id
     filter_uid = uid or user_id
@@ -131,7 +217,8 @@ def fetch_workouts(supabase, user_id: str, limit: int = 200) -> pd.DataFrame:
     res = supabase.table("workouts") \
         .select("*") \
         .eq("user_id", filter_uid) \
-        .order("start_time", desc=False) \
+        .is_("deleted_at", "null") \
+        .order("start_time", desc=newest) \
         .limit(limit) \
         .execute()
 
@@ -143,6 +230,201 @@ def fetch_workouts(supabase, user_id: str, limit: int = 200) -> pd.DataFrame:
     df = df.rename(columns=KEY_MAP_LOAD)
     if "start_time" in df.columns:
         df["start_time"] = pd.to_datetime(df["start_time"], errors="coerce")
+    if "date" not in df.columns and "local_date" in df.columns:
+        df["date"] = df["local_date"]
     if "date" in df.columns:
         df["date"] = pd.to_datetime(df["date"], errors="coerce").dt.date
-    return df
\ No newline at end of file
+    return df
+
+def fetch_fingerprints(supabase, user_id: str, start_between: Optional[Tuple[Any, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Узкая выборка для индекса дублей (dedup.py): только id, время, длительность, дистанция, отпечаток.
+    start_between — окно по start_time для проверки одной тренировки без чтения всей истории.
+    """
+    uid, _ = _attach_auth_token(supabase)
+    q = supabase.table("workouts") \
+        .select("id, start_time, time_s, duration_sec, distance_km, distance_m, uploaded_at, fingerprint") \
+        .eq("user_id", uid or user_id) \
+        .is_("deleted_at", "null")
+    if start_between is not None:
+        q = q.gte("start_time", _jsonable(start_between[0])).lte("start_time", _jsonable(start_between[1]))
+    res = q.order("uploaded_at", desc=False).execute()
+    return getattr(res, "data", None) or []
+
+
+def fetch_features(supabase, user_id: str) -> List[Dict[str, Any]]:
+    """Векторы признаков (similar.py) и метрики для вывода — без fit_summary и прочих тяжёлых колонок."""
+    uid, _ = _attach_auth_token(supabase)
+    res = supabase.table("workouts") \
+        .select("id, start_time, distance_km, distance_m, time_s, duration_sec, avg_hr, ef, pa_hr_pct, features") \
+        .eq("user_id", uid or user_id) \
+        .is_("deleted_at", "null") \
+        .execute()
+    return getattr(res, "data", None) or []
+
+
+def fetch_aggregates(supabase, user_id: str, since: Optional[Any] = None) -> List[Dict[str, Any]]:
+    """
+    Компактные агрегаты (aggregates.py) для графиков по истории: zone_s, hr_hist, aggregates — одним запросом.
+    since — нижняя граница start_time (например, последние 26 недель).
+    """
+    uid, _ = _attach_auth_token(supabase)
+    q = supabase.table("workouts") \
+        .select("id, start_time, local_date, time_s, distance_km, zone_s, hr_hist, aggregates") \
+        .eq("user_id", uid or user_id) \
+        .is_("deleted_at", "null")
+    if since is not None:
+        q = q.gte("start_time", _jsonable(since))
+    res = q.order("start_time", desc=False).execute()
+    return getattr(res, "data", None) or []
+
+
+@traced("db.fetch_dash_days", lambda rows, *a, **k: {"rows_out": len(rows)})
+def fetch_dash_days(supabase, days: int = 30) -> List[Dict[str, Any]]:
+    """Сводка по дням (RPC dash_fast_days): d, workouts, time_sec, distance_m, kcal. Пользователь — auth.uid()."""
+    _attach_auth_token(supabase)
+    res = supabase.rpc("dash_fast_days", {"days": int(days)}).execute()
+    return getattr(res, "data", None) or []
+
+
+@traced("db.fetch_dash_weeks", lambda rows, *a, **k: {"rows_out": len(rows)})
+def fetch_dash_weeks(supabase, weeks: int = 12) -> List[Dict[str, Any]]:
+    """Сводка по неделям (RPC dash_fast_weeks): week_start, workouts, time_sec, distance_m."""
+    _attach_auth_token(supabase)
+    res = supabase.rpc("dash_fast_weeks", {"weeks": int(weeks)}).execute()
+    return getattr(res, "data", None) or []
+
+
+def count_workouts(supabase, user_id: str) -> int:
+    uid, _ = _attach_auth_token(supabase)
+    res = supabase.table("workouts").select("id", count="exact") \
+        .eq("user_id", uid or user_id).is_("deleted_at", "null").limit(1).execute()
+    return int(getattr(res, "count", None) or 0)
+
+
+def fetch_hr_hists(supabase, user_id: str, after: Optional[str] = None, limit: int = 500) -> List[Dict[str, Any]]:
+    """Страница (id, hr_hist) по возрастанию id — keyset-пагинация для recompute.py."""
+    uid, _ = _attach_auth_token(supabase)
+    q = supabase.table("workouts").select("id, hr_hist") \
+        .eq("user_id", uid or user_id).is_("deleted_at", "null")
+    if after:
+        q = q.gt("id", after)
+    res = q.order("id", desc=False).limit(limit).execute()
+    return getattr(res, "data", None) or []
+
+
+def fetch_stream_previews(supabase, user_id: str, workout_ids: List[str]) -> List[Dict[str, Any]]:
+    """Превью-стримы (time_s, hr) из workout_streams_preview, которые пишет edge-функция импорта."""
+    if not workout_ids:
+        return []
+    uid, _ = _attach_auth_token(supabase)
+    res = supabase.table("workout_streams_preview").select("workout_id, s") \
+        .eq("user_id", uid or user_id).in_("workout_id", list(workout_ids)).execute()
+    return getattr(res, "data", None) or []
+
+
+def update_workout_metrics(supabase, rows: List[Dict[str, Any]]) -> None:
+    """Пачка пересчитанных метрик ({id, trimp, zone_s[, hr_hist]}) одним RPC: update … from jsonb."""
+    if not rows:
+        return
+    _attach_auth_token(supabase)
+    supabase.rpc("update_workout_metrics", {"_rows": _jsonable(rows)}).execute()
+
+
+def fetch_local_time_rows(supabase, user_id: str, after: Optional[str] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+    """Страница (id, start_time, local_date, utc_offset_s) по возрастанию id — для localtime.backfill_local_dates."""
+    uid, _ = _attach_auth_token(supabase)
+    q = supabase.table("workouts").select("id, start_time, local_date, utc_offset_s").eq("user_id", uid or user_id)
+    if after:
+        q = q.gt("id", after)
+    res = q.order("id", desc=False).limit(limit).execute()
+    return getattr(res, "data", None) or []
+
+
+def update_workout_local_dates(supabase, rows: List[Dict[str, Any]]) -> None:
+    """Пачка ({id, local_date, utc_offset_s}) одним RPC; utc_offset_s = null не затирает известное смещение."""
+    if not rows:
+        return
+    _attach_auth_token(supabase)
+    supabase.rpc("update_workout_local_dates", {"_rows": _jsonable(rows)}).execute()
+
+
+def fetch_recompute_state(supabase, user_id: str) -> Optional[Dict[str, Any]]:
+    uid, _ = _attach_auth_token(supabase)
+    res = supabase.table("profile_recompute").select("*").eq("user_id", uid or user_id).limit(1).execute()
+    data = getattr(res, "data", None) or []
+    return data[0] if data else None
+
+
+def save_recompute_state(supabase, user_id: str, state: Dict[str, Any]) -> None:
+    uid, _ = _attach_auth_token(supabase)
+    row = {**_jsonable(state), "user_id": uid or user_id, "updated_at": dt.datetime.now(dt.timezone.utc).isoformat()}
+    supabase.table("profile_recompute").upsert(row, on_conflict="user_id").execute()
+
+
+def mark_duplicates(supabase, user_id: str, pairs: pd.DataFrame) -> int:
+    """Мягкое удаление дублей: deleted_at = now, duplicate_of = оставленная копия."""
+    uid, _ = _attach_auth_token(supabase)
+    now = dt.datetime.now(dt.timezone.utc).isoformat()
+    for keep_id, grp in pairs.groupby("keep_id"):
+        supabase.table("workouts").update({"deleted_at": now, "duplicate_of": keep_id}) \
+            .eq("user_id", uid or user_id).in_("id", list(grp["duplicate_id"])).execute()
+    return len(pairs)
+
+
+def fetch_heatmap(supabase, user_id: str) -> Optional[Dict[str, Any]]:
+    uid, _ = _attach_auth_token(supabase)
+    res = supabase.table("user_heatmaps").select("tiles, n_workouts, updated_at") \
+        .eq("user_id", uid or user_id).limit(1).execute()
+    data = getattr(res, "data", None) or []
+    return data[0] if data else None
+
+
+def save_heatmap(supabase, user_id: str, heatmap) -> None:
+    """heatmap — heatmap.Heatmap; пишем целиком одной строкой (разреженно, обычно сотни КБ)."""
+    uid, _ = _attach_auth_token(supabase)
+    row = {"user_id": uid or user_id, "tiles": heatmap.to_b64(), "n_workouts": len(heatmap),
+           "updated_at": dt.datetime.now(dt.timezone.utc).isoformat()}
+    supabase.table("user_heatmaps").upsert(row, on_conflict="user_id").execute()
+
+
+# ---- контекст тренера (coach_snapshot.py) ----
+
+def fetch_coach_snapshot(supabase, user_id: str) -> Optional[Dict[str, Any]]:
+    """Одна строка coach_training_context: version, schema_version, doc."""
+    uid, _ = _attach_auth_token(supabase)
+    res = supabase.table("coach_training_context").select("version, schema_version, doc, updated_at") \
+        .eq("user_id", uid or user_id).limit(1).execute()
+    data = getattr(res, "data", None) or []
+    return data[0] if data else None
+
+
+def save_coach_snapshot(supabase, user_id: str, row: Dict[str, Any], expected_version: Optional[int]) -> bool:
+    """
+    Запись с оптимистической блокировкой: update … where version = expected_version.
+    Документа ещё нет (expected_version None) — вставка. False — кто-то успел записать раньше.
+    """
+    uid, _ = _attach_auth_token(supabase)
+    uid = uid or user_id
+    if expected_version is None:
+        try:
+            supabase.table("coach_training_context").insert({**_jsonable(row), "user_id": uid, "version": 1}).execute()
+            return True
+        except Exception:
+            return False         # параллельная вставка — перечитаем и применим поверх
+    res = supabase.table("coach_training_context") \
+        .update({**_jsonable(row), "version": int(expected_version) + 1}) \
+        .eq("user_id", uid).eq("version", int(expected_version)).execute()
+    return bool(getattr(res, "data", None))
+
+
+def fetch_coach_rows(supabase, user_id: str) -> List[Dict[str, Any]]:
+    """Узкая выборка истории для полной сборки контекста тренера."""
+    uid, _ = _attach_auth_token(supabase)
+    res = supabase.table("workouts") \
+        .select("id, start_time, local_date, distance_km, distance_m, time_s, duration_sec, avg_hr, trimp, tss, ef, "
+                "pa_hr_pct, zone_s") \
+        .eq("user_id", uid or user_id) \
+        .is_("deleted_at", "null") \
+        .execute()
+    return getattr(res, "data", None) or []
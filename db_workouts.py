@@ -40,16 +40,26 @@ def save_workout(
     filename: str,
     size_bytes: int,
     parsed: Optional[dict] = None,
+    fingerprint: Optional[dict] = None,
 ) -> Tuple[bool, Optional[str], Optional[Dict[str, Any]]]:
     """
     Сохраняет тренировку в public.workouts и возвращает вставленную строку.
     Не отправляем 'id' (пусть БД сама генерит serial/uuid — неважно).
     Поддержка клиентов supabase-py с/без insert().select().single().
+    С fingerprint (dedup.fingerprint) дубль уже сохранённой тренировки не вставляется:
+    возвращаем (True, None, {"id": <оригинал>, "duplicate_of": <оригинал>, ...}).
     """
     try:
         _ensure_auth(supabase)
         parsed = parsed or {}
 
+        if fingerprint:
+            from dedup import find_in_db
+            hit = find_in_db(supabase, user_id, fingerprint)
+            if hit:
+                return True, None, {"id": hit[0], "duplicate_of": hit[0], "reason": hit[1],
+                                    "filename": filename, "user_id": user_id}
+
         payload = {
             "user_id": user_id,
             "filename": filename,
@@ -61,6 +71,8 @@ def save_workout(
             "fit_summary": parsed,
             "uploaded_at": datetime.utcnow().isoformat(),
         }
+        if fingerprint:
+            payload["fingerprint"] = fingerprint
 
         builder = supabase.table("workouts").insert(payload)
 
@@ -0,0 +1,287 @@
+# dedup.py — поиск дублей тренировок (часы + экспорт из Strava) по грубым отпечаткам потоков
+#
+# Отпечаток — старт (epoch, с), длительность, дистанция, точки старта/финиша и профиль HR/скорости,
+# усреднённый в SIG_BINS долей времени и квантованный. Индекс пользователя — словарь
+# (день старта, корзина длительности, корзина дистанции) → id; корзины логарифмические и не уже допуска,
+# так что поиск — 27 обращений к словарю (соседние корзины), независимо от размера истории.
+# Кандидаты проверяются допусками: старт ±START_TOL_S или сдвиг часов на целые получасы
+# (часовой пояс/перевод часов), но тогда обязательно совпадение трека или профиля потоков.
+
+from __future__ import annotations
+import json
+import math
+import datetime as dt
+import hashlib
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from gps import semicircles_to_deg
+
+FP_VERSION = 1
+SIG_BINS = 16
+HR_Q = 5.0             # уд/мин на ступень квантования
+SPEED_Q = 0.25         # м/с на ступень
+SIG_TOL = 1.5          # средняя |Δ| профилей в ступенях
+START_TOL_S = 300      # расхождение часов устройств
+SHIFT_GRID_S = 1800    # сдвиг часовых поясов — кратен получасу
+SHIFT_TOL_S = 120
+MAX_SHIFT_S = 14 * 3600
+DUR_TOL_S, DUR_TOL = 120, 0.03
+DIST_TOL_M, DIST_TOL = 200, 0.03
+POS_TOL_M = 250
+EARTH_R = 6371000.0
+
+
+# ---------- отпечаток ----------
+
+def _epoch(t: Any) -> Optional[int]:
+    if t is None:
+        return None
+    ts = pd.Timestamp(t)
+    if pd.isna(ts):
+        return None
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert("UTC").tz_localize(None)
+    return int((ts - pd.Timestamp(0)).total_seconds())  # наивное время — UTC, как пишут fitparse и GPX
+
+
+def _profile(values: pd.Series, bins: np.ndarray, q: float) -> Optional[List[int]]:
+    """Среднее по долям времени, квантованное; −1 — доля без данных."""
+    v = pd.to_numeric(values, errors="coerce").to_numpy(float)
+    ok = np.isfinite(v) & (v > 0)
+    if ok.sum() < SIG_BINS:
+        return None
+    s = np.bincount(bins[ok], weights=v[ok], minlength=SIG_BINS)
+    n = np.bincount(bins[ok], minlength=SIG_BINS)
+    out = np.full(SIG_BINS, -1, np.int64)
+    out[n > 0] = np.rint(s[n > 0] / n[n > 0] / q)
+    return out.tolist()
+
+
+def _endpoints(df_rec: pd.DataFrame) -> Optional[List[float]]:
+    if "lat_sc" not in df_rec or "lon_sc" not in df_rec:
+        return None
+    lat = semicircles_to_deg(pd.to_numeric(df_rec["lat_sc"], errors="coerce"))
+    lon = semicircles_to_deg(pd.to_numeric(df_rec["lon_sc"], errors="coerce"))
+    idx = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+    if not len(idx):
+        return None
+    a, b = idx[0], idx[-1]
+    return [round(float(lat[a]), 4), round(float(lon[a]), 4), round(float(lat[b]), 4), round(float(lon[b]), 4)]
+
+
+def fingerprint(summary: Dict[str, Any], df_rec: Optional[pd.DataFrame] = None) -> Optional[Dict[str, Any]]:
+    """Отпечаток тренировки по summary и (если есть) точкам; None — если нет времени старта."""
+    start = _epoch(summary.get("start_time"))
+    if start is None:
+        return None
+    fp: Dict[str, Any] = {
+        "v": FP_VERSION, "start": start, "dur": int(summary.get("time_s") or 0),
+        "dist": int(round((summary.get("distance_km") or 0) * 1000)),
+        "pos": None, "hr": None, "spd": None,
+    }
+    if df_rec is not None and not df_rec.empty and "t_rel_s" in df_rec:
+        t = pd.to_numeric(df_rec["t_rel_s"], errors="coerce").fillna(0).to_numpy(float)
+        if t[-1] > 0:
+            bins = np.minimum((t / t[-1] * SIG_BINS).astype(np.int64), SIG_BINS - 1)
+            fp["hr"] = _profile(df_rec["hr"], bins, HR_Q) if "hr" in df_rec else None
+            fp["spd"] = _profile(df_rec["speed"], bins, SPEED_Q) if "speed" in df_rec else None
+        fp["pos"] = _endpoints(df_rec)
+    fp["hash"] = fingerprint_hash(fp)
+    return fp
+
+
+def fingerprint_hash(fp: Dict[str, Any]) -> str:
+    """Хеш грубой подписи: одинаков у побайтовых копий, дальше сравниваем допусками."""
+    key = [fp["start"] // 60, fp["dur"] // 10, fp["dist"] // 50, fp.get("hr"), fp.get("spd")]
+    return hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()[:16]
+
+
+def fingerprint_from_row(row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Отпечаток для старых строк workouts без колонки fingerprint — только время/длительность/дистанция."""
+    if row.get("fingerprint"):
+        fp = row["fingerprint"]
+        return json.loads(fp) if isinstance(fp, str) else fp
+    dist = row.get("distance_m")
+    if dist is None and row.get("distance_km") is not None:
+        dist = float(row["distance_km"]) * 1000
+    summary = {"start_time": row.get("start_time"), "time_s": row.get("time_s") or row.get("duration_sec"),
+               "distance_km": (float(dist) / 1000.0) if dist else None}
+    return fingerprint(summary)
+
+
+# ---------- сравнение ----------
+
+def _close(a: float, b: float, abs_tol: float, rel_tol: float) -> bool:
+    return abs(a - b) <= max(abs_tol, rel_tol * max(a, b))
+
+
+def _pos_match(a: Optional[list], b: Optional[list]) -> Optional[bool]:
+    if not a or not b:
+        return None
+    p, q = np.radians(np.asarray(a, float).reshape(2, 2)), np.radians(np.asarray(b, float).reshape(2, 2))
+    h = np.sin((q[:, 0] - p[:, 0]) / 2) ** 2 + np.cos(p[:, 0]) * np.cos(q[:, 0]) * np.sin((q[:, 1] - p[:, 1]) / 2) ** 2
+    return bool((2 * EARTH_R * np.arcsin(np.sqrt(h)) <= POS_TOL_M).all())
+
+
+def _sig_match(a: Optional[list], b: Optional[list]) -> Optional[bool]:
+    if not a or not b:
+        return None
+    a, b = np.asarray(a), np.asarray(b)
+    ok = (a >= 0) & (b >= 0)
+    if ok.sum() < SIG_BINS // 2:
+        return None
+    return bool(np.abs(a[ok] - b[ok]).mean() <= SIG_TOL)
+
+
+def match(a: Dict[str, Any], b: Dict[str, Any]) -> Optional[str]:
+    """Причина совпадения ("exact" / "start" / "clock_offset") или None."""
+    if a.get("hash") and a.get("hash") == b.get("hash"):
+        return "exact"
+    if not _close(a["dur"], b["dur"], DUR_TOL_S, DUR_TOL):
+        return None
+    if a["dist"] and b["dist"] and not _close(a["dist"], b["dist"], DIST_TOL_M, DIST_TOL):
+        return None
+    checks = [_pos_match(a.get("pos"), b.get("pos")),
+              _sig_match(a.get("hr"), b.get("hr")), _sig_match(a.get("spd"), b.get("spd"))]
+    if False in checks:
+        return None
+    off = b["start"] - a["start"]
+    if abs(off) <= START_TOL_S:
+        return "start"
+    resid = off - round(off / SHIFT_GRID_S) * SHIFT_GRID_S
+    if abs(off) <= MAX_SHIFT_S and abs(resid) <= SHIFT_TOL_S and True in checks:
+        return "clock_offset"
+    return None
+
+
+# ---------- индекс ----------
+
+def _log_bucket(x: float, knee: float) -> int:
+    """Логарифмическая корзина: ширина ≥ допуска (абсолютного у нуля, относительного дальше)."""
+    return int(math.log1p(max(x, 0) / knee) / math.log(1.05))
+
+
+def _key(fp: Dict[str, Any]) -> Tuple[int, int, int]:
+    return fp["start"] // 86400, _log_bucket(fp["dur"], 2600.0), _log_bucket(fp["dist"], 4500.0)
+
+
+class FingerprintIndex:
+    """Отпечатки тренировок одного пользователя: {id: fp} + корзины для поиска за O(1)."""
+
+    def __init__(self):
+        self.fps: Dict[str, Dict[str, Any]] = {}
+        self.buckets: Dict[Tuple[int, int, int], List[str]] = defaultdict(list)
+        self._lock = threading.Lock()   # user_index общий для сессий (st.cache_resource)
+
+    def __len__(self) -> int:
+        return len(self.fps)
+
+    def add(self, workout_id: str, fp: Optional[Dict[str, Any]]) -> None:
+        with self._lock:
+            if not fp or workout_id in self.fps:
+                return
+            self.fps[workout_id] = fp
+            self.buckets[_key(fp)].append(workout_id)
+
+    def remove(self, workout_id: str) -> None:
+        with self._lock:
+            fp = self.fps.pop(workout_id, None)
+            if fp is not None:
+                self.buckets[_key(fp)].remove(workout_id)
+
+    def find(self, fp: Optional[Dict[str, Any]]) -> Optional[Tuple[str, str]]:
+        """(id, причина) первого совпадения или None."""
+        if not fp:
+            return None
+        d, u, v = _key(fp)
+        with self._lock:
+            for dd in (d, d - 1, d + 1):
+                for du in (u, u - 1, u + 1):
+                    for dv in (v, v - 1, v + 1):
+                        for wid in self.buckets.get((dd, du, dv), ()):
+                            why = match(self.fps[wid], fp)
+                            if why:
+                                return wid, why
+        return None
+
+
+def index_from_rows(rows: Iterable[Dict[str, Any]]) -> FingerprintIndex:
+    idx = FingerprintIndex()
+    for r in rows:
+        if r.get("id"):
+            idx.add(str(r["id"]), fingerprint_from_row(r))
+    return idx
+
+
+@st.cache_resource(show_spinner=False, max_entries=64)
+def user_index(_supabase, user_id: str) -> FingerprintIndex:
+    """Индекс по истории пользователя: читаем один раз, дальше пополняем при сохранении."""
+    from db import fetch_fingerprints
+    return index_from_rows(fetch_fingerprints(_supabase, user_id))
+
+
+def flag_duplicates(index: FingerprintIndex, fps: Sequence[Optional[Dict[str, Any]]]) -> List[Optional[Tuple[str, str]]]:
+    """
+    Для пачки загрузок: (id оригинала, причина) или None. Сверяем с историей и с предыдущими файлами
+    той же пачки (их id — "upload:<i>").
+    """
+    batch = FingerprintIndex()
+    out = []
+    for i, fp in enumerate(fps):
+        hit = index.find(fp) or batch.find(fp)
+        out.append(hit)
+        if hit is None:
+            batch.add(f"upload:{i}", fp)
+    return out
+
+
+def find_in_db(supabase, user_id: str, fp: Optional[Dict[str, Any]]) -> Optional[Tuple[str, str]]:
+    """Проверка одной тренировки без кэша: читаем только строки в окне ±MAX_SHIFT_S от старта."""
+    from db import fetch_fingerprints
+
+    if not fp:
+        return None
+    pad = dt.timedelta(seconds=MAX_SHIFT_S + START_TOL_S)
+    t0 = dt.datetime(1970, 1, 1) + dt.timedelta(seconds=fp["start"])
+    return index_from_rows(fetch_fingerprints(supabase, user_id, (t0 - pad, t0 + pad))).find(fp)
+
+
+# ---------- история ----------
+
+def _richness(fp: Dict[str, Any]) -> int:
+    return (fp.get("pos") is not None) + (fp.get("hr") is not None) + (fp.get("spd") is not None)
+
+
+def find_history_duplicates(rows: Sequence[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Дубли в уже сохранённой истории: duplicate_id → keep_id. Оставляем копию с более полными
+    потоками, при равенстве — загруженную раньше.
+    """
+    items = [(str(r["id"]), fingerprint_from_row(r), k) for k, r in enumerate(rows) if r.get("id")]
+    items = [it for it in items if it[1]]
+    items.sort(key=lambda it: (-_richness(it[1]), it[2]))
+    idx = FingerprintIndex()
+    pairs = []
+    for wid, fp, _ in items:
+        hit = idx.find(fp)
+        if hit:
+            pairs.append({"duplicate_id": wid, "keep_id": hit[0], "reason": hit[1]})
+        else:
+            idx.add(wid, fp)
+    return pd.DataFrame(pairs, columns=["duplicate_id", "keep_id", "reason"])
+
+
+def dedup_history(supabase, user_id: str, apply: bool = False) -> pd.DataFrame:
+    """Массовый поиск дублей в истории; apply=True — помечает их удалёнными (deleted_at, duplicate_of)."""
+    from db import fetch_fingerprints, mark_duplicates
+
+    pairs = find_history_duplicates(fetch_fingerprints(supabase, user_id))
+    if apply and not pairs.empty:
+        mark_duplicates(supabase, user_id, pairs)
+    return pairs
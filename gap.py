@@ -0,0 +1,81 @@
+# gap.py — темп с поправкой на уклон (GAP): сглаженная высота, уклон по окну дистанции, модель Минетти
+#
+# Уклон считаем не по соседним точкам (шум барометра/GPS даёт ±30 %), а по окну дистанции:
+# высота как функция накопленной дистанции, g = (h(d + W/2) − h(d − W/2)) / W — два np.interp
+# по уже отсортированной дистанции. Энергозатраты бега C(g) (Minetti et al., 2002, Дж/кг/м)
+# заранее сведены в таблицу по уклонам −45…+45 %; множитель GAP = C(g)/C(0) берётся интерполяцией.
+# GAP-скорость = скорость · множитель: на подъёме она выше фактической, на спуске — ниже.
+# Всё линейно по числу точек и без промежуточных DataFrame: ультра на 200 000 точек — десятки мс.
+
+from __future__ import annotations
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from utils import efficiency_factor, decoupling
+
+GRADE_WINDOW_M = 50.0     # окно дистанции для уклона
+GRADE_MAX = 0.45          # за пределами модель не проверялась — обрезаем
+_GRID = np.linspace(-GRADE_MAX, GRADE_MAX, 91)
+
+
+def minetti_cost(g: np.ndarray) -> np.ndarray:
+    """Энергозатраты бега, Дж/(кг·м), по уклону g (доля)."""
+    g = np.asarray(g, float)
+    return ((((155.4 * g - 30.4) * g - 43.3) * g + 46.3) * g + 19.5) * g + 3.6
+
+
+COST_FACTOR = minetti_cost(_GRID) / minetti_cost(0.0)   # таблица множителей по _GRID
+
+
+def grade(df_rec: pd.DataFrame, window_m: float = GRADE_WINDOW_M) -> Optional[np.ndarray]:
+    """Уклон (доля) на точку по окну дистанции; None — нет высоты или дистанции."""
+    if df_rec is None or df_rec.empty or "elev" not in df_rec or "dist" not in df_rec:
+        return None
+    h = pd.to_numeric(df_rec["elev"], errors="coerce").to_numpy(float)
+    d = pd.to_numeric(df_rec["dist"], errors="coerce").to_numpy(float)
+    ok = np.isfinite(h) & np.isfinite(d)
+    if ok.sum() < 2:
+        return None
+    dk, hk = np.fmax.accumulate(d[ok]), h[ok]
+    if dk[-1] - dk[0] < window_m:
+        return None
+    dd = np.where(np.isfinite(d), d, np.interp(np.arange(len(d)), np.flatnonzero(ok), dk))
+    half = window_m / 2.0
+    lo = np.clip(dd - half, dk[0], dk[-1])
+    hi = np.clip(dd + half, dk[0], dk[-1])
+    g = np.interp(hi, dk, hk)
+    g -= np.interp(lo, dk, hk)
+    span = hi - lo
+    np.divide(g, span, out=g, where=span > 0)
+    g[span <= 0] = 0.0
+    return np.clip(g, -GRADE_MAX, GRADE_MAX, out=g)
+
+
+def gap_speed(df_rec: pd.DataFrame, window_m: float = GRADE_WINDOW_M) -> Optional[np.ndarray]:
+    """GAP-скорость (м/с) на точку: скорость · C(g)/C(0)."""
+    g = grade(df_rec, window_m)
+    if g is None or "speed" not in df_rec:
+        return None
+    v = pd.to_numeric(df_rec["speed"], errors="coerce").to_numpy(float)
+    return v * np.interp(g, _GRID, COST_FACTOR)
+
+
+def gap_summary(df_rec: pd.DataFrame) -> Dict[str, Any]:
+    """Ключи для summary: средний GAP-темп, EF и Pa:Hr по GAP-скорости. Без высоты — все None."""
+    out = {"gap_pace_s_per_km": None, "GAP_EF": None, "GAP_Pa:Hr_%": None}
+    v = gap_speed(df_rec)
+    if v is None:
+        return out
+    dt = np.nan_to_num(pd.to_numeric(df_rec["dt_s"], errors="coerce").to_numpy(float), nan=0.0) \
+        if "dt_s" in df_rec else np.ones(len(v))
+    moving = np.isfinite(v) & (v > 0.5) & (dt > 0)
+    if moving.any():
+        out["gap_pace_s_per_km"] = int(round(1000.0 * dt[moving].sum() / (v[moving] * dt[moving]).sum()))
+    hr = df_rec["hr"] if "hr" in df_rec else None
+    ef = efficiency_factor(v, hr)
+    de = decoupling(v, hr) if hr is not None else None
+    out["GAP_EF"] = round(ef, 4) if ef else None
+    out["GAP_Pa:Hr_%"] = round(de, 1) if de is not None else None
+    return out
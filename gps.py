@@ -0,0 +1,268 @@
+# gps.py — GPS-трек: полукруги FIT → int32, компактное delta/zigzag/varint-хранение и упрощение под зумы карты
+#
+# Формат трека (bytes): [версия][точность E-n][varint(zigzag(Δlat)), varint(zigzag(Δlon)), ...].
+# Координаты квантуются до 1e-5° (~1 м): на секундной записи соседние точки отличаются на единицы,
+# и большинство дельт занимает 1 байт — 100-км трек весит десятки КБ вместо мегабайт.
+# Для карты заранее считаем упрощённые полилинии (Douglas-Peucker) на несколько зумов,
+# так что отрисовка не трогает полный массив.
+
+from __future__ import annotations
+import base64
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+SEMICIRCLES_PER_DEG = 2 ** 31 / 180.0
+FORMAT_VERSION = 1
+PRECISION = 5                      # знаков после запятой в градусах (1e-5° ≈ 1.1 м)
+ZOOM_LEVELS = (8, 11, 14)          # зумы карты, для которых храним упрощённые полилинии
+PIXEL_TOLERANCE = 1.0              # допуск упрощения в пикселях экрана
+EARTH_R = 6_371_000.0
+_M_PER_PX_Z0 = 156_543.03392       # метров в пикселе на экваторе при зуме 0 (Web Mercator, тайл 256)
+
+
+# ---------- координаты ----------
+
+def semicircles_to_deg(sc) -> np.ndarray:
+    return np.asarray(sc, dtype=float) / SEMICIRCLES_PER_DEG
+
+
+def deg_to_semicircles(deg) -> np.ndarray:
+    """Градусы → int32-полукруги; NaN остаются NaN (результат float, если есть пропуски)."""
+    a = np.asarray(deg, dtype=float)
+    out = np.round(a * SEMICIRCLES_PER_DEG)
+    return out.astype(np.int32) if np.isfinite(out).all() else out
+
+
+def semicircle_column(values) -> pd.Series:
+    """Колонка полукругов для df_rec: nullable Int32 (у точек без GPS — <NA>)."""
+    s = pd.to_numeric(pd.Series(values), errors="coerce")
+    return s.round().astype("Int32")
+
+
+def track_arrays(df_rec: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(lat_sc, lon_sc, t_s) только по точкам с валидными координатами, в порядке записи; t_s — от старта."""
+    if df_rec is None or df_rec.empty or "lat_sc" not in df_rec or "lon_sc" not in df_rec:
+        return np.empty(0, np.int32), np.empty(0, np.int32), np.empty(0)
+    lat = df_rec["lat_sc"].to_numpy(dtype="float64", na_value=np.nan)
+    lon = df_rec["lon_sc"].to_numpy(dtype="float64", na_value=np.nan)
+    if "t_rel_s" in df_rec:
+        t = pd.to_numeric(df_rec["t_rel_s"], errors="coerce").to_numpy(dtype=float)
+    else:
+        t = np.arange(len(df_rec), dtype=float)
+    ok = np.isfinite(lat) & np.isfinite(lon) & ((lat != 0) | (lon != 0)) & np.isfinite(t)
+    return lat[ok].astype(np.int32), lon[ok].astype(np.int32), t[ok]
+
+
+# ---------- varint ----------
+
+def _zigzag(d: np.ndarray) -> np.ndarray:
+    d = d.astype(np.int64)
+    return ((d << 1) ^ (d >> 63)).astype(np.uint64)
+
+
+def _unzigzag(u: np.ndarray) -> np.ndarray:
+    u = u.astype(np.uint64)
+    return (u >> np.uint64(1)).astype(np.int64) ^ -(u & np.uint64(1)).astype(np.int64)
+
+
+def varint_encode(values: np.ndarray) -> bytes:
+    """LEB128 для массива uint64 без цикла по элементам (цикл только по номеру байта, ≤ 10)."""
+    v = np.asarray(values, dtype=np.uint64)
+    if len(v) == 0:
+        return b""
+    nbytes = np.ones(len(v), dtype=np.int64)
+    for k in range(1, 10):
+        nbytes += v >= np.uint64(1 << (7 * k))
+    offsets = np.cumsum(nbytes) - nbytes
+    out = np.zeros(int(nbytes.sum()), dtype=np.uint8)
+    for k in range(int(nbytes.max())):
+        m = nbytes > k
+        b = ((v[m] >> np.uint64(7 * k)) & np.uint64(0x7F)).astype(np.uint8)
+        b[nbytes[m] > k + 1] |= 0x80
+        out[offsets[m] + k] = b
+    return out.tobytes()
+
+
+def varint_decode(buf: bytes) -> np.ndarray:
+    b = np.frombuffer(buf, dtype=np.uint8)
+    if len(b) == 0:
+        return np.empty(0, np.uint64)
+    ends = np.flatnonzero(b < 0x80)
+    if len(ends) == 0 or ends[-1] != len(b) - 1:
+        raise ValueError("truncated varint stream")
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    if (ends - starts).max() >= 10:
+        raise ValueError("varint longer than 64 bits")
+    pos = np.arange(len(b)) - np.repeat(starts, ends - starts + 1)
+    vals = (b & 0x7F).astype(np.uint64) << (7 * pos).astype(np.uint64)
+    return np.add.reduceat(vals, starts)  # биты не пересекаются — сумма == OR
+
+
+# ---------- encode / decode ----------
+
+def encode_track(lat_deg: np.ndarray, lon_deg: np.ndarray, precision: int = PRECISION) -> bytes:
+    """Градусы → bytes: квантование до 10^-precision, дельты, zigzag, varint (lat/lon чередуются)."""
+    scale = 10.0 ** precision
+    q = np.empty(2 * len(lat_deg), dtype=np.int64)
+    q[0::2] = np.round(np.asarray(lat_deg, float) * scale)
+    q[1::2] = np.round(np.asarray(lon_deg, float) * scale)
+    d = q.copy()
+    d[2:] = q[2:] - q[:-2]
+    return bytes([FORMAT_VERSION, precision]) + varint_encode(_zigzag(d))
+
+
+def decode_track(buf: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """bytes → (lat_deg, lon_deg) float64."""
+    if not buf:
+        return np.empty(0), np.empty(0)
+    if buf[0] != FORMAT_VERSION:
+        raise ValueError(f"unknown track format version {buf[0]}")
+    if len(buf) < 2:
+        raise ValueError("truncated track header")
+    precision = buf[1]
+    d = _unzigzag(varint_decode(buf[2:]))
+    if len(d) % 2:
+        raise ValueError("truncated track: lat without lon")
+    q = np.empty_like(d)
+    q[0::2] = np.cumsum(d[0::2])
+    q[1::2] = np.cumsum(d[1::2])
+    scale = 10.0 ** precision
+    return q[0::2] / scale, q[1::2] / scale
+
+
+def encode_times(t_s: np.ndarray, decimals: int = 1) -> bytes:
+    """Время точек (с от старта) → bytes: десятые доли секунды, дельты, zigzag, varint."""
+    q = np.round(np.asarray(t_s, float) * 10 ** decimals).astype(np.int64)
+    d = np.diff(q, prepend=0)
+    return bytes([FORMAT_VERSION, decimals]) + varint_encode(_zigzag(d))
+
+
+def decode_times(buf: bytes) -> np.ndarray:
+    if not buf:
+        return np.empty(0)
+    if buf[0] != FORMAT_VERSION:
+        raise ValueError(f"unknown times format version {buf[0]}")
+    if len(buf) < 2:
+        raise ValueError("truncated times header")
+    return np.cumsum(_unzigzag(varint_decode(buf[2:]))) / 10.0 ** buf[1]
+
+
+# ---------- simplification ----------
+
+def _project_m(lat: np.ndarray, lon: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Локальная равнопромежуточная проекция в метры (для треков в пределах сотен км точности хватает)."""
+    lat0 = np.radians(np.nanmean(lat)) if len(lat) else 0.0
+    return np.radians(lon) * EARTH_R * np.cos(lat0), np.radians(lat) * EARTH_R
+
+
+def simplify_dp(x: np.ndarray, y: np.ndarray, eps: float) -> np.ndarray:
+    """
+    Douglas-Peucker → индексы сохранённых точек.
+    Векторизован по «уровням»: на каждом шаге все ещё не принятые отрезки обрабатываются
+    одним набором numpy-операций, так что число шагов ~ глубина рекурсии, а не число точек.
+    """
+    n = len(x)
+    if n <= 2:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    s = np.array([0])
+    e = np.array([n - 1])
+    while len(s):
+        inner = e - s - 1
+        m = inner > 0
+        s, e, inner = s[m], e[m], inner[m]
+        if not len(s):
+            break
+        seg = np.repeat(np.arange(len(s)), inner)
+        first = np.cumsum(inner) - inner
+        idx = np.arange(int(inner.sum())) - np.repeat(first, inner) + np.repeat(s + 1, inner)
+
+        ax, ay = x[s][seg], y[s][seg]
+        dx, dy = x[e][seg] - ax, y[e][seg] - ay
+        px, py = x[idx] - ax, y[idx] - ay
+        L2 = dx * dx + dy * dy
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(L2 > 0, np.clip((px * dx + py * dy) / L2, 0.0, 1.0), 0.0)
+        dist = np.hypot(px - t * dx, py - t * dy)
+
+        dmax = np.maximum.reduceat(dist, first)
+        split = dmax > eps
+        if not split.any():
+            break
+        # первая точка с максимальным отклонением в каждом отрезке, где нужен разрез
+        hit = (dist == dmax[seg]) & split[seg]
+        seg_hit, where = np.unique(seg[hit], return_index=True)
+        mid = idx[hit][where]
+        keep[mid] = True
+        s = np.concatenate([s[seg_hit], mid])
+        e = np.concatenate([mid, e[seg_hit]])
+    return np.flatnonzero(keep)
+
+
+def tolerance_m(zoom: int, lat_deg: float, pixels: float = PIXEL_TOLERANCE) -> float:
+    return _M_PER_PX_Z0 * np.cos(np.radians(lat_deg)) / (2 ** zoom) * pixels
+
+
+def simplify_levels(lat: np.ndarray, lon: np.ndarray, zooms: Sequence[int] = ZOOM_LEVELS) -> Dict[int, np.ndarray]:
+    """{зум: индексы точек}; каждый следующий (более крупный) зум упрощается из полного трека."""
+    x, y = _project_m(lat, lon)
+    lat_mid = float(np.nanmean(lat)) if len(lat) else 0.0
+    return {z: simplify_dp(x, y, tolerance_m(z, lat_mid)) for z in zooms}
+
+
+# ---------- track row (для БД) ----------
+
+def build_track(df_rec: pd.DataFrame, zooms: Sequence[int] = ZOOM_LEVELS) -> Optional[Dict[str, Any]]:
+    """
+    df_rec с lat_sc/lon_sc → словарь для таблицы workout_tracks (base64 внутри, JSON-совместимо).
+    None, если GPS нет.
+    """
+    lat_sc, lon_sc, t_s = track_arrays(df_rec)
+    if len(lat_sc) < 2:
+        return None
+    lat, lon = semicircles_to_deg(lat_sc), semicircles_to_deg(lon_sc)
+    full = encode_track(lat, lon)
+    levels = {str(z): base64.b64encode(encode_track(lat[i], lon[i])).decode("ascii")
+              for z, i in simplify_levels(lat, lon, zooms).items()}
+    return {
+        "n_points": int(len(lat)),
+        "precision": PRECISION,
+        "min_lat": float(lat.min()), "min_lon": float(lon.min()),
+        "max_lat": float(lat.max()), "max_lon": float(lon.max()),
+        "polyline": base64.b64encode(full).decode("ascii"),
+        "times": base64.b64encode(encode_times(t_s)).decode("ascii"),
+        "levels": levels,
+    }
+
+
+def track_full(track: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Полный трек (lat, lon, t_s) — для сегментов и анализа; строка должна содержать polyline и times."""
+    lat, lon = decode_track(base64.b64decode(track["polyline"]))
+    t = decode_times(base64.b64decode(track["times"])) if track.get("times") else np.arange(len(lat), dtype=float)
+    return lat, lon, t
+
+
+def zoom_for_bbox(track: Dict[str, Any], width_px: int = 700, height_px: int = 450) -> int:
+    """Зум Web Mercator, при котором bbox трека помещается в окно карты."""
+    lat_mid = (track["min_lat"] + track["max_lat"]) / 2.0
+    x, y = _project_m(np.array([track["min_lat"], track["max_lat"]]), np.array([track["min_lon"], track["max_lon"]]))
+    span_m = max(float(np.ptp(x)) / max(width_px, 1), float(np.ptp(y)) / max(height_px, 1), 1e-6)
+    z = np.log2(_M_PER_PX_Z0 * np.cos(np.radians(lat_mid)) / span_m)
+    return int(np.clip(np.floor(z), 0, 20))
+
+
+def track_latlon(track: Dict[str, Any], zoom: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Полилиния для отрисовки: ближайший сохранённый уровень не грубее zoom; полный трек — только если такого нет."""
+    levels = {int(z): v for z, v in (track.get("levels") or {}).items()}
+    if zoom is not None:
+        fit = sorted(z for z in levels if z >= zoom)
+        if fit:
+            return decode_track(base64.b64decode(levels[fit[0]]))
+    if track.get("polyline"):
+        return decode_track(base64.b64decode(track["polyline"]))
+    if levels:  # строку выбрали без полного трека — берём самый подробный уровень
+        return decode_track(base64.b64decode(levels[max(levels)]))
+    return np.empty(0), np.empty(0)
@@ -0,0 +1,302 @@
+# heatmap.py — персональная тепловая карта «где я бегаю»: пирамида тайлов по всем GPS-трекам
+#
+# Каждый трек бинируется в сетку Web Mercator (тайл 256 px = BINS×BINS ячеек) на зуме Z_MAX,
+# а более мелкие зумы получаются сдвигом индексов (>> k) — без повторного чтения точек.
+# Одна тренировка добавляет не больше 1 в ячейку (уникальные ячейки), так что стояние на светофоре
+# не «прожигает» карту. Хранение разреженное: отсортированные id ячеек (дельты varint) + счётчики.
+# Отрисовка — выборка ячеек в пределах окна на нужном зуме, а не скан миллионов точек.
+
+from __future__ import annotations
+import io
+import base64
+import struct
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from gps import track_full, varint_encode, varint_decode
+
+Z_MIN, Z_MAX = 3, 15        # z15 ≈ 5–10 м на ячейку в средних широтах; крупнее рисуем из z15
+BINS = 64                  # ячеек на сторону тайла (4 px на ячейку при тайле 256)
+FORMAT_VERSION = 1
+_MAX_LAT = 85.05112878
+
+
+# ---------- проекция ----------
+
+def world_bins(lat: np.ndarray, lon: np.ndarray, zoom: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Целочисленные координаты ячеек (gx, gy) на зуме zoom; ширина мира — 2^zoom · BINS."""
+    n = float(2 ** zoom * BINS)
+    lat = np.clip(np.asarray(lat, float), -_MAX_LAT, _MAX_LAT)
+    x = (np.asarray(lon, float) + 180.0) / 360.0 * n
+    r = np.radians(lat)
+    y = (1.0 - np.log(np.tan(r) + 1.0 / np.cos(r)) / np.pi) / 2.0 * n
+    gx = np.clip(np.floor(x), 0, n - 1).astype(np.int64)
+    gy = np.clip(np.floor(y), 0, n - 1).astype(np.int64)
+    return gx, gy
+
+
+def bin_center(gx: np.ndarray, gy: np.ndarray, zoom: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Центр ячейки → (lat, lon)."""
+    n = float(2 ** zoom * BINS)
+    lon = (np.asarray(gx) + 0.5) / n * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * (np.asarray(gy) + 0.5) / n))))
+    return lat, lon
+
+
+def _width(zoom: int) -> int:
+    return 2 ** zoom * BINS
+
+
+# ---------- пирамида ----------
+
+class Heatmap:
+    """Разреженная пирамида: {zoom: (ids, counts)}, ids = gy · width + gx, отсортированы."""
+
+    def __init__(self, z_min: int = Z_MIN, z_max: int = Z_MAX):
+        self.z_min, self.z_max = z_min, z_max
+        self.levels: Dict[int, Tuple[np.ndarray, np.ndarray]] = {
+            z: (np.empty(0, np.int64), np.empty(0, np.uint32)) for z in range(z_min, z_max + 1)
+        }
+        self.workouts: set = set()
+
+    def __len__(self) -> int:
+        return len(self.workouts)
+
+    def _unique_bins(self, lat: np.ndarray, lon: np.ndarray) -> Optional[Dict[int, np.ndarray]]:
+        """{зум: уникальные id ячеек одного трека}."""
+        lat = np.asarray(lat, float)
+        lon = np.asarray(lon, float)
+        ok = np.isfinite(lat) & np.isfinite(lon)
+        if not ok.any():
+            return None
+        gx, gy = world_bins(lat[ok], lon[ok], self.z_max)
+        out = {}
+        for z in range(self.z_max, self.z_min - 1, -1):
+            k = self.z_max - z
+            out[z] = np.unique((gy >> k) * _width(z) + (gx >> k))
+        return out
+
+    def add_points(self, lat: np.ndarray, lon: np.ndarray, workout_id: Optional[str] = None) -> bool:
+        """Добавить трек. Повторное добавление той же тренировки игнорируется. True — если что-то добавили."""
+        if workout_id is not None and str(workout_id) in self.workouts:
+            return False
+        bins = self._unique_bins(lat, lon)
+        if bins is None:
+            return False
+        if workout_id is not None:
+            self.workouts.add(str(workout_id))
+        for z, new in bins.items():
+            self._merge(z, new)
+        return True
+
+    def add_many(self, items: Iterable[Tuple[str, np.ndarray, np.ndarray]], batch: int = 200) -> int:
+        """
+        Массовое добавление [(workout_id, lat, lon)]: ячейки копятся пачкой и сливаются одним
+        np.unique + bincount на зум — вместо вставки в отсортированный массив на каждый трек.
+        """
+        added = 0
+        pending: Dict[int, List[np.ndarray]] = {z: [] for z in self.levels}
+
+        def flush():
+            for z, parts in pending.items():
+                if not parts:
+                    continue
+                ids, counts = self.levels[z]
+                allv = np.concatenate([ids] + parts)
+                w = np.concatenate([counts.astype(np.int64), np.ones(len(allv) - len(ids), np.int64)])
+                u, inv = np.unique(allv, return_inverse=True)
+                self.levels[z] = (u, np.bincount(inv, weights=w).astype(np.uint32))
+                parts.clear()
+
+        for wid, lat, lon in items:
+            if wid is not None and str(wid) in self.workouts:
+                continue
+            bins = self._unique_bins(lat, lon)
+            if bins is None:
+                continue
+            if wid is not None:
+                self.workouts.add(str(wid))
+            for z, b in bins.items():
+                pending[z].append(b)
+            added += 1
+            if added % batch == 0:
+                flush()
+        flush()
+        return added
+
+    def add_track(self, workout_id: str, track: Dict[str, Any]) -> bool:
+        """Строка workout_tracks с полным polyline (gps.build_track / db.fetch_tracks(full=True))."""
+        if not track or not track.get("polyline"):
+            return False
+        lat, lon, _ = track_full(track)
+        return self.add_points(lat, lon, str(workout_id))
+
+    def remove_track(self, workout_id: str, track: Dict[str, Any]) -> bool:
+        """Вычесть тренировку (скрытый дубль): её уникальные ячейки −1. True — если она была на карте."""
+        if str(workout_id) not in self.workouts or not track or not track.get("polyline"):
+            return False
+        lat, lon, _ = track_full(track)
+        bins = self._unique_bins(lat, lon)
+        self.workouts.discard(str(workout_id))
+        for z, old in (bins or {}).items():
+            ids, counts = self.levels[z]
+            pos = np.searchsorted(ids, old)
+            hit = pos < len(ids)
+            hit[hit] = ids[pos[hit]] == old[hit]
+            counts = counts.copy()
+            counts[pos[hit]] -= 1
+            keep = counts > 0
+            self.levels[z] = (ids[keep], counts[keep])
+        return True
+
+    def _merge(self, z: int, new_ids: np.ndarray) -> None:
+        ids, counts = self.levels[z]
+        if not len(ids):
+            self.levels[z] = (new_ids, np.ones(len(new_ids), np.uint32))
+            return
+        pos = np.searchsorted(ids, new_ids)
+        hit = pos < len(ids)
+        hit[hit] = ids[pos[hit]] == new_ids[hit]
+        counts = counts.copy()
+        counts[pos[hit]] += 1
+        fresh = new_ids[~hit]
+        if len(fresh):
+            ins = np.searchsorted(ids, fresh)
+            ids = np.insert(ids, ins, fresh)
+            counts = np.insert(counts, ins, np.ones(len(fresh), np.uint32))
+        self.levels[z] = (ids, counts)
+
+    # --- lookup ---
+    def tile(self, z: int, tx: int, ty: int) -> np.ndarray:
+        """Тайл (BINS×BINS, uint32) — BINS бинарных поисков по строкам, без сканирования уровня."""
+        ids, counts = self.levels[z]
+        out = np.zeros((BINS, BINS), np.uint32)
+        if not len(ids):
+            return out
+        w = _width(z)
+        rows = ty * BINS + np.arange(BINS, dtype=np.int64)
+        lo = np.searchsorted(ids, rows * w + tx * BINS)
+        hi = np.searchsorted(ids, rows * w + (tx + 1) * BINS)
+        n = hi - lo
+        if n.sum() == 0:
+            return out
+        sel = np.concatenate([np.arange(a, b) for a, b in zip(lo, hi) if b > a])
+        r = np.repeat(np.arange(BINS), n)
+        out[r, ids[sel] % w - tx * BINS] = counts[sel]
+        return out
+
+    def points(self, z: int, bbox: Optional[Tuple[float, float, float, float]] = None) -> pd.DataFrame:
+        """Ненулевые ячейки зума z внутри bbox (min_lat, min_lon, max_lat, max_lon) → lat, lon, count."""
+        z = int(np.clip(z, self.z_min, self.z_max))
+        ids, counts = self.levels[z]
+        w = _width(z)
+        if bbox is not None and len(ids):
+            (x0, x1), (y1, y0) = (world_bins(np.array([bbox[0], bbox[2]]), np.array([bbox[1], bbox[3]]), z))
+            a, b = np.searchsorted(ids, [y0 * w, (y1 + 1) * w])  # строки сетки лежат подряд
+            ids, counts = ids[a:b], counts[a:b]
+            gx = ids % w
+            m = (gx >= x0) & (gx <= x1)
+            ids, counts = ids[m], counts[m]
+        lat, lon = bin_center(ids % w, ids // w, z)
+        return pd.DataFrame({"lat": lat, "lon": lon, "count": counts.astype(np.int64)})
+
+    def bbox(self) -> Optional[Tuple[float, float, float, float]]:
+        ids, _ = self.levels[self.z_min]
+        if not len(ids):
+            return None
+        w = _width(self.z_min)
+        gx, gy = ids % w, ids // w
+        lat_top, lon_left = bin_center(gx.min() - 0.5, gy.min() - 0.5, self.z_min)
+        lat_bot, lon_right = bin_center(gx.max() + 0.5, gy.max() + 0.5, self.z_min)
+        return float(lat_bot), float(lon_left), float(lat_top), float(lon_right)
+
+    # --- хранение ---
+    def to_bytes(self) -> bytes:
+        """[версия, z_min, z_max] + по каждому зуму: n, varint(Δids), varint(counts) + id тренировок."""
+        buf = io.BytesIO()
+        buf.write(struct.pack("<BBB", FORMAT_VERSION, self.z_min, self.z_max))
+        for z in range(self.z_min, self.z_max + 1):
+            ids, counts = self.levels[z]
+            a = varint_encode(np.diff(ids, prepend=0).astype(np.uint64))
+            b = varint_encode(counts.astype(np.uint64))
+            buf.write(struct.pack("<III", len(ids), len(a), len(b)))
+            buf.write(a)
+            buf.write(b)
+        w = "\n".join(sorted(self.workouts)).encode("utf-8")
+        buf.write(struct.pack("<I", len(w)))
+        buf.write(w)
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Heatmap":
+        try:
+            ver, z_min, z_max = struct.unpack_from("<BBB", data, 0)
+            if ver != FORMAT_VERSION:
+                raise ValueError(f"unknown heatmap format version {ver}")
+            hm = cls(z_min, z_max)
+            off = 3
+            for z in range(z_min, z_max + 1):
+                n, la, lb = struct.unpack_from("<III", data, off)
+                off += 12
+                ids = np.cumsum(varint_decode(data[off:off + la]).astype(np.int64)) if n else np.empty(0, np.int64)
+                off += la
+                counts = varint_decode(data[off:off + lb]).astype(np.uint32) if n else np.empty(0, np.uint32)
+                off += lb
+                if len(ids) != n or len(counts) != n:
+                    raise ValueError(f"truncated heatmap level {z}")
+                hm.levels[z] = (ids, counts)
+            (lw,) = struct.unpack_from("<I", data, off)
+            off += 4
+            if off + lw != len(data):
+                raise ValueError("truncated heatmap workouts")
+            hm.workouts = set(filter(None, data[off:off + lw].decode("utf-8").split("\n")))
+        except struct.error as e:
+            raise ValueError(f"truncated heatmap: {e}") from e
+        return hm
+
+    def to_b64(self) -> str:
+        return base64.b64encode(self.to_bytes()).decode("ascii")
+
+    @classmethod
+    def from_b64(cls, s: str) -> "Heatmap":
+        return cls.from_bytes(base64.b64decode(s))
+
+
+def build_heatmap(tracks: Iterable[Dict[str, Any]]) -> Heatmap:
+    """Полная сборка по строкам workout_tracks (с polyline) — пачками через add_many."""
+    hm = Heatmap()
+    hm.add_many((str(tr["workout_id"]), *track_full(tr)[:2]) for tr in tracks if tr and tr.get("polyline"))
+    return hm
+
+
+def refresh_for_saved(supabase, user_id: str, workout_ids: Sequence[Optional[str]],
+                      tracks: Sequence[Optional[Dict[str, Any]]]) -> Optional[Heatmap]:
+    """Инкрементальное обновление после сохранения тренировок: читаем тайлы, добавляем новые треки, пишем обратно."""
+    from db import fetch_heatmap, save_heatmap
+
+    pairs = [(w, t) for w, t in zip(workout_ids or [], tracks or []) if w and t]
+    if not pairs:
+        return None
+    row = fetch_heatmap(supabase, user_id)
+    hm = Heatmap.from_b64(row["tiles"]) if row and row.get("tiles") else None
+    if hm is None:
+        return None  # полной карты ещё нет — соберётся целиком при первом просмотре
+    if any([hm.add_track(w, t) for w, t in pairs]):
+        save_heatmap(supabase, user_id, hm)
+    return hm
+
+
+def refresh_for_removed(supabase, user_id: str, workout_ids: Sequence[str]) -> Optional[Heatmap]:
+    """После скрытия тренировок (дубли): вычитаем их треки из сохранённой карты, а не пересобираем её."""
+    from db import fetch_heatmap, fetch_tracks, save_heatmap
+
+    row = fetch_heatmap(supabase, user_id)
+    hm = Heatmap.from_b64(row["tiles"]) if row and row.get("tiles") else None
+    ids = [str(w) for w in workout_ids or [] if hm is not None and str(w) in hm.workouts]
+    if not ids:
+        return hm
+    if any([hm.remove_track(str(t["workout_id"]), t) for t in fetch_tracks(supabase, user_id, ids, full=True)]):
+        save_heatmap(supabase, user_id, hm)
+    return hm
@@ -0,0 +1,788 @@
+# import_worker.py — долгоживущий Python-воркер очереди import_jobs (аналог supabase/functions/process-import-jobs)
+#
+# Клеймит джобы пачками (FOR UPDATE SKIP LOCKED в Postgres, BEGIN IMMEDIATE в SQLite-стенде),
+# парсит файлы в пуле процессов, пишет метрики и статусы обратно одним запросом на пачку.
+# Запуск:  python import_worker.py --dsn postgresql://...        (прод/локальный Postgres)
+#          python import_worker.py --sqlite jobs.db --files-dir ./files --init-sqlite   (стенд)
+
+from __future__ import annotations
+import io
+import os
+import json
+import time
+import uuid
+import math
+import socket
+import sqlite3
+import argparse
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# --- Postgres driver (optional) ---
+try:
+    import psycopg  # type: ignore
+    from psycopg.rows import dict_row  # type: ignore
+except Exception:
+    psycopg = None
+    dict_row = None
+
+from ingest import iter_members, parse_payload, call_with_timeout
+from db import _jsonable
+from gps import build_track, track_full
+from heatmap import Heatmap
+from recompute import hist_b64_from_records
+from aggregates import build_aggregates, zone_seconds
+from utils import parse_bounds
+from coach_snapshot import update_snapshot, snapshot_row
+from dedup import fingerprint, index_from_rows, MAX_SHIFT_S, START_TOL_S
+from similar import workout_features, encode_features
+
+DEFAULT_PROFILE = {"hr_rest": 50, "hr_max": 185, "ftp_w": None, "zone_bounds_text": "120,140,155,170"}  # как profile.DEFAULTS, без импорта streamlit-части
+CLAIMABLE = ("queued", "retry_wait")
+STUCK_GRACE_S = 30.0   # запас сверх таймаутов, после которого процесс пула считаем зависшим
+EXPIRED_MSG = "visibility timeout"   # воркер умер на последней попытке — джоба закрывается при следующем клейме
+JOB_COLUMNS = "id, user_id, source_file_id, workout_id, attempt, max_attempts"
+FILE_COLUMNS = "id, user_id, storage_bucket, storage_path, filename, size_bytes, extension, workout_id"
+
+# метрики, которые воркер пишет в public.workouts
+WORKOUT_FIELDS = (
+    "start_time", "local_date", "utc_offset_s", "duration_sec", "moving_time_sec", "distance_m",
+    "time_s", "time_min", "avg_hr", "max_hr", "trimp", "ef", "pa_hr_pct",
+    "gap_pace_s_per_km", "gap_ef", "gap_pa_hr_pct",
+    "avg_power_w", "max_power_w", "np_power_w", "intensity_factor", "tss", "hr_hist", "zone_s", "aggregates", "avg_speed_kmh", "avg_pace_s_per_km", "sport", "laps_count", "fit_summary",
+    "fingerprint", "duplicate_of", "features",
+)
+JSON_FIELDS = ("fit_summary", "zone_s", "fingerprint")   # в SQLite-стенде — текстом
+DEDUP_COLUMNS = "id, start_time, time_s, duration_sec, distance_m, fingerprint"
+DEDUP_PAD_S = MAX_SHIFT_S + START_TOL_S
+
+
+COACH_COLUMNS = "id, start_time, local_date, distance_m, time_s, duration_sec, avg_hr, trimp, tss, ef, pa_hr_pct, zone_s"
+
+
+def _coach_rows_by_user(done: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Сохранённые тренировки пачки по пользователям — для инкрементального контекста тренера (coach_snapshot.py)."""
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    for d in done:
+        out.setdefault(str(d["user_id"]), []).append({"id": d["workout_id"], **d["row"]})
+    return out
+
+
+def _flag_duplicates(done: List[Dict[str, Any]], history: Callable[[str, str, str], List[Dict[str, Any]]]) -> None:
+    """
+    Дубли пачки (часы + экспорт Strava) — как в db_workouts.save_workout, но строка уже заведена под файл:
+    не выбрасываем, а помечаем row["duplicate_of"] (→ deleted_at). Сверяем с историей пользователя в окне
+    стартов пачки (history(uid, от, до)) и с предыдущими файлами той же пачки.
+    """
+    by_user: Dict[str, List[Dict[str, Any]]] = {}
+    for d in done:
+        if d["row"].get("fingerprint"):
+            by_user.setdefault(str(d["user_id"]), []).append(d)
+    epoch = dt.datetime(1970, 1, 1)
+    for uid, items in by_user.items():
+        starts = [d["row"]["fingerprint"]["start"] for d in items]
+        lo = (epoch + dt.timedelta(seconds=min(starts) - DEDUP_PAD_S)).isoformat()
+        hi = (epoch + dt.timedelta(seconds=max(starts) + DEDUP_PAD_S)).isoformat()
+        own = {str(d["workout_id"]) for d in items}
+        idx = index_from_rows(r for r in history(uid, lo, hi) if str(r["id"]) not in own)
+        for d in items:
+            hit = idx.find(d["row"]["fingerprint"])
+            if hit:
+                d["row"]["duplicate_of"], d["dup_reason"] = hit
+            else:
+                idx.add(str(d["workout_id"]), d["row"]["fingerprint"])
+
+
+def _fresh(done: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Тренировки пачки без дублей — только они идут в треки и контекст тренера."""
+    return [d for d in done if not d["row"].get("duplicate_of")]
+
+
+def _heatmap_tracks_by_user(done: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Треки пачки (без дублей) с полилинией — по пользователям, для тепловой карты."""
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    for d in _fresh(done):
+        if d.get("track") and d["track"].get("polyline"):
+            out.setdefault(str(d["user_id"]), []).append({"workout_id": d["workout_id"], **d["track"]})
+    return out
+
+
+def _merge_heatmap(tiles: Optional[str], tracks: List[Dict[str, Any]]) -> Optional[Heatmap]:
+    """
+    Как heatmap.refresh_for_saved, но одним add_many на пачку. Карты ещё нет — None:
+    она соберётся целиком при первом просмотре (views_multi._render_heatmap).
+    """
+    if not tiles:
+        return None
+    hm = Heatmap.from_b64(tiles)
+    added = hm.add_many((str(t["workout_id"]), *track_full(t)[:2]) for t in tracks)
+    return hm if added else None
+
+
+def _now() -> dt.datetime:
+    return dt.datetime.now(dt.timezone.utc)
+
+
+def _iso(t: dt.datetime) -> str:
+    return t.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def retry_delay_s(attempt: int) -> int:
+    """Экспоненциальная пауза как в markRetry: 60с·2^(n-1), максимум 30 минут."""
+    return min(60 * 2 ** max(0, attempt - 1), 1800)
+
+
+# ---------------- parsing (runs in worker processes) ----------------
+
+def _map_sport(s: Any) -> str:
+    v = str(s or "").lower()
+    for key, names in (
+        ("run", ("running", "run")), ("ride", ("cycling", "bike", "biking", "ride")),
+        ("walk", ("walking", "walk")), ("hike", ("hiking", "hike")),
+        ("swim", ("swimming", "swim")), ("row", ("rowing", "row")),
+        ("strength", ("strength_training", "strength")),
+    ):
+        if v in names:
+            return key
+    return "other"
+
+
+def parse_job_payload(name: str, data: bytes, hr_rest: int, hr_max: int, ftp: Optional[int] = None,
+                      zone_bounds_text: Optional[str] = None) -> Dict[str, Any]:
+    """Байты файла → строка метрик для workouts. Возвращаем только компактный dict, не DataFrame."""
+    members = list(iter_members(io.BytesIO(data), name))
+    if not members:
+        raise ValueError("Unsupported or unparsable file")
+    # как в edge-функции: из архива берём сначала FIT, потом GPX, потом TCX
+    members.sort(key=lambda m: [".fit", ".gpx", ".tcx"].index(os.path.splitext(m[0].lower())[1]))
+    inner_name, inner = members[0]
+    df_rec, df_laps, _, summary = parse_payload(inner_name, inner, hr_rest, hr_max, ftp)
+
+    time_s = summary.get("time_s")
+    distance_m = round(summary["distance_km"] * 1000) if summary.get("distance_km") else None
+    moving = None
+    max_hr = None
+    if not df_rec.empty:
+        moving = int(round(float(df_rec.loc[df_rec["speed"].fillna(0) > 0.5, "dt_s"].sum())))
+        if df_rec["hr"].notna().any():
+            max_hr = int(df_rec["hr"].max())
+    avg_speed = (distance_m / time_s) if (distance_m and time_s) else None
+    sport = _map_sport(summary.get("sport"))
+    start = summary.get("start_time")
+
+    row = {
+        "start_time": start.isoformat() if start is not None else None,
+        "local_date": summary["date"].isoformat() if summary.get("date") else None,
+        "utc_offset_s": summary.get("utc_offset_s"),
+        "duration_sec": time_s,
+        "moving_time_sec": moving,
+        "distance_m": distance_m,
+        "time_s": moving or time_s,
+        "time_min": round((moving or time_s) / 60.0, 2) if (moving or time_s) else None,
+        "avg_hr": summary.get("avg_hr"),
+        "max_hr": max_hr,
+        "trimp": summary.get("TRIMP"),
+        "ef": summary.get("EF"),
+        "pa_hr_pct": summary.get("Pa:Hr_%"),
+        "gap_pace_s_per_km": summary.get("gap_pace_s_per_km"),
+        "gap_ef": summary.get("GAP_EF"),
+        "gap_pa_hr_pct": summary.get("GAP_Pa:Hr_%"),
+        "avg_power_w": summary.get("avg_power_w"),
+        "max_power_w": summary.get("max_power_w"),
+        "np_power_w": summary.get("np_power_w"),
+        "intensity_factor": summary.get("IF"),
+        "tss": summary.get("TSS"),
+        "hr_hist": hist_b64_from_records(df_rec),
+        "zone_s": zone_seconds(df_rec, parse_bounds(zone_bounds_text or "")),
+        "aggregates": build_aggregates(df_rec),
+        "avg_speed_kmh": round(avg_speed * 3.6, 2) if avg_speed else None,
+        "avg_pace_s_per_km": round(1000 / avg_speed) if (avg_speed and sport in ("run", "walk", "hike")) else None,
+        "sport": sport,
+        "laps_count": int(len(df_laps)),
+        "fit_summary": {"records": int(len(df_rec)), "laps": int(len(df_laps)), "parsed_by": "import_worker"},
+        "fingerprint": fingerprint(summary, df_rec),
+        "features": encode_features(workout_features(summary, df_rec, hr_max)),
+    }
+    return {"row": _jsonable(row), "records": int(len(df_rec)), "ext": os.path.splitext(inner_name)[1][1:],
+            "track": build_track(df_rec)}
+
+
+def parse_job_timed(timeout_s: float, *args) -> Dict[str, Any]:
+    """parse_job_payload с таймаутом внутри процесса пула: отсчёт — с начала разбора, а не с клейма пачки."""
+    return call_with_timeout(timeout_s, parse_job_payload, *args)
+
+
+# ---------------- stores ----------------
+
+class SqliteStore:
+    """
+    Локальный стенд очереди на SQLite. SKIP LOCKED здесь не нужен: BEGIN IMMEDIATE берёт
+    блокировку записи, поэтому выбор+клейм атомарны между процессами.
+    """
+
+    SCHEMA = """
+    create table if not exists import_jobs (
+      id text primary key, user_id text, source_file_id text, workout_id text,
+      status text default 'queued', attempt integer default 0, max_attempts integer default 5,
+      priority integer default 0, scheduled_at text, created_at text,
+      locked_by text, locked_at text, start_time text, finished_at text,
+      error_message text, output text
+    );
+    create table if not exists workout_files (
+      id text primary key, user_id text, storage_bucket text, storage_path text, filename text,
+      size_bytes integer, extension text, workout_id text, status text, processed_at text
+    );
+    create table if not exists workouts (
+      id text primary key, user_id text, source text, filename text, size_bytes integer,
+      storage_path text, uploaded_at text, start_time text, local_date text, utc_offset_s integer, duration_sec integer,
+      moving_time_sec integer, distance_m integer, time_s integer, time_min real, avg_hr integer,
+      max_hr integer, trimp integer, ef real, pa_hr_pct real, gap_pace_s_per_km integer,
+      gap_ef real, gap_pa_hr_pct real, avg_power_w integer, max_power_w integer,
+      np_power_w integer, intensity_factor real, tss real, hr_hist text, zone_s text, aggregates text, avg_speed_kmh real,
+      avg_pace_s_per_km integer, sport text, laps_count integer, fit_summary text,
+      fingerprint text, duplicate_of text, features text, deleted_at text
+    );
+    create table if not exists profiles (user_id text primary key, hr_rest integer, hr_max integer, ftp_w integer,
+                                         zone_bounds_text text);
+    create table if not exists workout_tracks (
+      workout_id text primary key, user_id text, n_points integer, precision integer,
+      min_lat real, min_lon real, max_lat real, max_lon real, polyline text, times text, levels text
+    );
+    create table if not exists user_heatmaps (
+      user_id text primary key, tiles text not null, n_workouts integer not null default 0, updated_at text
+    );
+    create table if not exists coach_training_context (
+      user_id text primary key, version integer not null default 1, schema_version integer not null,
+      doc text not null, n_workouts integer not null default 0, last_workout_at text, updated_at text
+    );
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, isolation_level=None, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+
+    def init_schema(self) -> None:
+        self.conn.executescript(self.SCHEMA)
+
+    def claim(self, worker_id: str, n: int, visibility_s: int) -> List[Dict[str, Any]]:
+        now = _now()
+        expired = _iso(now - dt.timedelta(seconds=visibility_s))
+        c = self.conn
+        c.execute("begin immediate")
+        try:
+            # зависшие на последней попытке уже не переклеймить — закрываем, иначе висят в running вечно
+            c.execute(
+                """update import_jobs set status = 'failed', finished_at = ?, error_message = ?
+                   where status = 'running' and locked_at < ? and coalesce(attempt, 0) >= coalesce(max_attempts, 5)""",
+                (_iso(now), EXPIRED_MSG, expired),
+            )
+            rows = c.execute(
+                f"""select id from import_jobs
+                    where (status in ({",".join("?" * len(CLAIMABLE))}) and scheduled_at <= ?)
+                       or (status = 'running' and locked_at < ? and attempt < coalesce(max_attempts, 5))
+                    order by priority desc, scheduled_at, created_at limit ?""",
+                (*CLAIMABLE, _iso(now), expired, n),
+            ).fetchall()
+            ids = [r["id"] for r in rows]
+            c.executemany(
+                """update import_jobs set status = 'running', attempt = coalesce(attempt, 0) + 1,
+                   locked_by = ?, locked_at = ?, start_time = ? where id = ?""",
+                [(worker_id, _iso(now), _iso(now), i) for i in ids],
+            )
+            jobs = [dict(r) for r in c.execute(
+                f"select {JOB_COLUMNS} from import_jobs where id in ({','.join('?' * len(ids))})", ids
+            )] if ids else []
+            c.execute("commit")
+        except Exception:
+            c.execute("rollback")
+            raise
+        return jobs
+
+    def files(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not ids:
+            return {}
+        q = f"select {FILE_COLUMNS} from workout_files where id in ({','.join('?' * len(ids))})"
+        return {str(r["id"]): dict(r) for r in self.conn.execute(q, ids)}
+
+    def profiles(self, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not user_ids:
+            return {}
+        q = f"select user_id, hr_rest, hr_max, ftp_w, zone_bounds_text from profiles where user_id in ({','.join('?' * len(user_ids))})"
+        return {str(r["user_id"]): dict(r) for r in self.conn.execute(q, user_ids)}
+
+    def complete(self, worker_id: str, done: List[Dict[str, Any]]) -> None:
+        now = _iso(_now())
+        c = self.conn
+        c.execute("begin immediate")
+        try:
+            for d in done:
+                if not d.get("workout_id"):
+                    d["workout_id"] = str(uuid.uuid4())
+                    c.execute(
+                        "insert into workouts (id, user_id, source, filename, size_bytes, storage_path, uploaded_at, sport) "
+                        "values (?, ?, ?, ?, ?, ?, ?, 'other')",
+                        (d["workout_id"], d["user_id"], d["ext"], d["filename"], d["size_bytes"], d["storage_path"], now),
+                    )
+            _flag_duplicates(done, lambda uid, lo, hi: [dict(r) for r in c.execute(
+                f"""select {DEDUP_COLUMNS} from workouts
+                    where user_id = ? and deleted_at is null and start_time between ? and ?""", (uid, lo, hi))])
+            sets = ", ".join(f"{k} = ?" for k in WORKOUT_FIELDS)
+            c.executemany(
+                f"update workouts set {sets}, deleted_at = ? where id = ?",
+                [tuple(json.dumps(d["row"][k]) if k in JSON_FIELDS and d["row"].get(k) is not None
+                       else d["row"].get(k) for k in WORKOUT_FIELDS)
+                 + (now if d["row"].get("duplicate_of") else None, d["workout_id"]) for d in done],
+            )
+            c.executemany(
+                """insert or replace into workout_tracks
+                   (workout_id, user_id, n_points, precision, min_lat, min_lon, max_lat, max_lon, polyline, times, levels)
+                   values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                [(d["workout_id"], d["user_id"], t["n_points"], t["precision"], t["min_lat"], t["min_lon"],
+                  t["max_lat"], t["max_lon"], t["polyline"], t.get("times"), json.dumps(t["levels"]))
+                 for d in _fresh(done) for t in [d.get("track")] if t],
+            )
+            self._refresh_heatmaps(c, done, now)
+            self._refresh_coach(c, _fresh(done))
+            c.executemany(
+                "update workout_files set status = 'ready', processed_at = ?, workout_id = coalesce(workout_id, ?) where id = ?",
+                [(now, d["workout_id"], d["file_id"]) for d in done],
+            )
+            c.executemany(
+                """update import_jobs set status = 'succeeded', finished_at = ?, error_message = null, output = ?
+                   where id = ? and locked_by = ?""",
+                [(now, json.dumps(_job_output(d)), d["job_id"], worker_id) for d in done],
+            )
+            c.execute("commit")
+        except Exception:
+            c.execute("rollback")
+            raise
+
+    def _refresh_heatmaps(self, c, done: List[Dict[str, Any]], now: str) -> None:
+        """Новые треки — в сохранённые тепловые карты пользователей, в той же транзакции."""
+        for uid, tracks in _heatmap_tracks_by_user(done).items():
+            try:
+                cur = c.execute("select tiles from user_heatmaps where user_id = ?", (uid,)).fetchone()
+                hm = _merge_heatmap(cur["tiles"] if cur else None, tracks)
+                if hm is not None:
+                    c.execute("update user_heatmaps set tiles = ?, n_workouts = ?, updated_at = ? where user_id = ?",
+                              (hm.to_b64(), len(hm), now, uid))
+            except Exception:
+                pass   # карта не должна валить импорт — пересоберётся при просмотре
+
+    def _refresh_coach(self, c, done: List[Dict[str, Any]]) -> None:
+        """Контекст тренера в той же транзакции: документ читается и пишется под begin immediate."""
+        def history(uid: str) -> List[Dict[str, Any]]:
+            rows = c.execute(f"select {COACH_COLUMNS} from workouts where user_id = ? and deleted_at is null",
+                             (uid,)).fetchall()
+            return [{**dict(r), "zone_s": json.loads(r["zone_s"]) if r["zone_s"] else None} for r in rows]
+
+        for uid, rows in _coach_rows_by_user(done).items():
+            try:
+                cur = c.execute("select doc from coach_training_context where user_id = ?", (uid,)).fetchone()
+                doc = update_snapshot(json.loads(cur["doc"]) if cur else None, rows, lambda: history(uid))
+                r = snapshot_row(doc)
+                c.execute(
+                    """insert into coach_training_context
+                         (user_id, version, schema_version, doc, n_workouts, last_workout_at, updated_at)
+                       values (?, 1, ?, ?, ?, ?, ?)
+                       on conflict(user_id) do update set version = version + 1,
+                         schema_version = excluded.schema_version, doc = excluded.doc, n_workouts = excluded.n_workouts,
+                         last_workout_at = excluded.last_workout_at, updated_at = excluded.updated_at""",
+                    (uid, r["schema_version"], json.dumps(doc), r["n_workouts"], r["last_workout_at"], r["updated_at"]),
+                )
+            except Exception:
+                pass   # контекст тренера не должен валить импорт — пересоберётся при следующем сохранении
+
+    def fail(self, worker_id: str, failed: List[Tuple[Dict[str, Any], str]]) -> None:
+        now = _now()
+        rows = []
+        for job, msg in failed:
+            attempt = int(job.get("attempt") or 0)
+            exhausted = attempt >= int(job.get("max_attempts") or 5)
+            next_at = _iso(now + dt.timedelta(seconds=retry_delay_s(attempt)))
+            rows.append(("failed" if exhausted else "retry_wait", _iso(now) if exhausted else None,
+                         msg[:500], next_at, job["id"], worker_id))
+        self.conn.executemany(
+            """update import_jobs set status = ?, finished_at = ?, error_message = ?, scheduled_at = ?
+               where id = ? and locked_by = ?""",
+            rows,
+        )
+
+
+class PgStore:
+    """Postgres/Supabase (service role DSN): клейм через FOR UPDATE SKIP LOCKED, запись пачкой через jsonb_to_recordset."""
+
+    CLAIM_SQL = f"""
+    with expired as (
+      update public.import_jobs
+         set status = 'failed', finished_at = now(), error_message = %(expired_msg)s
+       where status = 'running' and locked_at < now() - make_interval(secs => %(vt)s)
+         and coalesce(attempt, 0) >= coalesce(max_attempts, 5)
+    ),
+    picked as (
+      select id from public.import_jobs
+      where (status = any(%(claimable)s) and scheduled_at <= now())
+         or (status = 'running' and locked_at < now() - make_interval(secs => %(vt)s)
+             and coalesce(attempt, 0) < coalesce(max_attempts, 5))
+      order by priority desc, scheduled_at, created_at
+      limit %(n)s
+      for update skip locked
+    )
+    update public.import_jobs j
+       set status = 'running', attempt = coalesce(j.attempt, 0) + 1,
+           locked_by = %(worker)s, locked_at = now(), start_time = now()
+      from picked where j.id = picked.id
+    returning {", ".join("j." + c.strip() for c in JOB_COLUMNS.split(","))}
+    """
+
+    def __init__(self, dsn: str):
+        if psycopg is None:
+            raise RuntimeError("Библиотека `psycopg` не установлена. Установи пакет `psycopg[binary]`.")
+        self.conn = psycopg.connect(dsn, autocommit=True, row_factory=dict_row)
+
+    def claim(self, worker_id: str, n: int, visibility_s: int) -> List[Dict[str, Any]]:
+        with self.conn.transaction():
+            rows = self.conn.execute(
+                self.CLAIM_SQL,
+                {"claimable": list(CLAIMABLE), "vt": visibility_s, "n": n, "worker": worker_id,
+                 "expired_msg": EXPIRED_MSG},
+            ).fetchall()
+        return [{k: (str(v) if k.endswith("id") and v is not None else v) for k, v in r.items()} for r in rows]
+
+    def files(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not ids:
+            return {}
+        rows = self.conn.execute(
+            f"select {FILE_COLUMNS} from public.workout_files where id::text = any(%s)", (ids,)
+        ).fetchall()
+        return {str(r["id"]): {**r, "id": str(r["id"])} for r in rows}
+
+    def profiles(self, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not user_ids:
+            return {}
+        rows = self.conn.execute(
+            "select user_id, hr_rest, hr_max, ftp_w, zone_bounds_text from public.profiles where user_id::text = any(%s)", (user_ids,)
+        ).fetchall()
+        return {str(r["user_id"]): r for r in rows}
+
+    def complete(self, worker_id: str, done: List[Dict[str, Any]]) -> None:
+        c = self.conn
+        with c.transaction():
+            for d in done:
+                if not d.get("workout_id"):
+                    r = c.execute(
+                        """insert into public.workouts (user_id, source, sport, uploaded_at, storage_path, filename, size_bytes)
+                           values (%s, %s, 'other', now(), %s, %s, %s) returning id::text as id""",
+                        (d["user_id"], d["ext"], d["storage_path"], d["filename"], d["size_bytes"]),
+                    ).fetchone()
+                    d["workout_id"] = r["id"]
+                    c.execute("update public.workout_files set workout_id = %s where id::text = %s",
+                              (d["workout_id"], d["file_id"]))
+            _flag_duplicates(done, lambda uid, lo, hi: c.execute(
+                f"""select {DEDUP_COLUMNS} from public.workouts
+                    where user_id::text = %s and deleted_at is null and start_time between %s and %s""",
+                (uid, lo, hi)).fetchall())
+
+            recs = [{"id": d["workout_id"], **d["row"]} for d in done]
+            c.execute(
+                """update public.workouts w set
+                     start_time = v.start_time, local_date = v.local_date, utc_offset_s = v.utc_offset_s,
+                     duration_sec = v.duration_sec,
+                     moving_time_sec = v.moving_time_sec, distance_m = v.distance_m, time_s = v.time_s,
+                     time_min = v.time_min, avg_hr = v.avg_hr, max_hr = v.max_hr, trimp = v.trimp, ef = v.ef,
+                     pa_hr_pct = v.pa_hr_pct, gap_pace_s_per_km = v.gap_pace_s_per_km, gap_ef = v.gap_ef,
+                     gap_pa_hr_pct = v.gap_pa_hr_pct, avg_power_w = v.avg_power_w, max_power_w = v.max_power_w,
+                     np_power_w = v.np_power_w, intensity_factor = v.intensity_factor, tss = v.tss,
+                     hr_hist = v.hr_hist, zone_s = v.zone_s, aggregates = v.aggregates,
+                     avg_speed_kmh = v.avg_speed_kmh,
+                     avg_pace_s_per_km = v.avg_pace_s_per_km, sport = coalesce(v.sport, 'other'),
+                     laps_count = v.laps_count, fit_summary = v.fit_summary, fingerprint = v.fingerprint,
+                     duplicate_of = v.duplicate_of::uuid, features = v.features,
+                     deleted_at = case when v.duplicate_of is not null then now() else w.deleted_at end
+                   from jsonb_to_recordset(%s::jsonb) as v(
+                     id text, start_time timestamptz, local_date date, utc_offset_s int, duration_sec int, moving_time_sec int,
+                     distance_m int, time_s int, time_min float8, avg_hr int, max_hr int, trimp int, ef float8,
+                     pa_hr_pct float8, gap_pace_s_per_km int, gap_ef float8, gap_pa_hr_pct float8, avg_power_w int, max_power_w int, np_power_w int,
+                     intensity_factor float8, tss float8, hr_hist text, zone_s jsonb, aggregates text,
+                     avg_speed_kmh float8, avg_pace_s_per_km int, sport text, laps_count int,
+                     fit_summary jsonb, fingerprint jsonb, duplicate_of text, features text)
+                   where w.id::text = v.id""",
+                (json.dumps(recs),),
+            )
+            tracks = [{"workout_id": d["workout_id"], "user_id": d["user_id"], **d["track"]} for d in _fresh(done) if d.get("track")]
+            if tracks:
+                c.execute(
+                    """insert into public.workout_tracks
+                         (workout_id, user_id, n_points, precision, min_lat, min_lon, max_lat, max_lon, polyline, times, levels)
+                       select v.workout_id::uuid, v.user_id::uuid, v.n_points, v.precision, v.min_lat, v.min_lon,
+                              v.max_lat, v.max_lon, v.polyline, v.times, v.levels
+                       from jsonb_to_recordset(%s::jsonb) as v(
+                         workout_id text, user_id text, n_points int, precision smallint, min_lat float8,
+                         min_lon float8, max_lat float8, max_lon float8, polyline text, times text, levels jsonb)
+                       on conflict (workout_id) do update set
+                         n_points = excluded.n_points, precision = excluded.precision,
+                         min_lat = excluded.min_lat, min_lon = excluded.min_lon,
+                         max_lat = excluded.max_lat, max_lon = excluded.max_lon,
+                         polyline = excluded.polyline, times = excluded.times, levels = excluded.levels""",
+                    (json.dumps(tracks),),
+                )
+            self._refresh_heatmaps(c, done)
+            self._refresh_coach(c, _fresh(done))
+            c.execute(
+                """update public.workout_files f set status = 'ready', processed_at = now()
+                   where f.id::text = any(%s)""",
+                ([d["file_id"] for d in done],),
+            )
+            c.execute(
+                """update public.import_jobs j set status = 'succeeded', finished_at = now(),
+                          error_message = null, output = v.output
+                   from jsonb_to_recordset(%s::jsonb) as v(id text, output jsonb)
+                   where j.id::text = v.id and j.locked_by = %s""",
+                (json.dumps([{"id": d["job_id"], "output": _job_output(d)} for d in done]), worker_id),
+            )
+
+    def _refresh_heatmaps(self, c, done: List[Dict[str, Any]]) -> None:
+        """Новые треки — в сохранённые тепловые карты; строка карты блокируется (for update) до коммита."""
+        for uid, tracks in _heatmap_tracks_by_user(done).items():
+            try:
+                with c.transaction():   # savepoint: сбой карты не откатывает импорт
+                    cur = c.execute("select tiles from public.user_heatmaps where user_id::text = %s for update",
+                                    (uid,)).fetchone()
+                    hm = _merge_heatmap(cur["tiles"] if cur else None, tracks)
+                    if hm is not None:
+                        c.execute("""update public.user_heatmaps set tiles = %s, n_workouts = %s, updated_at = now()
+                                     where user_id::text = %s""", (hm.to_b64(), len(hm), uid))
+            except Exception:
+                pass   # карта не должна валить импорт — пересоберётся при просмотре
+
+    def _refresh_coach(self, c, done: List[Dict[str, Any]]) -> None:
+        """Контекст тренера в той же транзакции; строка документа блокируется (for update) до коммита."""
+        for uid, rows in _coach_rows_by_user(done).items():
+            try:
+                with c.transaction():   # savepoint: сбой контекста не откатывает импорт
+                    cur = c.execute("select doc from public.coach_training_context where user_id::text = %s for update",
+                                    (uid,)).fetchone()
+                    doc = update_snapshot(cur["doc"] if cur else None, rows, lambda: c.execute(
+                        f"""select {COACH_COLUMNS} from public.workouts
+                            where user_id::text = %s and deleted_at is null""", (uid,)).fetchall())
+                    r = snapshot_row(doc)
+                    c.execute(
+                        """insert into public.coach_training_context
+                             (user_id, version, schema_version, doc, n_workouts, last_workout_at, updated_at)
+                           values (%s::uuid, 1, %s, %s::jsonb, %s, %s, now())
+                           on conflict (user_id) do update set version = coach_training_context.version + 1,
+                             schema_version = excluded.schema_version, doc = excluded.doc,
+                             n_workouts = excluded.n_workouts, last_workout_at = excluded.last_workout_at,
+                             updated_at = now()""",
+                        (uid, r["schema_version"], json.dumps(_jsonable(doc)), r["n_workouts"], r["last_workout_at"]),
+                    )
+            except Exception:
+                pass   # контекст тренера не должен валить импорт — пересоберётся при следующем сохранении
+
+    def fail(self, worker_id: str, failed: List[Tuple[Dict[str, Any], str]]) -> None:
+        self.conn.execute(
+            """update public.import_jobs j set
+                 status = case when j.attempt >= coalesce(j.max_attempts, 5) then 'failed' else 'retry_wait' end,
+                 finished_at = case when j.attempt >= coalesce(j.max_attempts, 5) then now() else null end,
+                 error_message = v.msg,
+                 scheduled_at = now() + make_interval(secs => least(60 * power(2, greatest(0, j.attempt - 1)), 1800))
+               from jsonb_to_recordset(%s::jsonb) as v(id text, msg text)
+               where j.id::text = v.id and j.locked_by = %s""",
+            (json.dumps([{"id": j["id"], "msg": m[:500]} for j, m in failed]), worker_id),
+        )
+
+
+def _job_output(d: Dict[str, Any]) -> Dict[str, Any]:
+    out = {"workout_id": d["workout_id"], "file_id": d["file_id"], "parsed_ext": d["ext"]}
+    if d["row"].get("duplicate_of"):
+        out.update(duplicate_of=d["row"]["duplicate_of"], reason=d.get("dup_reason"))
+    return out
+
+
+# ---------------- file fetchers ----------------
+
+def local_fetcher(root: str) -> Callable[[str, str], bytes]:
+    """Файлы стенда лежат как <root>/<bucket>/<path>."""
+    def fetch(bucket: str, path: str) -> bytes:
+        with open(os.path.join(root, bucket or "", path), "rb") as f:
+            return f.read()
+    return fetch
+
+
+def storage_fetcher(supabase) -> Callable[[str, str], bytes]:
+    def fetch(bucket: str, path: str) -> bytes:
+        return supabase.storage.from_(bucket).download(path)
+    return fetch
+
+
+# ---------------- worker ----------------
+
+class ImportWorker:
+    def __init__(
+        self,
+        store,
+        fetch: Callable[[str, str], bytes],
+        *,
+        worker_id: Optional[str] = None,
+        procs: Optional[int] = None,
+        batch: Optional[int] = None,
+        visibility_s: int = 300,
+        job_timeout_s: float = 120.0,
+    ):
+        self.store = store
+        self.fetch = fetch
+        self.worker_id = worker_id or f"py-{socket.gethostname()}-{os.getpid()}"
+        self.procs = procs or os.cpu_count() or 1
+        self.batch = batch or 2 * self.procs
+        self.visibility_s = visibility_s
+        self.job_timeout_s = job_timeout_s
+        self.pool = ProcessPoolExecutor(max_workers=self.procs)
+        self.stats = {"started": time.time(), "claimed": 0, "succeeded": 0, "failed": 0,
+                      "bytes": 0, "records": 0, "busy_s": 0.0}
+
+    def run_once(self) -> int:
+        """Один цикл: клейм пачки → скачивание → парсинг в пуле → запись пачкой. Возвращает число джобов."""
+        jobs = self.store.claim(self.worker_id, self.batch, self.visibility_s)
+        if not jobs:
+            return 0
+        t0 = time.perf_counter()
+        self.stats["claimed"] += len(jobs)
+
+        files = self.store.files([j["source_file_id"] for j in jobs if j.get("source_file_id")])
+        profiles = self.store.profiles(sorted({str(j["user_id"]) for j in jobs}))
+
+        futures, failed = [], []
+        for job in jobs:
+            wf = files.get(str(job.get("source_file_id")))
+            if not wf:
+                failed.append((job, "file row not found"))
+                continue
+            try:
+                data = self.fetch(wf["storage_bucket"], wf["storage_path"])
+            except Exception as e:
+                failed.append((job, f"download failed: {e}"))
+                continue
+            self.stats["bytes"] += len(data)
+            prof = {**DEFAULT_PROFILE, **{k: v for k, v in profiles.get(str(job["user_id"]), {}).items() if v}}
+            ext = (wf.get("extension") or os.path.splitext(wf["storage_path"])[1][1:] or "fit").lower().lstrip(".")
+            name = wf["storage_path"] if wf["storage_path"].lower().endswith("." + ext) else f"upload.{ext}"
+            fut = self.pool.submit(parse_job_timed, self.job_timeout_s, name, data, int(prof["hr_rest"]), int(prof["hr_max"]),
+                                   int(prof["ftp_w"]) if prof.get("ftp_w") else None, prof["zone_bounds_text"])
+            futures.append((job, wf, fut))
+
+        done = []
+        # таймаут каждого файла считает сам процесс пула; здесь — только страховка от зависшего процесса
+        # (SIGALRM не прерывает долгий вызов в C): все волны пачки по job_timeout_s плюс запас
+        waves = math.ceil(len(futures) / self.procs) if futures else 0
+        backstop = time.monotonic() + waves * self.job_timeout_s + STUCK_GRACE_S
+        recycle = False
+        for job, wf, fut in futures:
+            try:
+                res = fut.result(timeout=max(0.0, backstop - time.monotonic()))
+            except FutureTimeout:
+                if not fut.done():          # не дождались процесса: пул пересоздадим
+                    fut.cancel()
+                    recycle = True
+                failed.append((job, "parse timeout"))
+                continue
+            except BrokenProcessPool as e:
+                recycle = True
+                failed.append((job, f"parse worker died: {e}"))
+                continue
+            except Exception as e:
+                failed.append((job, str(e) or e.__class__.__name__))
+                continue
+            self.stats["records"] += res["records"]
+            done.append({
+                "job_id": job["id"], "user_id": job["user_id"], "file_id": wf["id"],
+                "workout_id": wf.get("workout_id") or job.get("workout_id"),
+                "filename": wf.get("filename"), "size_bytes": wf.get("size_bytes"),
+                "storage_path": wf.get("storage_path"), **res,
+            })
+
+        if recycle:
+            self._recycle_pool()
+        if done:
+            self.store.complete(self.worker_id, done)
+        if failed:
+            self.store.fail(self.worker_id, failed)
+        self.stats["succeeded"] += len(done)
+        self.stats["failed"] += len(failed)
+        self.stats["busy_s"] += time.perf_counter() - t0
+        return len(jobs)
+
+    def _recycle_pool(self) -> None:
+        """Пересоздать пул: завершить зависшие/упавшие процессы, чтобы они не занимали слоты следующих пачек."""
+        procs = list((getattr(self.pool, "_processes", None) or {}).values())
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        self.pool = ProcessPoolExecutor(max_workers=self.procs)
+        self.stats["pool_recycled"] = self.stats.get("pool_recycled", 0) + 1
+
+    def throughput(self) -> Dict[str, float]:
+        s = self.stats
+        busy = max(s["busy_s"], 1e-9)
+        return {
+            "worker_id": self.worker_id,
+            "uptime_s": round(time.time() - s["started"], 1),
+            "jobs_ok": s["succeeded"], "jobs_failed": s["failed"],
+            "jobs_per_s": round(s["succeeded"] / busy, 2),
+            "mb_per_s": round(s["bytes"] / busy / 1e6, 2),
+            "records_per_s": round(s["records"] / busy, 1),
+        }
+
+    def run_forever(self, idle_sleep_s: float = 2.0, report_every_s: float = 60.0) -> None:
+        last_report = time.time()
+        try:
+            while True:
+                n = self.run_once()
+                if time.time() - last_report >= report_every_s:
+                    print(json.dumps(self.throughput(), ensure_ascii=False), flush=True)
+                    last_report = time.time()
+                if n == 0:
+                    time.sleep(idle_sleep_s)
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="CapyRun import_jobs worker")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--dsn", help="Postgres DSN (service role)")
+    src.add_argument("--sqlite", help="путь к SQLite-стенду")
+    ap.add_argument("--files-dir", help="локальный корень файлов <bucket>/<path> вместо Supabase Storage")
+    ap.add_argument("--init-sqlite", action="store_true", help="создать таблицы стенда")
+    ap.add_argument("--procs", type=int, default=None)
+    ap.add_argument("--batch", type=int, default=None)
+    ap.add_argument("--visibility", type=int, default=300, help="таймаут видимости running-джоба, сек")
+    ap.add_argument("--once", action="store_true", help="обработать одну пачку и выйти")
+    args = ap.parse_args(argv)
+
+    if args.sqlite:
+        store = SqliteStore(args.sqlite)
+        if args.init_sqlite:
+            store.init_schema()
+    else:
+        store = PgStore(args.dsn)
+
+    if args.files_dir:
+        fetch = local_fetcher(args.files_dir)
+    else:
+        from supabase import create_client  # type: ignore
+        fetch = storage_fetcher(create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_ROLE_KEY"]))
+
+    worker = ImportWorker(store, fetch, procs=args.procs, batch=args.batch, visibility_s=args.visibility)
+    if args.once:
+        worker.run_once()
+        worker.pool.shutdown()
+        print(json.dumps(worker.throughput(), ensure_ascii=False))
+    else:
+        worker.run_forever()
+
+
+if __name__ == "__main__":
+    main()
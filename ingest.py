@@ -0,0 +1,297 @@
+# ingest.py — приём контейнеров (ZIP / .gz) и треков GPX/TCX поверх parse_fit_file
+#
+# Архивы разворачиваются потоково в памяти (zipfile/gzip читают блоками, на диск ничего не пишем),
+# GPX/TCX разбираются через iterparse с удалением уже обработанных элементов,
+# а декодирование отдельных файлов раскидывается по процессам общего пула parse_pool.
+
+from __future__ import annotations
+import io
+import os
+import gzip
+import signal
+import zipfile
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+from parsing import parse_fit_file, finalize_records, build_summary
+from gps import SEMICIRCLES_PER_DEG
+
+try:
+    import resource  # POSIX only
+except Exception:
+    resource = None
+
+ACTIVITY_EXTS = (".fit", ".gpx", ".tcx")
+CHUNK_BYTES = 1 << 20                # читаем архивы блоками по 1 МБ
+MAX_MEMBER_BYTES = 256 * 1024 * 1024  # защита от zip-бомб: один файл активности не больше 256 МБ
+EARTH_R = 6371000.0
+
+REC_COLUMNS = ["timestamp", "hr", "speed", "cadence", "power", "elev", "dist"]
+TRACK_COLUMNS = ["lat_sc", "lon_sc"]  # int32-полукруги, как position_lat/position_long в FIT
+
+
+# ---------- containers ----------
+
+def _name_of(f: Any, default: str = "upload.fit") -> str:
+    return str(getattr(f, "name", None) or default)
+
+
+def _is_activity(name: str) -> bool:
+    low = name.lower()
+    if low.endswith(".gz"):
+        low = low[:-3]
+    return low.endswith(ACTIVITY_EXTS)
+
+
+def _read_stream(stream) -> bytes:
+    """Вычитывает поток блоками в память с ограничением размера."""
+    buf = io.BytesIO()
+    total = 0
+    while True:
+        chunk = stream.read(CHUNK_BYTES)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > MAX_MEMBER_BYTES:
+            raise ValueError("Файл в архиве слишком большой.")
+        buf.write(chunk)
+    return buf.getvalue()
+
+
+def iter_members(uploaded_file, name: Optional[str] = None) -> Iterator[Tuple[str, bytes]]:
+    """
+    Отдаёт (имя, байты) для каждого файла активности внутри загрузки.
+    Поддерживает .fit/.gpx/.tcx, их .gz-варианты, ZIP и ZIP внутри ZIP (экспорт Garmin/Strava).
+    """
+    name = name or _name_of(uploaded_file)
+    low = name.lower()
+    if hasattr(uploaded_file, "seek"):
+        try:
+            uploaded_file.seek(0)
+        except Exception:
+            pass
+
+    if low.endswith(".zip"):
+        with zipfile.ZipFile(uploaded_file) as zf:
+            for info in zf.infolist():
+                inner = info.filename
+                if info.is_dir() or os.path.basename(inner).startswith("."):
+                    continue
+                if inner.lower().endswith(".zip"):
+                    # вложенному ZIP нужен seek — держим его в памяти, не на диске
+                    with zf.open(info) as stream:
+                        nested = io.BytesIO(_read_stream(stream))
+                    yield from iter_members(nested, inner)
+                elif _is_activity(inner):
+                    with zf.open(info) as stream:
+                        yield from iter_members(stream, inner)
+        return
+
+    if low.endswith(".gz"):
+        with gzip.GzipFile(fileobj=uploaded_file, mode="rb") as gz:
+            yield name[:-3], _read_stream(gz)
+        return
+
+    if low.endswith(ACTIVITY_EXTS):
+        yield name, _read_stream(uploaded_file)
+
+
+# ---------- GPX / TCX ----------
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _num(text: Optional[str]) -> Optional[float]:
+    if text is None:
+        return None
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def haversine_cum(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Накопленная дистанция (м) по точкам в градусах; пропуски не добавляют расстояния."""
+    if len(lat) == 0:
+        return np.zeros(0)
+    la = np.radians(lat)
+    lo = np.radians(lon)
+    dla = np.diff(la)
+    dlo = np.diff(lo)
+    h = np.sin(dla / 2) ** 2 + np.cos(la[:-1]) * np.cos(la[1:]) * np.sin(dlo / 2) ** 2
+    step = 2 * EARTH_R * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+    step = np.nan_to_num(step, nan=0.0)
+    return np.concatenate([[0.0], np.cumsum(step)])
+
+
+def _iter_points(stream) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Потоковый разбор GPX/TCX: отдаёт ("point", {...}), ("lap", {...}), ("sport", {...}).
+    Обработанные элементы сразу удаляются из дерева, так что память не растёт с длиной трека.
+    """
+    stack: List[ET.Element] = []
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            tag = _local(elem.tag)
+            if tag == "Activity" and elem.get("Sport"):
+                yield "sport", {"sport": elem.get("Sport")}
+            continue
+
+        stack.pop()
+        tag = _local(elem.tag)
+        if tag in ("trkpt", "Trackpoint"):
+            p: Dict[str, Any] = {"lat": _num(elem.get("lat")), "lon": _num(elem.get("lon"))}
+            for ch in elem.iter():
+                t = _local(ch.tag)
+                if t in ("time", "Time"):
+                    p["timestamp"] = ch.text
+                elif t in ("ele", "AltitudeMeters"):
+                    p["elev"] = _num(ch.text)
+                elif t == "LatitudeDegrees":
+                    p["lat"] = _num(ch.text)
+                elif t == "LongitudeDegrees":
+                    p["lon"] = _num(ch.text)
+                elif t == "DistanceMeters":
+                    p["dist"] = _num(ch.text)
+                elif t in ("hr", "heartrate") or (t == "Value" and "hr" not in p):
+                    p["hr"] = _num(ch.text)
+                elif t in ("cad", "cadence", "Cadence", "RunCadence"):
+                    p["cadence"] = _num(ch.text)
+                elif t in ("power", "Watts"):
+                    p["power"] = _num(ch.text)
+                elif t in ("speed", "Speed"):
+                    p["speed"] = _num(ch.text)
+            yield "point", p
+        elif tag == "Lap":
+            lap: Dict[str, Any] = {"start_time": elem.get("StartTime")}
+            for ch in elem:
+                t = _local(ch.tag)
+                if t == "TotalTimeSeconds":
+                    lap["total_timer_time_s"] = _num(ch.text)
+                elif t == "DistanceMeters":
+                    lap["total_distance_m"] = _num(ch.text)
+                elif t == "MaximumSpeed":
+                    lap["max_speed_m_s"] = _num(ch.text)
+                elif t == "AverageHeartRateBpm":
+                    lap["avg_hr"] = _num(ch.findtext("{*}Value"))
+                elif t == "MaximumHeartRateBpm":
+                    lap["max_hr"] = _num(ch.findtext("{*}Value"))
+                elif t == "Cadence":
+                    lap["avg_cadence"] = _num(ch.text)
+                elif t == "TriggerMethod":
+                    lap["lap_trigger"] = ch.text
+            yield "lap", lap
+        elif tag == "type" and stack and _local(stack[-1].tag) == "trk":
+            yield "sport", {"sport": elem.text}
+        else:
+            continue
+        if stack:
+            stack[-1].remove(elem)
+        elem.clear()
+
+
+def parse_xml_track(stream, hr_rest: int, hr_max: int, ftp: Optional[int] = None):
+    """GPX/TCX → (df_rec, df_laps, df_ses, summary) в той же схеме, что и parse_fit_file."""
+    cols: Dict[str, list] = {k: [] for k in REC_COLUMNS + ["lat", "lon"]}
+    laps: List[Dict[str, Any]] = []
+    sport = None
+    for kind, item in _iter_points(stream):
+        if kind == "point":
+            for k in cols:
+                cols[k].append(item.get(k))
+        elif kind == "lap":
+            laps.append(item)
+        elif kind == "sport" and sport is None and item.get("sport"):
+            sport = str(item["sport"]).strip().lower()
+
+    df = pd.DataFrame(cols)
+    for k in REC_COLUMNS[1:] + ["lat", "lon"]:
+        df[k] = pd.to_numeric(df[k], errors="coerce")
+    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce", utc=True).dt.tz_localize(None)
+
+    if not df.empty:
+        if df["dist"].isna().all() and df["lat"].notna().any():
+            df["dist"] = haversine_cum(df["lat"].to_numpy(float), df["lon"].to_numpy(float))
+        if df["speed"].isna().all() and df["dist"].notna().any() and df["timestamp"].notna().any():
+            dt_s = df["timestamp"].diff().dt.total_seconds().to_numpy()
+            dd = df["dist"].diff().to_numpy()
+            with np.errstate(divide="ignore", invalid="ignore"):
+                spd = np.where(dt_s > 0, dd / dt_s, np.nan)
+            df["speed"] = pd.Series(spd).clip(lower=0)
+
+    df["lat_sc"] = (df["lat"] * SEMICIRCLES_PER_DEG).round()
+    df["lon_sc"] = (df["lon"] * SEMICIRCLES_PER_DEG).round()
+    df_rec = finalize_records(df[REC_COLUMNS + TRACK_COLUMNS].copy())
+
+    df_laps = pd.DataFrame(laps)
+    if not df_laps.empty:
+        df_laps["start_time"] = pd.to_datetime(df_laps["start_time"], errors="coerce", utc=True).dt.tz_localize(None)
+        df_laps = df_laps.sort_values("start_time").reset_index(drop=True)
+
+    start_time = df_rec["timestamp"].min() if not df_rec.empty else None
+    df_ses = pd.DataFrame([{"start_time": start_time, "sport": sport}]) if sport or start_time is not None else pd.DataFrame()
+
+    summary = build_summary(df_rec, df_ses, hr_rest, hr_max, ftp)
+    return df_rec, df_laps, df_ses, summary
+
+
+# ---------- dispatch ----------
+
+def parse_payload(name: str, data: bytes, hr_rest: int, hr_max: int, ftp: Optional[int] = None):
+    """Разбирает один файл активности по расширению. Функция верхнего уровня — пригодна для пула процессов."""
+    low = name.lower()
+    if low.endswith(".fit"):
+        return parse_fit_file(io.BytesIO(data), hr_rest, hr_max, ftp)
+    if low.endswith((".gpx", ".tcx")):
+        return parse_xml_track(io.BytesIO(data), hr_rest, hr_max, ftp)
+    raise ValueError(f"Неподдерживаемый формат: {name}")
+
+
+def parse_single_upload(uploaded_file, hr_rest: int, hr_max: int, ftp: Optional[int] = None):
+    """Первая активность из загрузки (FIT/GPX/TCX, .gz или ZIP) — для экрана одной тренировки."""
+    for name, data in iter_members(uploaded_file):
+        return parse_payload(name, data, hr_rest, hr_max, ftp)
+    raise ValueError(f"В файле {_name_of(uploaded_file)} нет поддерживаемых тренировок.")
+
+
+# ---------- процессы пула (parse_pool, import_worker) ----------
+
+def limit_memory(mem_limit_mb: int) -> None:
+    """Инициализатор процесса пула: ограничиваем адресное пространство — большой файл упадёт с MemoryError, а не уронит сервер."""
+    if resource is None or not mem_limit_mb:
+        return
+    try:
+        limit = mem_limit_mb * 1024 * 1024
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    except Exception:
+        pass
+
+
+def call_with_timeout(timeout_s: float, fn, *args, message: str = "parse timeout"):
+    """fn(*args) с таймаутом внутри процесса пула (SIGALRM): отсчёт — с начала вызова, а не с постановки в очередь."""
+    use_alarm = bool(timeout_s) and hasattr(signal, "setitimer")
+    if use_alarm:
+        def _on_alarm(signum, frame):
+            raise TimeoutError(message)
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout_s)
+    try:
+        return fn(*args)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def parse_payload_timed(name: str, data: bytes, hr_rest: int, hr_max: int, timeout_s: float,
+                        ftp: Optional[int] = None):
+    """parse_payload в процессе пула parse_pool: с таймаутом и понятной пользователю ошибкой."""
+    return call_with_timeout(timeout_s, parse_payload, name, data, hr_rest, hr_max, ftp,
+                             message="Разбор файла занял слишком много времени.")
@@ -0,0 +1,262 @@
+# instrument.py — спаны Sentry и локальные гистограммы для горячих путей (parse / excel / db)
+#
+# Выключено по умолчанию: обёртка стоит одну проверку флага. Включается через CAPYRUN_METRICS=1
+# или из sentry_init (когда Sentry реально сконфигурирован).
+
+from __future__ import annotations
+import os
+import sys
+import json
+import time
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+try:
+    import sentry_sdk  # type: ignore
+except Exception:
+    sentry_sdk = None
+
+ENABLED = os.getenv("CAPYRUN_METRICS", "") not in ("", "0")
+HIST_SIZE = 2048
+DUMP_PATH = os.getenv("CAPYRUN_METRICS_DUMP", "capyrun_metrics.json")
+
+_lock = threading.Lock()
+_hist: Dict[str, Dict[str, Any]] = {}
+
+
+def enable(on: bool = True) -> None:
+    global ENABLED
+    ENABLED = bool(on)
+
+
+def is_enabled() -> bool:
+    return ENABLED
+
+
+# ---------- local histograms ----------
+
+def record(op: str, duration_s: float, bytes_in: Optional[int] = None, rows_out: Optional[int] = None,
+           bytes_out: Optional[int] = None) -> None:
+    """Кладёт одно измерение в гистограмму op (последние HIST_SIZE значений + счётчики); bytes_out — размер результата."""
+    if not ENABLED:
+        return
+    with _lock:
+        h = _hist.get(op)
+        if h is None:
+            h = _hist[op] = {"dur": deque(maxlen=HIST_SIZE), "count": 0, "bytes_in": 0, "bytes_out": 0, "rows_out": 0,
+                             "time_s": 0.0}
+        h["dur"].append(duration_s)
+        h["count"] += 1
+        h["time_s"] += duration_s
+        if bytes_in:
+            h["bytes_in"] += int(bytes_in)
+        if rows_out:
+            h["rows_out"] += int(rows_out)
+        if bytes_out:
+            h["bytes_out"] += int(bytes_out)
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """p50/p95/p99 (мс), суммарные байты/строки и пропускная способность по каждому op."""
+    out: Dict[str, Dict[str, Any]] = {}
+    with _lock:
+        items = [(op, np.fromiter(h["dur"], dtype=float), dict(h)) for op, h in _hist.items()]
+    for op, dur, h in items:
+        p50, p95, p99 = np.percentile(dur, [50, 95, 99]) * 1000 if len(dur) else (0.0, 0.0, 0.0)
+        t = max(h["time_s"], 1e-9)
+        out[op] = {
+            "count": h["count"],
+            "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2),
+            "bytes_in": h["bytes_in"],
+            "bytes_out": h["bytes_out"],
+            "rows_out": h["rows_out"],
+            "rows_per_s": round(h["rows_out"] / t, 1) if h["rows_out"] else None,
+            "mb_per_s": round(h["bytes_in"] / t / 1e6, 2) if h["bytes_in"] else None,
+        }
+    return out
+
+
+def reset() -> None:
+    with _lock:
+        _hist.clear()
+
+
+def dump_metrics(path: Optional[str] = None) -> str:
+    """Пишет snapshot() в JSON-файл (по умолчанию CAPYRUN_METRICS_DUMP) и возвращает путь."""
+    path = path or DUMP_PATH
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"ts": time.time(), "pid": os.getpid(), "metrics": snapshot()}, f, ensure_ascii=False, indent=2)
+    return path
+
+
+# ---------- spans ----------
+
+class _Span:
+    __slots__ = ("op", "bytes_in", "bytes_out", "rows_out", "_sentry")
+
+    def __init__(self, op: str):
+        self.op = op
+        self.bytes_in: Optional[int] = None
+        self.bytes_out: Optional[int] = None
+        self.rows_out: Optional[int] = None
+        self._sentry = None
+
+    def set(self, **data: Any) -> None:
+        if "bytes_in" in data:
+            self.bytes_in = data["bytes_in"]
+        if "rows_out" in data:
+            self.rows_out = data["rows_out"]
+        if "bytes_out" in data:
+            self.bytes_out = data["bytes_out"]
+        if self._sentry is not None:
+            for k, v in data.items():
+                self._sentry.set_data(k, v)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **data: Any) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def _sentry_span(op: str, description: Optional[str]):
+    """Дочерний спан, если транзакция уже идёт; иначе — своя транзакция (у Streamlit-ранов её нет)."""
+    if sentry_sdk is None:
+        return None
+    try:
+        if sentry_sdk.get_current_span() is None:
+            return sentry_sdk.start_transaction(op=op, name=description or op)
+        return sentry_sdk.start_span(op=op, description=description or op)
+    except Exception:
+        return None
+
+
+@contextmanager
+def span(op: str, description: Optional[str] = None):
+    """
+    with span("db.fetch_workouts") as sp:
+        ...; sp.set(rows_out=len(df))
+    """
+    if not ENABLED:
+        yield _NOOP
+        return
+    sp = _Span(op)
+    cm = _sentry_span(op, description)
+    if cm is not None:
+        sp._sentry = cm.__enter__()
+    t0 = time.perf_counter()
+    exc = (None, None, None)
+    try:
+        yield sp
+    except BaseException:
+        exc = sys.exc_info()
+        raise
+    finally:
+        dur = time.perf_counter() - t0
+        if cm is not None:
+            try:
+                cm.__exit__(*exc)
+            except Exception:
+                pass
+        record(op, dur, sp.bytes_in, sp.rows_out, sp.bytes_out)
+
+
+def traced(op: str, measure: Optional[Callable[..., Dict[str, Any]]] = None):
+    """
+    Декоратор: спан на весь вызов. measure(result, *args, **kwargs) -> {"bytes_in": ..., "bytes_out": ..., "rows_out": ...}.
+    В выключенном состоянии — просто вызов функции после проверки флага.
+    """
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with span(op, fn.__qualname__) as sp:
+                result = fn(*args, **kwargs)
+                if measure is not None:
+                    try:
+                        sp.set(**measure(result, *args, **kwargs))
+                    except Exception:
+                        pass
+                return result
+        return wrapper
+    return deco
+
+
+def sizeof_upload(f: Any) -> Optional[int]:
+    """Размер загруженного файла/байтов без чтения содержимого."""
+    if isinstance(f, (bytes, bytearray, memoryview)):
+        return len(f)
+    size = getattr(f, "size", None)
+    if isinstance(size, int):
+        return size
+    try:
+        return f.getbuffer().nbytes
+    except Exception:
+        return None
+
+
+# ---------- Streamlit debug panel ----------
+
+def debug_panel_enabled(user_email: Optional[str] = None) -> bool:
+    """
+    Панель показывает данные всех сессий и пишет файлы на сервере — поэтому только по явному разрешению
+    и только вошедшим администраторам (CAPYRUN_ADMIN_EMAILS, через запятую; пустой список — никому).
+    CAPYRUN_DEBUG_PANEL=1 — всегда, =query — только с ?debug=1; без переменной (или 0) — никогда.
+    """
+    mode = os.getenv("CAPYRUN_DEBUG_PANEL", "").strip().lower()
+    if mode in ("", "0"):
+        return False
+    admins = {e.strip().lower() for e in os.getenv("CAPYRUN_ADMIN_EMAILS", "").split(",") if e.strip()}
+    email = (user_email or "").strip().lower()
+    if not email or email not in admins:
+        return False
+    if mode != "query":
+        return True
+    try:
+        import streamlit as st
+        return str(st.query_params.get("debug", "")) == "1"
+    except Exception:
+        return False
+
+
+def render_debug_panel() -> None:
+    """Необязательная панель «⏱ Метрики»: гистограммы горячих путей и состояние пула разбора."""
+    import streamlit as st
+    import pandas as pd
+
+    with st.expander("⏱ Метрики (debug)"):
+        on = st.toggle("Сбор метрик", value=ENABLED, key="dbg_metrics_on")
+        if on != ENABLED:
+            enable(on)
+        snap = snapshot()
+        if snap:
+            st.dataframe(pd.DataFrame.from_dict(snap, orient="index"))
+        else:
+            st.caption("Пока нет измерений.")
+        try:
+            from parse_pool import get_scheduler
+            st.json(get_scheduler().stats())
+        except Exception:
+            pass
+        try:
+            from memory_governor import get_governor
+            st.json(get_governor().stats())
+        except Exception:
+            pass
+        c1, c2 = st.columns(2)
+        if c1.button("💾 Сохранить в JSON", key="dbg_dump"):
+            st.caption(f"Записано: {dump_metrics()}")
+        if c2.button("♻️ Сбросить", key="dbg_reset"):
+            reset()
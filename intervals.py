@@ -0,0 +1,244 @@
+# intervals.py — структура тренировки: разминка / работа / отдых / заминка и метрики по повторам
+#
+# Интенсивность (мощность, а без неё скорость) растягивается в секундный ряд, сглаживается
+# и усредняется блоками по BLOCK_S. На блоках ищем точки смены уровня методом PELT
+# (Killick et al., 2012) со штрафом за сегмент: стоимость отрезка — сумма квадратов отклонений
+# от среднего через кумулятивные суммы, кандидаты на каждом шаге перебираются одним векторным
+# выражением, а отсечение выкидывает те, что уже не могут дать минимум. Уровни сегментов делятся
+# на «работу» и «отдых» порогом, минимизирующим внутриклассовую дисперсию (как у Оцу).
+# Метрики повторов — splits.segment_metrics по номеру отрезка на точку, тем же одним проходом.
+
+from __future__ import annotations
+import re
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from splits import segment_metrics
+
+BLOCK_S = 5           # шаг ряда для поиска смен уровня
+SMOOTH_S = 15         # скользящее среднее секундного ряда перед блоками
+MIN_SEG_S = 30        # короче — не отрезок (шум, светофор)
+MAX_GAP_S = 10        # пауза длиннее схлопывается до 1 с
+MIN_CONTRAST = 0.15   # работа должна быть хотя бы на 15 % интенсивнее отдыха, иначе структуры нет
+
+WARMUP, WORK, RECOVERY, COOLDOWN, STEADY = "warmup", "work", "recovery", "cooldown", "steady"
+
+
+# ---------- ряд ----------
+
+def _intensity(df_rec: pd.DataFrame) -> Tuple[Optional[str], Optional[np.ndarray]]:
+    """Канал интенсивности на точку: мощность, если она есть, иначе скорость."""
+    for ch in ("power", "speed"):
+        if ch in df_rec:
+            x = pd.to_numeric(df_rec[ch], errors="coerce").to_numpy(float)
+            if np.isfinite(x).sum() > 0 and np.nanmax(x) > 0:
+                return ch, np.nan_to_num(x, nan=0.0)
+    return None, None
+
+
+def _per_second(df_rec: pd.DataFrame, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sample-and-hold до секунд (как power.power_1hz). Возвращает (ряд, индекс точки для каждой секунды)."""
+    dt = np.append(pd.to_numeric(df_rec["dt_s"], errors="coerce").to_numpy(float)[1:], 1.0) \
+        if "dt_s" in df_rec else np.ones(len(x))
+    dt = np.nan_to_num(dt, nan=1.0)
+    reps = np.where(dt > MAX_GAP_S, 1, np.clip(np.rint(dt), 1, None)).astype(np.int64)
+    return np.repeat(x, reps), np.repeat(np.arange(len(x)), reps)
+
+
+def _blocks(x1: np.ndarray) -> np.ndarray:
+    c = np.concatenate(([0.0], np.cumsum(x1)))
+    w = min(SMOOTH_S, len(x1))
+    sm = (c[w:] - c[:-w]) / w
+    sm = np.concatenate((np.full(w // 2, sm[0]), sm, np.full(len(x1) - len(sm) - w // 2, sm[-1])))
+    n = len(sm) // BLOCK_S
+    return sm[:n * BLOCK_S].reshape(n, BLOCK_S).mean(axis=1)
+
+
+# ---------- PELT ----------
+
+def pelt(y: np.ndarray, penalty: float, min_size: int = 1) -> np.ndarray:
+    """
+    Точки смены среднего (индексы начала сегментов, без 0) для ряда y. Стоимость отрезка (s, t]:
+    Σy² − (Σy)²/(t − s); F[t] = min_s F[s] + C(s, t) + penalty, кандидаты s с отсечением PELT.
+    """
+    n = len(y)
+    S = np.concatenate(([0.0], np.cumsum(y)))
+    Q = np.concatenate(([0.0], np.cumsum(y * y)))
+    F = np.full(n + 1, np.inf)
+    F[0] = -penalty
+    prev = np.zeros(n + 1, np.int64)
+    R = np.array([0], np.int64)
+    for t in range(min_size, n + 1):
+        cand = R[t - R >= min_size]
+        if len(cand):
+            L = t - cand
+            cost = F[cand] + (Q[t] - Q[cand]) - (S[t] - S[cand]) ** 2 / L
+            j = int(np.argmin(cost))
+            F[t] = cost[j] + penalty
+            prev[t] = cand[j]
+            # отсечение: s, у которых F[s] + C(s, t) уже хуже F[t], не станут оптимальными и дальше
+            keep = np.ones(len(R), bool)
+            keep[t - R >= min_size] = cost <= F[t]
+            R = R[keep]
+        R = np.append(R, t - min_size + 1) if t - min_size + 1 > 0 else R
+    cps, t = [], n
+    while t > 0:
+        t = int(prev[t])
+        if t > 0:
+            cps.append(t)
+    return np.asarray(cps[::-1], np.int64)
+
+
+def _penalty(y: np.ndarray) -> float:
+    """BIC-штраф: σ² по разностям (устойчиво к ступенькам, MAD) × 2·ln n."""
+    d = np.diff(y)
+    sigma = 1.4826 * np.median(np.abs(d - np.median(d))) / np.sqrt(2) if len(d) else 0.0
+    sigma = max(sigma, 0.02 * (np.mean(np.abs(y)) or 1.0))
+    return float(2.0 * sigma ** 2 * np.log(max(len(y), 2)))
+
+
+def _threshold(levels: np.ndarray, weights: np.ndarray) -> float:
+    """Порог работа/отдых: минимум взвешенной внутриклассовой дисперсии по всем разбиениям уровней."""
+    order = np.argsort(levels)
+    v, w = levels[order], weights[order]
+    cw, cs, cq = np.cumsum(w), np.cumsum(w * v), np.cumsum(w * v * v)
+    W, Sm, Qm = cw[-1], cs[-1], cq[-1]
+    lw, ls, lq = cw[:-1], cs[:-1], cq[:-1]
+    rw, rs, rq = W - lw, Sm - ls, Qm - lq
+    within = (lq - ls ** 2 / lw) + (rq - rs ** 2 / rw)
+    i = int(np.argmin(within))
+    return float((v[i] + v[i + 1]) / 2.0)
+
+
+# ---------- структура ----------
+
+def detect_structure(df_rec: pd.DataFrame) -> pd.DataFrame:
+    """
+    Отрезки тренировки: label (warmup/work/recovery/cooldown/steady), rep (номер повтора у work),
+    start_s, end_s (секунды от старта, без пауз), level (средняя интенсивность), channel.
+    """
+    cols = ["label", "rep", "start_s", "end_s", "duration_s", "level", "channel"]
+    if df_rec is None or df_rec.empty:
+        return pd.DataFrame(columns=cols)
+    ch, x = _intensity(df_rec)
+    if ch is None:
+        return pd.DataFrame(columns=cols)
+    x1, _ = _per_second(df_rec, x)
+    if len(x1) < 2 * MIN_SEG_S:
+        return pd.DataFrame(columns=cols)
+    y = _blocks(x1)
+    min_size = max(1, MIN_SEG_S // BLOCK_S)
+    cps = pelt(y, _penalty(y), min_size)
+    edges = np.concatenate(([0], cps, [len(y)]))
+    S = np.concatenate(([0.0], np.cumsum(y)))
+    lengths = np.diff(edges)
+    levels = (S[edges[1:]] - S[edges[:-1]]) / lengths
+
+    work = np.zeros(len(levels), bool)
+    if len(levels) >= 3:
+        thr = _threshold(levels, lengths.astype(float))
+        hi, lo = levels[levels > thr], levels[levels <= thr]
+        if len(hi) and len(lo) and np.average(hi) > (1.0 + MIN_CONTRAST) * np.average(lo):
+            work = levels > thr
+    labels = np.where(work, WORK, RECOVERY).astype(object)
+    if work.any():
+        first, last = np.flatnonzero(work)[[0, -1]]
+        labels[:first] = WARMUP
+        labels[last + 1:] = COOLDOWN
+    else:
+        labels[:] = STEADY
+
+    # соседние отрезки с одной меткой склеиваем (два «отдыха» подряд — один отдых)
+    keep = np.concatenate(([True], labels[1:] != labels[:-1]))
+    starts = edges[:-1][keep]
+    ends = np.append(starts[1:], edges[-1])
+    labels = labels[keep]
+    lv = (S[ends] - S[starts]) / (ends - starts)
+    rep = np.where(labels == WORK, np.cumsum(labels == WORK), 0)
+    start_s, end_s = starts * BLOCK_S, np.minimum(ends * BLOCK_S, len(x1))
+    end_s[-1] = len(x1)
+    return pd.DataFrame({"label": labels, "rep": rep, "start_s": start_s, "end_s": end_s,
+                         "duration_s": end_s - start_s, "level": lv.round(3), "channel": ch})
+
+
+def structure_metrics(df_rec: pd.DataFrame, structure: pd.DataFrame, bounds=None) -> pd.DataFrame:
+    """Метрики каждого отрезка структуры (splits.segment_metrics) рядом с меткой и номером повтора."""
+    if structure.empty:
+        return structure
+    _, x = _intensity(df_rec)
+    _, idx = _per_second(df_rec, x)
+    # секунда начала отрезка → индекс точки; номер отрезка на точку — searchsorted по этим индексам
+    first_rec = idx[np.minimum(structure["start_s"].to_numpy(np.int64), len(idx) - 1)]
+    seg = np.searchsorted(first_rec, np.arange(len(df_rec)), side="right") - 1
+    m = segment_metrics(df_rec, np.clip(seg, 0, None), len(structure), bounds).drop(columns=["segment", "start_s"])
+    return pd.concat([structure.reset_index(drop=True), m], axis=1)
+
+
+def _fmt_dur(s: float) -> str:
+    m, sec = divmod(int(round(s / 15.0) * 15), 60)
+    return f"{m}′" if not sec else (f"{m}′{sec:02d}″" if m else f"{sec}″")
+
+
+def pattern(structure: pd.DataFrame) -> Optional[str]:
+    """Строка вида «6×3′/2′» по медианам длительности повторов и отдыха между ними."""
+    work = structure[structure["label"] == WORK]
+    if work.empty:
+        return None
+    rest = structure[structure["label"] == RECOVERY]
+    out = f"{len(work)}×{_fmt_dur(work['duration_s'].median())}"
+    return out + (f"/{_fmt_dur(rest['duration_s'].median())}" if not rest.empty else "")
+
+
+# ---------- сравнение с планом ----------
+
+_UNITS_S = {"’": 60, "′": 60, "'": 60, "мин": 60, "min": 60, "″": 1, '"': 1, "с": 1, "сек": 1, "s": 1, "sec": 1}
+_UNITS_M = {"м": 1, "m": 1, "км": 1000, "km": 1000}
+_UNIT = r"(мин|min|сек|sec|км|km|[’′'″\"сsмm])?"
+_PLAN_RE = re.compile(r"(\d+)\s*[×xх*]\s*(\d+(?:[.,]\d+)?)\s*" + _UNIT + r"\s*/\s*(\d+(?:[.,]\d+)?)\s*" + _UNIT,
+                      re.IGNORECASE)
+
+
+def parse_plan(text: str) -> Optional[Dict[str, Any]]:
+    """
+    «Intervals Z4 (6×3’/2’)» → {"reps": 6, "work_s": 180, "rest_s": 120}; «5×1000м/90с» → work_m вместо work_s.
+    Без единиц: до 60 — минуты, больше — метры (8×400/200 — отдых тоже трусцой по дистанции).
+    """
+    m = _PLAN_RE.search(text or "")
+    if not m:
+        return None
+    reps, work, wu, rest, ru = m.groups()
+
+    def part(v: str, u: Optional[str]) -> Tuple[str, float]:
+        v, u = float(v.replace(",", ".")), (u or "").lower()
+        if u in _UNITS_M or (not u and v > 60):
+            return "m", v * _UNITS_M.get(u, 1)
+        return "s", v * _UNITS_S.get(u, 60)
+
+    wk, wv = part(work, wu)
+    rk, rv = part(rest, ru)
+    return {"reps": int(reps), f"work_{wk}": wv, f"rest_{rk}": rv}
+
+
+def compare_to_plan(structure: pd.DataFrame, plan: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Сделано против плана: число повторов и медианное отклонение работы/отдыха — в секундах
+    или, для повторов на дистанцию, в метрах (нужна колонка distance_m из structure_metrics).
+    """
+    out: Dict[str, Any] = {"reps_planned": plan["reps"], "pattern": pattern(structure)}
+    target = None
+    for kind, col, unit in (("work", "duration_s", "s"), ("work", "distance_m", "m"),
+                            ("rest", "duration_s", "s"), ("rest", "distance_m", "m")):
+        goal = plan.get(f"{kind}_{unit}")
+        if goal is None or col not in structure:
+            continue
+        label = WORK if kind == "work" else RECOVERY
+        x = structure.loc[structure["label"] == label, col].to_numpy(float)
+        out[f"{kind}_dev_{unit}"] = float(np.median(x - goal)) if len(x) else None
+        if kind == "work":
+            target = (x, goal)
+    out["reps_done"] = int((structure["label"] == WORK).sum())
+    out["match"] = bool(target is not None and out["reps_done"] == plan["reps"] and len(target[0])
+                        and abs(np.median(target[0]) - target[1]) <= 0.2 * target[1])
+    return out
@@ -0,0 +1,222 @@
+# localtime.py — местное время тренировки: смещение от UTC и локальная дата, пачками
+#
+# FIT хранит время в UTC; дата из start_time.date() у вечерней пробежки восточнее Гринвича — уже завтра,
+# а у западнее — ещё вчера (суточный TRIMP в views_multi и local_date в SQL-сводках уезжают на день).
+# Источники смещения по убыванию надёжности:
+#   1) activity.local_timestamp − activity.timestamp из самого FIT (часы знают свой пояс);
+#   2) часовой пояс по первому GPS-фиксу: timezonefinder (офлайн-индекс полигонов) на сетке GRID_DEG°,
+#      ячейка → имя пояса кэшируется, смещение на момент старта (с учётом летнего времени) — zoneinfo;
+#   3) при бэкфилле истории — самое частое известное смещение пользователя.
+# Всё векторно: уникальные ячейки и уникальные пояса считаются один раз на пачку, не на тренировку.
+# timezonefinder — необязательная зависимость; без неё работают 1) и 3).
+
+from __future__ import annotations
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from gps import track_arrays, semicircles_to_deg
+
+# --- офлайн-индекс часовых поясов (optional) ---
+try:
+    from timezonefinder import TimezoneFinder  # type: ignore
+except Exception:
+    TimezoneFinder = None
+
+OFFSET_STEP_S = 15 * 60          # пояса кратны 15 мин; разницу часов и записи округляем до шага
+MAX_OFFSET_S = 14 * 3600
+GRID_DEG = 0.1                   # ячейка кэша поясов ≈ 11 км: граница пояса внутри ячейки — редкость
+BACKFILL_BATCH = 1000
+
+_finder = None
+
+
+def _tz_finder():
+    global _finder
+    if _finder is None and TimezoneFinder is not None:
+        _finder = TimezoneFinder(in_memory=True)
+    return _finder
+
+
+def _utc_index(t) -> pd.DatetimeIndex:
+    """Время в UTC без пояса; naive считаем UTC (так его отдают fitparse и ingest)."""
+    idx = pd.to_datetime(list(t), errors="coerce", utc=True, format="mixed")
+    return pd.DatetimeIndex(idx).tz_localize(None)
+
+
+def _round_offsets(off_s) -> np.ndarray:
+    off = np.asarray(off_s, dtype=float)
+    off = np.round(off / OFFSET_STEP_S) * OFFSET_STEP_S
+    off[np.abs(off) > MAX_OFFSET_S] = np.nan
+    return off
+
+
+def fit_offset(timestamp, local_timestamp) -> Optional[int]:
+    """Смещение (с) из сообщения activity: local_timestamp − timestamp, округлённо до 15 мин; None — нет данных."""
+    if timestamp is None or local_timestamp is None:
+        return None
+    t = _utc_index([timestamp, local_timestamp])
+    if t.isna().any():
+        return None
+    off = _round_offsets([(t[1] - t[0]).total_seconds()])[0]
+    return int(off) if np.isfinite(off) else None
+
+
+@lru_cache(maxsize=65536)
+def _cell_tz(i: int, j: int) -> Optional[str]:
+    finder = _tz_finder()
+    if finder is None:
+        return None
+    lat, lon = (i + 0.5) * GRID_DEG, (j + 0.5) * GRID_DEG
+    return finder.timezone_at(lng=lon, lat=lat) or finder.certain_timezone_at(lng=lon, lat=lat)
+
+
+def tz_names(lat_deg, lon_deg) -> np.ndarray:
+    """Имена поясов для координат (object-массив, None — нет координат/индекса); поиск — раз на ячейку сетки."""
+    lat = np.asarray(lat_deg, dtype=float)
+    lon = np.asarray(lon_deg, dtype=float)
+    out = np.full(lat.shape, None, dtype=object)
+    ok = np.isfinite(lat) & np.isfinite(lon) & ((lat != 0) | (lon != 0))
+    if not ok.any() or _tz_finder() is None:
+        return out
+    cells = np.stack([np.floor(lat[ok] / GRID_DEG), np.floor(lon[ok] / GRID_DEG)], axis=1).astype(np.int64)
+    uniq, inv = np.unique(cells, axis=0, return_inverse=True)
+    names = np.array([_cell_tz(int(i), int(j)) for i, j in uniq], dtype=object)
+    out[ok] = names[inv.ravel()]
+    return out
+
+
+def tz_offsets(t_utc, names) -> np.ndarray:
+    """Смещения (с, float; NaN — неизвестно) для моментов UTC в поясах names; один tz_convert на пояс."""
+    t = _utc_index(t_utc)
+    names = np.asarray(names, dtype=object)
+    out = np.full(len(t), np.nan)
+    valid = ~np.asarray(t.isna()) & np.array([isinstance(n, str) for n in names], dtype=bool)
+    for tz in pd.unique(names[valid]):
+        m = valid & (names == tz)
+        try:
+            loc = t[m].tz_localize("UTC").tz_convert(tz).tz_localize(None)
+        except Exception:
+            continue
+        out[m] = (loc - t[m]).total_seconds()
+    return out
+
+
+def gps_offsets(t_utc, lat_deg, lon_deg) -> np.ndarray:
+    """Смещения по первому фиксу каждой тренировки (массивы одинаковой длины)."""
+    return tz_offsets(t_utc, tz_names(lat_deg, lon_deg))
+
+
+def local_dates(t_utc, offsets_s) -> List[Optional[Any]]:
+    """Локальные даты (datetime.date; None — нет времени); неизвестное смещение — дата по UTC."""
+    t = _utc_index(t_utc)
+    off = np.nan_to_num(np.asarray(offsets_s, dtype=float), nan=0.0)
+    loc = (t + pd.to_timedelta(off, unit="s")).normalize()
+    return [None if pd.isna(d) else d.date() for d in loc]
+
+
+def first_fix_deg(df_rec: pd.DataFrame):
+    """(lat, lon) первой точки с GPS в градусах или (nan, nan)."""
+    lat, lon, _ = track_arrays(df_rec)
+    if not len(lat):
+        return np.nan, np.nan
+    return float(semicircles_to_deg(lat[0])), float(semicircles_to_deg(lon[0]))
+
+
+def resolve_offset(start_time, utc_offset_s: Optional[int] = None,
+                   df_rec: Optional[pd.DataFrame] = None) -> Optional[int]:
+    """Смещение одной тренировки: из FIT, иначе по первому GPS-фиксу; None — не определить."""
+    if utc_offset_s is not None:
+        return int(utc_offset_s)
+    if start_time is None or df_rec is None or df_rec.empty:
+        return None
+    lat, lon = first_fix_deg(df_rec)
+    off = gps_offsets([start_time], [lat], [lon])[0]
+    return int(off) if np.isfinite(off) else None
+
+
+def _guess_missing(off: np.ndarray) -> np.ndarray:
+    """Неизвестные смещения (NaN) → самое частое известное в пачке; если известных нет — как было."""
+    rest = ~np.isfinite(off)
+    if not rest.any() or rest.all():
+        return off
+    vals, counts = np.unique(off[~rest], return_counts=True)
+    out = off.copy()
+    out[rest] = vals[np.argmax(counts)]
+    return out
+
+
+def apply_to_summaries(summaries: Sequence[Dict[str, Any]]) -> None:
+    """
+    Пачка сводок на месте: date/local_date — по utc_offset_s; у сводок без смещения (GPX без GPS-индекса)
+    — по самому частому смещению пачки. Угаданное смещение в utc_offset_s не пишем.
+    """
+    if not summaries:
+        return
+    off = np.array([np.nan if s.get("utc_offset_s") is None else float(s["utc_offset_s"]) for s in summaries])
+    dates = local_dates([s.get("start_time") for s in summaries], _guess_missing(off))
+    for s, d in zip(summaries, dates):
+        s["local_date"] = d
+        s["date"] = d
+
+
+def backfill_local_dates(supabase, user_id: str, batch: int = BACKFILL_BATCH) -> Dict[str, int]:
+    """
+    Пересчитать local_date всей истории пользователя: узкие страницы (id, start_time, local_date, utc_offset_s),
+    bbox треков одним запросом для тренировок без смещения, затем пачки изменений через update_workout_local_dates.
+    Угаданное по привычному поясу смещение в utc_offset_s не пишем — только дату.
+    """
+    from db import fetch_local_time_rows, fetch_tracks, update_workout_local_dates
+
+    rows: List[Dict[str, Any]] = []
+    after = None
+    while True:
+        page = fetch_local_time_rows(supabase, user_id, after=after, limit=batch)
+        rows.extend(page)
+        if len(page) < batch:
+            break
+        after = page[-1]["id"]
+    rows = [r for r in rows if r.get("start_time")]
+    stats = {"total": len(rows), "known": 0, "from_gps": 0, "guessed": 0, "updated": 0}
+    if not rows:
+        return stats
+
+    ids = np.array([str(r["id"]) for r in rows], dtype=object)
+    t = [r["start_time"] for r in rows]
+    off = np.array([np.nan if r.get("utc_offset_s") is None else float(r["utc_offset_s"]) for r in rows])
+    known = np.isfinite(off)
+    stats["known"] = int(known.sum())
+
+    gps = np.zeros(len(rows), dtype=bool)
+    if (~known).any() and _tz_finder() is not None:
+        # первый фикс из workouts заранее не известен — центр bbox трека (для пояса этого хватает)
+        tracks = {str(tr["workout_id"]): tr for tr in fetch_tracks(supabase, user_id, list(ids[~known]))}
+        lat = np.full(len(rows), np.nan)
+        lon = np.full(len(rows), np.nan)
+        for k in np.flatnonzero(~known):
+            tr = tracks.get(ids[k])
+            if tr and tr.get("min_lat") is not None:
+                lat[k] = (float(tr["min_lat"]) + float(tr["max_lat"])) / 2.0
+                lon[k] = (float(tr["min_lon"]) + float(tr["max_lon"])) / 2.0
+        got = gps_offsets(t, lat, lon)
+        gps = ~known & np.isfinite(got)
+        off[gps] = got[gps]
+        stats["from_gps"] = int(gps.sum())
+
+    store = off
+    off = _guess_missing(off)
+    stats["guessed"] = int(np.isfinite(off).sum() - np.isfinite(store).sum())
+
+    dates = local_dates(t, off)
+    out = []
+    for k, r in enumerate(rows):
+        d = dates[k].isoformat() if dates[k] is not None else None
+        o = int(store[k]) if np.isfinite(store[k]) else None
+        if d != (str(r.get("local_date"))[:10] if r.get("local_date") else None) or (gps[k] and o is not None):
+            out.append({"id": r["id"], "local_date": d, "utc_offset_s": o})
+    for i in range(0, len(out), batch):
+        update_workout_local_dates(supabase, out[i:i + batch])
+    stats["updated"] = len(out)
+    return stats
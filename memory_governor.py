@@ -0,0 +1,385 @@
+# memory_governor.py — учёт памяти разобранных тренировок по сессиям, сброс холодных кадров на диск
+#
+# Каждая сессия Streamlit держит df_rec/df_laps/… своих тренировок (и представления для таблицы точек).
+# При сотне пользователей на одном сервере RSS растёт до OOM. Здесь — общий для процесса реестр:
+#   • put/get по (сессия, ключ); размер считается по DataFrame'ам значения (memory_usage(deep=True));
+#   • сверх бюджета (на сессию и общего) самые давно не трогавшиеся записи уходят на диск:
+#     числовые колонки — .npy, обратно читаются через np.load(mmap_mode="c") — страницы в page cache,
+#     ОС вытеснит их сама, запись в такой кадр не трогает файл; прочее — pickle;
+#   • записи, которые дешевле пересчитать (spill=False), при нехватке просто выбрасываются;
+#   • сессии, простоявшие дольше IDLE_TTL_S, удаляются целиком вместе с файлами;
+#   • stats() — цифры для панели метрик (instrument.render_debug_panel).
+# get() для сброшенной записи возвращает те же объекты, но колонки — memmap: для вызывающего прозрачно.
+# Поднятое с диска значение остаётся на записи (и снова учитывается в бюджете), файл не удаляется:
+# повторные рендеры не читают диск, а повторное вытеснение — просто отпустить ссылку, без записи.
+# Изменения такого значения на месте при вытеснении теряются — как и раньше у сброшенных записей.
+#
+# Лок реестра общий для всех сессий, поэтому диск под ним не трогаем: жертва выбирается и помечается
+# (spilling) под локом, пишется без него, путь фиксируется снова под локом — если запись за это время
+# заменили или удалили, написанное просто стирается. Удаление файлов (discard, замена в put, сброс
+# сессии и sweep) так же: пути собираются под локом, rmtree — после него.
+
+from __future__ import annotations
+import os
+import time
+import uuid
+import pickle
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from instrument import record
+
+# --- Streamlit script context (optional) ---
+try:
+    from streamlit.runtime.scriptrunner import get_script_run_ctx  # type: ignore
+except Exception:
+    get_script_run_ctx = None
+
+BUDGET_MB = int(os.getenv("CAPYRUN_MEM_BUDGET_MB", "1024"))
+SESSION_BUDGET_MB = int(os.getenv("CAPYRUN_MEM_SESSION_MB", "256"))
+IDLE_TTL_S = float(os.getenv("CAPYRUN_MEM_IDLE_TTL_S", "1800"))
+SPILL_DIR = os.getenv("CAPYRUN_SPILL_DIR") or os.path.join(tempfile.gettempdir(), "capyrun_spill")
+SWEEP_EVERY_S = 30.0
+SPILL_MIN_ROWS = 1000       # короткие кадры (круги, сессия) проще держать в одном pickle
+_OTHER_BYTES = 4096         # оценка для не-DataFrame частей значения (summary и т.п.)
+
+
+def session_id() -> str:
+    """Идентификатор текущей сессии Streamlit ("local" — вне сервера)."""
+    ctx = get_script_run_ctx() if get_script_run_ctx is not None else None
+    return str(getattr(ctx, "session_id", None) or "local")
+
+
+def _parts(value: Any) -> Tuple[bool, List[Any]]:
+    if isinstance(value, (tuple, list)):
+        return True, list(value)
+    return False, [value]
+
+
+def value_nbytes(value: Any) -> int:
+    """Байты значения: DataFrame'ы — memory_usage(deep=True), прочие части — условная константа."""
+    n = 0
+    for p in _parts(value)[1]:
+        if isinstance(p, pd.DataFrame):
+            n += int(p.memory_usage(index=True, deep=True).sum())
+        elif isinstance(p, np.ndarray):
+            n += int(p.nbytes)
+        elif hasattr(p, "nbytes"):
+            n += int(p.nbytes)
+        else:
+            n += _OTHER_BYTES
+    return n
+
+
+# ---------- spill / rehydrate ----------
+
+def _spill_frame(df: pd.DataFrame, path: str) -> Dict[str, Any]:
+    cols = []
+    for i, c in enumerate(df.columns):
+        s = df[c]
+        dtype = s.dtype
+        if isinstance(dtype, np.dtype) and dtype.kind in "biufcmM":
+            f = os.path.join(path, f"c{i}.npy")
+            np.save(f, s.to_numpy(), allow_pickle=False)
+            cols.append((c, "npy", f))
+        elif isinstance(s.array, (pd.arrays.IntegerArray, pd.arrays.FloatingArray)):
+            fd, fm = os.path.join(path, f"c{i}.npy"), os.path.join(path, f"c{i}.mask.npy")
+            np.save(fd, s.to_numpy(dtype=dtype.numpy_dtype, na_value=0), allow_pickle=False)
+            np.save(fm, s.isna().to_numpy(), allow_pickle=False)
+            cols.append((c, "masked", (fd, fm)))
+        else:
+            cols.append((c, "obj", s.to_numpy()))
+    return {"cols": cols, "index": df.index, "attrs": dict(df.attrs)}
+
+
+def _mmap(path: str) -> np.ndarray:
+    # обычный ndarray поверх отображения (без подкласса memmap — он иногда «протекает» в результаты)
+    return np.asarray(np.load(path, mmap_mode="c"))
+
+
+def _load_frame(meta: Dict[str, Any]) -> pd.DataFrame:
+    data = {}
+    for c, kind, ref in meta["cols"]:
+        if kind == "npy":
+            data[c] = _mmap(ref)
+        elif kind == "masked":
+            values, mask = _mmap(ref[0]), _mmap(ref[1])
+            arr_cls = pd.arrays.IntegerArray if values.dtype.kind in "iu" else pd.arrays.FloatingArray
+            data[c] = arr_cls(values, mask, copy=False)
+        else:
+            data[c] = ref
+    df = pd.DataFrame(data, index=meta["index"], copy=False)
+    df.attrs.update(meta["attrs"])
+    return df
+
+
+def spill_value(value: Any, path: str) -> int:
+    """Пишет значение в каталог path; возвращает байты на диске."""
+    os.makedirs(path, exist_ok=True)
+    seq, parts = _parts(value)
+    layout = []
+    for p in parts:
+        if isinstance(p, pd.DataFrame) and len(p) >= SPILL_MIN_ROWS:
+            layout.append(("frame", _spill_frame(p, path)))
+        else:
+            layout.append(("raw", p))
+    with open(os.path.join(path, "meta.pkl"), "wb") as f:
+        pickle.dump({"seq": seq, "tuple": isinstance(value, tuple), "layout": layout}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+
+
+def load_value(path: str) -> Any:
+    with open(os.path.join(path, "meta.pkl"), "rb") as f:
+        meta = pickle.load(f)
+    parts = [_load_frame(x) if kind == "frame" else x for kind, x in meta["layout"]]
+    if not meta["seq"]:
+        return parts[0]
+    return tuple(parts) if meta["tuple"] else parts
+
+
+# ---------- реестр ----------
+
+@dataclass
+class _Entry:
+    value: Any                    # None, если сброшено на диск
+    nbytes: int
+    spill: bool                   # False — при нехватке выбрасываем, а не пишем на диск
+    path: Optional[str] = None    # копия на диске; при value is not None — поднятая обратно
+    disk_bytes: int = 0
+    spilling: bool = False        # идёт запись на диск (вне лока) — второй раз не выбираем
+
+
+class MemoryGovernor:
+    """(сессия, ключ) → значение; LRU внутри сессии, бюджет на сессию и на процесс, TTL простоя сессий."""
+
+    def __init__(self, budget_mb: int = BUDGET_MB, session_budget_mb: int = SESSION_BUDGET_MB,
+                 idle_ttl_s: float = IDLE_TTL_S, spill_dir: str = SPILL_DIR):
+        self.budget = budget_mb * 1024 * 1024
+        self.session_budget = session_budget_mb * 1024 * 1024
+        self.idle_ttl_s = idle_ttl_s
+        self.spill_dir = os.path.join(spill_dir, f"p{os.getpid()}")
+        self._sessions: Dict[str, "OrderedDict[Hashable, _Entry]"] = {}
+        self._seen: Dict[str, float] = {}
+        self._lock = threading.RLock()
+        self._last_sweep = 0.0
+        self.counters = {"spills": 0, "rehydrates": 0, "drops": 0, "evicted_sessions": 0}
+
+    # --- public ---
+
+    def put(self, session: str, key: Hashable, value: Any, spill: bool = True) -> Any:
+        entry = _Entry(value, value_nbytes(value), spill)
+        with self._lock:
+            entries = self._sessions.setdefault(session, OrderedDict())
+            old = entries.pop(key, None)
+            entries[key] = entry
+            self._seen[session] = time.monotonic()
+        _remove_paths([old.path] if old is not None else [])
+        self._enforce(session, protect=(session, key))
+        return value
+
+    def get(self, session: str, key: Hashable) -> Any:
+        self._maybe_sweep()
+        with self._lock:
+            entries = self._sessions.get(session)
+            entry = entries.get(key) if entries else None
+            self._seen[session] = time.monotonic()
+            if entry is None:
+                return None
+            entries.move_to_end(key)
+            if entry.value is not None:
+                return entry.value
+            path = entry.path
+        t0 = time.perf_counter()
+        try:
+            value = load_value(path)
+        except Exception:
+            # файл пропал (чистка /tmp) — считаем промахом, вызывающий пересчитает
+            self.discard(session, key)
+            return None
+        record("mem.rehydrate", time.perf_counter() - t0, bytes_in=entry.disk_bytes)
+        with self._lock:
+            self.counters["rehydrates"] += 1
+            if (self._sessions.get(session) or {}).get(key) is not entry:
+                return value            # запись заменили/удалили, пока читали — не кэшируем
+            if entry.value is not None:
+                return entry.value      # другой поток уже поднял — отдаём общий объект
+            entry.value = value
+        self._enforce(session, protect=(session, key))
+        return value
+
+    def get_or_create(self, session: str, key: Hashable, make, spill: bool = True) -> Any:
+        value = self.get(session, key)
+        if value is None:
+            value = self.put(session, key, make(), spill=spill)
+        return value
+
+    def discard(self, session: str, key: Hashable) -> None:
+        with self._lock:
+            entry = (self._sessions.get(session) or {}).pop(key, None)
+        _remove_paths([entry.path] if entry is not None else [])
+
+    def drop_session(self, session: str) -> None:
+        with self._lock:
+            paths = self._pop_session_locked(session)
+        _remove_paths(paths, os.path.join(self.spill_dir, _safe(session)))
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Удаляет сессии, простоявшие дольше idle_ttl_s; возвращает их число."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            idle = [s for s, t in self._seen.items() if now - t > self.idle_ttl_s]
+            paths = {s: self._pop_session_locked(s) for s in idle}
+            self.counters["evicted_sessions"] += len(idle)
+            self._last_sweep = now
+        for s, p in paths.items():
+            _remove_paths(p, os.path.join(self.spill_dir, _safe(s)))
+        return len(idle)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            sessions = {}
+            for s, entries in self._sessions.items():
+                sessions[s] = {
+                    "entries": len(entries),
+                    "resident_mb": round(sum(e.nbytes for e in entries.values() if e.value is not None) / 2**20, 1),
+                    "spilled_mb": round(sum(e.disk_bytes for e in entries.values() if e.value is None) / 2**20, 1),
+                    "idle_s": round(now - self._seen.get(s, now)),
+                }
+            return {
+                "resident_mb": round(self._resident() / 2**20, 1),
+                "spilled_mb": round(sum(x["spilled_mb"] for x in sessions.values()), 1),
+                "budget_mb": round(self.budget / 2**20),
+                "session_budget_mb": round(self.session_budget / 2**20),
+                "sessions": len(sessions),
+                "rss_mb": _rss_mb(),
+                **self.counters,
+                "per_session": sessions,
+            }
+
+    # --- internals ---
+
+    def _resident(self, session: Optional[str] = None) -> int:
+        # уходящие на диск уже не считаем — иначе параллельный _enforce вытеснит лишнее
+        groups = [self._sessions.get(session) or {}] if session is not None else self._sessions.values()
+        return sum(e.nbytes for entries in groups for e in entries.values()
+                   if e.value is not None and not e.spilling)
+
+    def _pop_session_locked(self, session: str) -> List[str]:
+        """Под локом: забыть сессию; возвращает пути её файлов — удалять уже без лока."""
+        entries = self._sessions.pop(session, None) or {}
+        self._seen.pop(session, None)
+        return [e.path for e in entries.values() if e.path]
+
+    def _maybe_sweep(self) -> None:
+        """Вызывать без лока: sweep удаляет файлы после того, как отпустит его."""
+        if time.monotonic() - self._last_sweep > SWEEP_EVERY_S:
+            self.sweep()
+
+    def _enforce(self, session: str, protect: Tuple[str, Hashable]) -> None:
+        """Вытесняет до укладки в бюджеты; вызывать без лока — запись на диск идёт вне его."""
+        self._maybe_sweep()
+        while True:
+            with self._lock:
+                victim = self._pick_victim(session, protect)
+            if victim is None:
+                return
+            self._spill(*victim)
+
+    def _candidates(self, session: str) -> List[Tuple[str, Hashable]]:
+        groups = []
+        # сначала бюджет сессии — её же холодные записи
+        if self._resident(session) > self.session_budget:
+            groups += [(session, k) for k in self._sessions.get(session, {})]
+        # потом общий: самые холодные сессии первыми, внутри — LRU
+        if self._resident() > self.budget:
+            order = sorted(self._sessions, key=lambda s: self._seen.get(s, 0.0))
+            groups += [(s, k) for s in order for k in self._sessions[s]]
+        return groups
+
+    def _pick_victim(self, session: str, protect) -> Optional[Tuple[str, Hashable, _Entry, str]]:
+        """
+        Под локом: вытесняет без записи всё, что можно (spill=False — выбросить, уже есть на диске —
+        отпустить значение), пока бюджеты не сойдутся. Запись, которую надо писать, помечает spilling
+        и возвращает (сессия, ключ, запись, путь); None — укладываемся или вытеснять нечего.
+        """
+        while True:
+            for s, k in self._candidates(session):
+                e = self._sessions[s][k]
+                if e.value is None or e.spilling or (s, k) == protect:
+                    continue
+                if not e.spill:
+                    del self._sessions[s][k]
+                    self.counters["drops"] += 1
+                elif e.path:
+                    e.value = None
+                else:
+                    e.spilling = True
+                    return s, k, e, os.path.join(self.spill_dir, _safe(s), uuid.uuid4().hex)
+                break
+            else:
+                return None
+
+    def _spill(self, s: str, k: Hashable, e: _Entry, path: str) -> None:
+        """Пишет значение жертвы вне лока, затем под локом фиксирует путь (или убирает за собой)."""
+        t0 = time.perf_counter()
+        try:
+            disk_bytes = spill_value(e.value, path)
+        except Exception:
+            disk_bytes = None
+        with self._lock:
+            e.spilling = False
+            # запись заменили, удалили или сбросили сессию, пока писали, — файл не нужен
+            stale = (self._sessions.get(s) or {}).get(k) is not e
+            if not stale and disk_bytes is None:
+                # диск недоступен — лучше потерять кэш, чем процесс
+                del self._sessions[s][k]
+                self.counters["drops"] += 1
+            elif not stale:
+                e.path, e.disk_bytes, e.value = path, disk_bytes, None
+                self.counters["spills"] += 1
+        if stale or disk_bytes is None:
+            _remove_paths([path])
+            return
+        record("mem.spill", time.perf_counter() - t0, bytes_out=disk_bytes)
+
+
+def _remove_paths(paths: List[str], session_dir: Optional[str] = None) -> None:
+    """Удаление файлов записей — всегда вне лока реестра. Каталог сессии — только если он уже пуст:
+    параллельный put той же сессии мог начать туда писать."""
+    for p in paths:
+        if p:
+            shutil.rmtree(p, ignore_errors=True)
+    if session_dir:
+        try:
+            os.rmdir(session_dir)
+        except OSError:
+            pass
+
+
+def _safe(session: str) -> str:
+    return "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in session)[:64] or "anon"
+
+
+def _rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except Exception:
+        return None
+
+
+@st.cache_resource(show_spinner=False)
+def get_governor() -> MemoryGovernor:
+    """Один реестр на процесс Streamlit (общий для всех сессий)."""
+    gov = MemoryGovernor()
+    shutil.rmtree(gov.spill_dir, ignore_errors=True)
+    return gov
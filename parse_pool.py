@@ -0,0 +1,346 @@
+# parse_pool.py — общий для всего процесса Streamlit пул разбора файлов с честной очередью по пользователям
+#
+# Все сессии отдают файлы в один ProcessPoolExecutor. Очередь — по пользователю (round-robin),
+# одновременно в работе не больше max_in_flight файлов, у каждого файла таймаут и лимит памяти
+# (ставятся внутри процесса-воркера). Контракт результата — как у parse_fit_file.
+# Процессы пула стартуют из forkserver (или spawn), а не fork: fork многопоточного сервера наследует
+# всё его адресное пространство (~1 ГБ VmSize до любых сессий), и лимит RLIMIT_AS почти не оставлял
+# запаса. Дочерний процесс импортирует только ingest (разбор) — код воркера лежит там.
+
+from __future__ import annotations
+import os
+import time
+import uuid
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+import streamlit as st
+
+from ingest import iter_members, limit_memory, parse_payload_timed
+from instrument import record
+
+MAX_WORKERS = int(os.getenv("CAPYRUN_PARSE_WORKERS", "0")) or max(1, (os.cpu_count() or 2) - 1)
+MAX_IN_FLIGHT = int(os.getenv("CAPYRUN_PARSE_IN_FLIGHT", "0")) or 2 * MAX_WORKERS
+JOB_TIMEOUT_S = float(os.getenv("CAPYRUN_PARSE_TIMEOUT_S", "90"))
+MEM_LIMIT_MB = int(os.getenv("CAPYRUN_PARSE_MEM_MB", "2048"))
+MAX_FILE_MB = int(os.getenv("CAPYRUN_PARSE_MAX_FILE_MB", "64"))
+MAX_QUEUED_PER_USER = int(os.getenv("CAPYRUN_PARSE_MAX_QUEUED", "200"))
+# файлов одной загрузки в очереди одновременно: остальные члены архива ждут (и не держат байты в памяти)
+UPLOAD_WINDOW = min(int(os.getenv("CAPYRUN_PARSE_WINDOW", "0")) or 2 * MAX_IN_FLIGHT, MAX_QUEUED_PER_USER)
+RESULT_TTL_S = 600  # результаты, которые никто не забрал (сессия ушла), выбрасываем
+POLL_S = 0.25
+
+
+# ---------- worker side ----------
+
+def _mp_context():
+    """forkserver (POSIX) или spawn: процессы пула не наследуют память и потоки сервера."""
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    ctx = multiprocessing.get_context(method)
+    if method == "forkserver":
+        ctx.set_forkserver_preload(["ingest"])   # форки сервера уже с numpy/pandas/fitparse
+    return ctx
+
+
+# ---------- scheduler ----------
+
+class QueueFull(RuntimeError):
+    """У пользователя уже MAX_QUEUED_PER_USER файлов в очереди."""
+
+
+class _Job:
+    __slots__ = ("id", "user", "name", "args", "future", "pool", "size", "submitted", "started", "finished",
+                 "result", "error")
+
+    def __init__(self, user: str, name: str, args: tuple):
+        self.id = uuid.uuid4().hex
+        self.user = user
+        self.name = name
+        self.args = args
+        self.size = len(args[1])
+        self.future = None
+        self.pool = None
+        self.submitted = time.perf_counter()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.result = None
+        self.error: Optional[str] = None
+
+
+class ParseScheduler:
+    """Процессный пул + честная очередь: каждый пользователь получает слот по очереди, независимо от числа файлов."""
+
+    def __init__(
+        self,
+        max_workers: int = MAX_WORKERS,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        job_timeout_s: float = JOB_TIMEOUT_S,
+        mem_limit_mb: int = MEM_LIMIT_MB,
+    ):
+        self.max_in_flight = max(1, max_in_flight)
+        self.job_timeout_s = job_timeout_s
+        self._pool_args = dict(max_workers=max_workers, mp_context=_mp_context(),
+                               initializer=limit_memory, initargs=(mem_limit_mb,))
+        self.pool = ProcessPoolExecutor(**self._pool_args)
+        self._restarts = 0
+        self._lock = threading.RLock()  # done-callback может сработать прямо внутри submit
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._jobs: Dict[str, _Job] = {}
+        self._in_flight = 0
+        self._lat = deque(maxlen=4096)  # (wait_s, run_s)
+        self._rejected = 0
+
+    # --- submit / dispatch ---
+    def submit(self, user_id: str, name: str, data: bytes, hr_rest: int, hr_max: int,
+               ftp: Optional[int] = None) -> str:
+        if len(data) > MAX_FILE_MB * 1024 * 1024:
+            raise ValueError(f"Файл больше {MAX_FILE_MB} МБ.")
+        job = _Job(str(user_id or "anon"), name, (name, data, int(hr_rest), int(hr_max), self.job_timeout_s,
+                                                  int(ftp) if ftp else None))
+        with self._lock:
+            q = self._queues.setdefault(job.user, deque())
+            if len(q) >= MAX_QUEUED_PER_USER:
+                self._rejected += 1
+                raise QueueFull("Слишком много файлов в очереди — дождись окончания разбора.")
+            q.append(job)
+            self._jobs[job.id] = job
+            self._purge_locked()
+            self._dispatch_locked()
+        return job.id
+
+    def _dispatch_locked(self) -> None:
+        while self._in_flight < self.max_in_flight and self._queues:
+            user, q = next(iter(self._queues.items()))
+            job = q.popleft()
+            # пользователь уходит в конец очереди (round-robin); пустая очередь удаляется
+            self._queues.move_to_end(user)
+            if not q:
+                del self._queues[user]
+            job.started = time.perf_counter()
+            self._in_flight += 1
+            try:
+                job.pool, job.future = self.pool, self.pool.submit(parse_payload_timed, *job.args)
+            except (BrokenProcessPool, RuntimeError):
+                # пул сломан (процесс убит ОС) — новый пул и ещё одна попытка; вторая неудача — ошибка файла
+                self._replace_pool_locked(self.pool)
+                try:
+                    job.pool, job.future = self.pool, self.pool.submit(parse_payload_timed, *job.args)
+                except Exception as e:
+                    self._in_flight -= 1
+                    job.args = None
+                    job.error = f"Пул разбора недоступен: {e}"
+                    job.finished = time.perf_counter()
+                    continue
+            job.args = None  # байты файла больше не держим
+            job.future.add_done_callback(lambda f, j=job: self._on_done(j, f))
+
+    def _replace_pool_locked(self, broken: ProcessPoolExecutor) -> None:
+        """Пересоздать сломанный пул (один раз на пул: остальные упавшие джобы видят уже новый)."""
+        if self.pool is not broken:
+            return
+        try:
+            broken.shutdown(wait=False, cancel_futures=True)
+        except Exception:
+            pass
+        self.pool = ProcessPoolExecutor(**self._pool_args)
+        self._restarts += 1
+
+    def _purge_locked(self) -> None:
+        now = time.perf_counter()
+        stale = [k for k, j in self._jobs.items() if j.finished is not None and now - j.finished > RESULT_TTL_S]
+        for k in stale:
+            del self._jobs[k]
+
+    def _on_done(self, job: _Job, fut) -> None:
+        broken = False
+        try:
+            job.result = fut.result()
+        except BrokenProcessPool:
+            broken = True
+            job.error = "Процесс разбора завершился аварийно — загрузи файл ещё раз."
+        except Exception as e:
+            job.error = str(e) or e.__class__.__name__
+        job.finished = time.perf_counter()
+        # сам parse_fit_file идёт в дочернем процессе — его время и объём пишем здесь, в процессе сервера
+        record("parse.pool", job.finished - job.started, job.size,
+               len(job.result[0]) if job.result is not None else None)
+        with self._lock:
+            self._in_flight -= 1
+            if broken:
+                self._replace_pool_locked(job.pool)
+            self._lat.append((job.started - job.submitted, job.finished - job.started))
+            self._dispatch_locked()
+
+    # --- status ---
+    def position(self, job_id: str) -> int:
+        """Сколько файлов будет взято в работу раньше этого (0 — уже разбирается или готов)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.started is not None:
+                return 0
+            q = self._queues.get(job.user)
+            if q is None:
+                return 0
+            k = q.index(job)
+            ahead = 0
+            before = True
+            for user, other in self._queues.items():
+                if user == job.user:
+                    before = False
+                    ahead += k
+                    continue
+                ahead += min(len(other), k + (1 if before else 0))
+            return ahead
+
+    def is_done(self, job_id: str) -> bool:
+        job = self._jobs.get(job_id)
+        return job is None or job.finished is not None
+
+    def pop_result(self, job_id: str):
+        """Забирает результат готового файла (или бросает ошибку разбора) и забывает о джобе."""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is None:
+            raise KeyError(job_id)
+        if job.error:
+            raise RuntimeError(job.error)
+        return job.result
+
+    def cancel(self, job_id: str) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.started is not None:
+                return
+            q = self._queues.get(job.user)
+            if q is not None and job in q:
+                q.remove(job)
+                if not q:
+                    del self._queues[job.user]
+            self._jobs.pop(job_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Очередь и хвостовые задержки (ожидание в очереди и сам разбор), сек."""
+        with self._lock:
+            lat = np.array(self._lat, dtype=float).reshape(-1, 2)
+            out: Dict[str, Any] = {
+                "queued": sum(len(q) for q in self._queues.values()),
+                "users_waiting": len(self._queues),
+                "in_flight": self._in_flight,
+                "rejected": self._rejected,
+                "pool_restarts": self._restarts,
+                "completed": int(len(lat)),
+            }
+        if len(lat):
+            total = lat.sum(axis=1)
+            for label, col in (("wait", lat[:, 0]), ("run", lat[:, 1]), ("total", total)):
+                p50, p95, p99 = np.percentile(col, [50, 95, 99])
+                out[f"{label}_p50"], out[f"{label}_p95"], out[f"{label}_p99"] = (
+                    round(float(p50), 3), round(float(p95), 3), round(float(p99), 3))
+        return out
+
+
+@st.cache_resource(show_spinner=False)
+def get_scheduler() -> ParseScheduler:
+    """Один планировщик на процесс Streamlit (общий для всех сессий)."""
+    return ParseScheduler()
+
+
+# ---------- Streamlit helpers ----------
+
+def _wait(sched: ParseScheduler, job_ids: list, placeholder, done_before: int = 0,
+          total: Optional[int] = None) -> None:
+    total = len(job_ids) if total is None else total
+    of = f" из {total}" if total else ""
+    while True:
+        pending = [j for j in job_ids if not sched.is_done(j)]
+        if not pending:
+            break
+        pos = min(sched.position(j) for j in pending)
+        done = done_before + len(job_ids) - len(pending)
+        if pos > 0:
+            placeholder.info(f"⏳ В очереди на разбор: перед вами {pos} файл(ов). Готово {done}{of}.")
+        else:
+            placeholder.info(f"⚙️ Разбираем файлы… Готово {done}{of}.")
+        time.sleep(POLL_S)
+    placeholder.empty()
+
+
+def parse_single_queued(uploaded_file, user_id: str, hr_rest: int, hr_max: int, ftp: Optional[int] = None):
+    """Как ingest.parse_single_upload, но через общий пул с позицией в очереди в UI."""
+    sched = get_scheduler()
+    for name, data in iter_members(uploaded_file):
+        job_id = sched.submit(user_id, name, data, hr_rest, hr_max, ftp)
+        _wait(sched, [job_id], st.empty())
+        return sched.pop_result(job_id)
+    raise ValueError(f"В файле {getattr(uploaded_file, 'name', '')} нет поддерживаемых тренировок.")
+
+
+def _iter_uploads(files: Iterable[Any]) -> Iterator[Tuple[str, Optional[bytes], Optional[str]]]:
+    """(имя, байты, ошибка) по всем членам всех файлов — лениво, архив читается по мере отправки в пул."""
+    for f in files:
+        try:
+            found = False
+            for name, data in iter_members(f):
+                found = True
+                yield name, data, None
+            if not found:
+                yield getattr(f, "name", str(f)), None, "нет поддерживаемых файлов"
+        except Exception as e:
+            yield getattr(f, "name", str(f)), None, str(e)
+
+
+def parse_uploads_queued(
+    files: Iterable[Any], user_id: str, hr_rest: int, hr_max: int, ftp: Optional[int] = None,
+    window: int = UPLOAD_WINDOW,
+) -> Iterator[Tuple[str, Optional[tuple], Optional[str]]]:
+    """
+    Все активности из загрузок: (имя, результат | None, ошибка | None) через общий пул с честной очередью.
+    В очереди не больше window файлов этой загрузки: следующий член архива отправляется, когда забран
+    результат первого, — экспорт на тысячи тренировок не упирается в MAX_QUEUED_PER_USER. Порядок — как в архиве.
+    """
+    sched = get_scheduler()
+    placeholder = st.empty()
+    pending: deque = deque()   # (имя, job_id, ошибка) в порядке загрузки
+    done = 0
+
+    def pop():
+        name, job_id, err = pending.popleft()
+        if err:
+            return name, None, err
+        _wait(sched, [job_id], placeholder, done_before=done)
+        try:
+            return name, sched.pop_result(job_id), None
+        except Exception as e:
+            return name, None, str(e)
+
+    for name, data, err in _iter_uploads(files):
+        if err is None:
+            while True:
+                while len(pending) >= max(int(window), 1):
+                    yield pop()
+                    done += 1
+                try:
+                    job_id = sched.submit(user_id, name, data, hr_rest, hr_max, ftp)
+                    break
+                except QueueFull:
+                    # очередь пользователя забита другой его сессией — ждём свой результат или паузу
+                    if pending:
+                        yield pop()
+                        done += 1
+                    else:
+                        time.sleep(POLL_S)
+                except Exception as e:
+                    job_id, err = None, str(e)
+                    break
+            data = None
+            pending.append((name, job_id, err))
+        else:
+            pending.append((name, None, err))
+    while pending:
+        yield pop()
+        done += 1
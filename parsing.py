@@ -1,4 +1,6 @@
 # parsing.py
+from typing import Optional
+
 import pandas as pd
 from fitparse import FitFile
 from utils import (
@@ -9,77 +11,43 @@ from utils import (
     efficiency_factor,
     decoupling,
 )
+from instrument import traced, sizeof_upload
+from gps import semicircle_column
+from power import power_summary
+from cleaning import clean_records
+from gap import gap_summary
+from localtime import fit_offset, resolve_offset, local_dates
 
-def parse_fit_file(uploaded_file, hr_rest: int, hr_max: int):
-    """Возвращает df_rec, df_laps, df_ses, summary."""
-    fit = FitFile(uploaded_file)
-
-    # Records
-    rec_rows = []
-    for m in fit.get_messages("record"):
-        rec_rows.append({
-            "timestamp": get_val(m, "timestamp"),
-            "hr":        get_val(m, "heart_rate"),
-            "speed":     get_val(m, "speed", "enhanced_speed"),  # m/s
-            "cadence":   get_val(m, "cadence"),
-            "power":     get_val(m, "power"),
-            "elev":      get_val(m, "altitude", "enhanced_altitude"),
-            "dist":      get_val(m, "distance"),                 # meters (cumulative)
-        })
-    df_rec = pd.DataFrame(rec_rows)
-    if not df_rec.empty:
-        df_rec["timestamp"] = pd.to_datetime(df_rec["timestamp"], errors="coerce")
-        df_rec = df_rec.sort_values("timestamp").reset_index(drop=True)
-        if df_rec["timestamp"].notna().any():
-            t0 = df_rec["timestamp"].min()
-            df_rec["t_rel_s"] = (df_rec["timestamp"] - t0).dt.total_seconds()
-        else:
-            df_rec["t_rel_s"] = range(len(df_rec))
-        df_rec["dt_s"] = pd.Series(df_rec["t_rel_s"]).diff().fillna(0).clip(lower=0)
-        df_rec["pace"] = df_rec["speed"].apply(pace_from_speed)
-
-    # Laps
-    lap_rows = []
-    for m in fit.get_messages("lap"):
-        lap_rows.append({
-            "start_time": get_val(m, "start_time"),
-            "total_distance_m": get_val(m, "total_distance"),
-            "total_timer_time_s": get_val(m, "total_timer_time"),
-            "avg_hr": get_val(m, "avg_heart_rate"),
-            "max_hr": get_val(m, "max_heart_rate"),
-            "avg_speed_m_s": get_val(m, "avg_speed", "enhanced_avg_speed"),
-            "max_speed_m_s": get_val(m, "max_speed", "enhanced_max_speed"),
-            "avg_cadence": get_val(m, "avg_cadence"),
-            "total_ascent_m": get_val(m, "total_ascent"),
-            "total_descent_m": get_val(m, "total_descent"),
-            "lap_trigger": get_val(m, "lap_trigger"),
-        })
-    df_laps = pd.DataFrame(lap_rows)
-    if not df_laps.empty:
-        df_laps["start_time"] = pd.to_datetime(df_laps["start_time"], errors="coerce")
-        df_laps = df_laps.sort_values("start_time").reset_index(drop=True)
-
-    # Sessions
-    ses_rows = []
-    for m in fit.get_messages("session"):
-        ses_rows.append({
-            "start_time": get_val(m, "start_time"),
-            "sport": get_val(m, "sport"),
-            "sub_sport": get_val(m, "sub_sport"),
-            "total_distance_m": get_val(m, "total_distance"),
-            "total_elapsed_time_s": get_val(m, "total_elapsed_time"),
-            "total_timer_time_s": get_val(m, "total_timer_time"),
-            "avg_hr": get_val(m, "avg_heart_rate"),
-            "max_hr": get_val(m, "max_heart_rate"),
-            "avg_speed_m_s": get_val(m, "avg_speed", "enhanced_avg_speed"),
-            "max_speed_m_s": get_val(m, "max_speed", "enhanced_max_speed"),
-            "avg_cadence": get_val(m, "avg_cadence"),
-            "total_ascent_m": get_val(m, "total_ascent"),
-            "total_descent_m": get_val(m, "total_descent"),
-        })
-    df_ses = pd.DataFrame(ses_rows)
+def finalize_records(df_rec: pd.DataFrame, cleaning: Optional[dict] = None) -> pd.DataFrame:
+    """
+    Общая пост-обработка точек: сортировка, t_rel_s, dt_s, очистка каналов, pace (FIT/GPX/TCX).
+    cleaning — конфиг каналов для cleaning.clean_records (None — по умолчанию); отчёт — в df_rec.attrs["cleaning"].
+    """
+    if df_rec.empty:
+        return df_rec
+    for col in ("lat_sc", "lon_sc"):
+        if col in df_rec:
+            df_rec[col] = semicircle_column(df_rec[col])  # int32-полукруги, <NA> без фикса
+    df_rec["timestamp"] = pd.to_datetime(df_rec["timestamp"], errors="coerce")
+    df_rec = df_rec.sort_values("timestamp").reset_index(drop=True)
+    if df_rec["timestamp"].notna().any():
+        t0 = df_rec["timestamp"].min()
+        df_rec["t_rel_s"] = (df_rec["timestamp"] - t0).dt.total_seconds()
+    else:
+        df_rec["t_rel_s"] = range(len(df_rec))
+    df_rec["dt_s"] = pd.Series(df_rec["t_rel_s"]).diff().fillna(0).clip(lower=0)
+    df_rec, report = clean_records(df_rec, cleaning)
+    df_rec.attrs["cleaning"] = report
+    df_rec["pace"] = df_rec["speed"].apply(pace_from_speed)
+    return df_rec
 
-    # Summary
+def build_summary(df_rec: pd.DataFrame, df_ses: pd.DataFrame, hr_rest: int, hr_max: int,
+                  ftp: Optional[int] = None, utc_offset_s: Optional[int] = None) -> dict:
+    """
+    Сводка тренировки по точкам и (опционально) сессии; ftp — для IF/TSS, если есть мощность.
+    utc_offset_s — смещение местного времени из FIT; без него — по первому GPS-фиксу (localtime.py).
+    date/local_date — местная дата старта.
+    """
     start_time = None
     if not df_ses.empty and pd.notna(df_ses.iloc[0].get("start_time")):
         start_time = pd.to_datetime(df_ses.iloc[0]["start_time"])
@@ -125,9 +93,14 @@ def parse_fit_file(uploaded_file, hr_rest: int, hr_max: int):
     de = decoupling(df_rec["speed"] if "speed" in df_rec else None,
                     df_rec["hr"] if "hr" in df_rec else None)
 
+    utc_offset_s = resolve_offset(start_time, utc_offset_s, df_rec) if start_time is not None else None
+    local_date = local_dates([start_time], [utc_offset_s])[0] if start_time is not None else None
+
     summary = {
         "start_time": start_time,
-        "date": start_time.date() if start_time else None,
+        "date": local_date,
+        "local_date": local_date,
+        "utc_offset_s": utc_offset_s,
         "sport": (df_ses.iloc[0]["sport"] if not df_ses.empty else None),
         "distance_km": round(distance_km, 2) if distance_km else None,
         "time_s": round(time_s) if time_s is not None else None,
@@ -137,5 +110,79 @@ def parse_fit_file(uploaded_file, hr_rest: int, hr_max: int):
         "TRIMP": int(round(trimp)) if trimp else None,
         "EF": round(ef, 4) if ef else None,
         "Pa:Hr_%": round(de, 1) if de is not None else None,
+        **power_summary(df_rec, ftp),
+        **gap_summary(df_rec),
     }
+    return summary
+
+@traced("parse.fit", lambda res, f, *a, **k: {"bytes_in": sizeof_upload(f), "rows_out": len(res[0])})
+def parse_fit_file(uploaded_file, hr_rest: int, hr_max: int, ftp: Optional[int] = None):
+    """Возвращает df_rec, df_laps, df_ses, summary."""
+    fit = FitFile(uploaded_file)
+
+    # Records
+    rec_rows = []
+    for m in fit.get_messages("record"):
+        rec_rows.append({
+            "timestamp": get_val(m, "timestamp"),
+            "hr":        get_val(m, "heart_rate"),
+            "speed":     get_val(m, "speed", "enhanced_speed"),  # m/s
+            "cadence":   get_val(m, "cadence"),
+            "power":     get_val(m, "power"),
+            "elev":      get_val(m, "altitude", "enhanced_altitude"),
+            "dist":      get_val(m, "distance"),                 # meters (cumulative)
+            "lat_sc":    get_val(m, "position_lat"),             # semicircles
+            "lon_sc":    get_val(m, "position_long"),
+        })
+    df_rec = finalize_records(pd.DataFrame(rec_rows))
+
+    # Laps
+    lap_rows = []
+    for m in fit.get_messages("lap"):
+        lap_rows.append({
+            "start_time": get_val(m, "start_time"),
+            "total_distance_m": get_val(m, "total_distance"),
+            "total_timer_time_s": get_val(m, "total_timer_time"),
+            "avg_hr": get_val(m, "avg_heart_rate"),
+            "max_hr": get_val(m, "max_heart_rate"),
+            "avg_speed_m_s": get_val(m, "avg_speed", "enhanced_avg_speed"),
+            "max_speed_m_s": get_val(m, "max_speed", "enhanced_max_speed"),
+            "avg_cadence": get_val(m, "avg_cadence"),
+            "total_ascent_m": get_val(m, "total_ascent"),
+            "total_descent_m": get_val(m, "total_descent"),
+            "lap_trigger": get_val(m, "lap_trigger"),
+        })
+    df_laps = pd.DataFrame(lap_rows)
+    if not df_laps.empty:
+        df_laps["start_time"] = pd.to_datetime(df_laps["start_time"], errors="coerce")
+        df_laps = df_laps.sort_values("start_time").reset_index(drop=True)
+
+    # Sessions
+    ses_rows = []
+    for m in fit.get_messages("session"):
+        ses_rows.append({
+            "start_time": get_val(m, "start_time"),
+            "sport": get_val(m, "sport"),
+            "sub_sport": get_val(m, "sub_sport"),
+            "total_distance_m": get_val(m, "total_distance"),
+            "total_elapsed_time_s": get_val(m, "total_elapsed_time"),
+            "total_timer_time_s": get_val(m, "total_timer_time"),
+            "avg_hr": get_val(m, "avg_heart_rate"),
+            "max_hr": get_val(m, "max_heart_rate"),
+            "avg_speed_m_s": get_val(m, "avg_speed", "enhanced_avg_speed"),
+            "max_speed_m_s": get_val(m, "max_speed", "enhanced_max_speed"),
+            "avg_cadence": get_val(m, "avg_cadence"),
+            "total_ascent_m": get_val(m, "total_ascent"),
+            "total_descent_m": get_val(m, "total_descent"),
+        })
+    df_ses = pd.DataFrame(ses_rows)
+
+    # Activity: local_timestamp − timestamp = смещение часового пояса часов
+    utc_offset_s = None
+    for m in fit.get_messages("activity"):
+        utc_offset_s = fit_offset(get_val(m, "timestamp"), get_val(m, "local_timestamp"))
+        if utc_offset_s is not None:
+            break
+
+    summary = build_summary(df_rec, df_ses, hr_rest, hr_max, ftp, utc_offset_s)
     return df_rec, df_laps, df_ses, summary
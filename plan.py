@@ -0,0 +1,197 @@
+# plan.py — план тренировок на блок недель (рост объёма + разгрузочные недели) и экспорт в iCal
+#
+# Неделя строится как раньше в views_multi: целевой объём по TSB, раскладка по дням DIST_SPLIT и типы TYPES.
+# Блок на 12–16 недель — те же недели с ростом объёма GROWTH в неделю и разгрузкой каждую DELOAD_EVERY-ю
+# (объём × DELOAD_FACTOR, интенсивные сессии → лёгкие). Вся таблица блока — numpy/pandas без цикла по неделям.
+#
+# iCal: даты, время, тексты и UID считаются колонками сразу для всего плана, события отдаются потоком
+# (iter_ics) кусками по CHUNK строк. UID — sha1 от (plan_id, неделя блока, день недели): он одинаков между
+# процессами и перевыгрузками и не зависит от даты, поэтому при сдвиге начала блока календарь переносит
+# событие на новую дату, а не оставляет старое рядом с новым. DTSTAMP/SEQUENCE — один на выгрузку:
+# более новая выгрузка перекрывает старую.
+
+from __future__ import annotations
+import time
+import hashlib
+import datetime as dt
+from typing import Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+DAY_NAMES = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+DAY_IDX = {d: i for i, d in enumerate(DAY_NAMES)}
+DIST_SPLIT = np.array([0.12, 0.16, 0.10, 0.18, 0.08, 0.26, 0.10])   # доли недельного объёма Пн..Вс
+TYPES = ["Easy Z1–Z2", "Tempo Z3 (20–30 мин)", "Easy Z1–Z2",
+         "Intervals Z4 (6×3’/2’)", "Recovery 30–40’ Z1", "Long Z2", "Easy + strides"]
+# в разгрузочную неделю интенсивные сессии заменяем лёгкими
+DELOAD_TYPES = {"Tempo Z3 (20–30 мин)": "Easy Z1–Z2", "Intervals Z4 (6×3’/2’)": "Easy + strides"}
+
+WEEKS = 12
+GROWTH = 0.05           # +5% объёма в неделю нагрузки
+DELOAD_EVERY = 4        # 3 недели нагрузки, 4-я — разгрузка
+DELOAD_FACTOR = 0.7     # объём разгрузочной недели от предыдущей
+CHUNK = 256             # событий в одном куске потока iCal
+PLAN_ID = "capyrun-plan"
+
+
+def next_week_target(last_week_km: float, tsb_now: float) -> Tuple[float, str]:
+    """Целевой объём следующей недели по объёму последних 7 дней и TSB; (км, пояснение)."""
+    if tsb_now < -10:
+        return max(0.0, last_week_km * 0.9), "TSB низкий → снизим объём (~-10%) для восстановления."
+    if tsb_now > 10:
+        return last_week_km * 1.10, "TSB высокий → можно аккуратно поднять объём (~+10%)."
+    return last_week_km * 1.05, "TSB в норме → поддержим/слегка увеличим (~+5%)."
+
+
+def week_plan(target_km: float) -> pd.DataFrame:
+    """Одна неделя: День, Тип, Пробежка (км)."""
+    return pd.DataFrame({"День": DAY_NAMES, "Тип": TYPES, "Пробежка (км)": (DIST_SPLIT * target_km).round(1)})
+
+
+def week_targets(start_km: float, weeks: int = WEEKS, growth: float = GROWTH, deload_every: int = DELOAD_EVERY,
+                 deload_factor: float = DELOAD_FACTOR, peak_km: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Объёмы недель блока и маска разгрузочных. Неделя нагрузки k (счёт без разгрузок) — start_km·(1+growth)^k,
+    разгрузка — объём предыдущей недели × deload_factor; peak_km ограничивает рост сверху.
+    """
+    w = np.arange(max(int(weeks), 0))
+    if deload_every and deload_every >= 2:
+        cycle, pos = np.divmod(w, deload_every)
+        deload = pos == deload_every - 1
+        k = cycle * (deload_every - 1) + np.where(deload, pos - 1, pos)
+    else:
+        deload = np.zeros(len(w), dtype=bool)
+        k = w
+    km = float(start_km) * (1.0 + growth) ** k
+    if peak_km is not None:
+        km = np.minimum(km, float(peak_km))
+    km = np.where(deload, km * deload_factor, km)
+    return km, deload
+
+
+def week_start(d: dt.date) -> dt.date:
+    """Понедельник недели, в которую попадает d."""
+    return d - dt.timedelta(days=d.weekday())
+
+
+def build_block(start_date: dt.date, start_km: float, weeks: int = WEEKS, growth: float = GROWTH,
+                deload_every: int = DELOAD_EVERY, deload_factor: float = DELOAD_FACTOR,
+                peak_km: Optional[float] = None) -> pd.DataFrame:
+    """
+    План на weeks недель с понедельника недели start_date: Неделя, Дата, День, Тип, Пробежка (км), Разгрузка.
+    Первая неделя — start_km (обычно next_week_target), дальше — week_targets.
+    """
+    start_date = week_start(start_date)     # День идёт Пн..Вс — Дата должна с ним совпадать
+    km, deload = week_targets(start_km, weeks, growth, deload_every, deload_factor, peak_km)
+    n = len(km)
+    types = np.tile(np.array(TYPES, dtype=object), n)
+    is_deload = np.repeat(deload, 7)
+    types[is_deload] = pd.Series(types[is_deload]).replace(DELOAD_TYPES).to_numpy(dtype=object)
+    offsets = np.arange(n * 7)
+    return pd.DataFrame({
+        "Неделя": np.repeat(np.arange(1, n + 1), 7),
+        "Дата": (pd.Timestamp(start_date) + pd.to_timedelta(offsets, unit="D")).date,
+        "День": np.tile(DAY_NAMES, n),
+        "Тип": types,
+        "Пробежка (км)": (np.outer(km, DIST_SPLIT).ravel()).round(1),
+        "Разгрузка": is_deload,
+    })
+
+
+def block_weeks(plan_df: pd.DataFrame) -> pd.DataFrame:
+    """Свод блока по неделям: Неделя, Начало, км, Разгрузка."""
+    g = plan_df.groupby("Неделя", sort=True)
+    return pd.DataFrame({"Начало": g["Дата"].min(), "км": g["Пробежка (км)"].sum().round(1),
+                         "Разгрузка": g["Разгрузка"].any()}).reset_index()
+
+
+# ---------- iCal ----------
+
+def _esc(s: pd.Series) -> pd.Series:
+    """Экранирование TEXT по RFC 5545: \\ ; , и переводы строк."""
+    return (s.astype(str).str.replace("\\", "\\\\", regex=False).str.replace(";", "\\;", regex=False)
+            .str.replace(",", "\\,", regex=False).str.replace("\n", "\\n", regex=False))
+
+
+def _plan_dates(plan_df: pd.DataFrame, start_date: dt.date) -> pd.Series:
+    """Даты событий: колонка Дата, иначе start_date + день недели (+ неделя: Неделя или новый круг Пн..Вс)."""
+    if "Дата" in plan_df:
+        return pd.to_datetime(plan_df["Дата"], errors="coerce")
+    idx = plan_df["День"].astype(str).map(DAY_IDX).fillna(0).astype(int).to_numpy()
+    if "Неделя" in plan_df:
+        week = pd.to_numeric(plan_df["Неделя"], errors="coerce").fillna(1).astype(int).to_numpy() - 1
+    else:
+        week = np.concatenate(([0], np.cumsum(np.diff(idx) <= 0))) if len(idx) else idx
+    return pd.Series(pd.Timestamp(start_date) + pd.to_timedelta(idx + 7 * week, unit="D"), index=plan_df.index)
+
+
+def _event_slots(plan_df: pd.DataFrame, dates: pd.Series) -> pd.Series:
+    """Место события в блоке «неделя|день»: Неделя/День плана, для недели без Неделя — круги Пн..Вс."""
+    day = plan_df["День"].astype(str)
+    if "Неделя" in plan_df:
+        week = pd.to_numeric(plan_df["Неделя"], errors="coerce").fillna(1).astype(int)
+    else:
+        monday = dates - pd.to_timedelta(dates.dt.weekday, unit="D")
+        week = ((monday - monday.min()).dt.days // 7 + 1).astype(int)
+    return week.astype(str) + "|" + day
+
+
+def event_uids(slots: pd.Series, plan_id: str = PLAN_ID) -> pd.Series:
+    """Стабильные UID: sha1(plan_id|неделя|день) — одно событие на слот блока, независимо от даты и содержимого."""
+    keys = plan_id + "|" + slots.astype(str)
+    return keys.map(lambda k: hashlib.sha1(k.encode("utf-8")).hexdigest()[:24]) + "@capyrun"
+
+
+def iter_ics(
+    plan_df: pd.DataFrame,
+    start_date: dt.date,
+    workout_time: dt.time,
+    selected_days: Sequence[str],
+    duration_minutes: int,
+    location: str = "",
+    alert_minutes: int = 0,
+    plan_id: str = PLAN_ID,
+    chunk: int = CHUNK,
+) -> Iterator[str]:
+    """Календарь кусками (строки с CRLF): заголовок, события по chunk штук, окончание."""
+    yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//CapyRun//Training Plan//EN\r\nCALSCALE:GREGORIAN\r\n"
+    df = plan_df[plan_df["День"].astype(str).isin(list(selected_days))] if len(plan_df) else plan_df
+    if len(df):
+        now = time.time()
+        stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(now))
+        seq = int(now // 60)    # растёт с каждой выгрузкой — клиент берёт более новую версию события
+        dates = _plan_dates(df, start_date)
+        ok = dates.notna()
+        df, dates = df[ok], dates[ok]
+        t = pd.Timedelta(hours=workout_time.hour, minutes=workout_time.minute, seconds=workout_time.second)
+        start = dates + t
+        end = start + pd.Timedelta(minutes=int(duration_minutes))
+        km = df["Пробежка (км)"].astype(str)
+        kind = df["Тип"].astype(str)
+        body = (
+            "BEGIN:VEVENT\r\nUID:" + event_uids(_event_slots(df, dates), plan_id)
+            + "\r\nDTSTAMP:" + stamp + "\r\nSEQUENCE:" + str(seq)
+            + "\r\nDTSTART:" + start.dt.strftime("%Y%m%dT%H%M%S")
+            + "\r\nDTEND:" + end.dt.strftime("%Y%m%dT%H%M%S")
+            + "\r\nSUMMARY:" + _esc(kind + " — " + km + " км")
+            + "\r\nDESCRIPTION:" + _esc("CapyRun: " + kind + ". Плановый объём: " + km + " км.")
+            + "\r\n"
+        )
+        tail = f"LOCATION:{_esc(pd.Series([location])).iloc[0]}\r\n" if location else ""
+        if alert_minutes and int(alert_minutes) > 0:
+            tail += ("BEGIN:VALARM\r\nACTION:DISPLAY\r\nDESCRIPTION:Workout reminder\r\n"
+                     f"TRIGGER:-PT{int(alert_minutes)}M\r\nEND:VALARM\r\n")
+        tail += "END:VEVENT\r\n"
+        events = (body + tail).tolist()
+        step = max(int(chunk), 1)
+        for i in range(0, len(events), step):
+            yield "".join(events[i:i + step])
+    yield "END:VCALENDAR\r\n"
+
+
+def build_ics(plan_df: pd.DataFrame, start_date: dt.date, workout_time: dt.time, selected_days: list,
+              duration_minutes: int, location: str = "", alert_minutes: int = 0, plan_id: str = PLAN_ID) -> str:
+    """Весь календарь одной строкой (для st.download_button)."""
+    return "".join(iter_ics(plan_df, start_date, workout_time, selected_days, duration_minutes,
+                            location, alert_minutes, plan_id))
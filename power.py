@@ -0,0 +1,110 @@
+# power.py — аналитика мощности: NP, IF/TSS, W′bal на векторных окнах (без циклов по точкам)
+#
+# Все расчёты идут по секундному ряду: точки записи растягиваются sample-and-hold на свои dt_s
+# (np.repeat), а паузы длиннее MAX_GAP_S схлопываются до 1 с — как таймер часов на автопаузе.
+# Скользящее 30-с среднее — разность кумулятивных сумм; W′bal (дифференциальная модель Скибы)
+# — аффинная рекуррентность w[i+1] = a[i]·w[i] + b[i], которую решаем кусками через cumprod/cumsum.
+
+from __future__ import annotations
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+NP_WINDOW_S = 30
+MAX_GAP_S = 10        # дольше — пауза: не размазываем последнее значение на всё время стоянки
+MAX_POWER_W = 2500    # выше — сбой датчика
+CHUNK = 256           # длина куска рекуррентности: произведение a[i] на куске не уходит в denormal
+
+
+def power_1hz(df_rec: pd.DataFrame) -> Optional[np.ndarray]:
+    """Секундный ряд мощности (Вт) из df_rec (power, dt_s); None — если мощности нет."""
+    if df_rec is None or df_rec.empty or "power" not in df_rec:
+        return None
+    p = pd.to_numeric(df_rec["power"], errors="coerce").to_numpy(float)
+    if not np.isfinite(p).any() or np.nanmax(p) <= 0:
+        return None
+    p = np.where(np.isfinite(p) & (p >= 0) & (p <= MAX_POWER_W), p, 0.0)
+    if "dt_s" in df_rec:
+        # длительность точки — интервал до следующей (dt_s хранится «от предыдущей»)
+        dt = np.append(pd.to_numeric(df_rec["dt_s"], errors="coerce").to_numpy(float)[1:], 1.0)
+        dt = np.nan_to_num(dt, nan=1.0)
+        reps = np.where(dt > MAX_GAP_S, 1, np.clip(np.rint(dt), 1, None)).astype(np.int64)
+    else:
+        reps = np.ones(len(p), np.int64)
+    return np.repeat(p, reps)
+
+
+def rolling_mean(x: np.ndarray, window: int = NP_WINDOW_S) -> np.ndarray:
+    """Скользящее среднее по полным окнам (len = n − window + 1) через кумулятивную сумму."""
+    x = np.asarray(x, float)
+    if len(x) < window:
+        return np.empty(0)
+    c = np.concatenate(([0.0], np.cumsum(x)))
+    return (c[window:] - c[:-window]) / window
+
+
+def normalized_power(p1hz: np.ndarray) -> Optional[float]:
+    """NP = (среднее(30-с среднее⁴))^¼; короче окна — просто средняя."""
+    if p1hz is None or not len(p1hz):
+        return None
+    r = rolling_mean(p1hz)
+    if not len(r):
+        return float(np.mean(p1hz))
+    return float(np.mean(r ** 4) ** 0.25)
+
+
+def training_stress(np_w: Optional[float], duration_s: float, ftp: Optional[float]) -> Dict[str, Optional[float]]:
+    """IF = NP/FTP, TSS = t·NP·IF / (FTP·3600) · 100."""
+    if not np_w or not ftp or ftp <= 0 or not duration_s:
+        return {"IF": None, "TSS": None}
+    intensity = np_w / ftp
+    return {"IF": intensity, "TSS": duration_s * np_w * intensity / (ftp * 3600.0) * 100.0}
+
+
+def _affine_scan(a: np.ndarray, b: np.ndarray, w0: float) -> np.ndarray:
+    """
+    w[i+1] = a[i]·w[i] + b[i] для всех i сразу: на куске w[k+1] = P[k]·(w0 + Σ_{j≤k} b[j]/P[j]),
+    P[k] = a[0]·…·a[k]. Куски по CHUNK держат P вдали от нуля; между ними переносим хвост.
+    """
+    out = np.empty(len(a) + 1)
+    out[0] = w0
+    for s in range(0, len(a), CHUNK):
+        ac, bc = a[s:s + CHUNK], b[s:s + CHUNK]
+        P = np.cumprod(ac)
+        out[s + 1:s + 1 + len(ac)] = P * (out[s] + np.cumsum(bc / P))
+    return out
+
+
+def w_prime_balance(p1hz: np.ndarray, cp: float, w_prime: float) -> np.ndarray:
+    """
+    W′bal (Дж) по секундам, дифференциальная модель Скибы (2015):
+    выше CP — тратим (P − CP) Дж/с, ниже — восстанавливаем (CP − P)·(W′ − W′bal)/W′.
+    """
+    p = np.asarray(p1hz, float)
+    if not len(p) or not cp or not w_prime:
+        return np.empty(0)
+    below = p < cp
+    rate = np.clip((cp - p) / w_prime, 0.0, 0.5)  # доля недостающего W′, возвращаемая за секунду
+    a = np.where(below, 1.0 - rate, 1.0)
+    b = np.where(below, rate * w_prime, cp - p)
+    w = _affine_scan(a, b, float(w_prime))[1:]
+    return np.minimum(w, w_prime)
+
+
+def power_summary(df_rec: pd.DataFrame, ftp: Optional[float] = None) -> Dict[str, Any]:
+    """Ключи для summary: avg/max/NP (Вт), IF и TSS (если задан FTP). Без мощности — все None."""
+    out = {"avg_power_w": None, "max_power_w": None, "np_power_w": None, "IF": None, "TSS": None}
+    p = power_1hz(df_rec)
+    if p is None:
+        return out
+    np_w = normalized_power(p)
+    stress = training_stress(np_w, float(len(p)), ftp)
+    out.update({
+        "avg_power_w": int(round(float(p.mean()))),
+        "max_power_w": int(round(float(p.max()))),
+        "np_power_w": int(round(np_w)) if np_w else None,
+        "IF": round(stress["IF"], 3) if stress["IF"] else None,
+        "TSS": round(stress["TSS"], 1) if stress["TSS"] else None,
+    })
+    return out
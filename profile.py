@@ -1,4 +1,4 @@
-# profile.py — профиль пользователя (HRrest/HRmax/зоны), upsert с RLS
+# profile.py — профиль пользователя (HRrest/HRmax/зоны, FTP/CP/W′), upsert с RLS
 
 from __future__ import annotations
 import datetime as dt
@@ -6,8 +6,10 @@ from typing import Any, Dict, Optional, Tuple, List, Union
 
 import streamlit as st
 
-DEFAULTS = {"hr_rest": 50, "hr_max": 185, "zone_bounds_text": "120,140,155,170"}
-PROFILE_VERSION = "profile.py v1.2"
+# мощность не выдумываем: без FTP/CP/W′ от пользователя IF/TSS и W′bal не считаются
+DEFAULTS = {"hr_rest": 50, "hr_max": 185, "zone_bounds_text": "120,140,155,170",
+            "ftp_w": None, "cp_w": None, "w_prime_j": None}
+PROFILE_VERSION = "profile.py v1.3"
 
 # ---------------- internals ----------------
 
@@ -114,7 +116,7 @@ def load_or_init_profile(supabase, user_id: str) -> Dict[str, Any]:
     try:
         res = (
             supabase.table("profiles")
-            .select("user_id, hr_rest, hr_max, zone_bounds_text")
+            .select("user_id, hr_rest, hr_max, zone_bounds_text, ftp_w, cp_w, w_prime_j")
             .eq("user_id", user_id)
             .limit(1)
             .execute()
@@ -127,6 +129,9 @@ def load_or_init_profile(supabase, user_id: str) -> Dict[str, Any]:
                 "hr_rest": row.get("hr_rest", DEFAULTS["hr_rest"]),
                 "hr_max": row.get("hr_max", DEFAULTS["hr_max"]),
                 "zone_bounds_text": row.get("zone_bounds_text", DEFAULTS["zone_bounds_text"]),
+                "ftp_w": row.get("ftp_w") or None,
+                "cp_w": row.get("cp_w") or None,
+                "w_prime_j": row.get("w_prime_j") or None,
             }
     except Exception as e:
         # Покажем коротко, без технических деталей
@@ -134,9 +139,14 @@ def load_or_init_profile(supabase, user_id: str) -> Dict[str, Any]:
     return {"user_id": user_id, **DEFAULTS}
 
 
-def save_profile(supabase, user: Optional[Dict[str, Any]], hr_rest: int, hr_max: int, zone_bounds_text: str) -> bool:
+_UNSET = object()   # «не передано» в save_profile — в отличие от None («очистить»)
+
+
+def save_profile(supabase, user: Optional[Dict[str, Any]], hr_rest: int, hr_max: int, zone_bounds_text: str,
+                 ftp_w: Any = _UNSET, cp_w: Any = _UNSET, w_prime_j: Any = _UNSET) -> bool:
     """
     Upsert профиля по user_id. user_id берём из переданного user/сессии.
+    Настройки мощности (FTP/CP/W′) пишем, только если переданы; None — очистить (null в БД).
     """
     _attach_auth_token(supabase)
     uid = _get_current_user_id(supabase, user)
@@ -151,6 +161,10 @@ def save_profile(supabase, user: Optional[Dict[str, Any]], hr_rest: int, hr_max:
         "zone_bounds_text": (zone_bounds_text or "").strip(),
         "updated_at": dt.datetime.utcnow().isoformat(),
     }
+    for key, val in (("ftp_w", ftp_w), ("cp_w", cp_w), ("w_prime_j", w_prime_j)):
+        if val is not _UNSET:
+            # пустое поле в форме — явный null: иначе старый FTP остался бы и IF/TSS считались дальше
+            row[key] = int(val) if val else None
 
     try:
         supabase.table("profiles").upsert(row, on_conflict="user_id").execute()
@@ -169,10 +183,35 @@ def save_profile(supabase, user: Optional[Dict[str, Any]], hr_rest: int, hr_max:
         return False
 
 
-def profile_sidebar(supabase, user: Dict[str, Any], profile_row: Dict[str, Any]) -> Tuple[int, int, str]:
+def _run_recompute(supabase, user: Optional[Dict[str, Any]], hr_rest: int, hr_max: int, zone_bounds_text: str) -> None:
+    """Пересчёт TRIMP/зон по истории с прогрессом; прерванный пересчёт продолжается с чекпоинта."""
+    from recompute import recompute_history
+    from utils import parse_bounds
+
+    uid = _get_current_user_id(supabase, user)
+    if not uid:
+        return
+    bar = st.progress(0.0, text="Пересчёт истории…")
+    try:
+        res = recompute_history(supabase, uid, int(hr_rest), int(hr_max), parse_bounds(zone_bounds_text),
+                                progress=lambda d, t: bar.progress(min(1.0, d / max(t, 1)), text=f"Пересчёт истории: {d}/{t}"))
+    except Exception:
+        st.warning("Пересчёт прерван — нажми «Пересчитать историю», он продолжится с места остановки.")
+        return
+    bar.empty()
+    try:
+        from coach_snapshot import refresh_coach_snapshot
+        refresh_coach_snapshot(supabase, uid, rebuild=True)   # TRIMP и зоны поменялись — контекст тренера заново
+    except Exception:
+        pass
+    st.caption(f"История пересчитана: {res.get('updated', 0)} тренировок"
+               + (f", без пульса: {res['skipped']}" if res.get("skipped") else "") + ".")
+
+
+def profile_sidebar(supabase, user: Dict[str, Any], profile_row: Dict[str, Any]) -> Tuple[int, int, str, Dict[str, Optional[int]]]:
     """
     Рендерит блок профиля в сайдбаре.
-    Возвращает (hr_rest, hr_max, zone_bounds_text).
+    Возвращает (hr_rest, hr_max, zone_bounds_text, {"ftp_w", "cp_w", "w_prime_j"}); не заданные — None.
     """
     st.markdown("### ⚙️ Профиль")
     st.caption(PROFILE_VERSION)
@@ -180,10 +219,19 @@ def profile_sidebar(supabase, user: Dict[str, Any], profile_row: Dict[str, Any])
     hr_rest = st.number_input("Пульс в покое (HRrest)", 30, 120, int(profile_row.get("hr_rest", DEFAULTS["hr_rest"])))
     hr_max  = st.number_input("Максимальный пульс (HRmax)", 120, 240, int(profile_row.get("hr_max", DEFAULTS["hr_max"])))
     zone_bounds_text = st.text_input("Границы зон ЧСС (через запятую)", value=str(profile_row.get("zone_bounds_text", DEFAULTS["zone_bounds_text"])))
+    ftp_w = st.number_input("FTP, Вт", 50, 600, profile_row.get("ftp_w") or None, placeholder="не задан")
+    cp_w = st.number_input("Критическая мощность CP, Вт", 50, 600, profile_row.get("cp_w") or None, placeholder="не задана")
+    w_prime_j = st.number_input("W′, Дж", 2000, 60000, profile_row.get("w_prime_j") or None, 500, placeholder="не задан")
 
     if st.button("💾 Сохранить профиль", use_container_width=True, key="btn_save_profile"):
         with st.spinner("Сохраняем профиль..."):
-            ok = save_profile(supabase, user, hr_rest, hr_max, zone_bounds_text)
+            ok = save_profile(supabase, user, hr_rest, hr_max, zone_bounds_text, ftp_w, cp_w, w_prime_j)
         if ok:
             st.success("Профиль сохранён.")
-    return int(hr_rest), int(hr_max), zone_bounds_text
+            old = (profile_row.get("hr_rest"), profile_row.get("hr_max"), str(profile_row.get("zone_bounds_text") or "").strip())
+            if old != (int(hr_rest), int(hr_max), zone_bounds_text.strip()):
+                _run_recompute(supabase, user, hr_rest, hr_max, zone_bounds_text)
+    elif st.button("🔁 Пересчитать историю", use_container_width=True, key="btn_recompute"):
+        _run_recompute(supabase, user, hr_rest, hr_max, zone_bounds_text)
+    power_cfg = {k: int(v) if v else None for k, v in (("ftp_w", ftp_w), ("cp_w", cp_w), ("w_prime_j", w_prime_j))}
+    return int(hr_rest), int(hr_max), zone_bounds_text, power_cfg
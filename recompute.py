@@ -0,0 +1,201 @@
+# recompute.py — пересчёт TRIMP и времени в зонах по всей истории после смены HR-профиля
+#
+# У каждой тренировки храним гистограмму «секунды на удар пульса» (workouts.hr_hist, ~100–200 байт).
+# TRIMP линеен по гистограмме: TRIMP = 100/60 · Σ_h c[h]·max(0, (h − HRrest)/(HRmax − HRrest)),
+# а время в зонах — суммы c[h] по диапазонам, поэтому пересчёт пачки — два матричных произведения
+# (n × 256) · (256 × k) без чтения точек. У старых тренировок без гистограммы строим её из
+# workout_streams_preview в пуле процессов и заодно сохраняем — следующий пересчёт уже чисто матричный.
+# Результат пишется одним RPC на пачку; после каждой пачки — чекпоинт (profile_recompute),
+# так что прерванный пересчёт продолжается с того же места, пока параметры профиля те же.
+
+from __future__ import annotations
+import os
+import base64
+import hashlib
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from gps import varint_encode, varint_decode
+
+HIST_VERSION = 1
+N_BPM = 256
+BATCH = 500              # тренировок на один RPC и чекпоинт
+PREVIEW_CHUNK = 200      # превью-стримов на одну задачу пула
+MAX_DT_S = 30            # шаг превью длиннее — пауза, не засчитываем
+
+
+# ---------- гистограммы ----------
+
+def hr_histogram(hr: Sequence[float], dt_s: Sequence[float]) -> Optional[np.ndarray]:
+    """Секунды на каждый удар 0..255 (uint32); None — если пульса нет."""
+    hr = pd.to_numeric(pd.Series(hr), errors="coerce").to_numpy(float)
+    dt_s = np.nan_to_num(pd.to_numeric(pd.Series(dt_s), errors="coerce").to_numpy(float), nan=0.0)
+    ok = np.isfinite(hr) & (hr > 0) & (dt_s > 0)
+    if not ok.any():
+        return None
+    h = np.clip(np.rint(hr[ok]), 0, N_BPM - 1).astype(np.int64)
+    return np.rint(np.bincount(h, weights=dt_s[ok], minlength=N_BPM)).astype(np.uint32)
+
+
+def encode_hist(c: np.ndarray) -> str:
+    """[версия][lo][hi] + varint(секунды для lo..hi) → base64."""
+    nz = np.flatnonzero(c)
+    lo, hi = (int(nz[0]), int(nz[-1])) if len(nz) else (0, 0)
+    raw = bytes([HIST_VERSION, lo, hi]) + varint_encode(c[lo:hi + 1].astype(np.uint64))
+    return base64.b64encode(raw).decode("ascii")
+
+
+def decode_hist(s: str) -> np.ndarray:
+    raw = base64.b64decode(s)
+    if len(raw) < 3 or raw[0] != HIST_VERSION:
+        raise ValueError("unknown hr_hist format")
+    lo, hi = raw[1], raw[2]
+    v = varint_decode(raw[3:])
+    if hi < lo or len(v) != hi - lo + 1:
+        raise ValueError("truncated hr_hist")
+    out = np.zeros(N_BPM, np.uint32)
+    out[lo:hi + 1] = v.astype(np.uint32)
+    return out
+
+
+def hist_b64_from_records(df_rec: pd.DataFrame) -> Optional[str]:
+    """Для сохранения вместе с тренировкой (views / import_worker)."""
+    if df_rec is None or df_rec.empty or "hr" not in df_rec or "dt_s" not in df_rec:
+        return None
+    c = hr_histogram(df_rec["hr"], df_rec["dt_s"])
+    return encode_hist(c) if c is not None else None
+
+
+def hists_from_previews(previews: List[Tuple[str, Dict[str, Any]]]) -> List[Tuple[str, Optional[str]]]:
+    """Задача для пула: [(workout_id, s)] из workout_streams_preview → [(workout_id, hr_hist | None)]."""
+    out = []
+    for wid, s in previews:
+        s = s or {}
+        t = np.asarray([np.nan if v is None else v for v in (s.get("time_s") or [])], float)
+        hr = np.asarray([np.nan if v is None else v for v in (s.get("hr") or [])], float)
+        if len(t) < 2 or len(hr) != len(t):
+            out.append((wid, None))
+            continue
+        # превью прорежено: вес точки — интервал до следующей
+        dt_s = np.append(np.diff(t), 0.0)
+        dt_s[(dt_s < 0) | (dt_s > MAX_DT_S)] = 0.0
+        c = hr_histogram(hr, dt_s)
+        out.append((wid, encode_hist(c) if c is not None else None))
+    return out
+
+
+# ---------- векторный пересчёт ----------
+
+def trimp_weights(hr_rest: int, hr_max: int) -> np.ndarray:
+    """Вес секунды на ударе h — как utils.compute_trimp_timeweighted (минуты · относительная интенсивность · 100)."""
+    h = np.arange(N_BPM, dtype=float)
+    rel = np.clip((h - hr_rest) / max(1, hr_max - hr_rest), 0.0, None)
+    return rel * 100.0 / 60.0
+
+
+def zone_matrix(bounds: Sequence[int]) -> np.ndarray:
+    """(256 × зоны) индикатор: зоны как в utils.zones_time — (−∞, b1], (b1, b2], …, (bk, ∞)."""
+    z = np.searchsorted(np.asarray(sorted(bounds), float), np.arange(N_BPM), side="left")
+    return np.eye(len(bounds) + 1, dtype=np.float64)[z]
+
+
+def recompute_batch(C: np.ndarray, hr_rest: int, hr_max: int, bounds: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """C — (n × 256) секунд на удар. Возвращает (TRIMP[n], секунды в зонах [n × k])."""
+    C = np.asarray(C, np.float64)
+    return C @ trimp_weights(hr_rest, hr_max), C @ zone_matrix(bounds)
+
+
+def params_signature(hr_rest: int, hr_max: int, bounds: Sequence[int]) -> str:
+    key = f"{int(hr_rest)}|{int(hr_max)}|{','.join(str(int(b)) for b in bounds)}|v{HIST_VERSION}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+# ---------- задание ----------
+
+def _backfill(missing: List[str], fetch_previews: Callable[[List[str]], List[Dict[str, Any]]],
+              pool: Optional[ProcessPoolExecutor]) -> Dict[str, str]:
+    """hr_hist для строк без гистограммы — из превью-стримов; JSON-массивы разбираем в пуле процессов."""
+    previews = [(str(p["workout_id"]), p.get("s")) for p in fetch_previews(missing)]
+    chunks = [previews[i:i + PREVIEW_CHUNK] for i in range(0, len(previews), PREVIEW_CHUNK)]
+    if pool is None or len(chunks) < 2:
+        results = [hists_from_previews(c) for c in chunks]
+    else:
+        results = list(pool.map(hists_from_previews, chunks))
+    return {wid: h for part in results for wid, h in part if h}
+
+
+def recompute_history(
+    supabase,
+    user_id: str,
+    hr_rest: int,
+    hr_max: int,
+    bounds: Sequence[int],
+    progress: Optional[Callable[[int, int], None]] = None,
+    batch: int = BATCH,
+    max_workers: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Пересчитывает trimp и zone_s всей истории пользователя. Возвращает итог чекпоинта
+    (done, total, updated, skipped, status). Повторный вызов с теми же параметрами продолжает с курсора,
+    с другими — начинает заново.
+    """
+    from db import (count_workouts, fetch_hr_hists, fetch_stream_previews, update_workout_metrics,
+                    fetch_recompute_state, save_recompute_state)
+
+    sig = params_signature(hr_rest, hr_max, bounds)
+    state = fetch_recompute_state(supabase, user_id) or {}
+    if state.get("signature") == sig and state.get("status") == "done":
+        return state
+    resume = state.get("signature") == sig and state.get("cursor")
+    state = {"signature": sig, "status": "running", "total": count_workouts(supabase, user_id),
+             "cursor": state["cursor"] if resume else None,
+             **{k: int(state.get(k) or 0) if resume else 0 for k in ("done", "updated", "skipped")}}
+    save_recompute_state(supabase, user_id, state)
+    if progress:
+        progress(state["done"], state["total"])
+
+    # keyset-пагинация по id: курсор чекпоинта — id последней обработанной тренировки
+    pool: Optional[ProcessPoolExecutor] = None   # поднимаем, только если есть что разбирать из превью
+    try:
+        while True:
+            part = fetch_hr_hists(supabase, user_id, after=state["cursor"], limit=batch)
+            if not part:
+                break
+            missing = [str(r["id"]) for r in part if not r.get("hr_hist")]
+            if pool is None and len(missing) > PREVIEW_CHUNK:
+                pool = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count() or 1)
+            fresh = _backfill(missing, lambda ids: fetch_stream_previews(supabase, user_id, ids), pool) if missing else {}
+            ids, hists = [], []
+            for r in part:
+                h = r.get("hr_hist") or fresh.get(str(r["id"]))
+                if h:
+                    ids.append(str(r["id"]))
+                    hists.append(h)
+            if ids:
+                C = np.stack([decode_hist(h) for h in hists])
+                trimp, zones = recompute_batch(C, hr_rest, hr_max, bounds)
+                out = []
+                for wid, h, t, z in zip(ids, hists, trimp, zones):
+                    row = {"id": wid, "trimp": int(round(t)) if t > 0 else None, "zone_s": [int(round(x)) for x in z]}
+                    if wid in fresh:
+                        row["hr_hist"] = h
+                    out.append(row)
+                update_workout_metrics(supabase, out)
+            state.update(cursor=str(part[-1]["id"]), done=state["done"] + len(part),
+                         updated=state["updated"] + len(ids), skipped=state["skipped"] + len(part) - len(ids))
+            save_recompute_state(supabase, user_id, state)
+            if progress:
+                progress(state["done"], max(state["total"], state["done"]))
+            if len(part) < batch:
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    state.update(status="done", finished_at=dt.datetime.now(dt.timezone.utc).isoformat())
+    save_recompute_state(supabase, user_id, state)
+    return state
@@ -0,0 +1,145 @@
+# records_view.py — постраничный просмотр всех точок df_rec: столбцы, диапазон времени, сортировка
+#
+# В браузер уходит только текущая страница. Фильтр по времени — бинарный поиск по отсортированному
+# t_rel_s (диапазон точек непрерывен), страница без сортировки — срез этого диапазона: в Arrow это
+# Table.slice без копирования, в запасном варианте — iloc по тем же границам. Сортировка — один argsort
+# на (столбец, направление), дальше страница — take по куску перестановки. Стоимость страницы не зависит
+# от длины файла. pyarrow ставится вместе со streamlit; без него работаем на pandas/NumPy.
+
+from __future__ import annotations
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from memory_governor import get_governor, session_id
+
+# --- Arrow (optional) ---
+try:
+    import pyarrow as pa  # type: ignore
+except Exception:
+    pa = None
+
+PAGE_SIZES = (50, 100, 250, 500)
+DEFAULT_COLUMNS = ("timestamp", "t_rel_s", "hr", "speed", "pace", "cadence", "power", "elev", "dist")
+MAX_VIEWS = 2          # представлений на сессию: текущая тренировка и предыдущая
+
+
+class RecordsView:
+    """Данные одной тренировки для постраничного вывода: колонки, ось времени и кэш сортировок."""
+
+    def __init__(self, df_rec: pd.DataFrame):
+        df = df_rec.reset_index(drop=True)
+        self.n = len(df)
+        self.columns: List[str] = [c for c in df.columns if c not in ("lat_sc", "lon_sc")]
+        self.t = pd.to_numeric(df["t_rel_s"], errors="coerce").to_numpy(float) if "t_rel_s" in df \
+            else np.arange(self.n, dtype=float)
+        self._df = df[self.columns]
+        self._table = pa.Table.from_pandas(self._df, preserve_index=False) if pa is not None else None
+        self._orders: Dict[Tuple[str, bool], np.ndarray] = {}
+        self._ranged: Tuple[Optional[tuple], Optional[np.ndarray]] = (None, None)   # последняя отфильтрованная
+
+    @property
+    def nbytes(self) -> int:
+        """Память представления (для memory_governor): копия колонок, Arrow-таблица, перестановки."""
+        n = int(self._df.memory_usage(index=True, deep=True).sum())
+        n += int(self._table.nbytes) if self._table is not None else 0
+        return n + sum(o.nbytes for o in self._orders.values())
+
+    def time_range(self, t0: Optional[float] = None, t1: Optional[float] = None) -> Tuple[int, int]:
+        """Границы [lo, hi) точек с t_rel_s в [t0, t1] — бинарный поиск, t_rel_s отсортирован."""
+        lo = 0 if t0 is None else int(np.searchsorted(self.t, t0, side="left"))
+        hi = self.n if t1 is None else int(np.searchsorted(self.t, t1, side="right"))
+        return lo, max(lo, hi)
+
+    def _order(self, col: str, desc: bool) -> np.ndarray:
+        key = (col, desc)
+        if key not in self._orders:
+            x = self._df[col]
+            x = x.to_numpy() if not pd.api.types.is_numeric_dtype(x) else pd.to_numeric(x, errors="coerce").to_numpy(float)
+            o = np.argsort(x, kind="stable")
+            if desc:
+                # пропуски (NaN) остаются в конце при любом направлении
+                nan = pd.isna(x[o])
+                o = np.concatenate((o[~nan][::-1], o[nan]))
+            self._orders[key] = o
+        return self._orders[key]
+
+    def page(self, page: int, size: int, columns: Optional[Sequence[str]] = None,
+             t0: Optional[float] = None, t1: Optional[float] = None,
+             sort: Optional[str] = None, desc: bool = False) -> Tuple[pd.DataFrame, int]:
+        """Страница (номер с 0) и число строк после фильтра по времени."""
+        cols = [c for c in (columns or self.columns) if c in self.columns] or self.columns
+        lo, hi = self.time_range(t0, t1)
+        total = hi - lo
+        a = min(max(page, 0) * size, total)
+        b = min(a + size, total)
+        if sort and sort in self.columns:
+            o = self._order(sort, desc)
+            if lo > 0 or hi < self.n:
+                # фильтр по времени — маска на готовой перестановке, один раз на диапазон (листание — без неё)
+                rk = (sort, desc, lo, hi)
+                if self._ranged[0] != rk:
+                    self._ranged = (rk, o[(o >= lo) & (o < hi)])
+                o = self._ranged[1]
+            idx = o[a:b]
+            if self._table is not None:
+                out = self._table.select(cols).take(pa.array(idx)).to_pandas()
+            else:
+                out = self._df.iloc[idx][cols]
+            out.index = idx
+            return out, total
+        if self._table is not None:
+            out = self._table.select(cols).slice(lo + a, b - a).to_pandas()
+        else:
+            out = self._df.iloc[lo + a:lo + b][cols]
+        out.index = pd.RangeIndex(lo + a, lo + b)
+        return out, total
+
+
+def records_view(df_rec: pd.DataFrame, key: str) -> RecordsView:
+    """
+    Представление для тренировки key (строится один раз на загрузку файла). Живёт в реестре памяти сессии
+    как пересчитываемое: при нехватке памяти выбрасывается, а не пишется на диск.
+    """
+    gov, sid = get_governor(), session_id()
+    view = gov.get(sid, ("records_view", key))
+    if view is None:
+        keys = st.session_state.setdefault("_records_view_keys", [])
+        if key in keys:                      # реестр уже выбросил его при нехватке памяти
+            keys.remove(key)
+        while len(keys) >= MAX_VIEWS:
+            gov.discard(sid, ("records_view", keys.pop(0)))
+        view = gov.put(sid, ("records_view", key), RecordsView(df_rec), spill=False)
+        keys.append(key)
+    return view
+
+
+def render_records(df_rec: pd.DataFrame, key: str) -> None:
+    """Таблица точек по страницам: выбор столбцов, диапазон времени, сортировка."""
+    if df_rec is None or df_rec.empty:
+        st.dataframe(pd.DataFrame(columns=["—"]))
+        return
+    view = records_view(df_rec, key)
+    c1, c2, c3 = st.columns([3, 2, 1])
+    with c1:
+        cols = st.multiselect("Столбцы", view.columns, key=f"rv_cols_{key}",
+                              default=[c for c in DEFAULT_COLUMNS if c in view.columns] or view.columns)
+    with c2:
+        sort = st.selectbox("Сортировка", ["—"] + view.columns, key=f"rv_sort_{key}")
+        desc = st.checkbox("по убыванию", key=f"rv_desc_{key}")
+    with c3:
+        size = st.selectbox("Строк", PAGE_SIZES, index=1, key=f"rv_size_{key}")
+    t_max = float(np.nanmax(view.t)) / 60.0 if view.n else 0.0
+    t0, t1 = (st.slider("Время, мин", 0.0, max(t_max, 0.1), (0.0, max(t_max, 0.1)), key=f"rv_time_{key}")
+              if t_max > 0 else (None, None))
+    t0s = t0 * 60.0 if t0 else None
+    t1s = t1 * 60.0 if t1 is not None and t1 < t_max else None
+    total = view.time_range(t0s, t1s)
+    pages = max(1, -(-(total[1] - total[0]) // size))
+    page = st.number_input(f"Страница (из {pages})", 1, pages, 1, key=f"rv_page_{key}") - 1
+    out, n = view.page(int(page), int(size), cols, t0s, t1s, None if sort == "—" else sort, desc)
+    st.dataframe(out)
+    st.caption(f"Строки {page * size + 1 if n else 0}–{page * size + len(out)} из {n}"
+               + (f" (всего в файле {view.n})" if n < view.n else "") + ".")
@@ -0,0 +1,323 @@
+# segments.py — поиск всех прохождений сегмента (подъём, круг стадиона, паркран) по истории треков
+#
+# Индекс: сетка CELL_DEG×CELL_DEG, инвертированный список «ячейка → тренировки» по упрощённым трекам
+# (уровень зума 14 из gps.build_track) + bbox каждой тренировки. Запрос берёт кандидатов, у которых
+# есть ячейки и у старта, и у финиша сегмента, отсекает по bbox, и только для них грузит полный трек:
+# пересечение стартовой/финишной линии (с интерполяцией времени) и векторная проверка «шёл по сегменту».
+
+from __future__ import annotations
+import base64
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from gps import decode_track, track_full, EARTH_R
+
+CELL_DEG = 0.005             # ~550 м по широте
+INDEX_ZOOM = "14"            # уровень упрощения, из которого строим индекс
+GATE_HALF_WIDTH_M = 25.0     # полуширина стартовой/финишной линии
+MATCH_TOLERANCE_M = 30.0     # максимум отклонения трека от сегмента
+MIN_COVERAGE = 0.9           # доля точек сегмента, возле которых трек реально прошёл
+_LON_CELLS = int(round(360 / CELL_DEG)) + 1
+
+TrackLoader = Callable[[List[str]], Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]]
+
+
+# ---------- геометрия ----------
+
+def _project(lat: np.ndarray, lon: np.ndarray, lat0: float, lon0: float) -> Tuple[np.ndarray, np.ndarray]:
+    k = np.cos(np.radians(lat0))
+    return np.radians(lon - lon0) * EARTH_R * k, np.radians(lat - lat0) * EARTH_R
+
+
+def _densify(lat: np.ndarray, lon: np.ndarray, step_deg: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Точки вдоль полилинии не реже step_deg — чтобы длинные прямые отрезки упрощённого трека не пропускали ячейки."""
+    if len(lat) < 2:
+        return lat, lon
+    d = np.maximum(np.abs(np.diff(lat)), np.abs(np.diff(lon)))
+    k = np.maximum(1, np.ceil(d / step_deg).astype(np.int64))
+    seg = np.repeat(np.arange(len(k)), k)
+    frac = (np.arange(int(k.sum())) - np.repeat(np.cumsum(k) - k, k)) / np.repeat(k, k)
+    la = lat[seg] + frac * (lat[seg + 1] - lat[seg])
+    lo = lon[seg] + frac * (lon[seg + 1] - lon[seg])
+    return np.append(la, lat[-1]), np.append(lo, lon[-1])
+
+
+def cells_of(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Уникальные id ячеек сетки, через которые проходит полилиния."""
+    la, lo = _densify(np.asarray(lat, float), np.asarray(lon, float), CELL_DEG / 2)
+    i = np.floor((la + 90.0) / CELL_DEG).astype(np.int64)
+    j = np.floor((lo + 180.0) / CELL_DEG).astype(np.int64)
+    return np.unique(i * _LON_CELLS + j)
+
+
+def _neighbourhood(lat: float, lon: float) -> np.ndarray:
+    """Ячейка точки и 8 соседей (допуск по краям ячейки)."""
+    i = int(np.floor((lat + 90.0) / CELL_DEG))
+    j = int(np.floor((lon + 180.0) / CELL_DEG))
+    di, dj = np.meshgrid([-1, 0, 1], [-1, 0, 1])
+    return ((i + di) * _LON_CELLS + (j + dj)).ravel()
+
+
+def polyline_distance(px: np.ndarray, py: np.ndarray, qx: np.ndarray, qy: np.ndarray, chunk: int = 2048) -> np.ndarray:
+    """Расстояние от каждой точки (px, py) до полилинии q (м). Матрица точки×отрезки считается кусками."""
+    if len(qx) == 1:
+        return np.hypot(px - qx[0], py - qy[0])
+    ax, ay = qx[:-1], qy[:-1]
+    dx, dy = qx[1:] - ax, qy[1:] - ay
+    L2 = dx * dx + dy * dy
+    L2 = np.where(L2 > 0, L2, 1.0)
+    out = np.empty(len(px))
+    for a in range(0, len(px), chunk):
+        x = px[a:a + chunk, None] - ax
+        y = py[a:a + chunk, None] - ay
+        t = np.clip((x * dx + y * dy) / L2, 0.0, 1.0)
+        out[a:a + chunk] = np.hypot(x - t * dx, y - t * dy).min(axis=1)
+    return out
+
+
+def _gate_crossings(x: np.ndarray, y: np.ndarray, t: np.ndarray, gx: float, gy: float,
+                    ux: float, uy: float, half_width: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Пересечения линии ворот (через точку g, перпендикулярно направлению u) в направлении u.
+    Возвращает (индекс точки после пересечения, интерполированное время пересечения).
+    """
+    s = (x - gx) * ux + (y - gy) * uy              # вдоль направления
+    lat_off = np.abs((x - gx) * uy - (y - gy) * ux)  # поперёк
+    hit = np.flatnonzero((s[:-1] < 0) & (s[1:] >= 0) & (np.minimum(lat_off[:-1], lat_off[1:]) <= half_width)) + 1
+    if not len(hit):
+        return hit, np.empty(0)
+    s0, s1 = s[hit - 1], s[hit]
+    frac = np.where(s1 > s0, -s0 / (s1 - s0), 0.0)
+    return hit, t[hit - 1] + frac * (t[hit] - t[hit - 1])
+
+
+def _direction(x: np.ndarray, y: np.ndarray, at_end: bool, min_len_m: float = 20.0) -> Tuple[float, float]:
+    """Единичный вектор направления сегмента у старта/финиша (по точке не ближе min_len_m)."""
+    if at_end:
+        x, y = x[::-1], y[::-1]
+    d = np.hypot(x - x[0], y - y[0])
+    k = int(np.argmax(d >= min_len_m)) if (d >= min_len_m).any() else len(x) - 1
+    vx, vy = x[k] - x[0], y[k] - y[0]
+    n = float(np.hypot(vx, vy)) or 1.0
+    return (-vx / n, -vy / n) if at_end else (vx / n, vy / n)
+
+
+# ---------- сегмент ----------
+
+class Segment:
+    """Сегмент — полилиния в градусах; старт/финиш — её крайние точки."""
+
+    def __init__(self, lat: Sequence[float], lon: Sequence[float], name: str = "", segment_id: Optional[str] = None,
+                 tolerance_m: float = MATCH_TOLERANCE_M, gate_half_width_m: float = GATE_HALF_WIDTH_M):
+        self.lat = np.asarray(lat, float)
+        self.lon = np.asarray(lon, float)
+        if len(self.lat) < 2:
+            raise ValueError("сегменту нужно минимум 2 точки")
+        self.name = name
+        self.id = segment_id or name
+        self.tolerance_m = tolerance_m
+        self.gate_half_width_m = gate_half_width_m
+        self.lat0, self.lon0 = float(self.lat.mean()), float(self.lon.mean())
+        self.x, self.y = _project(self.lat, self.lon, self.lat0, self.lon0)
+        self.length_m = float(np.hypot(np.diff(self.x), np.diff(self.y)).sum())
+        self.bbox = (self.lat.min(), self.lon.min(), self.lat.max(), self.lon.max())
+        # контрольные точки сегмента для проверки покрытия — примерно каждые 10 м
+        step = 10.0 / 111_320.0
+        self._clat, self._clon = _densify(self.lat, self.lon, step)
+
+    @classmethod
+    def from_track(cls, lat: np.ndarray, lon: np.ndarray, i0: int, i1: int, name: str = "", **kw) -> "Segment":
+        """Кусок уже загруженного трека [i0, i1] как сегмент (например, подъём из текущей тренировки)."""
+        return cls(lat[i0:i1 + 1], lon[i0:i1 + 1], name=name, **kw)
+
+    def match(self, lat: np.ndarray, lon: np.ndarray, t: np.ndarray) -> List[Dict[str, float]]:
+        """Все прохождения сегмента в одном треке: [{start_s, end_s, elapsed_s, max_dev_m, coverage}]."""
+        if len(lat) < 2:
+            return []
+        x, y = _project(lat, lon, self.lat0, self.lon0)
+        u0 = _direction(self.x, self.y, at_end=False)
+        u1 = _direction(self.x, self.y, at_end=True)
+        si, st = _gate_crossings(x, y, t, self.x[0], self.y[0], *u0, self.gate_half_width_m)
+        ei, et = _gate_crossings(x, y, t, self.x[-1], self.y[-1], *u1, self.gate_half_width_m)
+        if not len(si) or not len(ei):
+            return []
+        # для каждого старта — первый финиш после него; берём только последний старт перед этим финишем
+        k = np.searchsorted(ei, si, side="right")
+        ok = k < len(ei)
+        si, st, k = si[ok], st[ok], k[ok]
+        nxt = np.append(si[1:], np.iinfo(np.int64).max)
+        last = nxt >= ei[k]
+        cx, cy = _project(self._clat, self._clon, self.lat0, self.lon0)
+        out = []
+        for a, ta, kk in zip(si[last], st[last], k[last]):
+            b, tb = ei[kk], et[kk]
+            px, py = x[a - 1:b + 1], y[a - 1:b + 1]
+            dev = polyline_distance(px, py, self.x, self.y)
+            max_dev = float(dev[1:-1].max()) if len(dev) > 2 else 0.0
+            if max_dev > self.tolerance_m:
+                continue
+            cov = float((polyline_distance(cx, cy, px, py) <= self.tolerance_m).mean())
+            if cov < MIN_COVERAGE:
+                continue
+            out.append({"start_s": float(ta), "end_s": float(tb), "elapsed_s": float(tb - ta),
+                        "max_dev_m": round(max_dev, 1), "coverage": round(cov, 3)})
+        return out
+
+
+# ---------- индекс ----------
+
+class SegmentIndex:
+    """Инвертированный индекс «ячейка сетки → тренировки» + bbox; обновляется по одной тренировке."""
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self._pos: Dict[str, int] = {}
+        self._bbox = np.empty((0, 4))    # буфер с запасом: add не копирует весь массив (см. bbox)
+        self.cells: Dict[int, Set[int]] = {}
+        self._cells_of: Dict[int, List[int]] = {}   # позиция → её ячейки: remove трогает только их
+        self._alive: List[bool] = []
+        self._lock = threading.RLock()   # индекс общий для сессий (st.cache_resource)
+
+    def __len__(self) -> int:
+        return sum(self._alive)
+
+    @property
+    def bbox(self) -> np.ndarray:
+        """(n × 4) lat0, lon0, lat1, lon1 по позициям; у удалённых — NaN."""
+        return self._bbox[:len(self.ids)]
+
+    def _append_bbox(self, row: Sequence[float]) -> None:
+        n = len(self.ids)
+        if n >= len(self._bbox):
+            grown = np.full((max(2 * len(self._bbox), 64), 4), np.nan)
+            grown[:n] = self._bbox[:n]
+            self._bbox = grown
+        self._bbox[n] = row
+
+    def add(self, workout_id: str, lat: np.ndarray, lon: np.ndarray) -> None:
+        """Добавить/перезаписать тренировку по (упрощённой) полилинии."""
+        if len(lat) == 0:
+            return
+        cells = cells_of(lat, lon).tolist()
+        with self._lock:
+            if workout_id in self._pos:
+                self.remove(workout_id)
+            p = len(self.ids)
+            self._append_bbox([np.min(lat), np.min(lon), np.max(lat), np.max(lon)])
+            self.ids.append(workout_id)
+            self._alive.append(True)
+            self._pos[workout_id] = p
+            self._cells_of[p] = cells
+            for c in cells:
+                self.cells.setdefault(c, set()).add(p)
+
+    def add_track(self, workout_id: str, track: Dict[str, Any]) -> None:
+        """Строка workout_tracks (gps.build_track / db.fetch_tracks) → add по уровню INDEX_ZOOM."""
+        levels = track.get("levels") or {}
+        if INDEX_ZOOM in levels:
+            lat, lon = decode_track(base64.b64decode(levels[INDEX_ZOOM]))
+        elif levels:
+            lat, lon = decode_track(base64.b64decode(levels[max(levels, key=int)]))
+        elif track.get("polyline"):
+            lat, lon = decode_track(base64.b64decode(track["polyline"]))
+        else:
+            return
+        self.add(str(workout_id), lat, lon)
+
+    def remove(self, workout_id: str) -> None:
+        with self._lock:
+            p = self._pos.pop(workout_id, None)
+            if p is None:
+                return
+            self._alive[p] = False
+            self._bbox[p] = np.nan
+            for c in self._cells_of.pop(p, ()):
+                s = self.cells.get(c)
+                if s is not None:
+                    s.discard(p)
+                    if not s:
+                        del self.cells[c]
+
+    def candidates(self, seg: Segment) -> List[str]:
+        """Тренировки, проходящие и возле старта, и возле финиша, с bbox, пересекающим bbox сегмента."""
+        def _near(lat, lon) -> Set[int]:
+            out: Set[int] = set()
+            for c in _neighbourhood(lat, lon).tolist():
+                out |= self.cells.get(c, set())
+            return out
+
+        with self._lock:
+            pos = _near(seg.lat[0], seg.lon[0]) & _near(seg.lat[-1], seg.lon[-1])
+            if not pos:
+                return []
+            p = np.fromiter(pos, dtype=np.int64)
+            pad = seg.tolerance_m / 111_320.0
+            b = self.bbox[p]
+            lat0, lon0, lat1, lon1 = seg.bbox
+            ok = (b[:, 0] <= lat0 + pad) & (b[:, 2] >= lat1 - pad) & (b[:, 1] <= lon0 + pad) & (b[:, 3] >= lon1 - pad)
+            return [self.ids[i] for i in np.sort(p[ok]).tolist()]
+
+    def find_efforts(self, seg: Segment, load_tracks: TrackLoader, batch: int = 50) -> pd.DataFrame:
+        """
+        Прохождения сегмента по всей истории. load_tracks(ids) -> {id: (lat, lon, t_s)} грузит полные треки
+        только кандидатов, пачками.
+        """
+        cand = self.candidates(seg)
+        rows = []
+        for a in range(0, len(cand), batch):
+            tracks = load_tracks(cand[a:a + batch])
+            for wid, (lat, lon, t) in tracks.items():
+                for e in seg.match(lat, lon, t):
+                    rows.append({"workout_id": wid, **e})
+        df = pd.DataFrame(rows, columns=["workout_id", "start_s", "end_s", "elapsed_s", "max_dev_m", "coverage"])
+        if not df.empty:
+            df = df.sort_values("elapsed_s").reset_index(drop=True)
+            df.insert(0, "rank", np.arange(1, len(df) + 1))
+        return df
+
+    # --- persistence ---
+    def save(self, path: str) -> None:
+        """npz: ids, bbox и CSR «ячейка → позиции тренировок»."""
+        alive = np.array(self._alive, dtype=bool)
+        cells = np.array(sorted(c for c, s in self.cells.items() if s), dtype=np.int64)
+        members = [np.fromiter(sorted(self.cells[c]), dtype=np.int64) for c in cells.tolist()]
+        indptr = np.concatenate([[0], np.cumsum([len(m) for m in members])]).astype(np.int64)
+        np.savez_compressed(
+            path, ids=np.array(self.ids, dtype=object).astype(str), alive=alive, bbox=self.bbox,
+            cells=cells, indptr=indptr, members=np.concatenate(members) if members else np.empty(0, np.int64),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "SegmentIndex":
+        z = np.load(path, allow_pickle=False)
+        idx = cls()
+        idx.ids = z["ids"].tolist()
+        idx._alive = z["alive"].tolist()
+        idx._pos = {w: i for i, w in enumerate(idx.ids) if idx._alive[i]}
+        idx._bbox = np.array(z["bbox"], dtype=float).reshape(-1, 4)
+        cells, indptr, members = z["cells"], z["indptr"], z["members"]
+        idx.cells = {int(c): set(members[indptr[i]:indptr[i + 1]].tolist()) for i, c in enumerate(cells)}
+        for c, s in idx.cells.items():
+            for p in s:
+                idx._cells_of.setdefault(p, []).append(c)
+        return idx
+
+
+def build_index(tracks: Iterable[Dict[str, Any]]) -> SegmentIndex:
+    """Индекс по строкам workout_tracks (достаточно bbox + levels — полные треки не нужны)."""
+    idx = SegmentIndex()
+    for tr in tracks:
+        idx.add_track(tr["workout_id"], tr)
+    return idx
+
+
+def db_track_loader(supabase, user_id: str) -> TrackLoader:
+    """Загрузчик полных треков кандидатов одним запросом на пачку."""
+    from db import fetch_tracks
+
+    def load(ids: List[str]) -> Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        return {str(r["workout_id"]): track_full(r) for r in fetch_tracks(supabase, user_id, ids, full=True)}
+    return load
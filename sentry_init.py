@@ -12,4 +12,9 @@ sentry_sdk.init(
     profiles_sample_rate=1.0 if os.getenv("APP_ENV") != "production" else 0.1,
     integrations=[LoggingIntegration(level=None, event_level="ERROR")],
     send_default_pii=False,  # не собираем PII по умолчанию
-)
\ No newline at end of file
+)
+
+# спаны и гистограммы горячих путей — только когда Sentry реально сконфигурирован
+if os.getenv("SENTRY_DSN_BACKEND"):
+    import instrument
+    instrument.enable()
@@ -0,0 +1,215 @@
+# similar.py — «похожие тренировки»: вектор признаков на тренировку и поиск ближайших (BLAS, float32)
+#
+# Вектор (DIM чисел): сводка (лог. дистанция/длительность, средний HR, скорость, набор/сброс на км),
+# доли времени в 5 зонах %HRmax, профиль темпа (скорость по долям времени / средняя) и профиль высоты
+# (по долям дистанции, от средней). Хранится в workouts.features — base64 от float32.
+# Индекс пользователя — матрица n×DIM float32: стандартизуем по столбцам, пропуски → 0 (= среднее),
+# группы признаков взвешиваем 1/√размер, чтобы профили из 8 чисел не перевешивали сводку.
+# Запрос — одно матрично-векторное произведение (||a||² + ||b||² − 2·A·b) и argpartition по top-k.
+
+from __future__ import annotations
+import base64
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+FEATURE_VERSION = 1
+N_PROFILE = 8
+HR_ZONES_PCT = (0.5, 0.6, 0.7, 0.8, 0.9)   # границы зон в долях HRmax
+GROUPS = {"summary": (0, 6), "zones": (6, 11), "pace": (11, 19), "elev": (19, 27)}
+DIM = 27
+DIST_BAND = 0.25    # «та же дистанция»: ±25 %
+
+
+# ---------- признаки ----------
+
+def _bin_means(values: np.ndarray, frac: np.ndarray) -> np.ndarray:
+    ok = np.isfinite(values) & np.isfinite(frac)
+    out = np.full(N_PROFILE, np.nan)
+    if ok.sum() < N_PROFILE:
+        return out
+    b = np.minimum((frac[ok] * N_PROFILE).astype(np.int64), N_PROFILE - 1)
+    n = np.bincount(b, minlength=N_PROFILE)
+    s = np.bincount(b, weights=values[ok], minlength=N_PROFILE)
+    out[n > 0] = s[n > 0] / n[n > 0]
+    return out
+
+
+def _col(df: pd.DataFrame, name: str) -> np.ndarray:
+    if name not in df:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[name], errors="coerce").to_numpy(float)
+
+
+def workout_features(summary: Dict[str, Any], df_rec: Optional[pd.DataFrame], hr_max: int) -> np.ndarray:
+    """Вектор признаков тренировки (float32, DIM); NaN — признак неизвестен."""
+    v = np.full(DIM, np.nan)
+    dist_km = summary.get("distance_km") or None
+    time_s = summary.get("time_s") or None
+    v[0] = np.log1p(dist_km) if dist_km else np.nan
+    v[1] = np.log1p(time_s / 60.0) if time_s else np.nan
+    v[2] = summary.get("avg_hr") or np.nan
+    v[3] = dist_km * 1000.0 / time_s if (dist_km and time_s) else np.nan
+    if df_rec is None or df_rec.empty:
+        return v.astype(np.float32)
+
+    t = _col(df_rec, "t_rel_s")
+    dt = np.nan_to_num(_col(df_rec, "dt_s"), nan=0.0)
+    hr = _col(df_rec, "hr")
+    spd = _col(df_rec, "speed")
+    elev = _col(df_rec, "elev")
+    dist = _col(df_rec, "dist")
+
+    if np.isfinite(elev).sum() > 1 and dist_km:
+        de = np.diff(elev[np.isfinite(elev)])
+        v[4] = de[de > 0].sum() / dist_km
+        v[5] = -de[de < 0].sum() / dist_km
+    if np.isfinite(hr).any() and hr_max:
+        edges = np.concatenate(([-np.inf], np.asarray(HR_ZONES_PCT[1:]) * hr_max, [np.inf]))
+        ok = np.isfinite(hr)
+        z = np.bincount(np.digitize(hr[ok], edges[1:-1]), weights=dt[ok], minlength=5)[:5]
+        if z.sum() > 0:
+            v[6:11] = z / z.sum()
+    if np.isfinite(t).any() and np.nanmax(t) > 0:
+        prof = _bin_means(spd, t / np.nanmax(t))
+        mean = np.nanmean(spd[spd > 0]) if (spd > 0).any() else np.nan
+        v[11:19] = prof / mean if mean else np.nan
+    if np.isfinite(dist).any() and np.nanmax(dist) > 0:
+        prof = _bin_means(elev, dist / np.nanmax(dist))
+        v[19:27] = prof - np.nanmean(prof) if np.isfinite(prof).any() else np.nan
+    return v.astype(np.float32)
+
+
+def features_from_row(row: Dict[str, Any]) -> np.ndarray:
+    """Вектор строки workouts: сохранённый features или только сводка (старые строки)."""
+    if row.get("features"):
+        try:
+            return decode_features(row["features"])
+        except ValueError:
+            pass
+    dist_km = row.get("distance_km")
+    if dist_km is None and row.get("distance_m"):
+        dist_km = float(row["distance_m"]) / 1000.0
+    summary = {"distance_km": dist_km, "time_s": row.get("time_s") or row.get("duration_sec"),
+               "avg_hr": row.get("avg_hr")}
+    return workout_features(summary, None, 0)
+
+
+def encode_features(vec: np.ndarray) -> str:
+    """[версия][DIM × float32] → base64 (~150 байт)."""
+    raw = bytes([FEATURE_VERSION]) + np.asarray(vec, np.float32).tobytes()
+    return base64.b64encode(raw).decode("ascii")
+
+
+def decode_features(s: str) -> np.ndarray:
+    raw = base64.b64decode(s)
+    if not raw or raw[0] != FEATURE_VERSION or len(raw) != 1 + 4 * DIM:
+        raise ValueError("unknown features format")
+    return np.frombuffer(raw, np.float32, offset=1).copy()
+
+
+# ---------- индекс ----------
+
+def _group_weights() -> np.ndarray:
+    w = np.ones(DIM, np.float32)
+    for a, b in GROUPS.values():
+        w[a:b] = 1.0 / np.sqrt(b - a)
+    return w
+
+
+class SimilarIndex:
+    """Матрица признаков пользователя (n × DIM, float32) + метаданные для вывода (дата, дистанция, EF…)."""
+
+    def __init__(self, ids: Sequence[str], X: np.ndarray, meta: Optional[pd.DataFrame] = None):
+        self.ids: List[str] = [str(i) for i in ids]
+        self.X = np.asarray(X, np.float32).reshape(len(self.ids), DIM)
+        self.meta = meta.reset_index(drop=True) if meta is not None else pd.DataFrame(index=range(len(self.ids)))
+        self._lock = threading.Lock()   # индекс общий для сессий (st.cache_resource)
+        self._fit()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _fit(self) -> None:
+        X = self.X
+        with np.errstate(all="ignore"):
+            mu = np.nan_to_num(np.nanmean(X, axis=0)) if len(X) else np.zeros(DIM, np.float32)
+            sd = np.nan_to_num(np.nanstd(X, axis=0)) if len(X) else np.ones(DIM, np.float32)
+        sd[sd < 1e-6] = 1.0
+        self.mu, self.sd, self.w = mu.astype(np.float32), sd.astype(np.float32), _group_weights()
+        self.Z = np.ascontiguousarray(self._standardize(X))
+        self.norms = np.einsum("ij,ij->i", self.Z, self.Z)
+
+    def _standardize(self, X: np.ndarray) -> np.ndarray:
+        Z = (np.asarray(X, np.float32) - self.mu) / self.sd * self.w
+        return np.nan_to_num(Z).astype(np.float32)
+
+    def add(self, workout_id: str, vec: np.ndarray, meta: Optional[Dict[str, Any]] = None) -> None:
+        """Новая тренировка; статистики пересчитываются (n×DIM — доли миллисекунды на тысячах строк)."""
+        with self._lock:
+            if str(workout_id) in self.ids:
+                return
+            self.ids.append(str(workout_id))
+            self.X = np.vstack([self.X, np.asarray(vec, np.float32).reshape(1, DIM)])
+            self.meta = pd.concat([self.meta, pd.DataFrame([meta or {}])], ignore_index=True)
+            self._fit()
+
+    def remove(self, workout_ids: Iterable[str]) -> None:
+        """Убрать тренировки (скрытые дубли); статистики пересчитываются."""
+        drop = set(map(str, workout_ids))
+        with self._lock:
+            keep = np.array([i not in drop for i in self.ids], dtype=bool)
+            if keep.all():
+                return
+            self.ids = [i for i, k in zip(self.ids, keep) if k]
+            self.X = self.X[keep]
+            self.meta = self.meta[keep].reset_index(drop=True)
+            self._fit()
+
+    def query(self, vec: np.ndarray, k: int = 10, exclude: Optional[Iterable[str]] = None,
+              band: Optional[float] = DIST_BAND) -> pd.DataFrame:
+        """Top-k ближайших: workout_id, distance (в стандартизованном пространстве) + метаданные."""
+        with self._lock:
+            return self._query(vec, k, exclude, band)
+
+    def _query(self, vec: np.ndarray, k: int, exclude: Optional[Iterable[str]], band: Optional[float]) -> pd.DataFrame:
+        if not len(self.ids):
+            return pd.DataFrame(columns=["workout_id", "distance"])
+        q = self._standardize(np.asarray(vec, np.float32).reshape(1, DIM))[0]
+        d2 = self.norms + float(q @ q) - 2.0 * (self.Z @ q)
+        mask = np.ones(len(self.ids), bool)
+        if band and np.isfinite(vec[0]):
+            # дистанция в признаке — log1p(км): сравниваем в километрах
+            km, km0 = np.expm1(self.X[:, 0]), float(np.expm1(vec[0]))
+            mask &= np.abs(km - km0) <= band * km0
+        if exclude:
+            ex = set(map(str, exclude))
+            mask &= np.array([i not in ex for i in self.ids])
+        cand = np.flatnonzero(mask)
+        if not len(cand):
+            return pd.DataFrame(columns=["workout_id", "distance"])
+        k = min(k, len(cand))
+        top = cand[np.argpartition(d2[cand], k - 1)[:k]]
+        top = top[np.argsort(d2[top])]
+        out = self.meta.iloc[top].reset_index(drop=True)
+        out.insert(0, "distance", np.sqrt(np.maximum(d2[top], 0.0)).round(3))
+        out.insert(0, "workout_id", [self.ids[i] for i in top])
+        return out
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Dict[str, Any]]) -> "SimilarIndex":
+        rows = [r for r in rows if r.get("id")]
+        X = np.stack([features_from_row(r) for r in rows]) if rows else np.empty((0, DIM), np.float32)
+        meta = pd.DataFrame([{k: r.get(k) for k in META_COLUMNS} for r in rows], columns=list(META_COLUMNS))
+        return cls([r["id"] for r in rows], X, meta)
+
+
+# колонки workouts для вывода рядом с результатом
+META_COLUMNS = ("start_time", "distance_km", "time_s", "avg_hr", "ef", "pa_hr_pct")
+
+
+def build_index(supabase, user_id: str) -> SimilarIndex:
+    from db import fetch_features
+    return SimilarIndex.from_rows(fetch_features(supabase, user_id))
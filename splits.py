@@ -0,0 +1,162 @@
+# splits.py — аналитика по кругам и сплитам (км/миля) сегментными редукциями
+#
+# Каждой точке df_rec ставится номер отрезка: круги — searchsorted времени точки по start_time кругов,
+# сплиты — searchsorted накопленной дистанции по границам 1 км / 1 мили. Дальше все метрики считаются
+# за один проход по точкам: суммы — np.bincount с весами по номеру отрезка, максимумы — np.maximum.reduceat
+# по началам отрезков (точки отсортированы по времени, отрезки непрерывны), время в зонах и половины
+# для Pa:Hr — bincount по составному ключу (отрезок, зона/половина). Число кругов на время не влияет:
+# 100 кругов на стадионе считаются так же быстро, как одна пробежка.
+
+from __future__ import annotations
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+MILE_M = 1609.344
+DECOUPLING_MIN_POINTS = 40     # как utils.decoupling: меньше точек — Pa:Hr не считаем
+MAX_DT_S = 30                  # интервал длиннее — пауза, во время отрезка не идёт
+
+
+def _col(df: pd.DataFrame, name: str) -> np.ndarray:
+    if name not in df:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[name], errors="coerce").to_numpy(float)
+
+
+def _naive_ns(ts) -> np.ndarray:
+    t = pd.to_datetime(pd.Series(ts), errors="coerce")
+    if getattr(t.dt, "tz", None) is not None:
+        t = t.dt.tz_convert("UTC").dt.tz_localize(None)
+    return t.to_numpy("datetime64[ns]").astype(np.int64)
+
+
+def lap_index(df_rec: pd.DataFrame, df_laps: pd.DataFrame) -> Optional[np.ndarray]:
+    """Номер круга для каждой точки (по start_time кругов); точки до первого круга — в первый."""
+    if df_rec.empty or df_laps is None or df_laps.empty or "start_time" not in df_laps:
+        return None
+    starts = _naive_ns(df_laps["start_time"])
+    t = _naive_ns(df_rec["timestamp"])
+    if (starts == np.iinfo(np.int64).min).any():
+        return None
+    return np.clip(np.searchsorted(starts, t, side="right") - 1, 0, len(starts) - 1)
+
+
+def cumulative_distance(df_rec: pd.DataFrame) -> np.ndarray:
+    """Накопленная дистанция (м): колонка dist, а без неё — интеграл скорости по dt_s."""
+    d = _col(df_rec, "dist")
+    if np.isfinite(d).sum() > 1:
+        return np.fmax.accumulate(np.nan_to_num(d, nan=0.0))
+    v = np.nan_to_num(_col(df_rec, "speed"), nan=0.0)
+    return np.cumsum(v * np.nan_to_num(_col(df_rec, "dt_s"), nan=0.0))
+
+
+def split_index(df_rec: pd.DataFrame, unit_m: float = 1000.0) -> np.ndarray:
+    """Номер сплита для каждой точки: границы — кратные unit_m по накопленной дистанции."""
+    d = cumulative_distance(df_rec)
+    edges = unit_m * np.arange(1, int(d[-1] // unit_m) + 1) if len(d) else np.empty(0)
+    return np.searchsorted(edges, d, side="right")
+
+
+def segment_metrics(df_rec: pd.DataFrame, seg: np.ndarray, n_seg: Optional[int] = None,
+                    bounds: Optional[Sequence[int]] = None) -> pd.DataFrame:
+    """
+    Метрики по отрезкам: время, дистанция, темп, средние/максимумы, EF, Pa:Hr, набор высоты,
+    время в зонах. seg — неубывающий номер отрезка на точку (lap_index / split_index).
+    """
+    n = int(n_seg if n_seg is not None else (seg.max() + 1 if len(seg) else 0))
+    seg = np.asarray(seg, np.int64)
+    dt = np.nan_to_num(_col(df_rec, "dt_s"), nan=0.0)
+    dt = np.where(dt <= MAX_DT_S, dt, 0.0)
+    t = _col(df_rec, "t_rel_s")
+    d = cumulative_distance(df_rec)
+
+    def wmean(x: np.ndarray) -> np.ndarray:
+        ok = np.isfinite(x) & (dt > 0)
+        s = np.bincount(seg[ok], weights=x[ok] * dt[ok], minlength=n)
+        w = np.bincount(seg[ok], weights=dt[ok], minlength=n)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(w > 0, s / w, np.nan)
+
+    # границы отрезков в индексах точек; пустые отрезки (круг без точек) маскируем
+    first = np.searchsorted(seg, np.arange(n), side="left")
+    last = np.searchsorted(seg, np.arange(n), side="right") - 1
+    empty = last < first
+    starts = np.minimum(first, max(len(seg) - 1, 0))
+
+    def smax(x: np.ndarray) -> np.ndarray:
+        if not len(x):
+            return np.full(n, np.nan)
+        m = np.maximum.reduceat(np.where(np.isfinite(x), x, -np.inf), starts)
+        return np.where(empty | ~np.isfinite(m), np.nan, m)
+
+    out = pd.DataFrame({"segment": np.arange(1, n + 1)})
+    if not len(seg):
+        return out
+    # отрезок длится до начала следующего: берём t и d на его первой точке и на первой точке следующего
+    t_end = np.append(t[starts[1:]], t[-1])
+    d_end = np.append(d[starts[1:]], d[-1])
+    out["start_s"] = np.where(empty, np.nan, t[starts])
+    out["elapsed_s"] = np.where(empty, np.nan, t_end - t[starts])
+    out["timer_s"] = np.bincount(seg, weights=dt, minlength=n)
+    out["distance_m"] = np.where(empty, np.nan, d_end - d[starts])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out["pace_s_per_km"] = np.where(out["distance_m"] > 0, out["timer_s"] / out["distance_m"] * 1000.0, np.nan)
+
+    hr, spd = _col(df_rec, "hr"), _col(df_rec, "speed")
+    out["avg_hr"] = wmean(hr)
+    out["max_hr"] = smax(hr)
+    out["avg_speed_m_s"] = wmean(spd)
+    out["avg_cadence"] = wmean(_col(df_rec, "cadence"))
+    out["avg_power_w"] = wmean(_col(df_rec, "power"))
+    out["max_power_w"] = smax(_col(df_rec, "power"))
+    elev = _col(df_rec, "elev")
+    gain = np.clip(np.nan_to_num(np.diff(elev, prepend=np.nan), nan=0.0), 0.0, None)
+    out["ascent_m"] = np.bincount(seg, weights=gain, minlength=n)
+
+    # EF и Pa:Hr — как utils.efficiency_factor / decoupling: средние по валидным точкам, половины по счёту
+    valid = np.isfinite(spd) & np.isfinite(hr) & (hr > 0)
+    sv = seg[valid]
+    cnt = np.bincount(sv, minlength=n)
+    rank = np.arange(len(sv)) - np.searchsorted(sv, sv, side="left")     # номер валидной точки в отрезке
+    half = (rank >= cnt[sv] // 2).astype(np.int64)
+    key = 2 * sv + half
+    s_spd = np.bincount(key, weights=spd[valid], minlength=2 * n).reshape(n, 2)
+    s_hr = np.bincount(key, weights=hr[valid], minlength=2 * n).reshape(n, 2)
+    c_h = np.bincount(key, minlength=2 * n).reshape(n, 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out["EF"] = np.where(cnt > 0, s_spd.sum(1) / s_hr.sum(1), np.nan)
+        ef_h = (s_spd / c_h) / (s_hr / c_h)
+        ok = (cnt >= DECOUPLING_MIN_POINTS) & (c_h.min(axis=1) >= DECOUPLING_MIN_POINTS // 2) & (ef_h[:, 0] > 0)
+        out["Pa:Hr_%"] = np.where(ok, (ef_h[:, 1] / ef_h[:, 0] - 1.0) * 100.0, np.nan)
+
+    if bounds:
+        b = np.asarray(sorted(bounds), float)
+        okz = np.isfinite(hr) & (dt > 0)
+        z = np.searchsorted(b, hr[okz], side="left")          # (−∞, b1], (b1, b2], … как utils.zones_time
+        k = len(b) + 1
+        zs = np.bincount(seg[okz] * k + z, weights=dt[okz], minlength=n * k).reshape(n, k)
+        for i in range(k):
+            out[f"Z{i + 1}_s"] = zs[:, i].round()
+    return out
+
+
+def lap_metrics(df_rec: pd.DataFrame, df_laps: pd.DataFrame, bounds: Optional[Sequence[int]] = None) -> pd.DataFrame:
+    """df_laps с посчитанными по точкам метриками (колонки устройства сохраняются, наши — с префиксом calc_)."""
+    seg = lap_index(df_rec, df_laps)
+    if seg is None:
+        return df_laps
+    m = segment_metrics(df_rec, seg, len(df_laps), bounds).drop(columns=["segment"]).add_prefix("calc_")
+    return pd.concat([df_laps.reset_index(drop=True), m], axis=1)
+
+
+def distance_splits(df_rec: pd.DataFrame, unit: str = "km", bounds: Optional[Sequence[int]] = None) -> pd.DataFrame:
+    """Автосплиты по 1 км или 1 миле; последний сплит — остаток."""
+    if df_rec.empty:
+        return pd.DataFrame()
+    unit_m = MILE_M if unit == "mi" else 1000.0
+    seg = split_index(df_rec, unit_m)
+    out = segment_metrics(df_rec, seg, bounds=bounds).rename(columns={"segment": unit})
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out[f"pace_s_per_{unit}"] = np.where(out["distance_m"] > 0, out["timer_s"] / out["distance_m"] * unit_m, np.nan)
+    return out
@@ -0,0 +1,26 @@
+-- GPS-трек тренировки: полный трек (delta/zigzag/varint, base64) + упрощённые полилинии по зумам.
+-- Отдельная таблица, чтобы select * по workouts не тянул килобайты координат.
+
+create table if not exists public.workout_tracks (
+  workout_id uuid primary key references public.workouts(id) on delete cascade,
+  user_id uuid not null default auth.uid(),
+  n_points integer not null,
+  precision smallint not null default 5,
+  min_lat double precision,
+  min_lon double precision,
+  max_lat double precision,
+  max_lon double precision,
+  polyline text not null,
+  levels jsonb not null default '{}'::jsonb,
+  created_at timestamptz not null default now()
+);
+
+create index if not exists workout_tracks_user_idx on public.workout_tracks (user_id);
+
+alter table public.workout_tracks enable row level security;
+
+drop policy if exists workout_tracks_owner on public.workout_tracks;
+create policy workout_tracks_owner on public.workout_tracks
+  for all
+  using (user_id = auth.uid())
+  with check (user_id = auth.uid());
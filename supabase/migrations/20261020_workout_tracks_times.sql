@@ -0,0 +1,3 @@
+-- Время точек трека (секунды от старта, delta/varint, base64) — нужно для времени на сегментах.
+
+alter table public.workout_tracks add column if not exists times text;
@@ -0,0 +1,16 @@
+-- Персональная тепловая карта: разреженная пирамида тайлов (heatmap.Heatmap.to_bytes, base64), одна строка на пользователя.
+
+create table if not exists public.user_heatmaps (
+  user_id uuid primary key default auth.uid(),
+  tiles text not null,
+  n_workouts integer not null default 0,
+  updated_at timestamptz not null default now()
+);
+
+alter table public.user_heatmaps enable row level security;
+
+drop policy if exists user_heatmaps_owner on public.user_heatmaps;
+create policy user_heatmaps_owner on public.user_heatmaps
+  for all
+  using (user_id = auth.uid())
+  with check (user_id = auth.uid());
@@ -0,0 +1,11 @@
+-- Аналитика мощности (power.py): FTP/CP/W′ в профиле, IF и TSS по тренировке.
+-- avg_power_w / max_power_w / np_power_w в workouts уже есть (их пишет и edge-функция импорта).
+
+alter table public.profiles
+  add column if not exists ftp_w integer,
+  add column if not exists cp_w integer,
+  add column if not exists w_prime_j integer;
+
+alter table public.workouts
+  add column if not exists intensity_factor numeric,
+  add column if not exists tss numeric;
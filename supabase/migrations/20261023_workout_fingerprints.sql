@@ -0,0 +1,10 @@
+-- Отпечатки тренировок для поиска дублей (dedup.py) и ссылка дубля на оставленную копию.
+-- Дубли не удаляются физически: deleted_at + duplicate_of, дашборды их уже пропускают.
+
+alter table public.workouts
+  add column if not exists fingerprint jsonb,
+  add column if not exists duplicate_of uuid references public.workouts(id) on delete set null;
+
+create index if not exists workouts_user_start_idx
+  on public.workouts (user_id, start_time)
+  where deleted_at is null;
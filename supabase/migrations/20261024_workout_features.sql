@@ -0,0 +1,3 @@
+-- Вектор признаков тренировки для поиска похожих (similar.py): base64 от [версия][float32 × 27].
+
+alter table public.workouts add column if not exists features text;
@@ -0,0 +1,48 @@
+-- Пересчёт TRIMP/зон по истории при смене HR-профиля (recompute.py).
+-- hr_hist — секунды на удар пульса (base64, varint), zone_s — секунды в зонах по текущим границам.
+
+alter table public.workouts
+  add column if not exists hr_hist text,
+  add column if not exists zone_s jsonb;
+
+-- чекпоинт задания: signature — хеш параметров профиля, cursor — последний обработанный id
+create table if not exists public.profile_recompute (
+  user_id uuid primary key default auth.uid(),
+  signature text not null,
+  status text not null default 'running',
+  total integer not null default 0,
+  done integer not null default 0,
+  updated integer not null default 0,
+  skipped integer not null default 0,
+  cursor uuid,
+  finished_at timestamptz,
+  updated_at timestamptz not null default now()
+);
+
+alter table public.profile_recompute enable row level security;
+
+drop policy if exists profile_recompute_owner on public.profile_recompute;
+create policy profile_recompute_owner on public.profile_recompute
+  for all
+  using (user_id = auth.uid())
+  with check (user_id = auth.uid());
+
+-- пачка пересчитанных метрик одним вызовом; RLS соблюдается (security invoker + фильтр по auth.uid())
+create or replace function public.update_workout_metrics(_rows jsonb)
+returns integer
+language sql
+security invoker
+set search_path = public
+as $$
+  with upd as (
+    update public.workouts w
+       set trimp = r.trimp,
+           zone_s = r.zone_s,
+           hr_hist = coalesce(r.hr_hist, w.hr_hist)
+      from jsonb_to_recordset(_rows) as r(id uuid, trimp integer, zone_s jsonb, hr_hist text)
+     where w.id = r.id
+       and w.user_id = auth.uid()
+    returning 1
+  )
+  select count(*)::integer from upd;
+$$;
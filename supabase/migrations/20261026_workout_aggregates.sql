@@ -0,0 +1,6 @@
+-- Компактные агрегаты тренировки для графиков по истории (aggregates.py):
+-- base64 от [версия] + varint (поминутные средние, гистограммы темпа и каденса).
+-- zone_s и hr_hist уже есть (20261025_profile_recompute.sql) — теперь заполняются и при сохранении.
+-- Выборка по диапазону дат идёт по workouts_user_start_idx (20261023_workout_fingerprints.sql).
+
+alter table public.workouts add column if not exists aggregates text;
@@ -0,0 +1,6 @@
+-- Темп с поправкой на уклон (gap.py): средний GAP-темп, EF и Pa:Hr по GAP-скорости рядом с «сырыми».
+
+alter table public.workouts
+  add column if not exists gap_pace_s_per_km integer,
+  add column if not exists gap_ef numeric,
+  add column if not exists gap_pa_hr_pct numeric;
@@ -0,0 +1,22 @@
+-- Контекст для тренера (coach_snapshot.py): компактный документ о последних тренировках, нагрузке,
+-- зонах, рекордах и трендах — одна строка на пользователя. Пересчитывается при сохранении тренировок,
+-- читается одним select'ом. version растёт на каждой записи (оптимистическая блокировка),
+-- doc->>'schema' — версия формата документа.
+
+create table if not exists public.coach_training_context (
+  user_id uuid primary key default auth.uid(),
+  version bigint not null default 1,
+  schema_version integer not null,
+  doc jsonb not null,
+  n_workouts integer not null default 0,
+  last_workout_at timestamptz,
+  updated_at timestamptz not null default now()
+);
+
+alter table public.coach_training_context enable row level security;
+
+drop policy if exists coach_training_context_owner on public.coach_training_context;
+create policy coach_training_context_owner on public.coach_training_context
+  for all
+  using (user_id = auth.uid())
+  with check (user_id = auth.uid());
@@ -0,0 +1,24 @@
+-- Местное время тренировки (localtime.py): смещение от UTC на момент старта и пакетный пересчёт local_date.
+-- utc_offset_s — из activity.local_timestamp FIT или по часовому поясу первого GPS-фикса; null — неизвестно.
+
+alter table public.workouts
+  add column if not exists utc_offset_s integer;
+
+-- пачка (id, local_date, utc_offset_s) одним вызовом; RLS соблюдается (security invoker + фильтр по auth.uid())
+create or replace function public.update_workout_local_dates(_rows jsonb)
+returns integer
+language sql
+security invoker
+set search_path = public
+as $$
+  with upd as (
+    update public.workouts w
+       set local_date = r.local_date,
+           utc_offset_s = coalesce(r.utc_offset_s, w.utc_offset_s)
+      from jsonb_to_recordset(_rows) as r(id uuid, local_date date, utc_offset_s integer)
+     where w.id = r.id
+       and w.user_id = auth.uid()
+    returning 1
+  )
+  select count(*)::integer from upd;
+$$;
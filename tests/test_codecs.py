@@ -0,0 +1,158 @@
+# test_codecs.py — компактные форматы хранения: varint/zigzag и трек (gps), hr_hist (recompute),
+# aggregates, тепловая карта. Кодирование → декодирование без потерь и отказ на битых данных.
+
+import base64
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from gps import (_zigzag, _unzigzag, varint_encode, varint_decode, encode_track, decode_track,
+                 encode_times, decode_times, build_track, track_full, deg_to_semicircles)
+from recompute import encode_hist, decode_hist, N_BPM
+from aggregates import build_aggregates, decode_aggregates, decode_hists, histograms, minute_rollup
+from heatmap import Heatmap
+
+
+def _records(n: int = 600, seed: int = 0) -> pd.DataFrame:
+    """Синтетическая пробежка раз в секунду: пульс, скорость, каденс, высота и GPS-полукруги."""
+    rng = np.random.default_rng(seed)
+    lat = 55.7558 + np.cumsum(rng.normal(0, 2e-5, n))
+    lon = 37.6173 + np.cumsum(rng.normal(0, 2e-5, n))
+    return pd.DataFrame({
+        "t_rel_s": np.arange(n, dtype=float),
+        "dt_s": np.ones(n),
+        "hr": rng.integers(120, 175, n).astype(float),
+        "speed": rng.uniform(2.5, 4.0, n),
+        "cadence": rng.integers(160, 185, n).astype(float),
+        "elev": 150 + np.cumsum(rng.normal(0, 0.1, n)),
+        "lat_sc": deg_to_semicircles(lat),
+        "lon_sc": deg_to_semicircles(lon),
+    })
+
+
+# ---------- varint / zigzag ----------
+
+def test_zigzag_round_trip():
+    d = np.array([0, 1, -1, 2, -2, 2 ** 31, -(2 ** 31), 2 ** 62, -(2 ** 63)], np.int64)
+    assert np.array_equal(_unzigzag(_zigzag(d)), d)
+    assert _zigzag(np.array([0, -1, 1, -2])).tolist() == [0, 1, 2, 3]
+
+
+def test_varint_round_trip():
+    v = np.array([0, 1, 127, 128, 300, 2 ** 32, 2 ** 64 - 1], np.uint64)
+    buf = varint_encode(v)
+    assert buf[:4] == bytes([0x00, 0x01, 0x7F, 0x80])
+    assert np.array_equal(varint_decode(buf), v)
+    assert varint_encode(np.empty(0, np.uint64)) == b""
+    assert len(varint_decode(b"")) == 0
+
+
+@pytest.mark.parametrize("buf", [b"\x80", b"\x01\xff", bytes([0xFF] * 10 + [0x01])])
+def test_varint_rejects_corrupt(buf):
+    with pytest.raises(ValueError):
+        varint_decode(buf)
+
+
+# ---------- трек ----------
+
+def test_track_round_trip():
+    rng = np.random.default_rng(1)
+    lat = np.round(55.75 + np.cumsum(rng.normal(0, 1e-4, 500)), 5)
+    lon = np.round(-37.61 + np.cumsum(rng.normal(0, 1e-4, 500)), 5)
+    la, lo = decode_track(encode_track(lat, lon))
+    assert np.allclose(la, lat, atol=1e-9) and np.allclose(lo, lon, atol=1e-9)
+
+    t = np.arange(500) * 1.5
+    assert np.allclose(decode_times(encode_times(t)), t)
+
+
+def test_build_track_full_round_trip():
+    df = _records()
+    tr = build_track(df)
+    lat, lon, t = track_full(tr)
+    assert tr["n_points"] == len(df) == len(lat)
+    assert np.allclose(lat, df["lat_sc"] * 180.0 / 2 ** 31, atol=1e-5)
+    assert np.allclose(t, df["t_rel_s"])
+    assert build_track(df.drop(columns=["lat_sc", "lon_sc"])) is None
+
+
+def test_track_rejects_corrupt():
+    buf = encode_track(np.array([55.0, 55.1]), np.array([37.0, 37.1]))
+    with pytest.raises(ValueError):
+        decode_track(bytes([99]) + buf[1:])          # неизвестная версия
+    with pytest.raises(ValueError):
+        decode_track(buf[:1])                        # нет точности
+    with pytest.raises(ValueError):
+        decode_track(buf[:-1])                       # оборван последний varint
+    with pytest.raises(ValueError):
+        decode_track(buf[:2] + varint_encode(np.array([4, 6, 8], np.uint64)))   # lat без lon
+    with pytest.raises(ValueError):
+        decode_times(bytes([99, 1, 0]))
+
+
+# ---------- hr_hist (recompute) ----------
+
+def test_hist_round_trip():
+    c = np.zeros(N_BPM, np.uint32)
+    c[[95, 140, 141, 188]] = [3, 600, 1, 25]
+    assert np.array_equal(decode_hist(encode_hist(c)), c)
+    empty = np.zeros(N_BPM, np.uint32)
+    assert np.array_equal(decode_hist(encode_hist(empty)), empty)
+
+
+def test_hist_rejects_corrupt():
+    c = np.zeros(N_BPM, np.uint32)
+    c[100:110] = 60
+    raw = base64.b64decode(encode_hist(c))
+    for bad in (raw[:2], bytes([9]) + raw[1:], raw[:-1], raw + b"\x01", raw[:1] + bytes([120, 110]) + raw[3:]):
+        with pytest.raises(ValueError):
+            decode_hist(base64.b64encode(bad).decode("ascii"))
+
+
+# ---------- aggregates ----------
+
+def test_aggregates_round_trip():
+    df = _records()
+    s = build_aggregates(df)
+    out = decode_aggregates(s)
+    minutes = minute_rollup(df)
+    assert len(out["minutes"]) == len(minutes["sec"]) == 10
+    assert np.array_equal(out["minutes"]["sec"], np.rint(minutes["sec"]))
+    assert np.allclose(out["minutes"]["hr"], np.round(minutes["hr"]), atol=0.5)
+    assert np.allclose(out["minutes"]["speed"], minutes["speed"], atol=0.005)
+    assert out["minutes"]["power"].isna().all()      # канала нет — NaN, а не ноль
+    for name, h in histograms(df).items():
+        assert np.array_equal(out["hists"][name], h)
+        assert np.array_equal(decode_hists(s)[name], h)
+    assert build_aggregates(df.iloc[:0]) is None
+
+
+def test_aggregates_rejects_corrupt():
+    raw = base64.b64decode(build_aggregates(_records(120)))
+    for bad in (b"", bytes([9]) + raw[1:], raw[:-1], raw + b"\x00"):
+        with pytest.raises(ValueError):
+            decode_aggregates(base64.b64encode(bad).decode("ascii"))
+
+
+# ---------- тепловая карта ----------
+
+def test_heatmap_round_trip():
+    hm = Heatmap()
+    for i in range(3):
+        tr = build_track(_records(300, seed=i))
+        assert hm.add_track(f"w{i}", tr)
+    back = Heatmap.from_b64(hm.to_b64())
+    assert back.workouts == {"w0", "w1", "w2"}
+    for z, (ids, counts) in hm.levels.items():
+        assert np.array_equal(back.levels[z][0], ids) and np.array_equal(back.levels[z][1], counts)
+    assert Heatmap.from_bytes(Heatmap().to_bytes()).workouts == set()
+
+
+def test_heatmap_rejects_corrupt():
+    hm = Heatmap()
+    hm.add_track("w0", build_track(_records(300)))
+    raw = hm.to_bytes()
+    for bad in (raw[:2], bytes([9]) + raw[1:], raw[:len(raw) // 2], raw[:-1], raw + b"\x00"):
+        with pytest.raises(ValueError):
+            Heatmap.from_bytes(bad)
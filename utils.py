@@ -7,6 +7,7 @@ import datetime as dt
 from math import exp
 import streamlit as st
 import streamlit.components.v1 as components
+from instrument import traced
 
 # ------------ Generic helpers ------------
 def get_val(msg, name, alt_name=None):
@@ -23,7 +24,7 @@ def pace_from_speed(spd):
         spd = float(spd)
     except (TypeError, ValueError):
         return None
-    if spd <= 0:
+    if not np.isfinite(spd) or spd <= 0:
         return None
     sec_per_km = 1000.0 / spd
     m = int(sec_per_km // 60)
@@ -118,6 +119,8 @@ def zones_time(series, bounds):
     z = pd.cut(series, bins=bins, labels=[f"Z{i}" for i in range(1, len(bins))])
     return z.value_counts().sort_index()
 
+@traced("export.excel", lambda bio, dfs, *a, **k: {"bytes_out": bio.getbuffer().nbytes,
+                                                   "rows_out": sum(len(d) for d in dfs.values() if d is not None)})
 def to_excel(dfs_named: dict):
     bio = io.BytesIO()
     with pd.ExcelWriter(bio, engine="xlsxwriter", datetime_format="yyyy-mm-dd hh:mm:ss") as writer:
@@ -155,59 +158,9 @@ def build_ics(
     location: str = "",
     alert_minutes: int = 0,
 ) -> str:
-    day_to_idx = {"Пн":0,"Вт":1,"Ср":2,"Чт":3,"Пт":4,"Сб":5,"Вс":6}
-
-    def dtstamp():
-        return dt.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-
-    def fmt_dt(d: dt.date, t: dt.time):
-        return dt.datetime.combine(d, t).strftime("%Y%m%dT%H%M%S")
-
-    lines = [
-        "BEGIN:VCALENDAR",
-        "VERSION:2.0",
-        "PRODID:-//CapyRun//Weekly Plan//EN"
-    ]
-    for _, row in plan_df.iterrows():
-        day = str(row["День"])
-        if day not in selected_days:
-            continue
-        idx = day_to_idx.get(day, 0)
-        d = start_date + dt.timedelta(days=idx)
-        start = fmt_dt(d, workout_time)
-        end_dt = (dt.datetime.combine(d, workout_time) + dt.timedelta(minutes=int(duration_minutes)))
-        end = end_dt.strftime("%Y%m%dT%H%M%S")
-
-        title = f'{row["Тип"]} — {row["Пробежка (км)"]} км'
-        desc = f'CapyRun: {row["Тип"]}. Плановый объём: {row["Пробежка (км)"]} км.'
-        uid = f"{start}-{hash(title) & 0xffffffff}@capyrun"
-
-        evt = [
-            "BEGIN:VEVENT",
-            f"UID:{uid}",
-            f"DTSTAMP:{dtstamp()}",
-            f"DTSTART:{start}",
-            f"DTEND:{end}",
-            f"SUMMARY:{title}",
-            f"DESCRIPTION:{desc}",
-        ]
-        if location:
-            evt.append(f"LOCATION:{location}")
-
-        if alert_minutes and int(alert_minutes) > 0:
-            evt += [
-                "BEGIN:VALARM",
-                "ACTION:DISPLAY",
-                "DESCRIPTION:Workout reminder",
-                f"TRIGGER:-PT{int(alert_minutes)}M",
-                "END:VALARM",
-            ]
-
-        evt.append("END:VEVENT")
-        lines += evt
-
-    lines.append("END:VCALENDAR")
-    return "\n".join(lines)
+    """iCal плана; реализация (пачкой, стабильные UID) — plan.build_ics."""
+    from plan import build_ics as _build_ics
+    return _build_ics(plan_df, start_date, workout_time, selected_days, duration_minutes, location, alert_minutes)
 
 # ------------ Sidebar helpers (auth landing integration) ------------
 def set_auth_mode(mode: str):
@@ -3,27 +3,127 @@ import pandas as pd
 import altair as alt
 import streamlit as st
 import datetime as dt
-from parsing import parse_fit_file
-from db import save_workouts, fetch_workouts
-from utils import format_duration, ewma_daily, build_ics, to_excel
+from parse_pool import parse_uploads_queued
+from db import save_workouts, save_tracks, fetch_workouts, fetch_tracks, fetch_heatmap, save_heatmap, fetch_aggregates
+from gps import build_track, zoom_for_bbox
+from heatmap import Heatmap, build_heatmap, refresh_for_saved
+from dedup import fingerprint, flag_duplicates, user_index, dedup_history
+from recompute import hist_b64_from_records
+from aggregates import build_aggregates, zone_seconds, weekly_zones, cadence_trend, weekly_above_hr
+from similar import workout_features, encode_features
+from dashboard import invalidate as invalidate_dashboard
+from coach_snapshot import refresh_coach_snapshot
+from localtime import apply_to_summaries as apply_local_dates, backfill_local_dates
+from utils import format_duration, ewma_daily, to_excel, parse_bounds
+from views_single import forget_workouts
+from plan import next_week_target, week_plan, week_start, build_block, block_weeks, build_ics
 
-def render_multi_workouts(files, supabase, user_id, hr_rest: int, hr_max: int):
+def _render_heatmap(supabase, user_id):
+    """Тепловая карта по всем сохранённым трекам: готовые тайлы из БД; собираем один раз, если их ещё нет."""
+    row = fetch_heatmap(supabase, user_id)
+    if row and row.get("tiles"):
+        hm = Heatmap.from_b64(row["tiles"])
+    else:
+        tracks = fetch_tracks(supabase, user_id, full=True, live_only=True)
+        if not tracks:
+            st.caption("Нет сохранённых тренировок с GPS.")
+            return
+        hm = build_heatmap(tracks)
+        save_heatmap(supabase, user_id, hm)
+    bbox = hm.bbox()
+    if bbox is None:
+        st.caption("Нет сохранённых тренировок с GPS.")
+        return
+    zoom = zoom_for_bbox({"min_lat": bbox[0], "min_lon": bbox[1], "max_lat": bbox[2], "max_lon": bbox[3]})
+    pts = hm.points(zoom, bbox)
+    try:
+        import pydeck as pdk
+    except Exception:
+        st.map(pts, zoom=zoom)
+        return
+    layer = pdk.Layer("HeatmapLayer", data=pts, get_position=["lon", "lat"], get_weight="count",
+                      radius_pixels=6, aggregation="SUM")
+    view = pdk.ViewState(latitude=(bbox[0] + bbox[2]) / 2, longitude=(bbox[1] + bbox[3]) / 2, zoom=zoom)
+    st.pydeck_chart(pdk.Deck(layers=[layer], initial_view_state=view, map_style=None))
+    st.caption(f"Тренировок на карте: {len(hm)}, ячеек в окне: {len(pts)}.")
+
+def _render_history_aggregates(supabase, user_id, bounds, weeks: int = 26):
+    since = pd.Timestamp.now(tz="UTC").normalize() - pd.Timedelta(weeks=weeks)
+    rows = fetch_aggregates(supabase, user_id, since=since)
+    if not rows:
+        st.write("Пока пусто.")
+        return
+    if bounds:
+        wz = weekly_zones(rows, bounds)
+        if not wz.empty:
+            base = wz.reset_index().melt(id_vars="week", var_name="zone", value_name="minutes")
+            st.altair_chart(alt.Chart(base).mark_bar().encode(
+                x="week:T", y=alt.Y("minutes:Q", title="минут в зоне"), color="zone:N"), use_container_width=True)
+    cad = cadence_trend(rows)
+    if not cad.empty:
+        st.altair_chart(alt.Chart(cad).mark_line(point=True).encode(
+            x="start_time:T", y=alt.Y("cadence:Q", scale=alt.Scale(zero=False), title="каденс")), use_container_width=True)
+    thr = st.number_input("Порог пульса, уд/мин", 100, 220, int(bounds[-1]) if bounds else 160, 1, key="agg_hr_thr")
+    df_above = weekly_above_hr(rows, int(thr))
+    st.altair_chart(alt.Chart(df_above).mark_bar().encode(
+        x="week:T", y=alt.Y("minutes:Q", title=f"минут с пульсом ≥ {int(thr)}")), use_container_width=True)
+    st.caption(f"Тренировок за {weeks} недель: {len(rows)}; без агрегатов: {sum(1 for r in rows if not r.get('aggregates'))}.")
+
+def _refresh_coach(supabase, user_id, rows=(), rebuild: bool = False):
+    # контекст тренера обновляется при сохранении; сбой не должен мешать самому сохранению
+    try:
+        refresh_coach_snapshot(supabase, user_id, rows, rebuild=rebuild)
+    except Exception:
+        st.caption("Контекст тренера обновится при следующем сохранении.")
+
+def render_multi_workouts(files, supabase, user_id, hr_rest: int, hr_max: int, ftp_w=None, zone_bounds_text: str = ""):
     st.subheader("📈 Прогресс: сводка по тренировкам")
 
     # --- Parse all files and collect summaries ---
+    # ZIP/.gz разворачиваются потоково, файлы разбираются в общем для сервера пуле (честная очередь по пользователям)
     summaries = []
-    for f in files:
-        try:
-            _, _, _, summary = parse_fit_file(f, hr_rest, hr_max)
-            if summary is not None and isinstance(summary, dict):
-                summaries.append(summary)
-        except Exception as e:
-            st.warning(f"Ошибка при обработке файла: {getattr(f, 'name', str(f))}. {e}")
+    tracks = []  # компактные GPS-треки параллельно summaries; DataFrame'ы точек не держим
+    fps = []     # отпечатки для поиска дублей (dedup.py)
+    feats = []   # векторы признаков для «похожих тренировок» (similar.py)
+    compact = [] # hr_hist (recompute.py), zone_s и aggregates (aggregates.py) — для графиков по истории
+    bounds = parse_bounds(zone_bounds_text or "")
+    names = []
+    for name, result, err in parse_uploads_queued(files, user_id, hr_rest, hr_max, ftp_w):
+        if err:
+            st.warning(f"Ошибка при обработке файла: {name}. {err}")
+            continue
+        summary = result[3]
+        if summary is not None and isinstance(summary, dict):
+            summaries.append(summary)
+            tracks.append(build_track(result[0]))
+            fps.append(fingerprint(summary, result[0]))
+            feats.append(encode_features(workout_features(summary, result[0], hr_max)))
+            compact.append({"hr_hist": hist_b64_from_records(result[0]),
+                            "zone_s": zone_seconds(result[0], bounds),
+                            "aggregates": build_aggregates(result[0])})
+            names.append(name)
+
+    # --- Duplicates: одна тренировка из часов и из экспорта Strava ---
+    fp_index = user_index(supabase, user_id)
+    flags = flag_duplicates(fp_index, fps)
+    in_batch = [i for i, f in enumerate(flags) if f and f[0].startswith("upload:")]
+    if in_batch:
+        st.warning("Дубли в загрузке (не учитываются): " + ", ".join(
+            f"{names[i]} = {names[int(flags[i][0].split(':')[1])]}" for i in in_batch))
+        drop = set(in_batch)
+        keep = [i for i in range(len(summaries)) if i not in drop]
+        summaries, tracks, fps, feats, compact, names, flags = (
+            [xs[i] for i in keep] for xs in (summaries, tracks, fps, feats, compact, names, flags))
+    in_history = [i for i, f in enumerate(flags) if f]
+    if in_history:
+        st.info(f"Уже есть в истории ({len(in_history)}): " + ", ".join(names[i] for i in in_history)
+                + " — при сохранении будут пропущены.")
 
     # --- Build DataFrame for summaries ---
     if not summaries:
         st.info("Нет данных для анализа тренировок.")
         return
+    apply_local_dates(summaries)   # местные даты; файлы без пояса — по поясу остальных файлов пачки
 
     df_sum = pd.DataFrame(summaries)
     # Defensive: ensure 'date' and 'start_time' exist and are not all NaN
@@ -45,39 +145,46 @@ def render_multi_workouts(files, supabase, user_id, hr_rest: int, hr_max: int):
     st.dataframe(df_sum)
 
     # --- Daily load + ATL/CTL/TSB ---
-    st.subheader("Нагрузка (TRIMP) по дням и тренды ATL/CTL/TSB")
-    # Defensive: fill missing TRIMP/distance_km with 0 for aggregation
-    for col in ["TRIMP", "distance_km"]:
+    st.subheader("Нагрузка по дням и тренды ATL/CTL/TSB")
+    load_key = st.radio("Мера нагрузки", ["TRIMP", "TSS"], horizontal=True, key="load_metric",
+                        help="TSS — по мощности и FTP из профиля; тренировки без мощности дают 0.")
+    # Defensive: fill missing TRIMP/TSS/distance_km with 0 for aggregation
+    for col in ["TRIMP", "TSS", "distance_km"]:
         if col not in df_sum.columns:
             df_sum[col] = 0.0
         else:
             df_sum[col] = pd.to_numeric(df_sum[col], errors="coerce").fillna(0.0)
+    if load_key == "TSS":
+        no_power = int((df_sum["TSS"] <= 0).sum())
+        if no_power:
+            st.caption(f"Без мощности (TSS = 0): {no_power} из {len(df_sum)} тренировок.")
 
     daily = df_sum.groupby("date").agg(
         TRIMP=("TRIMP", "sum"),
+        TSS=("TSS", "sum"),
         distance_km=("distance_km", "sum")
     ).reset_index()
 
     # Fill missing days in the range
     if not daily.empty:
         full = pd.DataFrame({"date": pd.date_range(daily["date"].min(), daily["date"].max(), freq="D")})
-        daily = full.merge(daily, on="date", how="left").fillna({"TRIMP": 0.0, "distance_km": 0.0})
+        daily = full.merge(daily, on="date", how="left").fillna({"TRIMP": 0.0, "TSS": 0.0, "distance_km": 0.0})
     else:
         st.info("Недостаточно данных для построения дневной нагрузки.")
         return
 
-    daily["ATL"] = ewma_daily(daily["TRIMP"].values, tau_days=7)
-    daily["CTL"] = ewma_daily(daily["TRIMP"].values, tau_days=42)
+    daily["ATL"] = ewma_daily(daily[load_key].values, tau_days=7)
+    daily["CTL"] = ewma_daily(daily[load_key].values, tau_days=42)
     daily["TSB"] = daily["CTL"] - daily["ATL"]
 
-    base = daily.melt(id_vars="date", value_vars=["TRIMP","ATL","CTL","TSB"], var_name="metric", value_name="value")
+    base = daily.melt(id_vars="date", value_vars=[load_key,"ATL","CTL","TSB"], var_name="metric", value_name="value")
     chart = alt.Chart(base).mark_line().encode(x="date:T", y="value:Q", color="metric:N").interactive()
     st.altair_chart(chart, use_container_width=True)
 
     last7 = daily.tail(7)
     c1, c2, c3, c4 = st.columns(4)
     with c1:
-        st.metric("TRIMP 7д", f"{last7['TRIMP'].sum():.0f}")
+        st.metric(f"{load_key} 7д", f"{last7[load_key].sum():.0f}")
     with c2:
         st.metric("DIST 7д", f"{last7['distance_km'].sum():.1f} км")
     with c3:
@@ -93,37 +200,42 @@ def render_multi_workouts(files, supabase, user_id, hr_rest: int, hr_max: int):
         last_week_km = float(last7["distance_km"].sum())
         tsb_now = float(daily["TSB"].iloc[-1])
 
-        if tsb_now < -10:
-            target_km = max(0.0, last_week_km * 0.9)
-            note = "TSB низкий → снизим объём (~-10%) для восстановления."
-        elif tsb_now > 10:
-            target_km = last_week_km * 1.10
-            note = "TSB высокий → можно аккуратно поднять объём (~+10%)."
-        else:
-            target_km = last_week_km * 1.05
-            note = "TSB в норме → поддержим/слегка увеличим (~+5%)."
-
-        dist_split = pd.Series([0.12,0.16,0.10,0.18,0.08,0.26,0.10])  # Пн..Вс
-        day_names = ["Пн","Вт","Ср","Чт","Пт","Сб","Вс"]
-        km_plan = (dist_split * target_km).round(1)
-        types = ["Easy Z1–Z2", "Tempo Z3 (20–30 мин)", "Easy Z1–Z2",
-                 "Intervals Z4 (6×3’/2’)", "Recovery 30–40’ Z1", "Long Z2", "Easy + strides"]
-
-        plan_df = pd.DataFrame({"День": day_names, "Тип": types, "Пробежка (км)": km_plan})
+        target_km, note = next_week_target(last_week_km, tsb_now)
+        plan_df = week_plan(target_km)
         if note:
             st.write(note)
         st.dataframe(plan_df)
     else:
         st.info("Недостаточно данных для составления плана (нужно ≥1 день с данными).")
 
+    # --- Multi-week block ---
+    block_df = pd.DataFrame()
+    today = dt.date.today()
+    next_monday = today + dt.timedelta(days=(7 - today.weekday())) if today.weekday() != 0 else today
+    with st.expander("🗓️ План на блок недель (рост объёма + разгрузка)"):
+        if plan_df.empty:
+            st.warning("План пуст — сначала сформируй его выше.")
+        else:
+            b1, b2, b3 = st.columns(3)
+            with b1:
+                n_weeks = st.number_input("Недель", 1, 24, 12, 1)
+            with b2:
+                growth = st.number_input("Рост объёма, %/нед", 0, 10, 5, 1)
+            with b3:
+                deload_every = st.number_input("Разгрузка каждую N-ю неделю", 0, 8, 4, 1,
+                                               help="0 — без разгрузочных недель")
+            start_date = week_start(st.date_input("Дата начала плана", value=next_monday))
+            block_df = build_block(start_date, target_km, int(n_weeks), growth / 100.0, int(deload_every))
+            st.dataframe(block_weeks(block_df))
+            st.dataframe(block_df)
+
     # --- ICS export ---
     with st.expander("📆 Экспорт плана в календарь (.ics)"):
-        if plan_df.empty:
+        if block_df.empty:
             st.warning("План пуст — сначала сформируй его выше.")
         else:
-            today = dt.date.today()
-            next_monday = today + dt.timedelta(days=(7 - today.weekday())) if today.weekday() != 0 else today
-            start_date = st.date_input("Дата начала плана", value=next_monday)
+            st.caption(f"Блок {block_df['Неделя'].max()} нед. с {block_df['Дата'].min():%d.%m.%Y}. "
+                       "При повторной выгрузке события обновятся на месте.")
             workout_time = st.time_input("Время тренировки", value=dt.time(7, 0))
             selected_days = st.multiselect("Какие дни добавить",
                                            options=["Пн","Вт","Ср","Чт","Пт","Сб","Вс"],
@@ -134,26 +246,53 @@ def render_multi_workouts(files, supabase, user_id, hr_rest: int, hr_max: int):
             alert_min = st.number_input("Напоминание, мин до старта", 0, 1440, 15, 5)
 
             ics_text = build_ics(
-                plan_df=plan_df,
+                plan_df=block_df,
                 start_date=start_date,
                 workout_time=workout_time,
                 selected_days=selected_days,
                 duration_minutes=duration_minutes,
                 location=location,
                 alert_minutes=int(alert_min) if alert_min else 0,
+                plan_id=f"capyrun-plan:{user_id}",
             )
             st.download_button("📥 Скачать iCal (.ics)", data=ics_text, file_name="capyrun_plan.ics", mime="text/calendar")
 
     # --- Excel export ---
-    xls = to_excel({"Workouts": df_sum, "DailyLoad": daily, "NextWeekPlan": plan_df})
+    xls = to_excel({"Workouts": df_sum, "DailyLoad": daily, "NextWeekPlan": plan_df, "Block": block_df})
     st.download_button("⬇️ Скачать Excel (прогресс + план)", data=xls,
                        file_name="capyrun_progress.xlsx",
                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
     # --- Save all to DB ---
     if st.button("📦 Сохранить все тренировки в историю"):
-        save_workouts(supabase, user_id, summaries)
-        st.success("Сохранено в БД")
+        new = [i for i, f in enumerate(flags) if not f]
+        rows = [{**summaries[i], "fingerprint": fps[i], "features": feats[i], **compact[i]} for i in new]
+        ids = save_workouts(supabase, user_id, rows)
+        if ids:
+            invalidate_dashboard(user_id)
+        if any(ids):
+            _refresh_coach(supabase, user_id, [{**r, "id": wid} for r, wid in zip(rows, ids) if wid])
+        new_tracks = [tracks[i] for i in new]
+        for wid, i in zip(ids, new):
+            if wid:
+                fp_index.add(str(wid), fps[i])
+        save_tracks(supabase, user_id, ids, new_tracks)
+        refresh_for_saved(supabase, user_id, ids, new_tracks)
+        missing = sum(1 for wid in ids if not wid)
+        if new and not ids:
+            st.warning("Тренировки не сохранены: нет активной сессии или сервер отклонил запись.")
+        else:
+            st.success(f"Сохранено в БД: {len(new)}" + (f", пропущено дублей: {len(flags) - len(new)}" if len(new) < len(flags) else ""))
+            if missing:
+                st.warning(f"Для {missing} тренировок сервер не вернул id — их треки, карта и индексы не обновлены.")
+
+    # --- Heatmap ---
+    with st.expander("🔥 Где я бегаю"):
+        _render_heatmap(supabase, user_id)
+
+    # --- History charts: суммы компактных агрегатов, без сырых точек ---
+    with st.expander("📊 История: зоны, каденс, время выше порога"):
+        _render_history_aggregates(supabase, user_id, bounds)
 
     # --- History from DB ---
     with st.expander("📚 Мои тренировки"):
@@ -167,6 +306,28 @@ def render_multi_workouts(files, supabase, user_id, hr_rest: int, hr_max: int):
                 st.dataframe(df_hist)
             else:
                 st.write("Пока пусто.")
+            if st.button("🧹 Найти дубли в истории", key="dedup_scan"):
+                st.session_state["dedup_pairs"] = dedup_history(supabase, user_id)
+            pairs = st.session_state.get("dedup_pairs")
+            if pairs is not None:
+                if pairs.empty:
+                    st.write("Дублей не найдено.")
+                else:
+                    st.dataframe(pairs)
+                    if st.button(f"Скрыть дубли ({len(pairs)})", key="dedup_apply"):
+                        dedup_history(supabase, user_id, apply=True)
+                        invalidate_dashboard(user_id)
+                        _refresh_coach(supabase, user_id, rebuild=True)
+                        forget_workouts(supabase, user_id, pairs["duplicate_id"])
+                        st.session_state.pop("dedup_pairs", None)
+                        st.success("Дубли помечены удалёнными.")
+            if st.button("🕒 Пересчитать местные даты истории", key="local_dates_backfill"):
+                stats = backfill_local_dates(supabase, user_id)
+                if stats["updated"]:
+                    invalidate_dashboard(user_id)
+                    _refresh_coach(supabase, user_id, rebuild=True)
+                st.success(f"Тренировок: {stats['total']}, исправлено дат: {stats['updated']} "
+                           f"(пояс из GPS: {stats['from_gps']}, по привычному поясу: {stats['guessed']}).")
         except ValueError as e:
             st.error("Ошибка при загрузке истории тренировок. Возможно, история пуста или повреждена.")
         except Exception as e:
@@ -1,19 +1,171 @@
 # views_single.py
+import numpy as np
 import pandas as pd
 import altair as alt
 import streamlit as st
-from parsing import parse_fit_file
-from db import save_workouts
+from parse_pool import parse_single_queued
+from memory_governor import get_governor, session_id
+from db import save_workouts, save_tracks, fetch_tracks
+from gps import build_track, track_latlon, track_full, zoom_for_bbox
+from segments import Segment, build_index, db_track_loader
+from heatmap import refresh_for_saved, refresh_for_removed
+from ingest import haversine_cum
+from power import power_1hz, rolling_mean, w_prime_balance
+from dedup import fingerprint, user_index
+from recompute import hist_b64_from_records
+from aggregates import build_aggregates, zone_seconds
+from splits import lap_metrics, distance_splits
+from gap import gap_speed
+from records_view import render_records
+from dashboard import invalidate as invalidate_dashboard
+from coach_snapshot import refresh_coach_snapshot
+from intervals import detect_structure, structure_metrics, pattern, parse_plan, compare_to_plan
+from similar import workout_features, encode_features, build_index as build_similar_index
 from utils import (
+    format_duration,
     speed_to_pace_min_per_km,
     parse_bounds,
     zones_time,
     to_excel,
 )
 
-def render_single_workout(file, supabase, user_id, hr_rest: int, hr_max: int, zone_bounds_text: str):
-    df_rec, df_laps, df_ses, summary = parse_fit_file(file, hr_rest, hr_max)
+def _render_track_map(track):
+    """Карта по упрощённой полилинии под текущий зум — полный трек в браузер не уходит."""
+    zoom = zoom_for_bbox(track)
+    lat, lon = track_latlon(track, zoom)
+    center_lat = (track["min_lat"] + track["max_lat"]) / 2.0
+    center_lon = (track["min_lon"] + track["max_lon"]) / 2.0
+    try:
+        import pydeck as pdk
+    except Exception:
+        st.map(pd.DataFrame({"lat": lat, "lon": lon}), zoom=zoom)
+        return
+    path = [[float(x), float(y)] for x, y in zip(lon, lat)]
+    layer = pdk.Layer("PathLayer", data=[{"path": path}], get_path="path",
+                      get_color=[230, 80, 40], width_min_pixels=3)
+    view = pdk.ViewState(latitude=center_lat, longitude=center_lon, zoom=zoom)
+    st.pydeck_chart(pdk.Deck(layers=[layer], initial_view_state=view, map_style=None))
+    st.caption(f"Трек: {len(lat)} из {track['n_points']} точек (зум {zoom}).")
 
+@st.cache_resource(show_spinner=False, max_entries=64)
+def _segment_index(_supabase, user_id: str):
+    """Индекс сегментов пользователя: строится один раз по bbox/уровням треков, дальше пополняется при сохранении."""
+    return build_index(fetch_tracks(_supabase, user_id, live_only=True))
+
+def _render_segment_search(track, supabase, user_id):
+    lat, lon, _ = track_full(track)
+    km = haversine_cum(lat, lon) / 1000.0
+    if km[-1] < 0.1:
+        return
+    a, b = st.slider("Участок трека (км)", 0.0, float(round(km[-1], 2)), (0.0, float(round(min(km[-1], 1.0), 2))),
+                     step=0.05, key="seg_range")
+    if not st.button("🔎 Найти прохождения", key="seg_find"):
+        return
+    i0, i1 = int(np.searchsorted(km, a)), int(min(np.searchsorted(km, b), len(km) - 1))
+    if i1 - i0 < 2:
+        st.info("Участок слишком короткий.")
+        return
+    seg = Segment.from_track(lat, lon, i0, i1, name=f"{a:.2f}–{b:.2f} км")
+    efforts = _segment_index(supabase, user_id).find_efforts(seg, db_track_loader(supabase, user_id))
+    if efforts.empty:
+        st.write("В сохранённых тренировках этот участок не найден.")
+        return
+    efforts["время"] = efforts["elapsed_s"].apply(format_duration)
+    st.dataframe(efforts[["rank", "workout_id", "время", "start_s", "max_dev_m", "coverage"]])
+
+@st.cache_resource(show_spinner=False, max_entries=64)
+def _similar_index(_supabase, user_id: str):
+    """Матрица признаков пользователя: читается один раз, дальше дописывается при сохранении."""
+    return build_similar_index(_supabase, user_id)
+
+def forget_workouts(supabase, user_id, workout_ids):
+    """Скрытые тренировки (дубли) — из всех общих индексов пользователя и из сохранённой тепловой карты."""
+    ids = [str(w) for w in workout_ids]
+    fp_index, seg_index = user_index(supabase, user_id), _segment_index(supabase, user_id)
+    for wid in ids:
+        fp_index.remove(wid)
+        seg_index.remove(wid)
+    _similar_index(supabase, user_id).remove(ids)
+    refresh_for_removed(supabase, user_id, ids)
+
+def _render_similar(vec, summary, supabase, user_id, exclude):
+    """Сопоставимые тренировки (дистанция ±25 %, профиль HR/темпа/рельефа) и их EF во времени."""
+    res = _similar_index(supabase, user_id).query(vec, k=10, exclude=exclude)
+    if res.empty:
+        st.write("В истории пока нет сопоставимых тренировок.")
+        return
+    res["время"] = res["time_s"].apply(format_duration)
+    st.dataframe(res[["start_time", "distance_km", "время", "avg_hr", "ef", "pa_hr_pct", "distance"]])
+    trend = pd.DataFrame({"date": pd.to_datetime(res["start_time"], errors="coerce"),
+                          "EF": pd.to_numeric(res["ef"], errors="coerce"), "kind": "похожие"})
+    if summary.get("EF") and summary.get("start_time") is not None:
+        trend.loc[len(trend)] = [pd.Timestamp(summary["start_time"]), summary["EF"], "эта"]
+    trend = trend.dropna()
+    if len(trend) > 1:
+        st.altair_chart(alt.Chart(trend).mark_point(filled=True).encode(x="date:T", y=alt.Y("EF:Q", scale=alt.Scale(zero=False)),
+                                                                        color="kind:N"), use_container_width=True)
+
+def _render_power(df_rec, cp_w, w_prime_j):
+    """Мощность (30-с среднее) и W′bal по секундам — время без пауз."""
+    p = power_1hz(df_rec)
+    if p is None:
+        return
+    w = w_prime_balance(p, cp_w, w_prime_j)
+    t_min = np.arange(len(p)) / 60.0
+    p30 = np.full(len(p), np.nan)
+    r = rolling_mean(p)
+    p30[len(p) - len(r):] = r
+    st.subheader("Мощность и W′bal")
+    base = pd.DataFrame({"t_min": t_min, "Power 30s (W)": p30, "W′bal (kJ)": w / 1000.0})
+    st.altair_chart(alt.Chart(base).mark_line().encode(x="t_min:Q", y="Power 30s (W):Q").interactive(), use_container_width=True)
+    st.altair_chart(alt.Chart(base).mark_line().encode(x="t_min:Q", y="W′bal (kJ):Q").interactive(), use_container_width=True)
+    st.caption(f"Минимум W′bal: {w.min() / 1000.0:.1f} кДж из {w_prime_j / 1000.0:.1f} (CP {cp_w} Вт).")
+
+def _render_structure(df_rec, bounds):
+    """Разминка / повторы / отдых / заминка и сравнение с планом вида «6×3’/2’»."""
+    structure = detect_structure(df_rec)
+    if structure.empty or not (structure["label"] == "work").any():
+        st.write("Интервальной структуры не найдено — ровная тренировка.")
+        return
+    st.write(f"Структура: **{pattern(structure)}** (по {'мощности' if structure['channel'].iloc[0] == 'power' else 'скорости'})")
+    m = structure_metrics(df_rec, structure, bounds)
+    cols = [c for c in ("label", "rep", "duration_s", "distance_m", "pace_s_per_km", "avg_hr", "max_hr",
+                        "avg_power_w", "EF") if c in m]
+    st.dataframe(m[cols])
+    plan_text = st.text_input("План (например, 6×3’/2’ или 5×1000м/90с)", value="", key="structure_plan")
+    plan = parse_plan(plan_text)
+    if plan_text and plan is None:
+        st.caption("Не удалось разобрать план.")
+    elif plan:
+        cmp = compare_to_plan(m, plan)
+        (st.success if cmp["match"] else st.warning)(
+            f"Повторов: {cmp['reps_done']} из {cmp['reps_planned']}; " + ", ".join(
+                f"{k}: {v:+.0f}" for k, v in cmp.items() if k.endswith(("_dev_s", "_dev_m")) and v is not None))
+
+
+def _refresh_coach(supabase, user_id, rows):
+    # контекст тренера обновляется при сохранении; сбой не должен мешать самому сохранению
+    try:
+        refresh_coach_snapshot(supabase, user_id, rows)
+    except Exception:
+        st.caption("Контекст тренера обновится при следующем сохранении.")
+
+
+def render_single_workout(file, supabase, user_id, hr_rest: int, hr_max: int, zone_bounds_text: str,
+                          power_cfg=None):
+    power_cfg = power_cfg or {}
+    # разобранный файл живёт в реестре памяти сессии: повторный рендер не гоняет разбор заново,
+    # а холодные кадры при нехватке памяти уходят на диск (memory_governor.py)
+    file_key = ("parsed", getattr(file, "file_id", None) or f"{getattr(file, 'name', '')}:{getattr(file, 'size', '')}",
+                hr_rest, hr_max, power_cfg.get("ftp_w"))
+    df_rec, df_laps, df_ses, summary = get_governor().get_or_create(
+        session_id(), file_key, lambda: parse_single_queued(file, user_id, hr_rest, hr_max, power_cfg.get("ftp_w")))
+
+    track = build_track(df_rec)
+    fp = fingerprint(summary, df_rec)
+    vec = workout_features(summary, df_rec, hr_max)
+    fp_index = user_index(supabase, user_id)
+    dup = fp_index.find(fp)
     bounds = parse_bounds(zone_bounds_text)
     zt = zones_time(df_rec["hr"], bounds) if (not df_rec.empty and bounds) else None
 
@@ -34,6 +186,24 @@ def render_single_workout(file, supabase, user_id, hr_rest: int, hr_max: int, zo
     with c6:
         st.metric("Средний HR", f"{summary['avg_hr']}" if summary["avg_hr"] else "—")
 
+    if summary.get("gap_pace_s_per_km"):
+        g1, g2, g3 = st.columns(3)
+        with g1:
+            st.metric("GAP-темп (с поправкой на уклон)", f"{format_duration(summary['gap_pace_s_per_km'])} /км")
+        with g2:
+            st.metric("EF по GAP", f"{summary['GAP_EF']}" if summary.get("GAP_EF") else "—")
+        with g3:
+            st.metric("Pa:Hr по GAP", f"{summary['GAP_Pa:Hr_%']}%" if summary.get("GAP_Pa:Hr_%") is not None else "—")
+
+    if summary.get("np_power_w"):
+        c7, c8, c9 = st.columns(3)
+        with c7:
+            st.metric("NP / средняя", f"{summary['np_power_w']} / {summary['avg_power_w']} Вт")
+        with c8:
+            st.metric("IF", f"{summary['IF']:.2f}" if summary["IF"] else "—")
+        with c9:
+            st.metric("TSS", f"{summary['TSS']:.0f}" if summary["TSS"] else "—")
+
     st.divider()
 
     # Charts
@@ -47,7 +217,13 @@ def render_single_workout(file, supabase, user_id, hr_rest: int, hr_max: int, zo
                 "Pace (мин/км)": pd.to_numeric(pd.Series(df_rec["speed"]).apply(speed_to_pace_min_per_km), errors="coerce")
             })
             st.altair_chart(alt.Chart(base).mark_line().encode(x="t_min:Q", y="HR:Q").interactive(), use_container_width=True)
-            st.altair_chart(alt.Chart(base).mark_line().encode(x="t_min:Q", y=alt.Y("Pace (мин/км):Q", sort="descending")).interactive(), use_container_width=True)
+            gap_v = gap_speed(df_rec)
+            pace_cols = ["Pace (мин/км)"]
+            if gap_v is not None:
+                base["GAP (мин/км)"] = pd.to_numeric(pd.Series(gap_v).apply(speed_to_pace_min_per_km), errors="coerce")
+                pace_cols.append("GAP (мин/км)")
+            st.altair_chart(alt.Chart(base).transform_fold(pace_cols, as_=["ряд", "мин/км"]).mark_line().encode(
+                x="t_min:Q", y=alt.Y("мин/км:Q", sort="descending"), color="ряд:N").interactive(), use_container_width=True)
         with right:
             st.subheader("Каденс и высота")
             base2 = pd.DataFrame({
@@ -58,6 +234,22 @@ def render_single_workout(file, supabase, user_id, hr_rest: int, hr_max: int, zo
             st.altair_chart(alt.Chart(base2).mark_line().encode(x="t_min:Q", y="Cadence (spm):Q").interactive(), use_container_width=True)
             st.altair_chart(alt.Chart(base2).mark_line().encode(x="t_min:Q", y="Elevation (m):Q").interactive(), use_container_width=True)
 
+    if summary.get("np_power_w") and power_cfg.get("cp_w") and power_cfg.get("w_prime_j"):
+        _render_power(df_rec, power_cfg["cp_w"], power_cfg["w_prime_j"])
+
+    # Map
+    if track is not None:
+        st.subheader("Карта")
+        _render_track_map(track)
+        with st.expander("🏁 Сегмент: прошлые прохождения"):
+            _render_segment_search(track, supabase, user_id)
+
+    with st.expander("⏱ Структура: интервалы и повторы"):
+        _render_structure(df_rec, bounds)
+
+    with st.expander("🔁 Похожие тренировки"):
+        _render_similar(vec, summary, supabase, user_id, exclude=[dup[0]] if dup else None)
+
     # Zones
     st.subheader("Зоны пульса")
     if zt is not None:
@@ -72,17 +264,30 @@ def render_single_workout(file, supabase, user_id, hr_rest: int, hr_max: int, zo
     st.subheader("Сессия")
     st.dataframe(df_ses if not df_ses.empty else pd.DataFrame(columns=["—"]))
     st.subheader("Круги (laps)")
+    # колонки устройства + посчитанные по точкам (calc_*): EF, Pa:Hr, зоны, мощность
+    df_laps = lap_metrics(df_rec, df_laps, bounds)
     st.dataframe(df_laps if not df_laps.empty else pd.DataFrame(columns=["—"]))
-    st.subheader("Точки (records) — без GPS")
-    st.dataframe(df_rec.head(500) if not df_rec.empty else pd.DataFrame(columns=["—"]))
-    if not df_rec.empty and len(df_rec) > 500:
-        st.caption(f"Показаны первые 500 строк из {len(df_rec)}.")
+    st.subheader("Сплиты")
+    unit = st.radio("Отрезок", ["km", "mi"], horizontal=True, key="split_unit",
+                    format_func=lambda u: "1 км" if u == "km" else "1 миля")
+    df_splits = distance_splits(df_rec, unit, bounds)
+    if not df_splits.empty:
+        df_splits[f"темп /{unit}"] = df_splits[f"pace_s_per_{unit}"].apply(format_duration)
+    st.dataframe(df_splits if not df_splits.empty else pd.DataFrame(columns=["—"]))
+    st.subheader("Точки (records)")
+    cleaning = df_rec.attrs.get("cleaning")
+    if cleaning is not None and not cleaning.empty and cleaning["changed"].sum() + cleaning["steps"].sum() > 0:
+        with st.expander(f"🧹 Очистка сигналов: исправлено {int(cleaning['changed'].sum())} точек"):
+            st.dataframe(cleaning.set_index("channel"))
+            st.caption("clipped — вне физиологических границ, outliers — фильтр Хампеля, steps — ступеньки высоты.")
+    render_records(df_rec, (fp or {}).get("hash") or str(getattr(file, "name", "upload")))
 
     # Downloads
     xls = to_excel({
         "Summary": pd.DataFrame([summary]),
         "Sessions": df_ses,
         "Laps": df_laps,
+        "Splits": df_splits,
         "Records": df_rec
     })
     st.download_button("⬇️ Скачать Excel", data=xls,
@@ -91,5 +296,26 @@ def render_single_workout(file, supabase, user_id, hr_rest: int, hr_max: int, zo
 
     # Save to DB
     if st.button("📦 Сохранить тренировку в историю"):
-        save_workouts(supabase, user_id, [summary])
-        st.success("Сохранено в БД")
+        if dup:
+            st.info(f"Эта тренировка уже есть в истории (id {dup[0]}) — не сохраняем повторно.")
+            return
+        row = {**summary, "fingerprint": fp, "features": encode_features(vec), "hr_hist": hist_b64_from_records(df_rec),
+               "zone_s": zone_seconds(df_rec, bounds), "aggregates": build_aggregates(df_rec)}
+        ids = save_workouts(supabase, user_id, [row])
+        if ids:
+            invalidate_dashboard(user_id)
+        if ids and ids[0]:
+            _refresh_coach(supabase, user_id, [{**row, "id": ids[0]}])
+            fp_index.add(str(ids[0]), fp)
+            _similar_index(supabase, user_id).add(ids[0], vec, {
+                "start_time": summary["start_time"], "distance_km": summary["distance_km"], "time_s": summary["time_s"],
+                "avg_hr": summary["avg_hr"], "ef": summary["EF"], "pa_hr_pct": summary["Pa:Hr_%"]})
+        if save_tracks(supabase, user_id, ids, [track]):
+            _segment_index(supabase, user_id).add_track(ids[0], track)
+            refresh_for_saved(supabase, user_id, ids, [track])
+        if not ids:
+            st.warning("Тренировка не сохранена: нет активной сессии или сервер отклонил запись.")
+        elif not ids[0]:
+            st.warning("Сохранено, но сервер не вернул id — трек, карта и индексы не обновлены.")
+        else:
+            st.success("Сохранено в БД")